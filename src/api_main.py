@@ -1,14 +1,18 @@
 # src/api_main.py
 import time
 import os
+import asyncio
+import json
+import uuid
 import logging
 from typing import Optional
 import re # Ensure re is imported
 from pydantic import BaseModel
-from fastapi import FastAPI, File, UploadFile, HTTPException, Query, BackgroundTasks
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query
+from fastapi import Request
+from starlette.routing import Match
+from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse, JSONResponse
 from dotenv import load_dotenv # Importar load_dotenv
-import google.generativeai as genai # Importar Gemini SDK
 
 # Cargar variables de entorno del archivo .env
 load_dotenv()
@@ -18,6 +22,16 @@ from src import config
 from src import utils
 from src import llm_processing
 from src import prompts
+from src import pipeline
+from src import trabajos
+from src import pool_replicas
+from src import cache_resultados
+from src import metricas
+from src import trazas
+from src import indice_vectorial
+from src import ingesta
+from src import cliente_gemini
+from src import documento_tokenizado
 
 
 # --- Configuración del Logging ---
@@ -60,42 +74,170 @@ class GuiaContenidoUpdate(BaseModel):
 
 # --- Funciones Helper para la API ---
 
+async def _generar_contenido_gemini_con_cache(tarea: str, prompt_completo: str, emitir_fragmento=None, componentes_cache=None,
+                                              tokens_prompt=None):
+    """
+    Genera con el cliente de Gemini compartido (ver cliente_gemini.generar), pero consulta antes la
+    caché de resultados. En un acierto no se llama a la API y response es None.
+    `componentes_cache` sustituye a la clave por defecto (el prompt completo y el modelo).
+    `tokens_prompt`: tokens ya contados con la API (el cliente no vuelve a contarlos).
+    """
+    componentes_cache = componentes_cache or {"prompt": prompt_completo, "modelo": config.GEMINI_MODEL_NAME}
+    texto_cacheado = cache_resultados.obtener(tarea, componentes_cache)
+    if texto_cacheado is not None:
+        api_logger.info(f"Resultado de Gemini ({tarea}) obtenido de la caché.")
+        if emitir_fragmento is not None:
+            emitir_fragmento(texto_cacheado)
+        return texto_cacheado, None
+
+    cliente = cliente_gemini.obtener_cliente()
+    inicio = time.perf_counter()
+    try:
+        texto_respuesta, response = await cliente.generar(prompt_completo, emitir_fragmento, tarea=tarea, tokens_prompt=tokens_prompt)
+    except Exception:
+        metricas.registrar_llamada_llm(tarea, "exception", {"processing_time_seconds": time.perf_counter() - inicio})
+        raise
+    metricas.registrar_llamada_llm(tarea, *_estadisticas_gemini(response, time.perf_counter() - inicio))
+    cache_resultados.guardar(tarea, componentes_cache, texto_respuesta)
+    return texto_respuesta, response
+
+def _estadisticas_gemini(response, duracion_segundos):
+    """(finish_reason, stats) de una respuesta de Gemini, con las mismas claves que _llamar_al_llm."""
+    finish_reason = "desconocido"
+    try:
+        razon = response.candidates[0].finish_reason
+        finish_reason = getattr(razon, "name", str(razon)).lower()
+    except (AttributeError, IndexError, TypeError):
+        pass
+    if finish_reason == "max_tokens":
+        finish_reason = "length" # Mismo nombre que llama.cpp para las respuestas truncadas
+    uso = getattr(response, "usage_metadata", None)
+    tokens_generados = getattr(uso, "candidates_token_count", 0) or 0
+    stats = {
+        "tokens_prompt": getattr(uso, "prompt_token_count", 0) or 0,
+        "tokens_generados": tokens_generados,
+        "processing_time_seconds": duracion_segundos,
+        "tokens_por_segundo": tokens_generados / duracion_segundos if duracion_segundos > 0 else 0,
+    }
+    return finish_reason, stats
+
+async def _dividir_transcripcion_para_gemini(transcripcion_contenido: str) -> tuple[list[str], Optional[int]]:
+    """
+    (partes, tokens) de la transcripción para el esquema con Gemini: una sola parte si cabe en
+    config.GEMINI_ESQUEMA_MAX_TOKENS_PASE_UNICO y, si no, los mega-chunks del pipeline local
+    (cortes por contenido, en fin de oración/párrafo) de ~config.GEMINI_ESQUEMA_TOKENS_POR_PARTE tokens.
+    Sin tokenizador local de Gemini, el documento se tokeniza por palabras y los presupuestos se
+    convierten con la proporción palabras/tokens que da el conteo de la API sobre el texto completo.
+    `tokens` es ese conteo de la API (None si falló y se estimó por palabras).
+    """
+    tokens_contados = await cliente_gemini.obtener_cliente().contar_tokens(transcripcion_contenido)
+    documento = documento_tokenizado.DocumentoTokenizado.desde_texto(
+        transcripcion_contenido, documento_tokenizado.TokenizadorPalabras()
+    )
+    tokens_gemini = tokens_contados or int(documento.num_tokens * config.GEMINI_TOKENS_POR_PALABRA_ESTIMADOS)
+    if tokens_gemini <= config.GEMINI_ESQUEMA_MAX_TOKENS_PASE_UNICO or documento.num_tokens == 0:
+        return [transcripcion_contenido], tokens_contados
+
+    palabras_por_token = documento.num_tokens / tokens_gemini
+    with trazas.span("gemini.division_partes", tokens=tokens_gemini) as span_division:
+        partes = [mega_chunk.texto for mega_chunk in utils.dividir_en_mega_chunks(
+            documento,
+            max(1, int(config.GEMINI_ESQUEMA_TOKENS_POR_PARTE * palabras_por_token)),
+            int(config.MEGA_CHUNK_OVERLAP_TOKENS * palabras_por_token)
+        )]
+        span_division.establecer(partes=len(partes))
+    api_logger.info(f"Transcripción de {tokens_gemini} tokens (Gemini): esquema por partes en {len(partes)} partes.")
+    return partes or [transcripcion_contenido], tokens_contados
+
+async def _generar_esquema_gemini_por_partes(partes: list[str], emitir_fragmento=None) -> str:
+    """
+    Map-reduce del esquema: los esquemas parciales de todas las partes se piden a la vez (como mucho
+    config.GEMINI_ESQUEMA_MAX_PARTES_EN_PARALELO en curso) y se fusionan con PROMPT_FUSIONAR_ESQUEMAS_TEMPLATE.
+    La latencia depende de la parte más lenta, no de la duración de la clase. Solo la fusión se emite en stream.
+    """
+    total_partes = len(partes)
+    semaforo = asyncio.Semaphore(config.GEMINI_ESQUEMA_MAX_PARTES_EN_PARALELO)
+
+    async def esquema_parcial(num_parte, texto_parte):
+        prompt_parcial = prompts.PROMPT_GENERAR_ESQUEMA_PARCIAL_TEMPLATE.format(
+            chunk_numero=num_parte, total_chunks=total_partes, texto_fragmento=texto_parte
+        )
+        # Como en el pipeline local, la clave no incluye "parte N de M": una parte sin cambios reutiliza su esquema.
+        componentes_cache = {"texto": texto_parte, "plantilla": prompts.PROMPT_GENERAR_ESQUEMA_PARCIAL_TEMPLATE, "modelo": config.GEMINI_MODEL_NAME}
+        async with semaforo:
+            with trazas.span("gemini.esquema_parcial", chunk=num_parte, total_chunks=total_partes):
+                texto_esquema, _ = await _generar_contenido_gemini_con_cache(
+                    "gemini_esquema_parcial", prompt_parcial, componentes_cache=componentes_cache
+                )
+        api_logger.info(f"Esquema parcial {num_parte}/{total_partes} recibido de Gemini.")
+        return texto_esquema
+
+    tareas = [asyncio.create_task(esquema_parcial(i, texto)) for i, texto in enumerate(partes, start=1)]
+    try:
+        esquemas_parciales = await asyncio.gather(*tareas)
+    except BaseException:
+        for tarea in tareas: # Si una parte falla, las demás ya no sirven: no seguir gastando cuota
+            tarea.cancel()
+        raise
+
+    esquemas_parciales = [e for e in esquemas_parciales if e and e.strip()]
+    if not esquemas_parciales:
+        raise HTTPException(status_code=500, detail="Error de la API de Gemini (esquema): No se generaron esquemas parciales.")
+    if len(esquemas_parciales) == 1:
+        if emitir_fragmento is not None:
+            emitir_fragmento(esquemas_parciales[0])
+        return esquemas_parciales[0]
+
+    api_logger.info(f"Fusionando {len(esquemas_parciales)} esquemas parciales con Gemini...")
+    with trazas.span("gemini.fusion", esquemas=len(esquemas_parciales)):
+        esquema_fusionado, _ = await _generar_contenido_gemini_con_cache(
+            "gemini_fusion", llm_processing.construir_prompt_fusion(esquemas_parciales), emitir_fragmento
+        )
+    if not esquema_fusionado:
+        raise HTTPException(status_code=500, detail="Error de la API de Gemini (esquema): La fusión no devolvió contenido.")
+    return esquema_fusionado
+
 async def _call_gemini_api_for_schema(
     transcripcion_contenido: str,
-    prompt_template: str
+    prompt_template: str,
+    emitir_fragmento=None
 ) -> str:
     """
     Llama a la API de Gemini para generar un esquema a partir de una transcripción.
+    Si se pasa `emitir_fragmento`, la respuesta se recibe en stream (ver cliente_gemini).
     """
     api_logger.info("Iniciando llamada a la API de Gemini para generar esquema...")
-    gemini_api_key = os.getenv("GEMINI_API_KEY")
-    if not gemini_api_key:
-        api_logger.error("GEMINI_API_KEY no encontrada en las variables de entorno.")
-        raise HTTPException(status_code=500, detail="Error de configuración: GEMINI_API_KEY no encontrada.")
-
     try:
-        genai.configure(api_key=gemini_api_key)
+        partes, tokens_transcripcion = await _dividir_transcripcion_para_gemini(transcripcion_contenido)
+        if len(partes) > 1:
+            return await _generar_esquema_gemini_por_partes(partes, emitir_fragmento)
 
         prompt_completo = prompt_template.format(
             transcripcion_contenido=transcripcion_contenido
         )
         
-        model = genai.GenerativeModel(config.GEMINI_MODEL_NAME)
-        
         api_logger.debug(f"Prompt para esquema Gemini (primeros 500 chars): \\n{prompt_completo[:500]}...")
 
-        response = await model.generate_content_async(prompt_completo)
+        # La transcripción ya se contó al dividirla y domina el prompt: no se repite el conteo (otra llamada a la API).
+        texto_respuesta, response = await _generar_contenido_gemini_con_cache(
+            "gemini_esquema", prompt_completo, emitir_fragmento, tokens_prompt=tokens_transcripcion
+        )
 
-        if response and response.text:
+        if texto_respuesta:
             api_logger.info("Esquema recibido de la API de Gemini.")
-            return response.text
-        elif response and not response.text and response.prompt_feedback:
+            return texto_respuesta
+        elif response and response.prompt_feedback:
             api_logger.error(f"Llamada a Gemini (esquema) no devolvió texto. Feedback: {response.prompt_feedback}")
             raise HTTPException(status_code=500, detail=f"Error de la API de Gemini (esquema): No se generó contenido. Feedback: {response.prompt_feedback}")
         else:
             api_logger.error("Respuesta inesperada o vacía de la API de Gemini (esquema).")
             raise HTTPException(status_code=500, detail="Error de la API de Gemini (esquema): Respuesta inesperada o vacía.")
 
+    except HTTPException:
+        raise
+    except cliente_gemini.ErrorGemini as e:
+        api_logger.error(f"Llamada a la API de Gemini para generar esquema fallida: {e}")
+        raise HTTPException(status_code=e.codigo_http, detail=str(e))
     except Exception as e:
         api_logger.error(f"Error durante la llamada a la API de Gemini para generar esquema: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error interno al contactar la API de Gemini para esquema: {str(e)}")
@@ -104,20 +246,15 @@ async def _call_gemini_api_with_schema_and_transcription(
     esquema_contenido: str, 
     transcripcion_contenido: str, 
     prompt_texto: str,
-    informacion_contextual: Optional[str] = None  # Nuevo parámetro
+    informacion_contextual: Optional[str] = None,  # Nuevo parámetro
+    emitir_fragmento=None
 ) -> str:
     """
     Llama a la API de Gemini para generar apuntes, opcionalmente con información contextual.
+    Si se pasa `emitir_fragmento`, la respuesta se recibe en stream (ver cliente_gemini).
     """
     api_logger.info("Iniciando llamada a la API de Gemini...")
-    gemini_api_key = os.getenv("GEMINI_API_KEY")
-    if not gemini_api_key:
-        api_logger.error("GEMINI_API_KEY no encontrada en las variables de entorno.")
-        raise HTTPException(status_code=500, detail="Error de configuración: GEMINI_API_KEY no encontrada.")
-
     try:
-        genai.configure(api_key=gemini_api_key)
-
         # Formatear el prompt final con el esquema, la transcripción y la información contextual si existe
         prompt_completo = prompt_texto.format(
             esquema_contenido=esquema_contenido,
@@ -125,263 +262,403 @@ async def _call_gemini_api_with_schema_and_transcription(
             informacion_contextual_adicional=informacion_contextual if informacion_contextual else "" 
         )
         
-        model = genai.GenerativeModel(config.GEMINI_MODEL_NAME) # ej: 'gemini-1.5-flash'
-        
         api_logger.debug(f"Prompt completo enviado a Gemini: \\n{prompt_completo[:500]}...") # Loguea una parte del prompt
 
-        response = await model.generate_content_async(prompt_completo) # Usar async para no bloquear
+        texto_respuesta, response = await _generar_contenido_gemini_con_cache("gemini_apuntes", prompt_completo, emitir_fragmento) # Usar async para no bloquear
 
-        if response and response.text:
+        if texto_respuesta:
             api_logger.info("Respuesta recibida de la API de Gemini.")
-            return response.text
-        elif response and not response.text and response.prompt_feedback:
+            return texto_respuesta
+        elif response and response.prompt_feedback:
             api_logger.error(f"Llamada a Gemini no devolvió texto. Feedback: {response.prompt_feedback}")
             raise HTTPException(status_code=500, detail=f"Error de la API de Gemini: No se generó contenido. Feedback: {response.prompt_feedback}")
         else:
             api_logger.error("Respuesta inesperada o vacía de la API de Gemini.")
             raise HTTPException(status_code=500, detail="Error de la API de Gemini: Respuesta inesperada o vacía.")
 
+    except HTTPException:
+        raise
+    except cliente_gemini.ErrorGemini as e:
+        # Errores de la API ya clasificados: 413 (prompt demasiado grande), 503/504 (reintentos o plazo agotados), 502.
+        api_logger.error(f"Llamada a la API de Gemini fallida: {e}")
+        raise HTTPException(status_code=e.codigo_http, detail=str(e))
     except Exception as e:
         api_logger.error(f"Error durante la llamada a la API de Gemini: {e}", exc_info=True)
         # Considerar si se quiere exponer detalles del error al cliente o un mensaje genérico
         raise HTTPException(status_code=500, detail=f"Error interno al contactar la API de Gemini: {str(e)}")
 
 
-# --- Evento de Inicio de la Aplicación ---
-@app.on_event("startup")
-async def startup_event():
-    api_logger.info("Iniciando API y cargando modelo LLM...")
-    utils.crear_directorios_necesarios() # Asegura que data/ y output/ existan
-    # _ensure_output_dir_exists() # Específicamente para archivos temporales de la API si se guardan ahí
-    
-    # Cargar modelo con GPU por defecto al inicio. El flag --cpu se maneja por endpoint.
-    llm_processing.cargar_modelo_llm(use_cpu_only=False) 
-    if llm_processing.llm_instance is None:
-        api_logger.error("FALLO CRÍTICO: No se pudo cargar el modelo LLM al iniciar la API.")
-    else:
-        api_logger.info("Modelo LLM cargado y listo para la API.")
-
-# --- Endpoint para Generar Esquema ---
-@app.post("/generar_esquema/", response_class=FileResponse)
-async def generar_esquema_endpoint(
-    # background_tasks: BackgroundTasks, # Removed
-    file: UploadFile = File(..., description="Archivo de transcripción en formato .txt")
-    # usar_cpu: bool = Query(False, description="Forzar el uso de CPU para esta solicitud.") # Removed
-):
-    request_start_time = time.time()
-    original_filename = file.filename
-    api_logger.info(f"Solicitud para generar esquema de: {original_filename}. Se usará la configuración de LLM cargada al inicio.")
-
-    # Manejo de carga de modelo CPU/GPU (simplificado por ahora)
-    # La carga inicial en startup usa GPU. Si se pide CPU aquí, idealmente se recargaría.
-    # Por ahora, si se pide CPU y el modelo ya está en GPU, se usará GPU.
-    # Una solución más robusta requeriría gestionar instancias de modelo separadas o recargas.
-    # if usar_cpu and not llm_processing.llm_instance.model_params.n_gpu_layers == 0: # Removed
-    #     api_logger.warning("Se solicitó CPU, pero el modelo ya está cargado con GPU. Usando GPU.") # Removed
-    
-    if llm_processing.llm_instance is None:
-        api_logger.error("Modelo LLM no está disponible.")
-        raise HTTPException(status_code=503, detail="Servicio no disponible: Modelo LLM no cargado.")
+# --- Ejecutores de Trabajos (corren en el hilo trabajador, dueño del modelo LLM; la ingesta, en el suyo) ---
+def _guardar_resultado_en_output(contenido, output_filename):
+    permanent_file_path = os.path.join(config.BASE_PROJECT_DIR, "output", output_filename)
+    utils._ensure_output_dir_exists()
+    with open(permanent_file_path, "w", encoding="utf-8") as f:
+        f.write(contenido)
+    api_logger.info(f"Resultado guardado permanentemente en: {permanent_file_path}")
+    return output_filename
+
+def _esperar_modelo(reportar_progreso):
+    """Los trabajos aceptados mientras el modelo carga en segundo plano esperan aquí (en el hilo trabajador)."""
+    if llm_processing.estado_carga["estado"] == llm_processing.ESTADO_CARGA_CARGANDO:
+        reportar_progreso("Esperando la carga del modelo")
+        llm_processing.esperar_carga_modelo()
+
+def _ejecutar_trabajo_esquema(trabajo, entradas, reportar_progreso, emitir_token):
+    _esperar_modelo(reportar_progreso)
+    esquema_final_texto = pipeline.generar_esquema_completo(
+        entradas["transcripcion"], reportar_progreso=reportar_progreso, emitir_token=emitir_token
+    )
+    timestamp = time.strftime("%Y%m%d-%H%M%S")
+    return _guardar_resultado_en_output(esquema_final_texto, f"{trabajo['nombre_base']}_esquema_local_{timestamp}.txt")
+
+def _ejecutar_trabajo_apuntes(trabajo, entradas, reportar_progreso, emitir_token):
+    _esperar_modelo(reportar_progreso)
+    apuntes_texto_final_md = pipeline.generar_apuntes_completos(
+        entradas["esquema"],
+        entradas["transcripcion"],
+        titulo_guia=f"Guía de Estudio Detallada: {trabajo['nombre_base']}",
+        reportar_progreso=reportar_progreso,
+        emitir_token=emitir_token
+    )
+    timestamp = time.strftime("%Y%m%d-%H%M%S")
+    return _guardar_resultado_en_output(apuntes_texto_final_md, f"{trabajo['nombre_base']}_apuntes_local_{timestamp}.md")
 
+def _ejecutar_trabajo_ingesta(trabajo, entradas, reportar_progreso, emitir_token):
+    resumen = ingesta.ingestar_directorio(
+        entradas["directorio"], reconstruir=entradas["reconstruir"] == "1", reportar_progreso=reportar_progreso
+    )
+    timestamp = time.strftime("%Y%m%d-%H%M%S")
+    return _guardar_resultado_en_output(json.dumps(resumen, ensure_ascii=False, indent=2), f"ingesta_{timestamp}.json")
+
+TIPO_TRABAJO_ESQUEMA = "esquema"
+TIPO_TRABAJO_APUNTES = "apuntes"
+TIPO_TRABAJO_INGESTA = "ingesta"
+
+# Se crean al arrancar (startup_event), junto a la carga del modelo: importar el módulo no escribe en data/trabajos.
+gestor_trabajos = None
+gestor_ingesta = None
+
+def _crear_gestores_trabajos():
+    global gestor_trabajos, gestor_ingesta
+    gestor_trabajos = trabajos.crear_gestor({
+        TIPO_TRABAJO_ESQUEMA: _ejecutar_trabajo_esquema,
+        TIPO_TRABAJO_APUNTES: _ejecutar_trabajo_apuntes,
+    })
+    # La ingesta solo usa el modelo de embeddings: su propia cola y su hilo, para no esperar detrás de
+    # los esquemas y apuntes (ni retrasarlos). Comparte el almacén: /trabajos/{id} sirve para ambos.
+    gestor_ingesta = trabajos.crear_gestor({
+        TIPO_TRABAJO_INGESTA: _ejecutar_trabajo_ingesta,
+    }, nombre_hilo="trabajador-ingesta", almacen=gestor_trabajos.almacen)
+    metricas.TRABAJOS_EN_COLA.establecer_funcion(gestor_trabajos.tamano_cola)
+    metricas.TRABAJOS_INGESTA_EN_COLA.establecer_funcion(gestor_ingesta.tamano_cola)
+
+async def _leer_archivo_subido(upload_file: UploadFile, descripcion: str) -> str:
     try:
-        contenido_bytes = await file.read()
-        texto_completo_transcripcion = contenido_bytes.decode("utf-8")
+        contenido_bytes = await upload_file.read()
+        return contenido_bytes.decode("utf-8")
     except Exception as e:
-        api_logger.error(f"Error al leer/decodificar archivo \'{original_filename}\': {e}", exc_info=True)
-        raise HTTPException(status_code=400, detail=f"Error al procesar archivo: {e}")
+        api_logger.error(f"Error al leer/decodificar archivo de {descripcion} \'{upload_file.filename}\': {e}", exc_info=True)
+        raise HTTPException(status_code=400, detail=f"Error al procesar archivo de {descripcion}: {e}")
     finally:
-        await file.close()
+        await upload_file.close()
 
-    api_logger.info(f"Transcripción \'{original_filename}\' leída: {len(texto_completo_transcripcion.split())} palabras.")
+def _verificar_modelo_disponible():
+    # Mientras el modelo carga, las peticiones se aceptan: el trabajo espera en la cola a que termine.
+    if llm_processing.registro is None and llm_processing.estado_carga["estado"] != llm_processing.ESTADO_CARGA_CARGANDO:
+        api_logger.error("Modelo LLM no está disponible.")
+        detalle = llm_processing.estado_carga["error"]
+        raise HTTPException(status_code=503, detail="Servicio no disponible: Modelo LLM no cargado" + (f" ({detalle})." if detalle else "."))
 
-    # --- Lógica de Generación de Esquema ---
-    esquema_final_texto = None
-    try:
-        # Análisis de Tokens para Esquema
-        prompt_template_base_texto = prompts.PROMPT_GENERAR_ESQUEMA_TEMPLATE.replace("{texto_completo}", "")
-        tokens_prompt_base = llm_processing.llm_instance.tokenize(prompt_template_base_texto.encode('utf-8', 'ignore'))
-        num_tokens_prompt_base = len(tokens_prompt_base)
-        tokens_contenido_transcripcion = llm_processing.llm_instance.tokenize(texto_completo_transcripcion.encode('utf-8', 'ignore'))
-        num_tokens_contenido_transcripcion = len(tokens_contenido_transcripcion)
-        api_logger.info(f"Tokens para esquema: Base={num_tokens_prompt_base}, Contenido={num_tokens_contenido_transcripcion}")
-
-        tokens_salida_pase_unico = config.MAX_TOKENS_ESQUEMA_FUSIONADO
-        max_tokens_para_contenido_en_pase_unico = int(
-            (config.CONTEXT_SIZE * config.MEGA_CHUNK_CONTEXT_FACTOR) - num_tokens_prompt_base - tokens_salida_pase_unico
-        )
-        max_tokens_para_contenido_en_mega_chunk_individual = int(
-             (config.CONTEXT_SIZE * config.MEGA_CHUNK_CONTEXT_FACTOR) - num_tokens_prompt_base - config.MAX_TOKENS_ESQUEMA_PARCIAL
-        )
+async def _encolar_trabajo_esquema(file: UploadFile, oyente=None):
+    _verificar_modelo_disponible()
+    texto_completo_transcripcion = await _leer_archivo_subido(file, "transcripción")
+    if not texto_completo_transcripcion.strip():
+        raise HTTPException(status_code=400, detail="El archivo de transcripción no puede estar vacío.")
+    api_logger.info(f"Transcripción \'{file.filename}\' leída: {len(texto_completo_transcripcion.split())} palabras.")
+    return gestor_trabajos.encolar(
+        TIPO_TRABAJO_ESQUEMA,
+        {"transcripcion": texto_completo_transcripcion},
+        nombre_base=os.path.splitext(file.filename)[0],
+        oyente=oyente
+    )
 
-        if max_tokens_para_contenido_en_pase_unico <=0 or max_tokens_para_contenido_en_mega_chunk_individual <= 0:
-            raise HTTPException(status_code=500, detail="Cálculo de tokens para contenido de esquema resultó no positivo.")
+async def _encolar_trabajo_apuntes(transcripcion_file: UploadFile, esquema_file: UploadFile, oyente=None):
+    _verificar_modelo_disponible()
+    texto_completo_transcripcion = await _leer_archivo_subido(transcripcion_file, "transcripción")
+    esquema_texto = await _leer_archivo_subido(esquema_file, "esquema")
+    if not esquema_texto or not esquema_texto.strip():
+        raise HTTPException(status_code=400, detail="El archivo de esquema no puede estar vacío.")
+    return gestor_trabajos.encolar(
+        TIPO_TRABAJO_APUNTES,
+        {"transcripcion": texto_completo_transcripcion, "esquema": esquema_texto},
+        nombre_base=os.path.splitext(transcripcion_file.filename)[0],
+        oyente=oyente
+    )
 
-        if num_tokens_contenido_transcripcion <= max_tokens_para_contenido_en_pase_unico:
-            api_logger.info("Generando esquema en un solo pase.")
-            esquema_final_texto = llm_processing.generar_esquema_de_texto(texto_completo_transcripcion, es_parcial=False)
-        else:
-            api_logger.info("Generando esquema con mega-chunking.")
-            mega_chunks = utils.dividir_en_mega_chunks(
-                texto_completo_transcripcion,
-                max_tokens_para_contenido_en_mega_chunk_individual,
-                config.MEGA_CHUNK_OVERLAP_TOKENS,
-                llm_tokenizer_instance=llm_processing.llm_instance
+async def _esperar_trabajo_y_responder(trabajo, futuro, media_type: str):
+    """Espera (sin bloquear el event loop) a que el trabajo termine y devuelve su archivo."""
+    request_start_time = time.time()
+    trabajo_final = await asyncio.wrap_future(futuro)
+    if trabajo_final["estado"] != trabajos.ESTADO_COMPLETADO:
+        raise HTTPException(status_code=500, detail=f"Error interno en la generación: {trabajo_final['error']}")
+
+    output_filename = trabajo_final["archivo_resultado"]
+    processing_time = round(time.time() - request_start_time, 2)
+    api_logger.info(f"Devolviendo archivo: {output_filename} (trabajo '{trabajo['id']}', {processing_time} seg.)")
+    return FileResponse(
+        path=os.path.join(config.BASE_PROJECT_DIR, "output", output_filename),
+        filename=output_filename,
+        media_type=media_type
+    )
+
+
+# --- Helpers de Streaming (NDJSON) ---
+# Cada línea es un evento JSON: {"tipo": "trabajo" | "progreso" | "token" | "fin" | "error", ...}.
+# El archivo se persiste en output/ igual que en los endpoints sin stream y se anuncia en el evento "fin".
+def _respuesta_ndjson(cola: asyncio.Queue, corrutina_generacion):
+    """
+    Lanza `corrutina_generacion` (debe devolver el nombre del archivo guardado) y devuelve una
+    StreamingResponse que emite los eventos de `cola` hasta el evento final.
+    """
+    async def producir():
+        try:
+            archivo = await corrutina_generacion
+            cola.put_nowait({"tipo": "fin", "archivo": archivo, "url_archivo": f"/get_file/{archivo}"})
+        except HTTPException as http_exc:
+            cola.put_nowait({"tipo": "error", "detalle": http_exc.detail})
+        except Exception as e:
+            api_logger.error(f"Error durante la generación en stream: {e}", exc_info=True)
+            cola.put_nowait({"tipo": "error", "detalle": f"Error interno: {str(e)}"})
+
+    tarea_produccion = asyncio.create_task(producir())
+
+    async def emitir_eventos():
+        while True:
+            evento = await cola.get()
+            yield json.dumps(evento, ensure_ascii=False) + "\n"
+            if evento["tipo"] in ("fin", "error"):
+                break
+        await tarea_produccion
+
+    return StreamingResponse(emitir_eventos(), media_type="application/x-ndjson")
+
+def _oyente_hacia_cola(cola: asyncio.Queue):
+    """Oyente de trabajos que reenvía los eventos del hilo trabajador a una cola del event loop."""
+    loop = asyncio.get_running_loop()
+    def oyente(evento):
+        loop.call_soon_threadsafe(cola.put_nowait, evento)
+    return oyente
+
+async def _esperar_archivo_de_trabajo(futuro):
+    trabajo_final = await asyncio.wrap_future(futuro)
+    if trabajo_final["estado"] != trabajos.ESTADO_COMPLETADO:
+        raise HTTPException(status_code=500, detail=f"Error interno en la generación: {trabajo_final['error']}")
+    return trabajo_final["archivo_resultado"]
+
+# --- Métricas ---
+def _ruta_declarada(request: Request) -> str:
+    """Ruta declarada que atiende la petición ("/trabajos/{id_trabajo}"), para no etiquetar por URL concreta."""
+    ruta = request.scope.get("route")
+    if ruta is not None:
+        return ruta.path
+    for ruta in app.router.routes:
+        coincidencia, _ = ruta.matches(request.scope)
+        if coincidencia == Match.FULL:
+            return ruta.path
+    return "sin_ruta"
+
+async def _finalizar_traza_al_terminar_cuerpo(cuerpo, traza_peticion, inicio, **atributos):
+    """Envuelve el cuerpo de la respuesta para cerrar la traza cuando termina de enviarse (incluido el stream)."""
+    try:
+        async for fragmento in cuerpo:
+            yield fragmento
+    finally:
+        traza_peticion.registrar_span("peticion", inicio, time.perf_counter(), **atributos)
+        trazas.finalizar_traza(traza_peticion)
+
+@app.middleware("http")
+async def medir_peticiones(request: Request, call_next):
+    inicio = time.perf_counter()
+    codigo = 500
+    # Id de correlación de la petición: el del cliente (X-Request-ID) o uno nuevo. Se propaga a los
+    # trabajos que encole y se devuelve en la respuesta para poder buscar sus trazas.
+    id_correlacion = trazas.normalizar_id_correlacion(request.headers.get("X-Request-ID")) or uuid.uuid4().hex
+    trazas.establecer_id_correlacion(id_correlacion)
+    traza_peticion, token_traza = trazas.iniciar_traza("peticion", id_correlacion)
+    try:
+        response = await call_next(request)
+        codigo = response.status_code
+        response.headers["X-Request-ID"] = id_correlacion
+        if traza_peticion is not None:
+            response.body_iterator = _finalizar_traza_al_terminar_cuerpo(
+                response.body_iterator, traza_peticion, inicio,
+                endpoint=_ruta_declarada(request), metodo=request.method, codigo=codigo
             )
-            if not mega_chunks: raise HTTPException(status_code=500, detail="No se generaron mega-chunks.")
-            
-            esquemas_parciales = []
-            for i, mega_chunk_texto in enumerate(mega_chunks):
-                esquema_parcial = llm_processing.generar_esquema_de_texto(
-                    mega_chunk_texto, es_parcial=True, chunk_num=i + 1, total_chunks=len(mega_chunks)
-                )
-                if esquema_parcial: esquemas_parciales.append(esquema_parcial)
-            
-            if not esquemas_parciales: raise HTTPException(status_code=500, detail="No se generaron esquemas parciales.")
-            esquema_final_texto = llm_processing.fusionar_esquemas(esquemas_parciales)
+            traza_peticion = None
+        return response
+    finally:
+        endpoint = _ruta_declarada(request)
+        metricas.HTTP_PETICIONES.inc(endpoint=endpoint, metodo=request.method, codigo=codigo)
+        metricas.HTTP_LATENCIA.observar(time.perf_counter() - inicio, endpoint=endpoint, metodo=request.method)
+        if traza_peticion is not None: # La petición falló antes de tener respuesta
+            traza_peticion.registrar_span("peticion", inicio, time.perf_counter(), endpoint=endpoint, metodo=request.method, codigo=codigo)
+        trazas.finalizar_traza(traza_peticion, token_traza)
+
+@app.get("/health/live")
+async def health_live():
+    """Liveness: el proceso responde (no depende del modelo, que puede estar cargándose)."""
+    return {"estado": "vivo"}
+
+@app.get("/health/ready")
+async def health_ready():
+    """
+    Readiness: 200 cuando el modelo local por defecto está cargado y calentado; 503 mientras carga o si
+    la carga falló. `modelos_cargados` lista los contextos abiertos de cada modelo del registro (del menos
+    al más reciente).
+    """
+    registro = llm_processing.registro
+    cuerpo = {
+        "modelo": dict(llm_processing.estado_carga),
+        "modelos_cargados": registro.cargados() if registro is not None else [],
+        "backend": config.LLM_BACKEND,
+        "gemini": cliente_gemini.cliente_disponible(),
+    }
+    if registro is None:
+        return JSONResponse(status_code=503, content={"listo": False, **cuerpo})
+    return {"listo": True, **cuerpo}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Métricas del servicio en formato de texto de Prometheus."""
+    return PlainTextResponse(metricas.exponer(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/cache/estadisticas")
+async def estadisticas_cache():
+    """Aciertos/fallos y ocupación de la caché de resultados, para dimensionarla."""
+    return cache_resultados.estadisticas()
 
-        if not esquema_final_texto or not esquema_final_texto.strip():
-            raise HTTPException(status_code=500, detail="Fallo en la generación del esquema final.")
+# --- Evento de Inicio de la Aplicación ---
+@app.on_event("startup")
+async def startup_event():
+    api_logger.info("Iniciando API; el modelo LLM se carga en segundo plano (ver /health/ready).")
+    utils.crear_directorios_necesarios() # Asegura que data/ y output/ existan
+    # _ensure_output_dir_exists() # Específicamente para archivos temporales de la API si se guardan ahí
 
-    except HTTPException as http_exc:
-        raise http_exc
-    except Exception as e_esquema:
-        api_logger.error(f"Error durante la generación del esquema para \'{original_filename}\': {e_esquema}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Error interno al generar el esquema: {str(e_esquema)}")
+    # Cargar modelo con GPU por defecto. El flag --cpu se maneja por endpoint. La carga (y el calentamiento)
+    # no bloquea el arranque: los endpoints que no usan el modelo local responden desde el primer momento.
+    llm_processing.cargar_modelo_en_segundo_plano(use_cpu_only=False)
+    _crear_gestores_trabajos()
 
-    # Guardar en archivo permanente en la carpeta output
-    nombre_base_salida = os.path.splitext(original_filename)[0]
-    timestamp = time.strftime("%Y%m%d-%H%M%S")
-    output_filename = f"{nombre_base_salida}_esquema_local_{timestamp}.txt"
-    output_dir_path = os.path.join(config.BASE_PROJECT_DIR, "output")
-    permanent_file_path = os.path.join(output_dir_path, output_filename)
+    pool_replicas.iniciar_pool() # No hace nada si POOL_REPLICAS_NUM = 0
+    gestor_trabajos.iniciar()
+    gestor_ingesta.iniciar()
+    await utils.iniciar_cliente_vector_db()
+    cliente_gemini.iniciar_cliente()
 
-    try:
-        utils._ensure_output_dir_exists() # Ensure output dir exists
-        with open(permanent_file_path, "w", encoding="utf-8") as f:
-            f.write(esquema_final_texto)
-        api_logger.info(f"Esquema para \'{original_filename}\' guardado permanentemente en: {permanent_file_path}")
-        
-        # background_tasks.add_task(utils._cleanup_temp_file, temp_file_path) # Removed
-        
-        api_logger.info(f"Devolviendo archivo de esquema: {output_filename}")
-        processing_time = round(time.time() - request_start_time, 2)
-        api_logger.info(f"Tiempo total para generar esquema de \'{original_filename}\': {processing_time} seg.")
+@app.on_event("shutdown")
+async def shutdown_event():
+    pool_replicas.cerrar_pool()
+    cache_resultados.cerrar()
+    await utils.cerrar_cliente_vector_db()
+    cliente_gemini.cerrar_cliente()
 
-        return FileResponse(
-            path=permanent_file_path,
-            filename=output_filename,
-            media_type='text/plain'
-        )
-    except Exception as e_file_resp:
-        api_logger.error(f"Error al preparar FileResponse para esquema de \'{original_filename}\': {e_file_resp}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Error al servir el archivo de esquema: {str(e_file_resp)}")
+# --- Endpoint para Generar Esquema ---
+@app.post("/generar_esquema/", response_class=FileResponse)
+async def generar_esquema_endpoint(
+    file: UploadFile = File(..., description="Archivo de transcripción en formato .txt")
+):
+    """
+    Genera el esquema y espera el resultado. El trabajo se ejecuta en el hilo trabajador,
+    así que el resto de endpoints siguen respondiendo mientras tanto.
+    """
+    api_logger.info(f"Solicitud para generar esquema de: {file.filename}. Se usará la configuración de LLM cargada al inicio.")
+    trabajo, futuro = await _encolar_trabajo_esquema(file)
+    return await _esperar_trabajo_y_responder(trabajo, futuro, media_type='text/plain')
 
 
 # --- Endpoint para Generar Apuntes ---
 @app.post("/generar_apuntes/", response_class=FileResponse)
 async def generar_apuntes_endpoint(
-    # background_tasks: BackgroundTasks, # Removed
     transcripcion_file: UploadFile = File(..., description="Archivo de transcripción original (.txt)"),
     esquema_file: UploadFile = File(..., description="Archivo de esquema generado previamente (.txt)")
-    # usar_cpu: bool = Query(False, description="Forzar el uso de CPU para esta solicitud.") # Removed
 ):
-    request_start_time = time.time()
-    original_transcripcion_filename = transcripcion_file.filename
-    original_esquema_filename = esquema_file.filename
-    api_logger.info(f"Solicitud para generar apuntes basada en esquema para: {original_transcripcion_filename} y esquema: {original_esquema_filename}. Se usará la configuración de LLM cargada al inicio.")
-
-    # Similar manejo de CPU que en el endpoint de esquema
-    # if usar_cpu and not llm_processing.llm_instance.model_params.n_gpu_layers == 0: # Removed
-    #     api_logger.warning("Se solicitó CPU, pero el modelo ya está cargado con GPU. Usando GPU.") # Removed
-
-    if llm_processing.llm_instance is None:
-        api_logger.error("Modelo LLM no está disponible.")
-        raise HTTPException(status_code=503, detail="Servicio no disponible: Modelo LLM no cargado.")
-
-    try:
-        contenido_bytes_transcripcion = await transcripcion_file.read()
-        texto_completo_transcripcion = contenido_bytes_transcripcion.decode("utf-8")
-    except Exception as e:
-        api_logger.error(f"Error al leer/decodificar archivo de transcripción \'{original_transcripcion_filename}\': {e}", exc_info=True)
-        raise HTTPException(status_code=400, detail=f"Error al procesar archivo de transcripción: {e}")
-    finally:
-        await transcripcion_file.close()
-
-    try:
-        contenido_bytes_esquema = await esquema_file.read()
-        esquema_texto = contenido_bytes_esquema.decode("utf-8")
-    except Exception as e:
-        api_logger.error(f"Error al leer/decodificar archivo de esquema \'{original_esquema_filename}\': {e}", exc_info=True)
-        raise HTTPException(status_code=400, detail=f"Error al procesar archivo de esquema: {e}")
-    finally:
-        await esquema_file.close()
-
-    if not esquema_texto or not esquema_texto.strip():
-        raise HTTPException(status_code=400, detail="El archivo de esquema no puede estar vacío.")
-
-    # --- Lógica de Generación de Apuntes ---
-    apuntes_texto_final_md = None
-    try:
-        api_logger.info("Dividiendo el esquema en secciones para generar apuntes.")
-        secciones_del_esquema = re.split(r"\n(?=\d+\.\s)", esquema_texto.strip()) # Ensure re is imported
-        secciones_del_esquema = [s.strip() for s in secciones_del_esquema if s.strip()]
-
-        apuntes_completos_md_list = []
-        if not secciones_del_esquema and esquema_texto.strip():
-            apuntes_para_seccion_unica = llm_processing.generar_apuntes_por_seccion(
-                esquema_texto, texto_completo_transcripcion, 1, 1
-            )
-            if apuntes_para_seccion_unica:
-                apuntes_completos_md_list.append(f"## Resumen General de la Clase\\n{apuntes_para_seccion_unica.strip()}")
-        elif secciones_del_esquema:
-            for i, seccion_esq_texto in enumerate(secciones_del_esquema):
-                apuntes_para_esta_seccion = llm_processing.generar_apuntes_por_seccion(
-                    seccion_esq_texto, texto_completo_transcripcion, i + 1, len(secciones_del_esquema)
-                )
-                if apuntes_para_esta_seccion:
-                    apuntes_completos_md_list.append(apuntes_para_esta_seccion.strip())
+    """Genera los apuntes y espera el resultado (ver generar_esquema_endpoint)."""
+    api_logger.info(f"Solicitud para generar apuntes basada en esquema para: {transcripcion_file.filename} y esquema: {esquema_file.filename}. Se usará la configuración de LLM cargada al inicio.")
+    trabajo, futuro = await _encolar_trabajo_apuntes(transcripcion_file, esquema_file)
+    return await _esperar_trabajo_y_responder(trabajo, futuro, media_type='text/markdown')
 
-        if apuntes_completos_md_list:
-            nombre_base_salida = os.path.splitext(original_transcripcion_filename)[0]
-            apuntes_texto_final_md = f"# Guía de Estudio Detallada: {nombre_base_salida}\\n\\n" + "\\n\\n".join(apuntes_completos_md_list)
-        else:
-            api_logger.warning("No se generó contenido para los apuntes.")
-            raise HTTPException(status_code=500, detail="No se pudo generar contenido para los apuntes.")
-
-    except HTTPException as http_exc:
-        raise http_exc
-    except Exception as e_apuntes:
-        api_logger.error(f"Error durante la generación de apuntes para \'{original_transcripcion_filename}\': {e_apuntes}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Error interno al generar apuntes: {str(e_apuntes)}")
-
-    # Guardar en archivo permanente en la carpeta output
-    nombre_base_salida = os.path.splitext(original_transcripcion_filename)[0]
-    timestamp = time.strftime("%Y%m%d-%H%M%S")
-    output_filename = f"{nombre_base_salida}_apuntes_local_{timestamp}.md"
-    output_dir_path = os.path.join(config.BASE_PROJECT_DIR, "output")
-    permanent_file_path_apuntes = os.path.join(output_dir_path, output_filename)
 
-    try:
-        utils._ensure_output_dir_exists() # Ensure output dir exists
-        with open(permanent_file_path_apuntes, "w", encoding="utf-8") as f:
-            f.write(apuntes_texto_final_md)
-        api_logger.info(f"Apuntes para \'{original_transcripcion_filename}\' guardados permanentemente en: {permanent_file_path_apuntes}")
+# --- Endpoints de Trabajos Asíncronos ---
+@app.post("/trabajos/esquema/", status_code=202)
+async def crear_trabajo_esquema(
+    file: UploadFile = File(..., description="Archivo de transcripción en formato .txt")
+):
+    """Encola la generación de un esquema y devuelve el id del trabajo de inmediato."""
+    trabajo, _ = await _encolar_trabajo_esquema(file)
+    return {"id_trabajo": trabajo["id"], "estado": trabajo["estado"], "url_estado": f"/trabajos/{trabajo['id']}"}
 
-        # background_tasks.add_task(utils._cleanup_temp_file, temp_file_path_apuntes) # Removed
+@app.post("/trabajos/apuntes/", status_code=202)
+async def crear_trabajo_apuntes(
+    transcripcion_file: UploadFile = File(..., description="Archivo de transcripción original (.txt)"),
+    esquema_file: UploadFile = File(..., description="Archivo de esquema generado previamente (.txt)")
+):
+    """Encola la generación de apuntes y devuelve el id del trabajo de inmediato."""
+    trabajo, _ = await _encolar_trabajo_apuntes(transcripcion_file, esquema_file)
+    return {"id_trabajo": trabajo["id"], "estado": trabajo["estado"], "url_estado": f"/trabajos/{trabajo['id']}"}
+
+def _obtener_trabajo_o_404(id_trabajo: str):
+    if not re.fullmatch(r"[0-9a-f]{32}", id_trabajo):
+        raise HTTPException(status_code=400, detail="Id de trabajo inválido.")
+    trabajo = gestor_trabajos.almacen.obtener(id_trabajo)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail=f"Trabajo '{id_trabajo}' no encontrado.")
+    return trabajo
+
+@app.get("/trabajos/{id_trabajo}")
+async def estado_trabajo(id_trabajo: str):
+    """Estado, progreso por fase (ej. 'Esquemas parciales 3/7') y archivo resultado de un trabajo."""
+    trabajo = _obtener_trabajo_o_404(id_trabajo)
+    respuesta = {k: v for k, v in trabajo.items() if k != "entradas"}
+    if trabajo["estado"] == trabajos.ESTADO_COMPLETADO:
+        respuesta["url_archivo"] = f"/trabajos/{id_trabajo}/archivo"
+    return respuesta
+
+@app.get("/trabajos/{id_trabajo}/archivo")
+async def archivo_trabajo(id_trabajo: str):
+    """Devuelve el archivo generado por un trabajo completado."""
+    trabajo = _obtener_trabajo_o_404(id_trabajo)
+    if trabajo["estado"] != trabajos.ESTADO_COMPLETADO:
+        raise HTTPException(status_code=409, detail=f"El trabajo '{id_trabajo}' no está completado (estado: {trabajo['estado']}).")
+    file_path = os.path.join(config.BASE_PROJECT_DIR, "output", trabajo["archivo_resultado"])
+    if not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail=f"El archivo del trabajo '{id_trabajo}' ya no existe.")
+    return FileResponse(path=file_path, filename=trabajo["archivo_resultado"])
+    
 
-        api_logger.info(f"Devolviendo archivo de apuntes: {output_filename}")
-        processing_time = round(time.time() - request_start_time, 2)
-        api_logger.info(f"Tiempo total para generar apuntes de \'{original_transcripcion_filename}\': {processing_time} seg.")
+# --- Endpoints de Streaming (modelo local) ---
+@app.post("/generar_esquema/stream/")
+async def generar_esquema_stream_endpoint(
+    file: UploadFile = File(..., description="Archivo de transcripción en formato .txt")
+):
+    """Como /generar_esquema/, pero emite en NDJSON el progreso y los tokens del esquema final a medida que se generan."""
+    api_logger.info(f"Solicitud de esquema en stream para: {file.filename}.")
+    cola = asyncio.Queue()
+    trabajo, futuro = await _encolar_trabajo_esquema(file, oyente=_oyente_hacia_cola(cola))
+    cola.put_nowait({"tipo": "trabajo", "id_trabajo": trabajo["id"]})
+    return _respuesta_ndjson(cola, _esperar_archivo_de_trabajo(futuro))
+
+@app.post("/generar_apuntes/stream/")
+async def generar_apuntes_stream_endpoint(
+    transcripcion_file: UploadFile = File(..., description="Archivo de transcripción original (.txt)"),
+    esquema_file: UploadFile = File(..., description="Archivo de esquema generado previamente (.txt)")
+):
+    """Como /generar_apuntes/, pero emite en NDJSON el progreso y los tokens de cada sección a medida que se generan."""
+    api_logger.info(f"Solicitud de apuntes en stream para: {transcripcion_file.filename} y esquema: {esquema_file.filename}.")
+    cola = asyncio.Queue()
+    trabajo, futuro = await _encolar_trabajo_apuntes(transcripcion_file, esquema_file, oyente=_oyente_hacia_cola(cola))
+    cola.put_nowait({"tipo": "trabajo", "id_trabajo": trabajo["id"]})
+    return _respuesta_ndjson(cola, _esperar_archivo_de_trabajo(futuro))
 
-        return FileResponse(
-            path=permanent_file_path_apuntes,
-            filename=output_filename,
-            media_type='text/markdown'
-        )
-    except Exception as e_file_resp_apuntes:
-        api_logger.error(f"Error al preparar FileResponse para apuntes de \'{original_transcripcion_filename}\': {e_file_resp_apuntes}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Error al servir el archivo de apuntes: {str(e_file_resp_apuntes)}")
-    
 
 # --- Endpoint para Generar Esquema con Gemini ---
 @app.post("/generar_esquema_gemini/", response_class=FileResponse)
@@ -549,6 +826,70 @@ async def generar_apuntes_gemini_endpoint(
     
 
 
+# --- Endpoints de Streaming (Gemini) ---
+@app.post("/generar_esquema_gemini/stream/")
+async def generar_esquema_gemini_stream_endpoint(
+    file: UploadFile = File(..., description="Archivo de transcripción en formato .txt")
+):
+    """Como /generar_esquema_gemini/, pero emite en NDJSON los fragmentos de Gemini a medida que llegan."""
+    api_logger.info(f"Solicitud de esquema Gemini en stream para: {file.filename}.")
+    texto_completo_transcripcion = await _leer_archivo_subido(file, "transcripción")
+    if not texto_completo_transcripcion.strip():
+        raise HTTPException(status_code=400, detail="El archivo de transcripción no puede estar vacío.")
+    nombre_base_salida = os.path.splitext(file.filename)[0]
+    cola = asyncio.Queue()
+
+    async def generar_y_guardar():
+        esquema_gemini_texto = await _call_gemini_api_for_schema(
+            transcripcion_contenido=texto_completo_transcripcion,
+            prompt_template=prompts.PROMPT_GEMINI_GENERAR_ESQUEMA_TEMPLATE,
+            emitir_fragmento=lambda texto: cola.put_nowait({"tipo": "token", "texto": texto})
+        )
+        if not esquema_gemini_texto.strip():
+            raise HTTPException(status_code=500, detail="La API de Gemini no devolvió contenido para el esquema.")
+        timestamp = time.strftime("%Y%m%d-%H%M%S")
+        return _guardar_resultado_en_output(esquema_gemini_texto, f"{nombre_base_salida}_esquema_gemini_{timestamp}.txt")
+
+    return _respuesta_ndjson(cola, generar_y_guardar())
+
+@app.post("/generar_apuntes_gemini/stream/")
+async def generar_apuntes_gemini_stream_endpoint(
+    esquema_file: UploadFile = File(..., description="Archivo de esquema (.txt o .md)"),
+    transcripcion_file: UploadFile = File(..., description="Archivo de transcripción (.txt)"),
+):
+    """Como /generar_apuntes_gemini/, pero emite en NDJSON los fragmentos de Gemini a medida que llegan."""
+    api_logger.info(f"Solicitud de apuntes Gemini en stream. Esquema: {esquema_file.filename}, Transcripción: {transcripcion_file.filename}.")
+    esquema_contenido = await _leer_archivo_subido(esquema_file, "esquema")
+    transcripcion_contenido = await _leer_archivo_subido(transcripcion_file, "transcripción")
+    if not esquema_contenido.strip():
+        raise HTTPException(status_code=400, detail="El archivo de esquema no puede estar vacío.")
+    if not transcripcion_contenido.strip():
+        raise HTTPException(status_code=400, detail="El archivo de transcripción no puede estar vacío.")
+    nombre_base_salida = os.path.splitext(transcripcion_file.filename)[0]
+    cola = asyncio.Queue()
+
+    async def generar_y_guardar():
+        cola.put_nowait({"tipo": "progreso", "fase": "Consulta a la base de datos vectorial", "actual": None, "total": None,
+                         "descripcion": "Consulta a la base de datos vectorial"})
+        informacion_contextual_formateada = await utils._extraer_y_consultar_terminos_esquema(
+            esquema_contenido,
+            max_terminos_consulta=config.MAX_SCHEMA_TERMS_TO_QUERY,
+            top_k_por_termino=config.VECTOR_DB_TOP_K_PER_TERM
+        )
+        apuntes_markdown_gemini = await _call_gemini_api_with_schema_and_transcription(
+            esquema_contenido=esquema_contenido,
+            transcripcion_contenido=transcripcion_contenido,
+            prompt_texto=prompts.PROMPT_GEMINI_APUNTES_DESDE_ESQUEMA_Y_TRANSCRIPCION,
+            informacion_contextual=informacion_contextual_formateada,
+            emitir_fragmento=lambda texto: cola.put_nowait({"tipo": "token", "texto": texto})
+        )
+        if not apuntes_markdown_gemini.strip():
+            raise HTTPException(status_code=500, detail="La API de Gemini no devolvió contenido.")
+        return _guardar_resultado_en_output(apuntes_markdown_gemini, f"{nombre_base_salida}_apuntes_gemini.md")
+
+    return _respuesta_ndjson(cola, generar_y_guardar())
+
+
 # Add this endpoint to your api_main.py
 @app.get("/get_file/{filename}")
 async def get_file(filename: str):
@@ -589,6 +930,68 @@ async def get_file(filename: str):
     )
 
 
+# --- Búsqueda vectorial embebida (mismo contrato que el servicio externo de VECTOR_DB_BASE_URL) ---
+class ConsultasVectorialesLote(BaseModel):
+    queries: list[dict]
+
+@app.get("/query/")
+async def query_indice_vectorial(q: str, top_k: int = 3, page_start: Optional[int] = None, page_end: Optional[int] = None):
+    """Búsqueda en el índice vectorial embebido; permite usar esta API como servicio vectorial (VECTOR_DB_URL)."""
+    resultados = await asyncio.to_thread(indice_vectorial.consultar, q, top_k, page_start, page_end)
+    return {"results": resultados}
+
+@app.post("/query/batch/")
+async def query_indice_vectorial_lote(cuerpo: ConsultasVectorialesLote):
+    """Varias consultas en una petición ({"queries": [{"q", "top_k", "page_start", "page_end"}, ...]})."""
+    # Se agrupan las consultas con los mismos filtros para calcular sus embeddings en un solo lote.
+    grupos = {}
+    for i, consulta in enumerate(cuerpo.queries):
+        if not consulta.get("q"):
+            raise HTTPException(status_code=422, detail="Cada consulta necesita el campo 'q'.")
+        filtros = (int(consulta.get("top_k", 3)), consulta.get("page_start"), consulta.get("page_end"))
+        grupos.setdefault(filtros, []).append(i)
+    resultados = [None] * len(cuerpo.queries)
+    for (top_k, page_start, page_end), indices in grupos.items():
+        resultados_grupo = await asyncio.to_thread(
+            indice_vectorial.consultar_lote, [cuerpo.queries[i]["q"] for i in indices], top_k, page_start, page_end
+        )
+        for i, resultados_consulta in zip(indices, resultados_grupo):
+            resultados[i] = resultados_consulta
+    return {"results": resultados}
+
+@app.post("/indice_vectorial/ingestar/", status_code=202)
+async def ingestar_material_referencia(
+    archivos: list[UploadFile] = File(default=[], description="Documentos (.txt, .md, .pdf) a guardar en el directorio antes de ingerir"),
+    subdirectorio: str = Query("", description="Subdirectorio de data/referencias a ingerir (por defecto, todo)"),
+    reconstruir: bool = Query(False, description="Borrar el índice y reindexar todo")
+):
+    """
+    Encola la ingesta de data/referencias (o de un subdirectorio) en el índice vectorial embebido.
+    Solo se embeben los documentos nuevos o modificados; el resumen queda como archivo del trabajo.
+    """
+    base = os.path.realpath(config.VECTOR_INGESTA_DIR)
+    directorio = os.path.realpath(os.path.join(base, subdirectorio))
+    if os.path.commonpath([base, directorio]) != base:
+        raise HTTPException(status_code=400, detail="El subdirectorio debe estar dentro del directorio de referencias.")
+    os.makedirs(directorio, exist_ok=True)
+    for upload_file in archivos:
+        nombre = os.path.basename(upload_file.filename or "")
+        if os.path.splitext(nombre)[1].lower() not in config.VECTOR_INGESTA_EXTENSIONES:
+            raise HTTPException(status_code=400, detail=f"Tipo de documento no admitido: '{upload_file.filename}'.")
+        try:
+            contenido = await upload_file.read()
+        finally:
+            await upload_file.close()
+        with open(os.path.join(directorio, nombre), "wb") as f:
+            f.write(contenido)
+        api_logger.info(f"Documento de referencia guardado: {os.path.join(directorio, nombre)} ({len(contenido)} bytes).")
+    trabajo, _ = gestor_ingesta.encolar(
+        TIPO_TRABAJO_INGESTA,
+        {"directorio": directorio, "reconstruir": "1" if reconstruir else "0"},
+        nombre_base="ingesta"
+    )
+    return {"id_trabajo": trabajo["id"], "estado": trabajo["estado"], "url_estado": f"/trabajos/{trabajo['id']}"}
+
 # Add this endpoint to your api_main.py
 @app.get("/list_files/")
 async def list_files():
@@ -0,0 +1,444 @@
+# src/backends_llm.py
+# Backends del modelo local. llm_processing solo habla con esta interfaz, de modo que el pipeline
+# completo (chunking, fusión, apuntes) y la API pueden ejecutarse sin un GGUF con el backend "falso".
+import os
+import re
+import codecs
+import time
+import random
+import hashlib
+import logging
+import threading
+from src import config
+
+logger = logging.getLogger(__name__)
+
+
+class BackendLLM:
+    """
+    Interfaz de un backend: cargar, tokenize/detokenize, completar y stream.
+    - `prompt` puede ser texto o lista de tokens (con BOS).
+    - `completar` devuelve {"choices": [{"text", "finish_reason"}], "usage": {"prompt_tokens", "completion_tokens"}},
+      la misma forma que llama.cpp; `stream` produce fragmentos {"choices": [{"text", "finish_reason"}]}, uno por token.
+      `gramatica` (texto GBNF, ver gramaticas.py) restringe la salida a lo que la gramática admite.
+    - `embed` devuelve un embedding por texto (en llama.cpp, solo si se creó con embedding=True; ver `pooling`).
+    - El KV cache (reset, eval, save_state, load_state, prefijo_en_cache) permite reutilizar un prefijo
+      ya evaluado entre llamadas (ver llm_processing.preparar_prefijo_apuntes).
+    - `estadisticas_borrador` devuelve los contadores acumulados de la decodificación especulativa
+      ({"pases", "propuestos"}), o None si el backend no la usa.
+    - `memoria_estimada_bytes` y `liberar` permiten al registro de modelos (ver registro_modelos.py)
+      repartir un presupuesto de memoria entre varios modelos y descargar los que sobran.
+    """
+    nombre = None
+
+    def cargar(self, n_threads=None, n_gpu_layers=0):
+        raise NotImplementedError
+
+    def n_ctx(self):
+        raise NotImplementedError
+
+    def tokenize(self, texto_bytes, add_bos=True):
+        raise NotImplementedError
+
+    def detokenize(self, tokens):
+        raise NotImplementedError
+
+    def completar(self, prompt, max_tokens, temperature=0.0, stop=None, seed=None, gramatica=None):
+        raise NotImplementedError
+
+    def stream(self, prompt, max_tokens, temperature=0.0, stop=None, seed=None, gramatica=None):
+        raise NotImplementedError
+
+    def embed(self, textos):
+        """Embeddings normalizados (norma L2 = 1): una lista de len(textos) vectores de la misma dimensión."""
+        raise NotImplementedError
+
+    def reset(self):
+        raise NotImplementedError
+
+    def eval(self, tokens):
+        raise NotImplementedError
+
+    def save_state(self):
+        raise NotImplementedError
+
+    def load_state(self, estado):
+        raise NotImplementedError
+
+    def prefijo_en_cache(self, tokens_prefijo):
+        """True si el KV cache empieza exactamente por `tokens_prefijo`."""
+        raise NotImplementedError
+
+    def estadisticas_borrador(self):
+        return None
+
+    def memoria_estimada_bytes(self):
+        """Memoria que ocupa el modelo cargado (pesos y KV cache), aproximada."""
+        return 0
+
+    def liberar(self):
+        """Libera el modelo y su contexto; el backend no se puede volver a usar sin cargar()."""
+
+
+class _BorradorConEstadisticas:
+    """
+    Envuelve el modelo de borrador que recibe Llama (draft_model) para contar los pases de
+    verificación y los tokens propuestos: llama-cpp-python no expone cuántos se aceptan, así que
+    llm_processing lo deduce de estos contadores y de los tokens generados.
+    """
+
+    def __init__(self, borrador):
+        self.borrador = borrador
+        self.pases = 0
+        self.propuestos = 0
+
+    def __call__(self, input_ids, **kwargs):
+        tokens = self.borrador(input_ids, **kwargs)
+        self.pases += 1
+        self.propuestos += len(tokens)
+        return tokens
+
+
+class BorradorGGUF:
+    """
+    Borrador de un GGUF pequeño con el mismo vocabulario que el modelo principal: propone los
+    `num_pred_tokens` siguientes tokens de forma greedy. Su KV cache conserva el prefijo común con la
+    llamada anterior, así que en cada pase solo evalúa los tokens nuevos.
+    """
+
+    def __init__(self, ruta_modelo, num_pred_tokens, n_ctx, n_threads=None, n_gpu_layers=0, n_batch=None, verbose=False):
+        if not ruta_modelo or not os.path.exists(ruta_modelo):
+            raise FileNotFoundError(f"No se encontró el modelo de borrador en '{ruta_modelo}' (config.LLM_BORRADOR_MODELO_FILENAME).")
+        from llama_cpp import Llama
+        self.llama = Llama(model_path=ruta_modelo, n_ctx=n_ctx, n_threads=n_threads, n_gpu_layers=n_gpu_layers,
+                           n_batch=n_batch or config.N_BATCH_LLAMA, use_mmap=config.LLM_USE_MMAP, verbose=verbose, seed=42)
+        self.num_pred_tokens = num_pred_tokens
+
+    def __call__(self, input_ids, **kwargs):
+        import numpy as np
+        borrador = []
+        # El modelo principal verifica el prompt más todo el borrador: si no cabe en el contexto, no se propone nada.
+        if len(input_ids) + self.num_pred_tokens < self.llama.n_ctx():
+            for token in self.llama.generate(input_ids.tolist(), top_k=1, temp=0.0, reset=True):
+                if token == self.llama.token_eos():
+                    break
+                borrador.append(token)
+                if len(borrador) >= self.num_pred_tokens:
+                    break
+        return np.array(borrador, dtype=np.intc)
+
+
+class BackendLlamaCpp(BackendLLM):
+    """llama-cpp-python sobre un archivo GGUF."""
+    nombre = "llama_cpp"
+
+    def __init__(self, ruta_modelo=None, n_ctx=None, n_batch=None, use_mmap=None, verbose=None, embedding=False,
+                 decodificacion_especulativa=None, use_mlock=None, pooling=None):
+        # Los valores por defecto se leen de config al crear el backend (no al importar el módulo).
+        self.ruta_modelo = ruta_modelo or config.MODEL_PATH
+        self._n_ctx = n_ctx or config.CONTEXT_SIZE
+        self.n_batch = n_batch or config.N_BATCH_LLAMA
+        self.use_mmap = config.LLM_USE_MMAP if use_mmap is None else use_mmap
+        self.use_mlock = config.LLM_USE_MLOCK if use_mlock is None else use_mlock
+        self.verbose = config.LLM_VERBOSE if verbose is None else verbose
+        self.embedding = embedding
+        self.pooling = config.VECTOR_EMBEBIDO_POOLING if pooling is None else pooling
+        self.decodificacion_especulativa = (
+            config.LLM_DECODIFICACION_ESPECULATIVA if decodificacion_especulativa is None else decodificacion_especulativa
+        )
+        self.llama = None
+        self._borrador = None
+        self._gramaticas = {} # GBNF -> LlamaGrammar (compilar la gramática en cada llamada cuesta más que generar varias líneas)
+
+    def _crear_borrador(self, n_threads, n_gpu_layers):
+        """Modelo de borrador de config.LLM_DECODIFICACION_ESPECULATIVA (None si está desactivada)."""
+        modo = self.decodificacion_especulativa
+        if not modo or self.embedding:
+            return None
+        if modo == "prompt_lookup":
+            from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+            borrador = LlamaPromptLookupDecoding(num_pred_tokens=config.LLM_BORRADOR_TOKENS, max_ngram_size=config.LLM_BORRADOR_MAX_NGRAM)
+        elif modo == "gguf":
+            borrador = BorradorGGUF(config.LLM_BORRADOR_MODELO_PATH, config.LLM_BORRADOR_TOKENS, self._n_ctx,
+                                    n_threads=n_threads, n_gpu_layers=n_gpu_layers, n_batch=self.n_batch, verbose=self.verbose)
+        else:
+            raise ValueError(f"Decodificación especulativa desconocida: '{modo}'. Opciones: '', 'prompt_lookup', 'gguf'.")
+        logger.info(f"Decodificación especulativa '{modo}': hasta {config.LLM_BORRADOR_TOKENS} tokens por borrador.")
+        return _BorradorConEstadisticas(borrador)
+
+    def _opciones_embeddings(self):
+        """Tipo de pooling en modo embeddings: sin él, un decodificador devuelve un vector por token y no uno por texto."""
+        if not self.embedding:
+            return {}
+        import llama_cpp
+        tipos = {
+            "": llama_cpp.LLAMA_POOLING_TYPE_UNSPECIFIED,
+            "mean": llama_cpp.LLAMA_POOLING_TYPE_MEAN,
+            "cls": llama_cpp.LLAMA_POOLING_TYPE_CLS,
+            "last": llama_cpp.LLAMA_POOLING_TYPE_LAST,
+        }
+        if self.pooling not in tipos:
+            raise ValueError(f"Pooling de embeddings desconocido: '{self.pooling}'. Opciones: {list(tipos)}.")
+        return {"embedding": True, "pooling_type": tipos[self.pooling]}
+
+    def cargar(self, n_threads=None, n_gpu_layers=0):
+        if not os.path.exists(self.ruta_modelo):
+            raise FileNotFoundError(f"No se encontró el archivo del modelo en {self.ruta_modelo}")
+        from llama_cpp import Llama # Import diferido: el backend falso no necesita llama.cpp instalado
+        self._borrador = self._crear_borrador(n_threads, n_gpu_layers)
+        self.llama = Llama(
+            model_path=self.ruta_modelo,
+            n_ctx=self._n_ctx,
+            n_threads=n_threads,
+            n_gpu_layers=n_gpu_layers,
+            n_batch=self.n_batch,
+            use_mmap=self.use_mmap, # Pesos mapeados en memoria: varios procesos comparten las mismas páginas
+            use_mlock=self.use_mlock,
+            verbose=self.verbose,
+            draft_model=self._borrador,
+            seed=42,
+            **self._opciones_embeddings(),
+        )
+        borrador = self._borrador.borrador if self._borrador is not None else None
+        if isinstance(borrador, BorradorGGUF) and borrador.llama.n_vocab() != self.llama.n_vocab():
+            raise ValueError(f"El modelo de borrador tiene {borrador.llama.n_vocab()} tokens de vocabulario "
+                             f"y el principal {self.llama.n_vocab()}: deben compartir tokenizador.")
+        return self
+
+    def n_ctx(self):
+        return self.llama.n_ctx()
+
+    def tokenize(self, texto_bytes, add_bos=True):
+        return self.llama.tokenize(texto_bytes, add_bos=add_bos)
+
+    def detokenize(self, tokens):
+        return self.llama.detokenize(tokens)
+
+    def _gramatica(self, gbnf):
+        if gbnf is None:
+            return None
+        if gbnf not in self._gramaticas:
+            from llama_cpp import LlamaGrammar
+            self._gramaticas[gbnf] = LlamaGrammar.from_string(gbnf, verbose=self.verbose)
+        return self._gramaticas[gbnf]
+
+    def completar(self, prompt, max_tokens, temperature=0.0, stop=None, seed=None, gramatica=None):
+        return self.llama(prompt, max_tokens=max_tokens, stop=stop, echo=False, temperature=temperature, seed=seed,
+                          grammar=self._gramatica(gramatica))
+
+    def stream(self, prompt, max_tokens, temperature=0.0, stop=None, seed=None, gramatica=None):
+        return self.llama(prompt, max_tokens=max_tokens, stop=stop, echo=False, temperature=temperature, seed=seed,
+                          grammar=self._gramatica(gramatica), stream=True)
+
+    def embed(self, textos):
+        textos = list(textos)
+        embeddings = self.llama.embed(textos, normalize=True)
+        # Sin pooling, cada texto trae una lista de vectores (uno por token) en lugar de un vector.
+        if len(embeddings) != len(textos) or any(not vector or isinstance(vector[0], list) for vector in embeddings):
+            raise ValueError(f"El modelo de embeddings no devolvió un vector por texto (pooling '{self.pooling}'): "
+                             "usar VECTOR_EMBEBIDO_POOLING = \"mean\" o \"last\" con un modelo decodificador.")
+        return embeddings
+
+    def reset(self):
+        self.llama.reset()
+
+    def eval(self, tokens):
+        self.llama.eval(tokens)
+
+    def save_state(self):
+        return self.llama.save_state()
+
+    def load_state(self, estado):
+        self.llama.load_state(estado)
+
+    def prefijo_en_cache(self, tokens_prefijo):
+        num_tokens_prefijo = len(tokens_prefijo)
+        return self.llama.n_tokens >= num_tokens_prefijo and \
+            self.llama.input_ids[:num_tokens_prefijo].tolist() == list(tokens_prefijo)
+
+    def estadisticas_borrador(self):
+        if self._borrador is None:
+            return None
+        return {"pases": self._borrador.pases, "propuestos": self._borrador.propuestos}
+
+    def memoria_estimada_bytes(self):
+        """Tamaño del GGUF (pesos) más el KV cache en f16 según las dimensiones de sus metadatos."""
+        memoria = os.path.getsize(self.ruta_modelo)
+        if self.llama is not None:
+            metadatos = self.llama.metadata or {}
+            arquitectura = metadatos.get("general.architecture", "llama")
+            try:
+                capas = int(metadatos[f"{arquitectura}.block_count"])
+                dimension = int(metadatos[f"{arquitectura}.embedding_length"])
+                cabezas = int(metadatos[f"{arquitectura}.attention.head_count"])
+                cabezas_kv = int(metadatos.get(f"{arquitectura}.attention.head_count_kv", cabezas))
+                memoria += 2 * capas * self.llama.n_ctx() * (dimension // cabezas * cabezas_kv) * 2 # K y V, 2 bytes por valor
+            except (KeyError, ValueError, ZeroDivisionError):
+                logger.debug(f"Metadatos incompletos en {self.ruta_modelo}: la memoria estimada no incluye el KV cache.")
+        if isinstance(getattr(self._borrador, "borrador", None), BorradorGGUF):
+            memoria += os.path.getsize(config.LLM_BORRADOR_MODELO_PATH)
+        return memoria
+
+    def liberar(self):
+        if self.llama is not None:
+            self.llama.close()
+        borrador = self._borrador.borrador if self._borrador is not None else None
+        if isinstance(borrador, BorradorGGUF):
+            borrador.llama.close()
+        self.llama = None
+        self._borrador = None
+        self._gramaticas = {}
+
+
+class BackendFalso(BackendLLM):
+    """
+    Backend determinista sin modelo, para pruebas de carga y perfilado de la orquestación.
+    Tokeniza en trozos de hasta 3 bytes (el id codifica los bytes: reversible y sin vocabulario,
+    igual en cualquier proceso), responde con un esquema/apuntes derivado del hash del prompt y
+    simula la velocidad configurada de evaluación del prompt y de generación, con KV cache de prefijos.
+    Ignora `gramatica`: su respuesta ya es un esquema numerado como el que admite gramaticas.gbnf_esquema.
+    """
+    nombre = "falso"
+    BOS = 1
+    DIMENSION_EMBEDDINGS = 256
+    _PATRON_TROZO = re.compile(rb" ?[^\s]{1,2}|\s")
+
+    def __init__(self, n_ctx=None, tokens_por_segundo=None, tokens_prompt_por_segundo=None):
+        self._n_ctx = n_ctx or config.CONTEXT_SIZE
+        self.tokens_por_segundo = config.LLM_FALSO_TOKENS_POR_SEGUNDO if tokens_por_segundo is None else tokens_por_segundo
+        self.tokens_prompt_por_segundo = (
+            config.LLM_FALSO_TOKENS_PROMPT_POR_SEGUNDO if tokens_prompt_por_segundo is None else tokens_prompt_por_segundo
+        )
+        self._tokens_en_cache = []
+        self._lock = threading.Lock() # Como llama.cpp, una sola generación a la vez por instancia
+
+    def cargar(self, n_threads=None, n_gpu_layers=0):
+        logger.info(f"Backend falso: {self.tokens_prompt_por_segundo} tokens/s de prompt, {self.tokens_por_segundo} tokens/s de generación.")
+        return self
+
+    def n_ctx(self):
+        return self._n_ctx
+
+    def tokenize(self, texto_bytes, add_bos=True):
+        tokens = [len(trozo) << 24 | int.from_bytes(trozo, "big") for trozo in self._PATRON_TROZO.findall(texto_bytes)]
+        return [self.BOS] + tokens if add_bos else tokens
+
+    def detokenize(self, tokens):
+        trozos = []
+        for token in tokens:
+            token = int(token)
+            longitud = token >> 24
+            if longitud:
+                trozos.append((token & 0xFFFFFF).to_bytes(longitud, "big"))
+        return b"".join(trozos)
+
+    def _a_tokens(self, prompt):
+        if isinstance(prompt, str):
+            return self.tokenize(prompt.encode("utf-8", "ignore"))
+        return [int(t) for t in prompt]
+
+    @staticmethod
+    def _esperar(num_tokens, tokens_por_segundo):
+        if tokens_por_segundo and num_tokens > 0:
+            time.sleep(num_tokens / tokens_por_segundo)
+
+    def _evaluar(self, tokens):
+        """Simula la evaluación de `tokens` reutilizando el prefijo común con el KV cache."""
+        comunes = 0
+        for a, b in zip(self._tokens_en_cache, tokens):
+            if a != b:
+                break
+            comunes += 1
+        self._esperar(len(tokens) - comunes, self.tokens_prompt_por_segundo)
+        self._tokens_en_cache = list(tokens)
+
+    def _respuesta(self, tokens_prompt, seed):
+        """Esquema numerado (sirve para esquemas, fusión y apuntes) con palabras del propio prompt."""
+        huella = hashlib.blake2b(repr((tokens_prompt[-2048:], len(tokens_prompt), seed)).encode(), digest_size=8).digest()
+        rng = random.Random(huella)
+        palabras = re.findall(r"\w{5,}", self.detokenize(tokens_prompt[-4096:]).decode("utf-8", "ignore")) or ["contenido"]
+        lineas = []
+        for i in range(1, rng.randint(3, 6) + 1):
+            lineas.append(f"{i}. {' '.join(rng.choice(palabras).capitalize() for _ in range(rng.randint(2, 4)))}")
+            for j in range(1, rng.randint(2, 4) + 1):
+                lineas.append(f"    {i}.{j}. {' '.join(rng.choice(palabras) for _ in range(rng.randint(3, 8)))}")
+        return "\n".join(lineas)
+
+    def stream(self, prompt, max_tokens, temperature=0.0, stop=None, seed=None, gramatica=None):
+        with self._lock:
+            tokens_prompt = self._a_tokens(prompt)
+            if len(tokens_prompt) > self._n_ctx:
+                raise ValueError(f"Requested tokens ({len(tokens_prompt)}) exceed context window of {self._n_ctx}")
+            self._evaluar(tokens_prompt)
+            texto = self._respuesta(tokens_prompt, seed)
+            for secuencia in stop or []:
+                if secuencia in texto:
+                    texto = texto[:texto.index(secuencia)]
+            tokens_respuesta = self.tokenize(texto.encode("utf-8"), add_bos=False)
+            finish_reason = "length" if len(tokens_respuesta) > max_tokens else "stop"
+            tokens_respuesta = tokens_respuesta[:max_tokens]
+            # Los trozos pueden partir un carácter UTF-8: se emite solo el texto ya completo, como llama.cpp.
+            decodificador = codecs.getincrementaldecoder("utf-8")("ignore")
+            for i, token in enumerate(tokens_respuesta):
+                self._esperar(1, self.tokens_por_segundo)
+                self._tokens_en_cache.append(token)
+                ultimo = i == len(tokens_respuesta) - 1
+                yield {"choices": [{"text": decodificador.decode(self.detokenize([token]), final=ultimo),
+                                    "finish_reason": finish_reason if ultimo else None}]}
+            if not tokens_respuesta:
+                yield {"choices": [{"text": "", "finish_reason": finish_reason}]}
+
+    def completar(self, prompt, max_tokens, temperature=0.0, stop=None, seed=None, gramatica=None):
+        tokens_prompt = self._a_tokens(prompt)
+        partes = []
+        finish_reason = None
+        for fragmento in self.stream(tokens_prompt, max_tokens, temperature, stop, seed):
+            eleccion = fragmento["choices"][0]
+            partes.append(eleccion["text"])
+            finish_reason = eleccion["finish_reason"] or finish_reason
+        texto = "".join(partes)
+        return {
+            "choices": [{"text": texto, "finish_reason": finish_reason}],
+            "usage": {"prompt_tokens": len(tokens_prompt), "completion_tokens": len(self.tokenize(texto.encode("utf-8"), add_bos=False))},
+        }
+
+    def embed(self, textos):
+        """Bolsa de palabras con hashing (determinista): textos que comparten palabras quedan cerca."""
+        import numpy as np
+        embeddings = np.zeros((len(textos), self.DIMENSION_EMBEDDINGS), dtype=np.float32)
+        for i, texto in enumerate(textos):
+            for palabra in re.findall(r"\w+", texto.lower()):
+                huella = int.from_bytes(hashlib.blake2b(palabra.encode("utf-8"), digest_size=4).digest(), "big")
+                embeddings[i, huella % self.DIMENSION_EMBEDDINGS] += 1.0 if huella & 0x80000000 else -1.0
+        normas = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return (embeddings / np.where(normas > 0, normas, 1.0)).tolist()
+
+    def reset(self):
+        self._tokens_en_cache = []
+
+    def eval(self, tokens):
+        with self._lock:
+            self._evaluar(list(self._tokens_en_cache) + [int(t) for t in tokens])
+
+    def save_state(self):
+        return list(self._tokens_en_cache)
+
+    def load_state(self, estado):
+        self._tokens_en_cache = list(estado)
+
+    def prefijo_en_cache(self, tokens_prefijo):
+        return self._tokens_en_cache[:len(tokens_prefijo)] == list(tokens_prefijo)
+
+
+BACKENDS = {
+    BackendLlamaCpp.nombre: BackendLlamaCpp,
+    BackendFalso.nombre: BackendFalso,
+}
+
+
+def crear_backend(nombre=None, **opciones):
+    """Instancia (sin cargar) el backend `nombre` (por defecto, config.LLM_BACKEND)."""
+    nombre = nombre or config.LLM_BACKEND
+    if nombre not in BACKENDS:
+        raise ValueError(f"Backend LLM desconocido: '{nombre}'. Disponibles: {sorted(BACKENDS)}")
+    return BACKENDS[nombre](**opciones)
@@ -0,0 +1,583 @@
+# src/benchmark_llm.py
+# Benchmark reproducible del modelo local con los prompts reales del proyecto.
+#
+# Por cada configuración de carga (capas en GPU, hilos, tamaño de batch) se lanza un proceso nuevo
+# que carga el modelo una vez (tiempo de carga y RSS pico medidos por configuración) y, para cada
+# corpus, recorre la misma cadena que el pipeline: esquema parcial de cada mitad -> fusión de ambos
+# esquemas -> apuntes de la primera sección con la transcripción completa como contexto.
+# De cada llamada se mide por separado la evaluación del prompt y la generación.
+#
+# Uso:
+#   python -m src.benchmark_llm ejecutar --hilos 4 6 --batch 256 512 --linea-base data/benchmarks/base.json
+#   python -m src.benchmark_llm comparar data/benchmarks/base.json data/benchmarks/benchmark_X.json
+#
+# El modo contextos mide, en cambio, la gestión de contextos del registro de modelos (ver
+# registro_modelos.py): recorre una ejecución normal de esquemas parciales, fusión y apuntes por
+# llm_processing con cada estrategia de config.LLM_CONTEXTOS y cuenta el tiempo total, incluidas las
+# aperturas de contextos y las evaluaciones del prefijo de apuntes que provocan.
+#   python -m src.benchmark_llm contextos --estrategias unico lru2 tope_tokens todos --tamanos 1024 6144
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
+import platform
+import itertools
+import statistics
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from src import config
+from src import prompts
+from src import backends_llm
+
+try:
+    import resource
+except ImportError: # Windows: sin RSS pico
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+VERSION_FORMATO = 1
+SEMILLA = 42
+TAREAS = ("esquema_parcial", "fusion", "apuntes_seccion")
+# Métricas que compara el modo comparar: (nombre, True si un valor mayor es mejor).
+METRICAS_POR_TAREA = (("tokens_por_segundo_prompt", True), ("tokens_por_segundo_generacion", True))
+METRICAS_POR_CONFIGURACION = (("tiempo_carga_s", False), ("rss_pico_mb", False))
+
+
+def _rss_pico_mb():
+    if resource is None:
+        return None
+    rss_pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss está en KiB en Linux y en bytes en macOS.
+    return round(rss_pico / (1024 * 1024) if sys.platform == "darwin" else rss_pico / 1024, 1)
+
+
+def _sha256_texto(texto):
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+def nombre_configuracion(parametros):
+    """Nombre derivado de los propios parámetros, para que la etiqueta siempre coincida con lo medido."""
+    hilos = parametros["n_threads"] if parametros["n_threads"] is not None else "auto"
+    nombre = f"gpu{parametros['n_gpu_layers']}_hilos{hilos}_batch{parametros['n_batch']}"
+    if parametros.get("especulativa"):
+        nombre += f"_{parametros['especulativa']}"
+    return nombre
+
+
+def construir_corpus(llm, texto_base, num_tokens):
+    """
+    Corpus de exactamente `num_tokens` tokens (o menos si no se alcanza): el texto base repetido
+    y cortado en un límite de token. Para un mismo modelo y texto base, siempre es el mismo texto.
+    """
+    from src.documento_tokenizado import DocumentoTokenizado
+    tokens_base = len(llm.tokenize(texto_base.encode("utf-8"), add_bos=False))
+    repeticiones = max(1, -(-num_tokens // max(tokens_base, 1)))
+    documento = DocumentoTokenizado.desde_texto("\n\n".join([texto_base] * repeticiones), llm)
+    return documento.fragmento(0, min(num_tokens, documento.num_tokens))
+
+
+def _medir_generacion(llm, tarea, prompt_texto, max_tokens, temperatura):
+    """Genera en stream: el primer fragmento marca el fin de la evaluación del prompt."""
+    llm.reset() # Sin reutilizar el KV cache de la llamada anterior: se mide la evaluación completa del prompt
+    tokens_prompt = llm.tokenize(prompt_texto.encode("utf-8", "ignore"), add_bos=True)
+    max_tokens = max(1, min(max_tokens, llm.n_ctx() - len(tokens_prompt) - 1))
+
+    partes_generadas = []
+    finish_reason = None
+    borrador_inicio = llm.estadisticas_borrador()
+    inicio = time.perf_counter()
+    primer_token = None
+    for fragmento in llm.stream(tokens_prompt, max_tokens=max_tokens, temperature=temperatura, seed=SEMILLA):
+        eleccion = fragmento["choices"][0]
+        if primer_token is None:
+            primer_token = time.perf_counter()
+        if eleccion.get("text"):
+            partes_generadas.append(eleccion["text"])
+        if eleccion.get("finish_reason"):
+            finish_reason = eleccion["finish_reason"]
+    fin = time.perf_counter()
+    primer_token = primer_token or fin
+
+    tiempo_prompt = primer_token - inicio
+    tiempo_generacion = fin - primer_token
+    # El primer token sale junto con la evaluación del prompt; la velocidad de generación se mide con el resto.
+    tokens_generados = len(partes_generadas)
+    tasa_aceptacion = None
+    borrador_fin = llm.estadisticas_borrador()
+    if borrador_inicio is not None and borrador_fin is not None:
+        # Como en llm_processing._estadisticas_borrador: cada pase aporta los aceptados más un token del modelo.
+        propuestos = borrador_fin["propuestos"] - borrador_inicio["propuestos"]
+        aceptados = min(propuestos, max(0, tokens_generados - 1 - (borrador_fin["pases"] - borrador_inicio["pases"])))
+        tasa_aceptacion = round(aceptados / propuestos, 4) if propuestos else None
+    medicion = {
+        "tarea": tarea,
+        "tokens_prompt": len(tokens_prompt),
+        "tokens_generados": tokens_generados,
+        "tiempo_prompt_s": round(tiempo_prompt, 4),
+        "tiempo_generacion_s": round(tiempo_generacion, 4),
+        "tokens_por_segundo_prompt": round(len(tokens_prompt) / tiempo_prompt, 2) if tiempo_prompt > 0 else None,
+        "tokens_por_segundo_generacion": (
+            round((tokens_generados - 1) / tiempo_generacion, 2) if tokens_generados > 1 and tiempo_generacion > 0 else None
+        ),
+        "tasa_aceptacion_borrador": tasa_aceptacion,
+        "finish_reason": finish_reason,
+    }
+    return "".join(partes_generadas), medicion
+
+
+def _cadena_de_prompts(llm, corpus, max_tokens):
+    """Esquemas parciales de cada mitad del corpus, su fusión y los apuntes de la primera sección."""
+    from src import pipeline
+    mediciones = []
+    mitad = corpus.num_tokens // 2
+    esquemas_parciales = []
+    for i, (inicio, fin) in enumerate(((0, mitad), (mitad, corpus.num_tokens))):
+        prompt_parcial = prompts.PROMPT_GENERAR_ESQUEMA_PARCIAL_TEMPLATE.format(
+            chunk_numero=i + 1, total_chunks=2, texto_fragmento=corpus.fragmento(inicio, fin).texto
+        )
+        esquema_parcial, medicion = _medir_generacion(
+            llm, "esquema_parcial", prompt_parcial,
+            min(max_tokens or config.MAX_TOKENS_ESQUEMA_PARCIAL, config.MAX_TOKENS_ESQUEMA_PARCIAL),
+            config.LLM_TEMPERATURE_ESQUEMA
+        )
+        esquemas_parciales.append(esquema_parcial.strip())
+        mediciones.append(medicion)
+
+    texto_esquemas = "".join(f"--- ESQUEMA PARCIAL {i+1} ---\n{e}\n\n" for i, e in enumerate(esquemas_parciales))
+    esquema_fusionado, medicion = _medir_generacion(
+        llm, "fusion", prompts.PROMPT_FUSIONAR_ESQUEMAS_TEMPLATE.format(texto_esquemas_parciales=texto_esquemas),
+        min(max_tokens or config.MAX_TOKENS_ESQUEMA_FUSIONADO, config.MAX_TOKENS_ESQUEMA_FUSIONADO),
+        config.LLM_TEMPERATURE_FUSION
+    )
+    mediciones.append(medicion)
+
+    secciones = pipeline.dividir_esquema_en_secciones(esquema_fusionado or esquemas_parciales[0])
+    seccion = secciones[0] if secciones else (esquema_fusionado or esquemas_parciales[0])
+    prompt_apuntes = prompts.PROMPT_GENERAR_APUNTES_POR_SECCION_TEMPLATE.format(
+        seccion_del_esquema_actual=seccion, contexto_relevante_de_transcripcion=corpus.texto
+    )
+    _, medicion = _medir_generacion(
+        llm, "apuntes_seccion", prompt_apuntes,
+        min(max_tokens or config.MAX_TOKENS_APUNTES_POR_SECCION, config.MAX_TOKENS_APUNTES_POR_SECCION),
+        config.LLM_TEMPERATURE_APUNTES
+    )
+    mediciones.append(medicion)
+    return mediciones
+
+
+def _resumir(mediciones):
+    """Mediana por corpus y tarea de cada métrica de las mediciones."""
+    resumen = {}
+    for medicion in mediciones:
+        resumen.setdefault(f"{medicion['corpus']}/{medicion['tarea']}", []).append(medicion)
+    for clave, grupo in resumen.items():
+        valores = {"llamadas": len(grupo)}
+        for campo in ("tokens_prompt", "tokens_generados", "tiempo_prompt_s", "tiempo_generacion_s",
+                      "tokens_por_segundo_prompt", "tokens_por_segundo_generacion", "tasa_aceptacion_borrador"):
+            datos = [m[campo] for m in grupo if m.get(campo) is not None]
+            valores[campo] = round(statistics.median(datos), 4) if datos else None
+        resumen[clave] = valores
+    return resumen
+
+
+def _crear_backend(nombre_backend, parametros, ruta_modelo, n_ctx):
+    if nombre_backend == backends_llm.BackendLlamaCpp.nombre:
+        return backends_llm.crear_backend(nombre_backend, ruta_modelo=ruta_modelo, n_ctx=n_ctx, n_batch=parametros["n_batch"], verbose=False,
+                                          decodificacion_especulativa=parametros.get("especulativa", ""))
+    return backends_llm.crear_backend(nombre_backend, n_ctx=n_ctx)
+
+
+def ejecutar_configuracion(nombre_backend, parametros, ruta_modelo, n_ctx, texto_base, tamanos_corpus, repeticiones, max_tokens):
+    """Se ejecuta en un proceso nuevo por configuración (RSS pico y tiempo de carga aislados)."""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)-5s] %(processName)s: %(message)s")
+    nombre = nombre_configuracion(parametros)
+    logger.info(f"[{nombre}] Cargando modelo...")
+    inicio_carga = time.perf_counter()
+    llm = _crear_backend(nombre_backend, parametros, ruta_modelo, n_ctx).cargar(
+        n_threads=parametros["n_threads"], n_gpu_layers=parametros["n_gpu_layers"]
+    )
+    tiempo_carga = time.perf_counter() - inicio_carga
+    rss_pico_carga = _rss_pico_mb()
+    logger.info(f"[{nombre}] Modelo cargado en {tiempo_carga:.2f} s.")
+
+    # Calentamiento (primeras asignaciones del contexto, páginas del mmap): no se mide.
+    _medir_generacion(llm, "calentamiento", "Hola.", 1, 0.0)
+
+    corpus_info = {}
+    mediciones = []
+    for num_tokens in tamanos_corpus:
+        corpus = construir_corpus(llm, texto_base, num_tokens)
+        nombre_corpus = f"{num_tokens}_tokens"
+        corpus_info[nombre_corpus] = {"tokens": corpus.num_tokens, "sha256": _sha256_texto(corpus.texto)}
+        for repeticion in range(repeticiones):
+            logger.info(f"[{nombre}] Corpus {nombre_corpus}, repetición {repeticion + 1}/{repeticiones}.")
+            for medicion in _cadena_de_prompts(llm, corpus, max_tokens):
+                mediciones.append({"corpus": nombre_corpus, "repeticion": repeticion + 1, **medicion})
+
+    return {
+        "nombre": nombre,
+        "parametros": parametros,
+        "tiempo_carga_s": round(tiempo_carga, 3),
+        "rss_pico_carga_mb": rss_pico_carga,
+        "rss_pico_mb": _rss_pico_mb(),
+        "corpus": corpus_info,
+        "resumen": _resumir(mediciones),
+        "mediciones": mediciones,
+    }
+
+
+def ejecutar_benchmark(configuraciones, tamanos_corpus, repeticiones=1, max_tokens=None, ruta_modelo=config.MODEL_PATH,
+                       ruta_corpus=config.BENCHMARK_CORPUS_PATH, n_ctx=config.CONTEXT_SIZE, nombre_backend=config.LLM_BACKEND):
+    """Ejecuta todas las configuraciones (una tras otra, cada una en su proceso) y devuelve el informe."""
+    with open(ruta_corpus, "r", encoding="utf-8") as f:
+        texto_base = f.read()
+    try:
+        from importlib.metadata import version
+        version_llama_cpp = version("llama-cpp-python")
+    except Exception:
+        version_llama_cpp = None
+
+    informe = {
+        "version_formato": VERSION_FORMATO,
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "backend": nombre_backend,
+        "modelo": (
+            {"archivo": os.path.basename(ruta_modelo), "tamano_bytes": os.path.getsize(ruta_modelo)}
+            if nombre_backend == backends_llm.BackendLlamaCpp.nombre else None
+        ),
+        "entorno": {
+            "python": platform.python_version(), "plataforma": platform.platform(),
+            "procesador": platform.processor(), "cpus": os.cpu_count(), "llama_cpp_python": version_llama_cpp,
+        },
+        "n_ctx": n_ctx,
+        "semilla": SEMILLA,
+        "repeticiones": repeticiones,
+        "max_tokens": max_tokens,
+        "corpus_base": {"archivo": os.path.basename(ruta_corpus), "sha256": _sha256_texto(texto_base)},
+        "configuraciones": [],
+    }
+    contexto_mp = multiprocessing.get_context("spawn")
+    for parametros in configuraciones:
+        with ProcessPoolExecutor(max_workers=1, mp_context=contexto_mp) as ejecutor:
+            futuro = ejecutor.submit(
+                ejecutar_configuracion, nombre_backend, parametros, ruta_modelo, n_ctx, texto_base, tuple(tamanos_corpus), repeticiones, max_tokens
+            )
+            try:
+                informe["configuraciones"].append(futuro.result())
+            except Exception as e:
+                logger.error(f"Falló la configuración {nombre_configuracion(parametros)}: {e}", exc_info=True)
+                informe["configuraciones"].append({"nombre": nombre_configuracion(parametros), "parametros": parametros, "error": str(e)})
+    return informe
+
+
+# Estrategias de contextos del registro de modelos que compara el modo contextos.
+ESTRATEGIAS_CONTEXTOS = ("unico", "lru2", "tope_tokens", "todos")
+
+
+def parametros_estrategia_contextos(estrategia, n_ctx):
+    """Parámetros de RegistroModelos de cada estrategia para un modelo de contexto máximo `n_ctx`."""
+    return {
+        # Un solo contexto de n_ctx para todas las llamadas
+        "unico": {"contextos": (), "max_contextos_por_modelo": 0, "max_tokens_contextos_por_modelo": 0},
+        # Por tamaño, dos abiertos a la vez
+        "lru2": {"contextos": config.LLM_CONTEXTOS, "max_contextos_por_modelo": 2, "max_tokens_contextos_por_modelo": 0},
+        # Por tamaño, sin pasar del KV cache de un único contexto de n_ctx (el valor por defecto, con CONTEXT_SIZE)
+        "tope_tokens": {"contextos": config.LLM_CONTEXTOS, "max_contextos_por_modelo": 0, "max_tokens_contextos_por_modelo": n_ctx},
+        # Por tamaño, todos abiertos
+        "todos": {"contextos": config.LLM_CONTEXTOS, "max_contextos_por_modelo": 0, "max_tokens_contextos_por_modelo": 0},
+    }[estrategia]
+
+
+def _sesion_esquema_y_apuntes(corpus, secciones):
+    """
+    Una ejecución por llm_processing (el mismo ruteo de contextos que la API y la CLI): esquemas
+    parciales de cada mitad del corpus, su fusión y los apuntes de las primeras `secciones` con el
+    prefijo KV de la transcripción.
+    """
+    from src import llm_processing
+    from src import metricas
+    from src import pipeline
+    cargas_inicio = metricas.LLM_MODELOS_CARGAS.total()
+    tokens_prompt_inicio = metricas.LLM_TOKENS_PROMPT.total()
+    reutilizados_inicio = metricas.LLM_TOKENS_PROMPT_REUTILIZADOS.total()
+    inicio = time.perf_counter()
+
+    mitad = corpus.num_tokens // 2
+    esquemas_parciales = [
+        llm_processing.generar_esquema_de_texto(corpus.fragmento(a, b), es_parcial=True, chunk_num=i + 1, total_chunks=2)
+        for i, (a, b) in enumerate(((0, mitad), (mitad, corpus.num_tokens)))
+    ]
+    esquemas_parciales = [e for e in esquemas_parciales if e] or ["1. Contenido"]
+    esquema = llm_processing.fusionar_grupo_de_esquemas(esquemas_parciales) or esquemas_parciales[0]
+    # Con un modelo de prueba el esquema puede no tener tantas secciones: se completan con secciones genéricas.
+    lista_secciones = (pipeline.dividir_esquema_en_secciones(esquema) + [f"{n}. Sección {n}" for n in range(1, secciones + 1)])[:secciones]
+    contexto_apuntes = llm_processing.preparar_contexto_apuntes(corpus.texto)
+    for i, seccion in enumerate(lista_secciones):
+        llm_processing.generar_apuntes_por_seccion(seccion, corpus.texto, i + 1, len(lista_secciones), contexto_apuntes=contexto_apuntes)
+
+    tokens_prompt = metricas.LLM_TOKENS_PROMPT.total() - tokens_prompt_inicio
+    return {
+        "tiempo_s": round(time.perf_counter() - inicio, 3),
+        "aperturas_contexto": metricas.LLM_MODELOS_CARGAS.total() - cargas_inicio,
+        "tokens_prompt_evaluados": tokens_prompt - (metricas.LLM_TOKENS_PROMPT_REUTILIZADOS.total() - reutilizados_inicio),
+        "secciones": len(lista_secciones),
+    }
+
+
+def ejecutar_estrategia_contextos(nombre_backend, estrategia, ruta_modelo, n_ctx, n_threads, texto_base, tamanos_corpus,
+                                  repeticiones, secciones):
+    """Se ejecuta en un proceso nuevo por estrategia (RSS pico aislado)."""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)-5s] %(processName)s: %(message)s")
+    from src import llm_processing
+    from src import registro_modelos
+    # Se mide la generación: sin caché de resultados y con el prefijo KV de apuntes.
+    config.CACHE_RESULTADOS_ACTIVADA = False
+    config.APUNTES_MODO_CONTEXTO = "prefijo_kv"
+    registro = registro_modelos.RegistroModelos(
+        modelos={"principal": {"ruta": ruta_modelo, "n_ctx": n_ctx, "n_threads": n_threads}},
+        modelos_por_tarea={}, modelo_por_defecto="principal", presupuesto_bytes=0, nombre_backend=nombre_backend,
+        **parametros_estrategia_contextos(estrategia, n_ctx)
+    )
+    inicio_carga = time.perf_counter()
+    registro.cargar("principal")
+    tiempo_carga = time.perf_counter() - inicio_carga
+    llm_processing.registro = registro
+
+    corpus_por_nombre = {}
+    corpus_info = {}
+    for num_tokens in tamanos_corpus:
+        with registro.tokenizador("esquema") as llm:
+            corpus = construir_corpus(llm, texto_base, num_tokens)
+            corpus.desplazamientos # Se calculan ahora: el contexto del tokenizador puede cerrarse después
+        nombre_corpus = f"{num_tokens}_tokens"
+        corpus_por_nombre[nombre_corpus] = corpus
+        corpus_info[nombre_corpus] = {"tokens": corpus.num_tokens, "sha256": _sha256_texto(corpus.texto)}
+
+    mediciones = []
+    memoria_pico = registro.memoria_bytes()
+    # Los corpus se alternan en cada repetición, como las transcripciones de distinta longitud que llegan a la API.
+    for repeticion in range(repeticiones):
+        for nombre_corpus, corpus in corpus_por_nombre.items():
+            logger.info(f"[{estrategia}] Corpus {nombre_corpus}, repetición {repeticion + 1}/{repeticiones}.")
+            medicion = _sesion_esquema_y_apuntes(corpus, secciones)
+            memoria_pico = max(memoria_pico, registro.memoria_bytes())
+            mediciones.append({"corpus": nombre_corpus, "repeticion": repeticion + 1, **medicion})
+    registro.cerrar()
+    llm_processing.registro = None
+
+    return {
+        "nombre": estrategia,
+        "parametros": {k: list(v) if isinstance(v, tuple) else v for k, v in parametros_estrategia_contextos(estrategia, n_ctx).items()},
+        "tiempo_carga_s": round(tiempo_carga, 3),
+        "tiempo_total_s": round(sum(m["tiempo_s"] for m in mediciones), 3),
+        "aperturas_contexto": sum(m["aperturas_contexto"] for m in mediciones),
+        "tokens_prompt_evaluados": sum(m["tokens_prompt_evaluados"] for m in mediciones),
+        "memoria_pico_mb": round(memoria_pico / 2**20),
+        "rss_pico_mb": _rss_pico_mb(),
+        "corpus": corpus_info,
+        "mediciones": mediciones,
+    }
+
+
+def ejecutar_benchmark_contextos(estrategias, tamanos_corpus, repeticiones=1, secciones=3, ruta_modelo=config.MODEL_PATH,
+                                 ruta_corpus=config.BENCHMARK_CORPUS_PATH, n_ctx=config.CONTEXT_SIZE, n_threads=config.N_THREADS,
+                                 nombre_backend=config.LLM_BACKEND):
+    """Ejecuta cada estrategia de ESTRATEGIAS_CONTEXTOS (cada una en su proceso) y devuelve el informe."""
+    with open(ruta_corpus, "r", encoding="utf-8") as f:
+        texto_base = f.read()
+    informe = {
+        "version_formato": VERSION_FORMATO,
+        "tipo": "contextos",
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "backend": nombre_backend,
+        "modelo": os.path.basename(ruta_modelo) if nombre_backend == backends_llm.BackendLlamaCpp.nombre else None,
+        "n_ctx": n_ctx,
+        "repeticiones": repeticiones,
+        "secciones": secciones,
+        "corpus_base": {"archivo": os.path.basename(ruta_corpus), "sha256": _sha256_texto(texto_base)},
+        "configuraciones": [],
+    }
+    contexto_mp = multiprocessing.get_context("spawn")
+    for estrategia in estrategias:
+        with ProcessPoolExecutor(max_workers=1, mp_context=contexto_mp) as ejecutor:
+            futuro = ejecutor.submit(
+                ejecutar_estrategia_contextos, nombre_backend, estrategia, ruta_modelo, n_ctx, n_threads, texto_base,
+                tuple(tamanos_corpus), repeticiones, secciones
+            )
+            try:
+                informe["configuraciones"].append(futuro.result())
+            except Exception as e:
+                logger.error(f"Falló la estrategia de contextos {estrategia}: {e}", exc_info=True)
+                informe["configuraciones"].append({"nombre": estrategia, "error": str(e)})
+    return informe
+
+
+def comparar(linea_base, actual, tolerancia=config.BENCHMARK_TOLERANCIA_REGRESION):
+    """
+    Compara dos informes por configuración, corpus y tarea. Devuelve una lista de diferencias
+    ({"clave", "metrica", "base", "actual", "cambio", "regresion"}); `cambio` es relativo y positivo
+    cuando el valor empeora. Es regresión si empeora más que `tolerancia`.
+    """
+    def diferencia(clave, metrica, mayor_es_mejor, valor_base, valor_actual):
+        if not valor_base or valor_actual is None:
+            return None
+        cambio = (valor_base - valor_actual) / valor_base if mayor_es_mejor else (valor_actual - valor_base) / valor_base
+        return {"clave": clave, "metrica": metrica, "base": valor_base, "actual": valor_actual,
+                "cambio": round(cambio, 4), "regresion": cambio > tolerancia}
+
+    base_por_nombre = {c["nombre"]: c for c in linea_base.get("configuraciones", []) if "error" not in c}
+    diferencias = []
+    for configuracion in actual.get("configuraciones", []):
+        base = base_por_nombre.get(configuracion["nombre"])
+        if base is None or "error" in configuracion:
+            continue
+        for nombre_corpus, info in configuracion["corpus"].items():
+            info_base = base["corpus"].get(nombre_corpus)
+            if info_base and info_base["sha256"] != info["sha256"]:
+                logger.warning(f"El corpus {nombre_corpus} de {configuracion['nombre']} difiere de la línea base "
+                               "(otro modelo o texto base): la comparación puede no ser representativa.")
+        for metrica, mayor_es_mejor in METRICAS_POR_CONFIGURACION:
+            diferencias.append(diferencia(configuracion["nombre"], metrica, mayor_es_mejor, base.get(metrica), configuracion.get(metrica)))
+        for clave, valores in configuracion["resumen"].items():
+            valores_base = base["resumen"].get(clave)
+            if valores_base is None:
+                continue
+            for metrica, mayor_es_mejor in METRICAS_POR_TAREA:
+                diferencias.append(diferencia(
+                    f"{configuracion['nombre']}/{clave}", metrica, mayor_es_mejor, valores_base.get(metrica), valores.get(metrica)
+                ))
+    return [d for d in diferencias if d is not None]
+
+
+def _imprimir_resumen(informe):
+    for configuracion in informe["configuraciones"]:
+        if "error" in configuracion:
+            print(f"\n{configuracion['nombre']}: ERROR - {configuracion['error']}")
+            continue
+        print(f"\n{configuracion['nombre']}: carga {configuracion['tiempo_carga_s']:.2f} s, RSS pico {configuracion['rss_pico_mb']} MB")
+        print(f"  {'corpus/tarea':<32} {'tok prompt':>10} {'prompt t/s':>11} {'tok gen':>8} {'gen t/s':>8} {'acept.':>7}")
+        for clave, valores in configuracion["resumen"].items():
+            aceptacion = valores.get("tasa_aceptacion_borrador")
+            print(f"  {clave:<32} {valores['tokens_prompt'] or 0:>10.0f} {valores['tokens_por_segundo_prompt'] or 0:>11.2f} "
+                  f"{valores['tokens_generados'] or 0:>8.0f} {valores['tokens_por_segundo_generacion'] or 0:>8.2f} "
+                  f"{f'{aceptacion:.0%}' if aceptacion is not None else '-':>7}")
+
+
+def _imprimir_resumen_contextos(informe):
+    print(f"\n{'estrategia':<10} {'total s':>9} {'aperturas':>10} {'tok evaluados':>14} {'memoria MB':>11} {'RSS pico MB':>12}")
+    for configuracion in informe["configuraciones"]:
+        if "error" in configuracion:
+            print(f"{configuracion['nombre']:<10} ERROR - {configuracion['error']}")
+            continue
+        print(f"{configuracion['nombre']:<10} {configuracion['tiempo_total_s']:>9.2f} {configuracion['aperturas_contexto']:>10.0f} "
+              f"{configuracion['tokens_prompt_evaluados']:>14.0f} {configuracion['memoria_pico_mb']:>11} {configuracion['rss_pico_mb'] or '-':>12}")
+
+
+def _imprimir_comparacion(diferencias, tolerancia):
+    regresiones = [d for d in diferencias if d["regresion"]]
+    for d in diferencias:
+        marca = "REGRESIÓN" if d["regresion"] else ("mejora" if d["cambio"] < -tolerancia else "")
+        print(f"  {d['clave']:<52} {d['metrica']:<30} {d['base']:>10} -> {d['actual']:>10} ({0.0 - d['cambio']:+.1%}) {marca}")
+    print(f"\n{len(regresiones)} regresiones (tolerancia {tolerancia:.0%}) en {len(diferencias)} métricas comparadas.")
+    return regresiones
+
+
+def _hilos(valor):
+    return None if valor == "auto" else int(valor)
+
+
+def _especulativa(valor):
+    return "" if valor == "no" else valor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del modelo local con los prompts del proyecto.")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+
+    parser_ejecutar = subparsers.add_parser("ejecutar", help="Ejecuta el benchmark y escribe el informe JSON.")
+    parser_ejecutar.add_argument("--capas-gpu", type=int, nargs="+", default=[config.N_GPU_LAYERS], help="Valores de n_gpu_layers.")
+    parser_ejecutar.add_argument("--hilos", type=_hilos, nargs="+", default=[config.N_THREADS], help="Valores de n_threads ('auto' = llama.cpp decide).")
+    parser_ejecutar.add_argument("--batch", type=int, nargs="+", default=[config.N_BATCH_LLAMA], help="Valores de n_batch.")
+    parser_ejecutar.add_argument("--especulativa", type=_especulativa, nargs="+", default=[config.LLM_DECODIFICACION_ESPECULATIVA],
+                                 choices=["", "prompt_lookup", "gguf"],
+                                 help="Decodificación especulativa: 'no', 'prompt_lookup' o 'gguf' (p. ej. '--especulativa no prompt_lookup' para comparar).")
+    parser_ejecutar.add_argument("--tamanos", type=int, nargs="+", default=list(config.BENCHMARK_TAMANOS_CORPUS), help="Tokens de cada corpus.")
+    parser_ejecutar.add_argument("--repeticiones", type=int, default=1)
+    parser_ejecutar.add_argument("--max-tokens", type=int, default=None, help="Tope de tokens generados por llamada (por defecto, los del proyecto).")
+    parser_ejecutar.add_argument("--modelo", default=config.MODEL_PATH)
+    parser_ejecutar.add_argument("--backend", default=config.LLM_BACKEND, choices=sorted(backends_llm.BACKENDS),
+                                 help="'falso' mide solo el propio harness, sin modelo.")
+    parser_ejecutar.add_argument("--corpus", default=config.BENCHMARK_CORPUS_PATH, help="Texto base de los corpus.")
+    parser_ejecutar.add_argument("--salida", default=None, help="Ruta del informe JSON (por defecto, en data/benchmarks/).")
+    parser_ejecutar.add_argument("--linea-base", default=None, help="Informe previo contra el que comparar al terminar.")
+    parser_ejecutar.add_argument("--tolerancia", type=float, default=config.BENCHMARK_TOLERANCIA_REGRESION)
+
+    parser_contextos = subparsers.add_parser("contextos", help="Compara estrategias de contextos del registro de modelos.")
+    parser_contextos.add_argument("--estrategias", nargs="+", default=list(ESTRATEGIAS_CONTEXTOS), choices=ESTRATEGIAS_CONTEXTOS)
+    parser_contextos.add_argument("--tamanos", type=int, nargs="+", default=list(config.BENCHMARK_TAMANOS_CORPUS), help="Tokens de cada corpus.")
+    parser_contextos.add_argument("--repeticiones", type=int, default=1)
+    parser_contextos.add_argument("--secciones", type=int, default=3, help="Secciones de apuntes generadas por ejecución.")
+    parser_contextos.add_argument("--n-ctx", type=int, default=config.CONTEXT_SIZE, help="Contexto más grande del modelo.")
+    parser_contextos.add_argument("--hilos", type=_hilos, default=config.N_THREADS)
+    parser_contextos.add_argument("--modelo", default=config.MODEL_PATH)
+    parser_contextos.add_argument("--backend", default=config.LLM_BACKEND, choices=sorted(backends_llm.BACKENDS))
+    parser_contextos.add_argument("--corpus", default=config.BENCHMARK_CORPUS_PATH, help="Texto base de los corpus.")
+    parser_contextos.add_argument("--salida", default=None, help="Ruta del informe JSON (por defecto, en data/benchmarks/).")
+
+    parser_comparar = subparsers.add_parser("comparar", help="Compara dos informes y marca regresiones.")
+    parser_comparar.add_argument("linea_base")
+    parser_comparar.add_argument("actual")
+    parser_comparar.add_argument("--tolerancia", type=float, default=config.BENCHMARK_TOLERANCIA_REGRESION)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)-5s] %(name)s: %(message)s")
+
+    if args.comando == "comparar":
+        with open(args.linea_base, "r", encoding="utf-8") as f:
+            linea_base = json.load(f)
+        with open(args.actual, "r", encoding="utf-8") as f:
+            actual = json.load(f)
+        regresiones = _imprimir_comparacion(comparar(linea_base, actual, args.tolerancia), args.tolerancia)
+        sys.exit(1 if regresiones else 0)
+
+    if args.backend == backends_llm.BackendLlamaCpp.nombre and not os.path.exists(args.modelo):
+        logger.critical(f"No se encontró el archivo del modelo en {args.modelo}")
+        sys.exit(2)
+
+    if args.comando == "contextos":
+        informe = ejecutar_benchmark_contextos(args.estrategias, args.tamanos, args.repeticiones, args.secciones, args.modelo,
+                                               args.corpus, args.n_ctx, args.hilos, nombre_backend=args.backend)
+        ruta_salida = args.salida or os.path.join(config.BENCHMARK_DIR, f"contextos_{time.strftime('%Y%m%d-%H%M%S')}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(ruta_salida)), exist_ok=True)
+        with open(ruta_salida, "w", encoding="utf-8") as f:
+            json.dump(informe, f, ensure_ascii=False, indent=2)
+        _imprimir_resumen_contextos(informe)
+        print(f"\nInforme guardado en: {ruta_salida}")
+        return
+    configuraciones = [
+        {"n_gpu_layers": capas, "n_threads": hilos, "n_batch": batch, "especulativa": especulativa}
+        for capas, hilos, batch, especulativa in itertools.product(args.capas_gpu, args.hilos, args.batch, args.especulativa)
+    ]
+    informe = ejecutar_benchmark(configuraciones, args.tamanos, args.repeticiones, args.max_tokens, args.modelo, args.corpus,
+                                 nombre_backend=args.backend)
+
+    ruta_salida = args.salida or os.path.join(config.BENCHMARK_DIR, f"benchmark_{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(ruta_salida)), exist_ok=True)
+    with open(ruta_salida, "w", encoding="utf-8") as f:
+        json.dump(informe, f, ensure_ascii=False, indent=2)
+    _imprimir_resumen(informe)
+    print(f"\nInforme guardado en: {ruta_salida}")
+
+    if args.linea_base:
+        with open(args.linea_base, "r", encoding="utf-8") as f:
+            linea_base = json.load(f)
+        regresiones = _imprimir_comparacion(comparar(linea_base, informe, args.tolerancia), args.tolerancia)
+        sys.exit(1 if regresiones else 0)
+
+
+if __name__ == "__main__":
+    main()
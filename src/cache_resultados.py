@@ -0,0 +1,128 @@
+# src/cache_resultados.py
+# Caché persistente de resultados de generación, direccionada por contenido.
+# La generación es determinista (seed y temperaturas fijas), así que la misma entrada con la misma
+# plantilla, modelo y parámetros produce el mismo texto: la clave es un hash de todo ello.
+# Usa diskcache (SQLite + archivos), seguro entre procesos: las réplicas del pool comparten la misma caché.
+import os
+import json
+import hashlib
+import logging
+import threading
+import diskcache
+from src import config
+
+logger = logging.getLogger(__name__)
+
+_cache = None
+_cache_lock = threading.Lock()
+_contadores = {} # tarea -> {"aciertos": int, "fallos": int} (solo de este proceso)
+_contadores_lock = threading.Lock()
+
+
+def _obtener_cache():
+    global _cache
+    if not config.CACHE_RESULTADOS_ACTIVADA:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = diskcache.Cache(
+                    config.CACHE_RESULTADOS_DIR,
+                    size_limit=config.CACHE_RESULTADOS_TAMANO_MAX_MB * 1024 * 1024,
+                    eviction_policy="least-recently-used",
+                    statistics=True, # Aciertos/fallos globales (compartidos entre procesos) en la propia BD
+                )
+                logger.info(f"Caché de resultados abierta en {config.CACHE_RESULTADOS_DIR} "
+                            f"(límite: {config.CACHE_RESULTADOS_TAMANO_MAX_MB} MB, LRU).")
+            except Exception as e:
+                logger.error(f"No se pudo abrir la caché de resultados; se continúa sin caché: {e}", exc_info=True)
+                return None
+        return _cache
+
+
+def huella_modelo_local(ruta_modelo=None):
+    """Identifica un GGUF (por defecto, config.MODEL_PATH) por nombre, tamaño y fecha de modificación (sin leer los pesos)."""
+    ruta_modelo = ruta_modelo or config.MODEL_PATH
+    try:
+        estado = os.stat(ruta_modelo)
+        return f"{os.path.basename(ruta_modelo)}:{estado.st_size}:{int(estado.st_mtime)}"
+    except OSError:
+        return os.path.basename(ruta_modelo)
+
+
+def calcular_clave(tarea, componentes):
+    """Hash SHA-256 de la tarea y de todos los componentes que determinan el resultado."""
+    serializado = json.dumps({"tarea": tarea, **componentes}, sort_keys=True, ensure_ascii=False, default=str)
+    return f"{tarea}:{hashlib.sha256(serializado.encode('utf-8')).hexdigest()}"
+
+
+def _contar(tarea, campo):
+    with _contadores_lock:
+        contadores_tarea = _contadores.setdefault(tarea, {"aciertos": 0, "fallos": 0})
+        contadores_tarea[campo] += 1
+
+
+def obtener(tarea, componentes):
+    """Devuelve el resultado cacheado o None. Cualquier error de la caché cuenta como fallo."""
+    cache = _obtener_cache()
+    if cache is None:
+        return None
+    try:
+        resultado = cache.get(calcular_clave(tarea, componentes))
+    except Exception as e:
+        logger.warning(f"Error al leer de la caché de resultados ({tarea}): {e}")
+        resultado = None
+    _contar(tarea, "aciertos" if resultado is not None else "fallos")
+    return resultado
+
+
+def contiene(tarea, componentes):
+    """Indica si hay un resultado cacheado, sin contarlo como acierto/fallo ni actualizar su uso (LRU)."""
+    cache = _obtener_cache()
+    if cache is None:
+        return False
+    try:
+        return calcular_clave(tarea, componentes) in cache
+    except Exception as e:
+        logger.warning(f"Error al consultar la caché de resultados ({tarea}): {e}")
+        return False
+
+
+def guardar(tarea, componentes, resultado, expira_segundos=None):
+    """`expira_segundos` da caducidad a resultados que no son deterministas (p. ej. consultas a servicios externos)."""
+    cache = _obtener_cache()
+    if cache is None or not resultado:
+        return
+    try:
+        cache.set(calcular_clave(tarea, componentes), resultado, expire=expira_segundos)
+    except Exception as e:
+        logger.warning(f"Error al escribir en la caché de resultados ({tarea}): {e}")
+
+
+def estadisticas():
+    """Aciertos/fallos por tarea de este proceso, totales globales de la caché y su ocupación."""
+    with _contadores_lock:
+        por_tarea = {tarea: dict(c) for tarea, c in _contadores.items()}
+    resumen = {
+        "activada": config.CACHE_RESULTADOS_ACTIVADA,
+        "por_tarea": por_tarea,
+    }
+    cache = _obtener_cache()
+    if cache is not None:
+        aciertos_globales, fallos_globales = cache.stats()
+        resumen.update({
+            "aciertos_globales": aciertos_globales,
+            "fallos_globales": fallos_globales,
+            "entradas": len(cache),
+            "tamano_bytes": cache.volume(),
+            "tamano_max_bytes": config.CACHE_RESULTADOS_TAMANO_MAX_MB * 1024 * 1024,
+        })
+    return resumen
+
+
+def cerrar():
+    global _cache
+    with _cache_lock:
+        if _cache is not None:
+            _cache.close()
+            _cache = None
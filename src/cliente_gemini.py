@@ -0,0 +1,279 @@
+# src/cliente_gemini.py
+# Cliente de Gemini compartido por todo el proceso. Se crea una vez al arrancar la API (antes, cada
+# petición llamaba a genai.configure y construía su GenerativeModel), pero el SDK se importa y configura
+# en la primera llamada, fuera del event loop: no retrasa el arranque. Centraliza la política de llamadas:
+#   - semáforo: como mucho config.GEMINI_MAX_CONCURRENCIA generaciones simultáneas contra la API,
+#   - reintentos con backoff exponencial y jitter ante errores transitorios (429, 5xx, timeouts),
+#   - plazo total por petición (config.GEMINI_PLAZO_SEGUNDOS), que incluye reintentos y esperas,
+#   - conteo de tokens antes de enviar: un prompt que no cabe se rechaza sin gastar una generación.
+# Con config.GEMINI_BACKEND = "falso" se usa ModeloGeminiFalso (sin red ni API key, con latencia y
+# fallos configurables) para probar la API y esta política en local.
+import os
+import time
+import random
+import asyncio
+import logging
+from types import SimpleNamespace
+from src import config
+from src import metricas
+from src import backends_llm
+
+logger = logging.getLogger(__name__)
+
+# Códigos HTTP de los errores de la API que merece la pena reintentar (google.api_core los expone en `.code`).
+CODIGOS_REINTENTABLES = frozenset({408, 429, 500, 502, 503, 504})
+
+
+class ErrorGemini(Exception):
+    """Fallo de una llamada a Gemini, con el código HTTP con el que la API debe responder al cliente."""
+
+    def __init__(self, mensaje, codigo_http=502):
+        super().__init__(mensaje)
+        self.codigo_http = codigo_http
+
+
+class PromptDemasiadoGrande(ErrorGemini):
+    def __init__(self, tokens_prompt, max_tokens):
+        super().__init__(f"El prompt tiene {tokens_prompt} tokens y el máximo admitido es {max_tokens}.", codigo_http=413)
+        self.tokens_prompt = tokens_prompt
+        self.max_tokens = max_tokens
+
+
+def _codigo_error(error):
+    codigo = getattr(error, "code", None)
+    codigo = getattr(codigo, "value", codigo) # Por si llega un enum en lugar del entero
+    return codigo if isinstance(codigo, int) else None
+
+
+def es_reintentable(error):
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    return _codigo_error(error) in CODIGOS_REINTENTABLES
+
+
+class ModeloGeminiFalso:
+    """
+    Sustituto local de genai.GenerativeModel con la misma interfaz asíncrona (generate_content_async,
+    con y sin stream, y count_tokens_async). Responde con el texto determinista de BackendFalso tras
+    `latencia_segundos`; `errores` es una lista de excepciones que se lanzan, en orden, en las
+    siguientes generaciones (para probar reintentos, plazos y la traducción a códigos HTTP), y
+    `errores_en_stream` las que se lanzan en las generaciones en stream tras el primer fragmento.
+    `max_simultaneas` registra cuántas generaciones hubo en curso a la vez y `conteos`, las llamadas a count_tokens.
+    """
+
+    def __init__(self, latencia_segundos=None, errores=None, errores_en_stream=None):
+        self.latencia_segundos = config.GEMINI_FALSO_LATENCIA_SEGUNDOS if latencia_segundos is None else latencia_segundos
+        self.errores = list(errores or [])
+        self.errores_en_stream = list(errores_en_stream or [])
+        self.llamadas = 0
+        self.conteos = 0
+        self.simultaneas = 0
+        self.max_simultaneas = 0
+        self._backend = backends_llm.BackendFalso(n_ctx=1 << 30, tokens_por_segundo=0, tokens_prompt_por_segundo=0)
+
+    async def count_tokens_async(self, contenido):
+        self.conteos += 1
+        return SimpleNamespace(total_tokens=len(self._backend.tokenize(contenido.encode("utf-8"), add_bos=False)))
+
+    def _respuesta(self, contenido):
+        resultado = self._backend.completar(contenido, max_tokens=config.MAX_TOKENS_ESQUEMA_FUSIONADO)
+        texto = resultado["choices"][0]["text"]
+        return SimpleNamespace(
+            text=texto,
+            prompt_feedback=None,
+            candidates=[SimpleNamespace(finish_reason=SimpleNamespace(name="STOP"))],
+            usage_metadata=SimpleNamespace(
+                prompt_token_count=resultado["usage"]["prompt_tokens"],
+                candidates_token_count=resultado["usage"]["completion_tokens"],
+            ),
+        )
+
+    async def generate_content_async(self, contenido, stream=False):
+        self.llamadas += 1
+        self.simultaneas += 1
+        self.max_simultaneas = max(self.max_simultaneas, self.simultaneas)
+        try:
+            await asyncio.sleep(self.latencia_segundos)
+            if self.errores:
+                raise self.errores.pop(0)
+            respuesta = self._respuesta(contenido)
+        finally:
+            self.simultaneas -= 1
+        if not stream:
+            return respuesta
+        error_en_stream = self.errores_en_stream.pop(0) if self.errores_en_stream else None
+
+        async def fragmentos():
+            for i, linea in enumerate(respuesta.text.splitlines(keepends=True)):
+                if i == 1 and error_en_stream is not None:
+                    raise error_en_stream
+                await asyncio.sleep(0)
+                yield SimpleNamespace(text=linea)
+        return fragmentos()
+
+
+class ClienteGemini:
+    """
+    Modelo de Gemini configurado una vez y compartido por las peticiones. `generar` aplica el
+    semáforo, el plazo y los reintentos; los errores salen como ErrorGemini con su código HTTP.
+    Con `fabrica_modelo` (y `modelo` None) el modelo se crea en un hilo en la primera llamada.
+    """
+
+    def __init__(self, modelo, nombre_modelo, max_concurrencia=None, max_reintentos=None,
+                 backoff_inicial_segundos=None, backoff_max_segundos=None, plazo_segundos=None, max_tokens_prompt=None,
+                 fabrica_modelo=None):
+        self.modelo = modelo
+        self._fabrica_modelo = fabrica_modelo
+        self._lock_modelo = asyncio.Lock()
+        self.nombre_modelo = nombre_modelo
+        self.max_reintentos = config.GEMINI_MAX_REINTENTOS if max_reintentos is None else max_reintentos
+        self.backoff_inicial_segundos = config.GEMINI_BACKOFF_INICIAL_SEGUNDOS if backoff_inicial_segundos is None else backoff_inicial_segundos
+        self.backoff_max_segundos = config.GEMINI_BACKOFF_MAX_SEGUNDOS if backoff_max_segundos is None else backoff_max_segundos
+        self.plazo_segundos = config.GEMINI_PLAZO_SEGUNDOS if plazo_segundos is None else plazo_segundos
+        self.max_tokens_prompt = config.GEMINI_MAX_TOKENS_PROMPT if max_tokens_prompt is None else max_tokens_prompt
+        self._semaforo = asyncio.Semaphore(max_concurrencia or config.GEMINI_MAX_CONCURRENCIA)
+
+    async def _obtener_modelo(self):
+        if self.modelo is None:
+            async with self._lock_modelo:
+                if self.modelo is None:
+                    self.modelo = await asyncio.to_thread(self._fabrica_modelo)
+        return self.modelo
+
+    async def contar_tokens(self, prompt):
+        """Tokens del prompt según la API, o None si el conteo falla (no debe impedir la generación)."""
+        try:
+            modelo = await self._obtener_modelo()
+            respuesta = await asyncio.wait_for(modelo.count_tokens_async(prompt), timeout=config.GEMINI_TIMEOUT_CONTEO_SEGUNDOS)
+            return respuesta.total_tokens
+        except Exception as e:
+            logger.warning(f"No se pudieron contar los tokens del prompt de Gemini ({type(e).__name__}: {e}). Se envía sin verificar.")
+            return None
+
+    async def _generar_una_vez(self, prompt, emitir_fragmento):
+        """Una llamada a generate_content_async; con `emitir_fragmento`, en stream. Devuelve (texto, response)."""
+        modelo = await self._obtener_modelo()
+        if emitir_fragmento is None:
+            response = await modelo.generate_content_async(prompt)
+            return (response.text if response else ""), response
+
+        response = await modelo.generate_content_async(prompt, stream=True)
+        partes_texto = []
+        async for fragmento in response:
+            try:
+                texto_fragmento = fragmento.text
+            except ValueError:
+                # Fragmentos sin partes de texto (p. ej. el que solo trae finish_reason).
+                continue
+            if texto_fragmento:
+                partes_texto.append(texto_fragmento)
+                emitir_fragmento(texto_fragmento)
+        return "".join(partes_texto), response
+
+    def _espera_backoff(self, intento):
+        """Backoff exponencial con jitter completo (reparte los reintentos de una ráfaga en el tiempo)."""
+        return random.uniform(0, min(self.backoff_max_segundos, self.backoff_inicial_segundos * (2 ** intento)))
+
+    async def generar(self, prompt, emitir_fragmento=None, tarea="gemini", plazo_segundos=None, tokens_prompt=None):
+        """
+        Genera la respuesta a `prompt` y devuelve (texto, response). Si el stream ya emitió texto al
+        cliente no se reintenta (se duplicaría la salida): el error se propaga.
+        `tokens_prompt`, si quien llama ya los contó con la API, evita volver a llamar a count_tokens.
+        """
+        if self.max_tokens_prompt:
+            if tokens_prompt is None:
+                tokens_prompt = await self.contar_tokens(prompt)
+            if tokens_prompt is not None and tokens_prompt > self.max_tokens_prompt:
+                raise PromptDemasiadoGrande(tokens_prompt, self.max_tokens_prompt)
+
+        limite = time.monotonic() + (plazo_segundos or self.plazo_segundos)
+        fragmento_emitido = False
+        emitir = None
+        if emitir_fragmento is not None:
+            def emitir(texto):
+                nonlocal fragmento_emitido
+                fragmento_emitido = True
+                emitir_fragmento(texto)
+
+        error_plazo = ErrorGemini(f"Plazo de {plazo_segundos or self.plazo_segundos:g} s agotado esperando a Gemini ({tarea}).", codigo_http=504)
+        intento = 0
+        while True:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                raise error_plazo
+            # La espera por un hueco del semáforo también cuenta para el plazo.
+            try:
+                await asyncio.wait_for(self._semaforo.acquire(), timeout=restante)
+            except asyncio.TimeoutError:
+                raise error_plazo from None
+            try:
+                return await asyncio.wait_for(self._generar_una_vez(prompt, emitir), timeout=max(0.0, limite - time.monotonic()))
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError) and time.monotonic() >= limite:
+                    raise error_plazo from e
+                codigo = _codigo_error(e)
+                if not es_reintentable(e) or fragmento_emitido:
+                    raise ErrorGemini(f"Error de la API de Gemini ({tarea}): {e}", codigo_http=502) from e
+                if intento >= self.max_reintentos:
+                    raise ErrorGemini(
+                        f"Gemini ({tarea}) no respondió tras {intento + 1} intentos: {e}",
+                        codigo_http=504 if isinstance(e, asyncio.TimeoutError) else 503
+                    ) from e
+                espera = min(self._espera_backoff(intento), max(0.0, limite - time.monotonic()))
+                metricas.GEMINI_REINTENTOS.inc(tarea=tarea, motivo=str(codigo) if codigo else type(e).__name__)
+                logger.warning(f"Gemini ({tarea}) falló con un error transitorio ({type(e).__name__}: {e}). "
+                               f"Reintento {intento + 1}/{self.max_reintentos} en {espera:.1f} s.")
+            finally:
+                self._semaforo.release()
+            await asyncio.sleep(espera)
+            intento += 1
+
+
+_cliente = None
+
+
+def _crear_modelo_genai(api_key, nombre_modelo):
+    """Importa y configura el SDK (segundos de import): solo se llama en la primera petición a Gemini."""
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(nombre_modelo)
+
+
+def iniciar_cliente(modelo=None):
+    """
+    Crea el cliente global (al arrancar la API). `modelo` permite inyectar un sustituto; si no se
+    pasa, se usa ModeloGeminiFalso o genai.GenerativeModel según config.GEMINI_BACKEND.
+    Sin GEMINI_API_KEY no se crea y las llamadas fallan con un error de configuración.
+    """
+    global _cliente
+    fabrica_modelo = None
+    if modelo is None:
+        if config.GEMINI_BACKEND == "falso":
+            modelo = ModeloGeminiFalso()
+        else:
+            gemini_api_key = os.getenv("GEMINI_API_KEY")
+            if not gemini_api_key:
+                logger.warning("GEMINI_API_KEY no encontrada en las variables de entorno: los endpoints de Gemini no estarán disponibles.")
+                _cliente = None
+                return None
+            fabrica_modelo = lambda: _crear_modelo_genai(gemini_api_key, config.GEMINI_MODEL_NAME)
+    _cliente = ClienteGemini(modelo, config.GEMINI_MODEL_NAME, fabrica_modelo=fabrica_modelo)
+    logger.info(f"Cliente de Gemini listo ({config.GEMINI_BACKEND}, modelo {config.GEMINI_MODEL_NAME}, "
+                f"hasta {config.GEMINI_MAX_CONCURRENCIA} llamadas simultáneas).")
+    return _cliente
+
+
+def obtener_cliente():
+    """El cliente global; lanza ErrorGemini (500) si no está configurado."""
+    if _cliente is None:
+        raise ErrorGemini("Error de configuración: GEMINI_API_KEY no encontrada.", codigo_http=500)
+    return _cliente
+
+
+def cliente_disponible():
+    return _cliente is not None
+
+
+def cerrar_cliente():
+    global _cliente
+    _cliente = None
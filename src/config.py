@@ -30,15 +30,147 @@ LLM_TEMPERATURE_ESQUEMA = 0.3
 LLM_TEMPERATURE_FUSION = 0.4
 LLM_TEMPERATURE_APUNTES = 0.4
 N_BATCH_LLAMA = 1024
+LLM_USE_MMAP = os.getenv("LLM_USE_MMAP", "1") == "1" # Mapear los pesos del GGUF en memoria (compartidos entre procesos/réplicas)
+LLM_USE_MLOCK = os.getenv("LLM_USE_MLOCK", "0") == "1" # Fijar los pesos en RAM (sin swap ni desalojo de páginas; requiere RLIMIT_MEMLOCK suficiente)
+# Calentamiento tras la carga: una generación corta paga los fallos de página del mmap antes de la primera petición.
+LLM_PROMPT_CALENTAMIENTO = "Esquema de la clase:\n1."
+LLM_CALENTAMIENTO_TOKENS = int(os.getenv("LLM_CALENTAMIENTO_TOKENS", "4")) # 0 = sin calentamiento
+# Decodificación especulativa (solo llama_cpp): un borrador propone varios tokens y el modelo los verifica en una
+# sola evaluación. "": desactivada. "prompt_lookup": borradores por n-gramas del propio prompt (rinde en los apuntes,
+# que copian definiciones y ejemplos de la transcripción). "gguf": un GGUF pequeño con el mismo vocabulario.
+LLM_DECODIFICACION_ESPECULATIVA = os.getenv("LLM_DECODIFICACION_ESPECULATIVA", "")
+LLM_BORRADOR_TOKENS = int(os.getenv("LLM_BORRADOR_TOKENS", "10")) # Tokens propuestos por borrador
+LLM_BORRADOR_MAX_NGRAM = 3 # prompt_lookup: n-grama más largo que se busca en el prompt (se prueba de mayor a menor)
+LLM_BORRADOR_MODELO_FILENAME = os.getenv("LLM_BORRADOR_MODELO", "") # gguf: archivo en models/
+LLM_BORRADOR_MODELO_PATH = os.path.join(BASE_PROJECT_DIR, "models", LLM_BORRADOR_MODELO_FILENAME) if LLM_BORRADOR_MODELO_FILENAME else ""
+# Salida del esquema (completo, parciales y fusión) restringida con una gramática GBNF a líneas numeradas
+# jerárquicas (ver gramaticas.py): sin preámbulos ni resúmenes finales, y sin secuencias de parada en la fusión.
+LLM_GRAMATICA_ESQUEMA = os.getenv("LLM_GRAMATICA_ESQUEMA", "0") == "1"
+LLM_GRAMATICA_ESQUEMA_PROFUNDIDAD = 4 # Niveles de numeración admitidos (4 = hasta 1.1.1.1.)
+# Registro de modelos (ver registro_modelos.py): cada tipo de tarea usa el modelo declarado en MODELOS_POR_TAREA,
+# que se carga la primera vez que se necesita. En cada modelo, "archivo" es un GGUF de models/ (o "ruta", una ruta
+# completa); n_ctx, n_threads, n_batch y n_gpu_layers ausentes o None toman CONTEXT_SIZE, N_THREADS, N_BATCH_LLAMA
+# y N_GPU_LAYERS.
+MODELOS_LLM = {
+    "principal": {"archivo": MODEL_FILENAME},
+    # Ejemplo: una cuantización más rápida para los esquemas parciales (añadirla también en MODELOS_POR_TAREA).
+    # "rapido": {"archivo": "mistral-7b-instruct-v0.2.Q3_K_S.gguf", "n_ctx": 8192, "n_batch": 512},
+}
+MODELOS_POR_TAREA = { # Tareas sin entrada aquí usan MODELO_POR_DEFECTO
+    "esquema": "principal",
+    "esquema_parcial": "principal",
+    "fusion": "principal",
+    "apuntes_seccion": "principal",
+}
+MODELO_POR_DEFECTO = "principal" # Se carga (y calienta) al arrancar
+# Memoria máxima de los modelos cargados a la vez (pesos + KV cache). Al cargar uno que no cabe se descargan los
+# usados hace más tiempo (LRU). 0 = sin límite: los modelos cargados no se descargan.
+MODELOS_PRESUPUESTO_MEMORIA_MB = int(os.getenv("MODELOS_PRESUPUESTO_MEMORIA_MB", "0"))
+# Contextos por tamaño: cada modelo se abre con contextos de estos tamaños (los menores que su n_ctx, más el propio
+# n_ctx) sobre los mismos pesos mapeados con mmap, y cada llamada usa el más pequeño en el que caben prompt + max_tokens.
+# Un modelo puede declarar los suyos con la clave "contextos". () = un solo contexto de n_ctx (comportamiento anterior).
+# Con capas en GPU (N_GPU_LAYERS > 0) cada contexto sube su propia copia de esas capas: conviene usar ().
+LLM_CONTEXTOS = (2048, 4096, 8192)
+# Límites de los contextos abiertos a la vez por modelo; al abrir otro se cierran los usados hace más tiempo hasta
+# cumplirlos. Tokens: suma de los n_ctx abiertos, por defecto CONTEXT_SIZE (el mismo KV cache que un único contexto
+# de n_ctx). Número: contextos abiertos. 0 = sin límite; con ambos a 0 todos siguen abiertos y cada uno se abre y
+# calienta una sola vez, a cambio del KV cache de todos (ver `python -m src.benchmark_llm contextos`).
+LLM_CONTEXTOS_MAX_TOKENS_POR_MODELO = int(os.getenv("LLM_CONTEXTOS_MAX_TOKENS_POR_MODELO", str(CONTEXT_SIZE)))
+LLM_CONTEXTOS_MAX_POR_MODELO = 0
+# Backend del modelo local (ver backends_llm.py): "llama_cpp" o "falso" (determinista, sin GGUF,
+# para pruebas de carga y perfilado de la orquestación).
+LLM_BACKEND = os.getenv("LLM_BACKEND", "llama_cpp")
+LLM_FALSO_TOKENS_POR_SEGUNDO = float(os.getenv("LLM_FALSO_TOKENS_POR_SEGUNDO", "50")) # Generación simulada (0 = sin espera)
+LLM_FALSO_TOKENS_PROMPT_POR_SEGUNDO = float(os.getenv("LLM_FALSO_TOKENS_PROMPT_POR_SEGUNDO", "500")) # Evaluación del prompt simulada
 
 # --- Configuración del Mega-Chunking (para generación de esquema si es necesario) ---
 MEGA_CHUNK_CONTEXT_FACTOR = 0.7
 MEGA_CHUNK_OVERLAP_TOKENS = 0 # Solapamiento de tokens para mega-chunks
+MEGA_CHUNK_TAMANO_MIN_FRACCION = 0.5 # Tamaño mínimo de un mega-chunk (fracción del máximo) antes de buscar un corte por contenido
+MEGA_CHUNK_TOLERANCIA_CORTE = 0.15 # Al llegar al máximo, retroceso permitido (fracción del máximo) para cortar en un fin de párrafo
+FUSION_FAN_IN = 4 # Máximo de esquemas por grupo en la fusión jerárquica (cuando no caben en un solo prompt)
 
 # --- Configuración específica de Gemini ---
 GEMINI_MODEL_NAME = "gemini-2.5-flash-preview-05-20" # O el modelo que vayas a usa
+# "api": google.generativeai (requiere GEMINI_API_KEY). "falso": respuestas locales deterministas, sin red (ver cliente_gemini.py).
+GEMINI_BACKEND = os.getenv("GEMINI_BACKEND", "api")
+GEMINI_MAX_CONCURRENCIA = 4 # Generaciones simultáneas contra la API como máximo (el resto espera turno)
+GEMINI_MAX_REINTENTOS = 4 # Reintentos ante errores transitorios (429, 5xx, timeouts)
+GEMINI_BACKOFF_INICIAL_SEGUNDOS = 1.0 # Espera máxima antes del primer reintento; se dobla en cada uno (con jitter)
+GEMINI_BACKOFF_MAX_SEGUNDOS = 30.0
+GEMINI_PLAZO_SEGUNDOS = 300.0 # Plazo total de cada llamada, incluidas las esperas por turno y los reintentos
+GEMINI_MAX_TOKENS_PROMPT = 1_048_576 # Ventana de entrada del modelo; los prompts mayores se rechazan antes de enviarlos (0 = no contar)
+GEMINI_TIMEOUT_CONTEO_SEGUNDOS = 10.0 # Si el conteo de tokens tarda más, se envía sin verificar
+GEMINI_FALSO_LATENCIA_SEGUNDOS = float(os.getenv("GEMINI_FALSO_LATENCIA_SEGUNDOS", "0.5"))
+# Esquema con Gemini por partes (map-reduce): las transcripciones de más de GEMINI_ESQUEMA_MAX_TOKENS_PASE_UNICO tokens
+# se dividen con el mismo mega-chunking que el modelo local, sus esquemas parciales se piden en paralelo y se fusionan.
+GEMINI_ESQUEMA_MAX_TOKENS_PASE_UNICO = 32_000
+GEMINI_ESQUEMA_TOKENS_POR_PARTE = 16_000
+GEMINI_ESQUEMA_MAX_PARTES_EN_PARALELO = 4 # Por petición (el límite global es GEMINI_MAX_CONCURRENCIA)
+GEMINI_TOKENS_POR_PALABRA_ESTIMADOS = 1.5 # Solo si falla el conteo de tokens de la API
 
 # --- Configuración de la Base de Datos Vectorial ---
 VECTOR_DB_BASE_URL = os.getenv("VECTOR_DB_URL", "http://localhost:9000") # URL base para el servicio de búsqueda vectorial
 MAX_SCHEMA_TERMS_TO_QUERY = 3 # Número máximo de términos a extraer del esquema para consultar la BD vectorial
-VECTOR_DB_TOP_K_PER_TERM = 1 # Número de resultados a obtener de la BD vectorial por cada término del esquema consultado
\ No newline at end of file
+VECTOR_DB_TOP_K_PER_TERM = 1 # Número de resultados a obtener de la BD vectorial por cada término del esquema consultado
+VECTOR_DB_TIMEOUT_SEGUNDOS = 10.0 # Tiempo máximo por consulta a la BD vectorial
+VECTOR_DB_TIMEOUT_CONEXION_SEGUNDOS = 3.0 # Tiempo máximo para establecer la conexión
+VECTOR_DB_MAX_CONCURRENCIA = 8 # Consultas simultáneas como máximo (los términos se consultan en paralelo)
+VECTOR_DB_MAX_CONEXIONES = 16 # Conexiones del pool compartido (keep-alive) del cliente HTTP
+VECTOR_DB_CACHE_TTL_SEGUNDOS = 7 * 24 * 3600 # Caducidad de las consultas cacheadas (en la caché de resultados); 0 = sin caché
+VECTOR_DB_CONSULTA_EN_LOTE = True # Enviar todos los términos en una sola petición (POST /query/batch/) si el servicio lo admite
+# "remoto": servicio en VECTOR_DB_BASE_URL. "embebido": índice local en VECTOR_EMBEBIDO_DIR (ver indice_vectorial.py), sin red.
+VECTOR_DB_MODO = os.getenv("VECTOR_DB_MODO", "remoto")
+VECTOR_EMBEBIDO_DIR = os.path.join(BASE_PROJECT_DIR, "data", "indice_vectorial")
+# GGUF de embeddings (p. ej. un modelo pequeño de embeddings en models/). Vacío = el mismo GGUF del modelo
+# principal, abierto en modo embeddings (con mmap comparte las páginas de los pesos con el ya cargado).
+VECTOR_EMBEBIDO_MODELO_FILENAME = os.getenv("VECTOR_EMBEBIDO_MODELO", "")
+VECTOR_EMBEBIDO_MODELO_PATH = (
+    os.path.join(BASE_PROJECT_DIR, "models", VECTOR_EMBEBIDO_MODELO_FILENAME) if VECTOR_EMBEBIDO_MODELO_FILENAME else MODEL_PATH
+)
+VECTOR_EMBEBIDO_N_CTX = 512 # Contexto del modelo de embeddings (los fragmentos indexados deben caber)
+# Cómo se combinan los vectores por token en uno por texto: "mean", "last" o "cls" (p. ej. BERT). Un decodificador
+# como el GGUF principal no declara ninguno y, sin él, llama.cpp devuelve un vector por token. "" = el que declare el GGUF.
+VECTOR_EMBEBIDO_POOLING = os.getenv("VECTOR_EMBEBIDO_POOLING", "mean")
+# Ingesta de material de referencia en el índice embebido (python -m src.ingesta o POST /indice_vectorial/ingestar/)
+VECTOR_INGESTA_DIR = os.path.join(BASE_PROJECT_DIR, "data", "referencias") # Directorio por defecto (y destino de las subidas)
+VECTOR_INGESTA_EXTENSIONES = (".txt", ".md", ".markdown", ".pdf") # .pdf requiere pypdf; en .txt/.md, "\f" separa páginas
+VECTOR_INGESTA_CARACTERES_FRAGMENTO = 1200 # ~300-400 tokens: holgado dentro de VECTOR_EMBEBIDO_N_CTX
+VECTOR_INGESTA_SOLAPAMIENTO_CARACTERES = 200 # Oraciones finales de un fragmento que se repiten al inicio del siguiente
+VECTOR_INGESTA_LOTE_EMBEDDINGS = 32 # Fragmentos por llamada al modelo de embeddings (y por escritura en el índice)
+
+# --- Configuración de Generación de Apuntes ---
+# "prefijo_kv": la transcripción va al inicio del prompt, se evalúa una sola vez y su estado KV
+#               se reutiliza en cada sección (solo se evalúa el sufijo específico de la sección).
+# "recuperacion": índice léxico BM25 sobre la transcripción; cada sección recibe solo los pasajes relevantes.
+#               (también se usa automáticamente si el prefijo de "prefijo_kv" no cabe en CONTEXT_SIZE).
+# "completo":   comportamiento original, se re-evalúa el prompt completo en cada sección.
+APUNTES_MODO_CONTEXTO = "prefijo_kv"
+APUNTES_RECUPERACION_PALABRAS_VENTANA = 150 # Tamaño aproximado (en palabras) de cada ventana del índice
+APUNTES_RECUPERACION_TOP_K = 8 # Máximo de ventanas recuperadas por sección
+APUNTES_RECUPERACION_MAX_TOKENS_CONTEXTO = 1500 # Presupuesto de tokens de transcripción por sección
+
+# --- Configuración de Trabajos en Segundo Plano (API) ---
+TRABAJOS_DIR = os.path.join(BASE_PROJECT_DIR, "data", "trabajos") # Almacén en disco de trabajos (sobrevive reinicios)
+
+# --- Configuración del Pool de Réplicas (esquemas parciales en paralelo) ---
+POOL_REPLICAS_NUM = int(os.getenv("POOL_REPLICAS_NUM", "0")) # 0 = desactivado (esquemas parciales en secuencia)
+POOL_REPLICAS_N_THREADS = 4 # Hilos de llama.cpp por réplica
+POOL_REPLICAS_FIJAR_CPUS = True # Fijar cada réplica a su propio bloque de núcleos (solo Linux)
+
+# --- Configuración de la Caché de Resultados ---
+# Caché persistente direccionada por contenido (hash de entrada, plantilla, modelo y parámetros de generación).
+CACHE_RESULTADOS_ACTIVADA = os.getenv("CACHE_RESULTADOS_ACTIVADA", "1") != "0"
+CACHE_RESULTADOS_DIR = os.path.join(BASE_PROJECT_DIR, "data", "cache_resultados")
+CACHE_RESULTADOS_TAMANO_MAX_MB = 512 # Al superarse se desalojan las entradas usadas hace más tiempo (LRU)
+
+# --- Configuración de Trazas ---
+# Trazas por petición/ejecución en formato Chrome trace-event JSON (chrome://tracing, ui.perfetto.dev).
+TRAZAS_ACTIVADAS = os.getenv("TRAZAS_ACTIVADAS", "0") == "1"
+TRAZAS_DIR = os.path.join(BASE_PROJECT_DIR, "data", "trazas")
+
+# --- Configuración del Benchmark (src/benchmark_llm.py) ---
+BENCHMARK_DIR = os.path.join(BASE_PROJECT_DIR, "data", "benchmarks")
+BENCHMARK_CORPUS_PATH = TEMPLATE_TRANSCRIPCION_PATH # Texto fijo del repositorio: los corpus son idénticos entre ejecuciones
+BENCHMARK_TAMANOS_CORPUS = (1024, 3072, 6144) # Tokens de transcripción de cada corpus
+BENCHMARK_TOLERANCIA_REGRESION = 0.10 # Empeoramiento relativo a partir del cual el modo comparar marca una regresión
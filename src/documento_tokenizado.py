@@ -0,0 +1,144 @@
+# src/documento_tokenizado.py
+# Documento tokenizado una sola vez: texto + tokens en un array compacto (NumPy int32) que el pipeline
+# pasa de fase en fase (análisis de tokens, mega-chunks, prompts) sin volver a tokenizar el texto.
+import re
+import logging
+from functools import lru_cache
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_MARCADOR_DOCUMENTO = "\x00DOCUMENTO\x00" # Cadena que nunca aparece en las plantillas
+
+
+class DocumentoTokenizado:
+    """
+    Texto y sus tokens (sin BOS). El mapa token -> desplazamiento en bytes del texto se calcula
+    bajo demanda, en un solo pase, y permite extraer fragmentos sin detokenizar.
+    Se puede enviar a otros procesos (réplicas): el tokenizador no se serializa.
+    """
+
+    def __init__(self, texto, tokens, tokenizador=None, desplazamientos=None):
+        self.texto = texto
+        self.tokens = np.asarray(tokens, dtype=np.int32)
+        self._tokenizador = tokenizador
+        self._desplazamientos = desplazamientos
+        self._texto_bytes = None
+
+    @classmethod
+    def desde_texto(cls, texto, tokenizador):
+        tokens = tokenizador.tokenize(texto.encode('utf-8', 'ignore'), add_bos=False)
+        return cls(texto, tokens, tokenizador)
+
+    def __len__(self):
+        return len(self.tokens)
+
+    @property
+    def num_tokens(self):
+        return len(self.tokens)
+
+    def __getstate__(self):
+        estado = self.__dict__.copy()
+        estado["_tokenizador"] = None
+        estado["_texto_bytes"] = None
+        return estado
+
+    @property
+    def texto_bytes(self):
+        if self._texto_bytes is None:
+            self._texto_bytes = self.texto.encode('utf-8', 'ignore')
+        return self._texto_bytes
+
+    @property
+    def desplazamientos(self):
+        """
+        Array de num_tokens + 1 posiciones: el token i ocupa los bytes
+        [desplazamientos[i], desplazamientos[i+1]) del texto codificado en UTF-8.
+        """
+        if self._desplazamientos is None:
+            if self._tokenizador is None:
+                raise ValueError("Se necesita el tokenizador para calcular los desplazamientos del documento.")
+            longitudes = np.fromiter(
+                (len(self._tokenizador.detokenize([int(t)])) for t in self.tokens),
+                dtype=np.int64, count=len(self.tokens)
+            )
+            desplazamientos = np.zeros(len(self.tokens) + 1, dtype=np.int64)
+            np.cumsum(longitudes, out=desplazamientos[1:])
+            # SentencePiece antepone un espacio al primer token; se descuenta para alinear con el texto.
+            total_bytes = len(self.texto_bytes)
+            sobrante = int(desplazamientos[-1]) - total_bytes
+            if sobrante > 0:
+                desplazamientos = np.maximum(desplazamientos - sobrante, 0)
+            elif sobrante < 0:
+                logger.debug(f"Los tokens detokenizados cubren {-sobrante} bytes menos que el texto original.")
+            self._desplazamientos = np.minimum(desplazamientos, total_bytes)
+        return self._desplazamientos
+
+    def fragmento(self, inicio_token, fin_token):
+        """Sub-documento con los tokens [inicio_token, fin_token) (vista, sin copiar) y su texto."""
+        desplazamientos = self.desplazamientos
+        texto_fragmento = self.texto_bytes[desplazamientos[inicio_token]:desplazamientos[fin_token]].decode('utf-8', 'ignore')
+        return DocumentoTokenizado(
+            texto_fragmento, self.tokens[inicio_token:fin_token], self._tokenizador,
+            desplazamientos[inicio_token:fin_token + 1] - desplazamientos[inicio_token]
+        )
+
+
+class TokenizadorPalabras:
+    """
+    Tokenizador reversible con vocabulario propio (un token por palabra con el espacio que la precede)
+    para dividir textos destinados a modelos sin tokenizador local, como Gemini: sus conteos se pasan
+    a tokens del modelo con la proporción medida sobre el propio texto (ver api_main).
+    """
+    _PATRON_PALABRA = re.compile(rb"\s*\S+|\s+")
+
+    def __init__(self):
+        self._ids = {}
+        self._palabras = []
+
+    def tokenize(self, texto_bytes, add_bos=False):
+        tokens = []
+        for palabra in self._PATRON_PALABRA.findall(texto_bytes):
+            id_palabra = self._ids.get(palabra)
+            if id_palabra is None:
+                id_palabra = self._ids[palabra] = len(self._palabras)
+                self._palabras.append(palabra)
+            tokens.append(id_palabra)
+        return tokens
+
+    def detokenize(self, tokens):
+        return b"".join(self._palabras[int(t)] for t in tokens)
+
+
+@lru_cache(maxsize=64)
+def _partes_de_plantilla(tokenizador, plantilla, campo_documento, otros_campos):
+    texto_formateado = plantilla.format(**{campo_documento: _MARCADOR_DOCUMENTO, **dict(otros_campos)})
+    texto_antes, texto_despues = texto_formateado.split(_MARCADOR_DOCUMENTO, 1)
+    tokens_antes = np.asarray(tokenizador.tokenize(texto_antes.encode('utf-8'), add_bos=True), dtype=np.int32)
+    tokens_despues = np.asarray(tokenizador.tokenize(texto_despues.encode('utf-8'), add_bos=False), dtype=np.int32)
+    return tokens_antes, tokens_despues
+
+
+def partes_de_plantilla(plantilla, campo_documento, tokenizador, **otros_campos):
+    """
+    Tokens de la plantilla antes (con BOS) y después del campo `campo_documento`, con el resto de
+    campos ya formateados. Se tokenizan una vez por plantilla/valores y se reutilizan.
+    """
+    return _partes_de_plantilla(tokenizador, plantilla, campo_documento, tuple(sorted(otros_campos.items())))
+
+
+def contar_tokens_plantilla(plantilla, campo_documento, tokenizador, **otros_campos):
+    """Tokens que aporta la plantilla sin contar el documento."""
+    tokens_antes, tokens_despues = partes_de_plantilla(plantilla, campo_documento, tokenizador, **otros_campos)
+    return len(tokens_antes) + len(tokens_despues)
+
+
+def construir_prompt(plantilla, campo_documento, documento, tokenizador, **otros_campos):
+    """Tokens del prompt completo: plantilla + tokens del documento, sin re-tokenizar su texto."""
+    tokens_antes, tokens_despues = partes_de_plantilla(plantilla, campo_documento, tokenizador, **otros_campos)
+    return np.concatenate([tokens_antes, documento.tokens, tokens_despues])
+
+
+def limpiar_cache_plantillas():
+    """Olvida los tokens de plantillas cacheados (p. ej. al descargar o cambiar de modelo)."""
+    _partes_de_plantilla.cache_clear()
@@ -0,0 +1,27 @@
+# src/gramaticas.py
+# Gramáticas GBNF (formato de llama.cpp) para restringir la salida del modelo local.
+#
+# El esquema solo admite líneas de esquema numerado jerárquico: "1. Tema", "1.1. Subtema",
+# "1.1.1. Detalle"... hasta la profundidad configurada, cada nivel anidado bajo uno del nivel
+# anterior. El nivel 1 empieza en la columna 0 (pipeline.dividir_esquema_en_secciones corta ahí) y los
+# demás pueden ir sangrados. Una línea en blanco cierra la gramática: el modelo no puede escribir
+# preámbulos, títulos ni el resumen final que piden evitar los prompts, y la generación termina en
+# cuanto termina el esquema (sin secuencias de parada).
+from functools import lru_cache
+
+_NUMERO = '[1-9] [0-9]? "."'
+
+
+@lru_cache(maxsize=None)
+def gbnf_esquema(profundidad_max):
+    """GBNF de un esquema numerado de hasta `profundidad_max` niveles (1 = solo temas principales)."""
+    if profundidad_max < 1:
+        raise ValueError(f"La profundidad del esquema debe ser al menos 1 (recibido: {profundidad_max}).")
+    reglas = ['root ::= nivel1+ "\\n"?']
+    for nivel in range(1, profundidad_max + 1):
+        anidado = f" nivel{nivel + 1}*" if nivel < profundidad_max else ""
+        sangria = "" if nivel == 1 else '[ \\t]* '
+        numero = " ".join([_NUMERO] * nivel)
+        reglas.append(f"nivel{nivel} ::= {sangria}{numero} \" \" texto \"\\n\"{anidado}")
+    reglas.append('texto ::= [^\\n\\t ] [^\\n]*')
+    return "\n".join(reglas) + "\n"
@@ -0,0 +1,136 @@
+# src/indice_lexico.py
+import math
+import re
+import unicodedata
+import logging
+from collections import Counter
+from src import config
+
+logger = logging.getLogger(__name__)
+
+# Palabras vacías frecuentes en transcripciones de clase en español (ya sin tildes).
+_STOPWORDS_ES = frozenset("""
+a al algo algun alguna algunas alguno algunos ante antes asi aun bien cada como con contra cual cuales
+cuando de del desde donde dos e el ella ellas ello ellos en entonces entre era eramos eran es esa esas
+ese eso esos esta estaba estamos estan estar este esto estos fue fueron ha habia han hasta hay la las
+le les lo los mas me mi mis mucho muy nada ni no nos nosotros o otra otras otro otros para pero poco
+por porque pues que se sea ser si sin sobre solo son su sus tambien tan tanto te tiene tienen todo
+todos tu u un una uno unos usted ustedes va vamos van ver vez y ya yo bueno ok okay eh este digamos
+""".split())
+
+# Sufijos que se recortan (del más largo al más corto) para agrupar variantes de una misma palabra.
+_SUFIJOS_ES = (
+    "amientos", "imientos", "aciones", "uciones", "amiento", "imiento", "idades", "mente",
+    "acion", "ucion", "cion", "idad", "ando", "iendo", "ador", "ores", "ante", "ivos", "ivas",
+    "ivo", "iva", "ces", "es", "os", "as", "s",
+)
+
+_PATRON_PALABRA = re.compile(r"[a-z0-9]+")
+_PATRON_NUMERACION = re.compile(r"^\s*((\d+\.(?:\d+\.)*|[IVXLCDMivxlcdm]+\.|[a-zA-Z]\))\s*|#+\s*|\*\s*|-\s*|\+\s*)+")
+_PATRON_FIN_ORACION = re.compile(r"(?<=[.!?…])\s+")
+
+
+def _raiz_es(palabra):
+    """Stemming ligero para español: recorta un sufijo común si la raíz resultante sigue siendo informativa."""
+    for sufijo in _SUFIJOS_ES:
+        if palabra.endswith(sufijo) and len(palabra) - len(sufijo) >= 4:
+            return palabra[:-len(sufijo)]
+    return palabra
+
+
+def normalizar_texto_es(texto):
+    """
+    Normaliza un texto en español para búsqueda léxica: minúsculas, sin tildes,
+    sin palabras vacías y con stemming ligero. Devuelve la lista de términos.
+    """
+    texto_sin_tildes = unicodedata.normalize("NFD", texto.lower())
+    texto_sin_tildes = "".join(c for c in texto_sin_tildes if unicodedata.category(c) != "Mn")
+    return [
+        _raiz_es(palabra)
+        for palabra in _PATRON_PALABRA.findall(texto_sin_tildes)
+        if len(palabra) > 1 and palabra not in _STOPWORDS_ES
+    ]
+
+
+def dividir_en_ventanas(texto, palabras_por_ventana):
+    """
+    Divide el texto en ventanas del tamaño aproximado de un párrafo.
+    Los párrafos cortos consecutivos se agrupan y los largos (o transcripciones sin saltos
+    de párrafo) se cortan en límites de oración.
+    """
+    unidades = []
+    for parrafo in re.split(r"\n\s*\n", texto):
+        parrafo = parrafo.strip()
+        if not parrafo:
+            continue
+        if len(parrafo.split()) <= palabras_por_ventana:
+            unidades.append(parrafo)
+        else:
+            unidades.extend(o.strip() for o in _PATRON_FIN_ORACION.split(parrafo) if o.strip())
+
+    ventanas = []
+    ventana_actual = []
+    palabras_actuales = 0
+    for unidad in unidades:
+        palabras_unidad = len(unidad.split())
+        if ventana_actual and palabras_actuales + palabras_unidad > palabras_por_ventana:
+            ventanas.append(" ".join(ventana_actual))
+            ventana_actual, palabras_actuales = [], 0
+        ventana_actual.append(unidad)
+        palabras_actuales += palabras_unidad
+    if ventana_actual:
+        ventanas.append(" ".join(ventana_actual))
+    return ventanas
+
+
+def consulta_desde_seccion(seccion_esquema):
+    """Convierte una sección del esquema en texto de consulta (sin numeración ni viñetas)."""
+    return " ".join(_PATRON_NUMERACION.sub("", linea).strip() for linea in seccion_esquema.splitlines())
+
+
+class IndiceBM25:
+    """
+    Índice léxico BM25 en memoria sobre las ventanas de una transcripción.
+    Se construye una vez por transcripción y se consulta una vez por sección del esquema.
+    """
+
+    def __init__(self, ventanas, k1=1.5, b=0.75):
+        self.ventanas = ventanas
+        self.k1 = k1
+        self.b = b
+        self._frecuencias = [Counter(normalizar_texto_es(v)) for v in ventanas]
+        self._longitudes = [sum(f.values()) for f in self._frecuencias]
+        self._longitud_media = (sum(self._longitudes) / len(self._longitudes)) if self._longitudes else 0.0
+        frecuencia_documental = Counter()
+        for frecuencias in self._frecuencias:
+            frecuencia_documental.update(frecuencias.keys())
+        num_ventanas = len(ventanas)
+        self._idf = {
+            termino: math.log(1 + (num_ventanas - df + 0.5) / (df + 0.5))
+            for termino, df in frecuencia_documental.items()
+        }
+        # Conteo de tokens LLM por ventana, calculado bajo demanda y reutilizado entre secciones.
+        self.tokens_por_ventana = [None] * num_ventanas
+
+    @classmethod
+    def desde_texto(cls, texto, palabras_por_ventana=None):
+        palabras_por_ventana = palabras_por_ventana or config.APUNTES_RECUPERACION_PALABRAS_VENTANA
+        ventanas = dividir_en_ventanas(texto, palabras_por_ventana)
+        logger.info(f"Índice BM25 construido sobre {len(ventanas)} ventanas (~{palabras_por_ventana} palabras c/u).")
+        return cls(ventanas)
+
+    def buscar(self, consulta, top_k=None):
+        """Devuelve [(indice_ventana, puntuacion), ...] ordenado por relevancia descendente."""
+        terminos_consulta = set(normalizar_texto_es(consulta))
+        puntuaciones = []
+        for i, frecuencias in enumerate(self._frecuencias):
+            puntuacion = 0.0
+            normalizacion_longitud = self.k1 * (1 - self.b + self.b * self._longitudes[i] / (self._longitud_media or 1))
+            for termino in terminos_consulta:
+                tf = frecuencias.get(termino)
+                if tf:
+                    puntuacion += self._idf[termino] * tf * (self.k1 + 1) / (tf + normalizacion_longitud)
+            if puntuacion > 0:
+                puntuaciones.append((i, puntuacion))
+        puntuaciones.sort(key=lambda par: par[1], reverse=True)
+        return puntuaciones[:top_k] if top_k else puntuaciones
@@ -0,0 +1,254 @@
+# src/indice_vectorial.py
+# Búsqueda vectorial embebida en el proceso (config.VECTOR_DB_MODO = "embebido"): la misma interfaz
+# que el servicio externo /query/ (q, top_k, page_start, page_end -> resultados con text y citation)
+# sin salto de red. El índice vive en config.VECTOR_EMBEBIDO_DIR:
+#   vectores.f32       matriz float32 (num_vectores x dimension), filas normalizadas; se abre con memmap
+#   fragmentos.jsonl   una línea JSON por fila: {"text", "citation", "page", ...}
+#   manifiesto.json    dimension, num_vectores (autoritativo) y modelo de embeddings usado
+#   fuentes.json       versión vigente (sha256) de cada documento ingerido (ver ingesta.py); las filas
+#                      de una versión anterior o de una ingesta interrumpida quedan fuera de las búsquedas
+# Los embeddings salen de un GGUF de embeddings o del mismo GGUF del modelo principal (ver backends_llm).
+import os
+import json
+import time
+import logging
+import threading
+import numpy as np
+from src import config
+from src import backends_llm
+
+logger = logging.getLogger(__name__)
+
+VERSION_FORMATO = 1
+ARCHIVO_VECTORES = "vectores.f32"
+ARCHIVO_FRAGMENTOS = "fragmentos.jsonl"
+ARCHIVO_MANIFIESTO = "manifiesto.json"
+ARCHIVO_FUENTES = "fuentes.json"
+
+
+class IndiceVectorial:
+    """
+    Índice de solo-añadir sobre archivos. Las búsquedas son un producto matriz-vector sobre el
+    memmap (el sistema operativo pagina los vectores bajo demanda) y son seguras entre hilos.
+    """
+
+    def __init__(self, directorio):
+        self.directorio = directorio
+        self.manifiesto = None
+        self.vectores = None
+        self.fragmentos = []
+        self.paginas = np.empty(0, dtype=np.int32)
+        self.activos = np.empty(0, dtype=bool)
+        self.fuentes = {}
+        self._lock = threading.RLock()
+        self._cargar()
+
+    def _ruta(self, archivo):
+        return os.path.join(self.directorio, archivo)
+
+    @property
+    def num_vectores(self):
+        return self.manifiesto["num_vectores"] if self.manifiesto else 0
+
+    def _cargar(self):
+        self.fuentes = {}
+        if os.path.exists(self._ruta(ARCHIVO_FUENTES)):
+            with open(self._ruta(ARCHIVO_FUENTES), "r", encoding="utf-8") as f:
+                self.fuentes = json.load(f)
+        if not os.path.exists(self._ruta(ARCHIVO_MANIFIESTO)):
+            self.manifiesto, self.vectores, self.fragmentos = None, None, []
+            self.paginas = np.empty(0, dtype=np.int32)
+            self.activos = np.empty(0, dtype=bool)
+            return
+        with open(self._ruta(ARCHIVO_MANIFIESTO), "r", encoding="utf-8") as f:
+            manifiesto = json.load(f)
+        num_vectores, dimension = manifiesto["num_vectores"], manifiesto["dimension"]
+        with open(self._ruta(ARCHIVO_FRAGMENTOS), "r", encoding="utf-8") as f:
+            fragmentos = [json.loads(linea) for linea in f if linea.strip()]
+        if len(fragmentos) < num_vectores:
+            raise ValueError(f"Índice vectorial inconsistente en {self.directorio}: "
+                             f"{len(fragmentos)} fragmentos para {num_vectores} vectores.")
+        # El manifiesto se escribe el último: lo que haya de más en los otros archivos es de una escritura interrumpida.
+        self._reparar(len(fragmentos) > num_vectores, num_vectores * dimension * 4, fragmentos[:num_vectores])
+        self.manifiesto = manifiesto
+        self.fragmentos = fragmentos[:num_vectores]
+        self.vectores = (
+            np.memmap(self._ruta(ARCHIVO_VECTORES), dtype=np.float32, mode="r", shape=(num_vectores, dimension))
+            if num_vectores else np.empty((0, dimension), dtype=np.float32)
+        )
+        self.paginas = np.array(
+            [f["page"] if f.get("page") is not None else -1 for f in self.fragmentos], dtype=np.int32
+        )
+        self._calcular_activos()
+
+    def _calcular_activos(self):
+        # Las filas sin "fuente" (añadidas fuera de la ingesta) siempre cuentan.
+        self.activos = np.array([
+            "fuente" not in f or self.fuentes.get(f["fuente"], {}).get("sha256") == f.get("sha256")
+            for f in self.fragmentos
+        ], dtype=bool)
+
+    def _reparar(self, sobran_fragmentos, bytes_vectores, fragmentos_validos):
+        try:
+            if os.path.getsize(self._ruta(ARCHIVO_VECTORES)) > bytes_vectores:
+                with open(self._ruta(ARCHIVO_VECTORES), "r+b") as f:
+                    f.truncate(bytes_vectores)
+            if sobran_fragmentos:
+                self._escribir_atomico(ARCHIVO_FRAGMENTOS, "".join(json.dumps(f, ensure_ascii=False) + "\n" for f in fragmentos_validos))
+        except OSError as e:
+            logger.warning(f"No se pudo reparar el índice vectorial tras una escritura interrumpida: {e}")
+
+    def _escribir_atomico(self, archivo, contenido):
+        ruta = self._ruta(archivo)
+        with open(ruta + ".tmp", "w", encoding="utf-8") as f:
+            f.write(contenido)
+        os.replace(ruta + ".tmp", ruta)
+
+    def agregar(self, fragmentos, vectores, modelo_embeddings):
+        """Añade filas al final del índice. `fragmentos[i]` describe `vectores[i]`."""
+        vectores = np.ascontiguousarray(vectores, dtype=np.float32)
+        if len(fragmentos) != len(vectores):
+            raise ValueError(f"{len(fragmentos)} fragmentos para {len(vectores)} vectores.")
+        if not fragmentos:
+            return
+        with self._lock:
+            if self.manifiesto is not None and vectores.shape[1] != self.manifiesto["dimension"]:
+                raise ValueError(f"Dimensión de embeddings {vectores.shape[1]} distinta de la del índice "
+                                 f"({self.manifiesto['dimension']}). Reconstruir el índice con el mismo modelo.")
+            os.makedirs(self.directorio, exist_ok=True)
+            with open(self._ruta(ARCHIVO_VECTORES), "ab") as f:
+                f.write(vectores.tobytes())
+            with open(self._ruta(ARCHIVO_FRAGMENTOS), "a", encoding="utf-8") as f:
+                f.writelines(json.dumps(fragmento, ensure_ascii=False) + "\n" for fragmento in fragmentos)
+            manifiesto = {
+                "version_formato": VERSION_FORMATO,
+                "dimension": int(vectores.shape[1]),
+                "num_vectores": self.num_vectores + len(fragmentos),
+                "modelo_embeddings": modelo_embeddings,
+                "actualizado": time.time(),
+            }
+            self._escribir_atomico(ARCHIVO_MANIFIESTO, json.dumps(manifiesto, ensure_ascii=False, indent=2))
+            self._cargar()
+
+    def vaciar(self):
+        """Borra el índice (p. ej. para reconstruirlo con otro modelo de embeddings)."""
+        with self._lock:
+            for archivo in (ARCHIVO_MANIFIESTO, ARCHIVO_FUENTES, ARCHIVO_FRAGMENTOS, ARCHIVO_VECTORES):
+                if os.path.exists(self._ruta(archivo)):
+                    os.remove(self._ruta(archivo))
+            self._cargar()
+
+    def version_fuente(self, fuente):
+        """sha256 de la versión indexada de `fuente`, o None si no se ha ingerido."""
+        with self._lock:
+            return self.fuentes.get(fuente, {}).get("sha256")
+
+    def registrar_fuentes(self, fuentes):
+        """
+        Marca como vigentes las versiones de documentos cuyas filas ya se añadieron con agregar()
+        (`fuentes` mapea la fuente a {"sha256", ...}); desde ese momento sustituyen a las anteriores.
+        """
+        with self._lock:
+            os.makedirs(self.directorio, exist_ok=True)
+            self.fuentes.update(fuentes)
+            self._escribir_atomico(ARCHIVO_FUENTES, json.dumps(self.fuentes, ensure_ascii=False, indent=2))
+            self._calcular_activos()
+
+    def buscar(self, vector_consulta, top_k, page_start=None, page_end=None):
+        """Los `top_k` fragmentos más similares (producto escalar = coseno, vectores normalizados)."""
+        with self._lock:
+            vectores, paginas, activos, fragmentos = self.vectores, self.paginas, self.activos, self.fragmentos
+        if vectores is None or not len(fragmentos) or top_k <= 0:
+            return []
+        puntuaciones = vectores @ np.asarray(vector_consulta, dtype=np.float32)
+        validos = activos.copy()
+        if page_start is not None or page_end is not None:
+            validos &= paginas >= 0
+            if page_start is not None:
+                validos &= paginas >= page_start
+            if page_end is not None:
+                validos &= paginas <= page_end
+        if not validos.all():
+            puntuaciones = np.where(validos, puntuaciones, -np.inf)
+        k = min(top_k, int(validos.sum()))
+        if k <= 0:
+            return []
+        mejores = np.argpartition(-puntuaciones, k - 1)[:k]
+        mejores = mejores[np.argsort(-puntuaciones[mejores])]
+        return [{
+            "text": fragmentos[i]["text"],
+            "citation": fragmentos[i].get("citation"),
+            "page": fragmentos[i].get("page"),
+            "score": float(puntuaciones[i]),
+        } for i in mejores]
+
+
+_indice = None
+_indice_lock = threading.Lock()
+_backend_embeddings = None
+_embeddings_lock = threading.Lock() # Un contexto de llama.cpp no admite llamadas concurrentes
+_aviso_modelo_distinto = False
+
+
+def huella_modelo_embeddings():
+    """Identifica el modelo de embeddings: vectores de modelos distintos no son comparables."""
+    if config.LLM_BACKEND == backends_llm.BackendFalso.nombre:
+        return f"{backends_llm.BackendFalso.nombre}:{backends_llm.BackendFalso.DIMENSION_EMBEDDINGS}"
+    ruta = config.VECTOR_EMBEBIDO_MODELO_PATH
+    pooling = config.VECTOR_EMBEBIDO_POOLING or "gguf"
+    try:
+        return f"{os.path.basename(ruta)}:{os.path.getsize(ruta)}:{pooling}"
+    except OSError:
+        return f"{os.path.basename(ruta)}:{pooling}"
+
+
+def _obtener_backend_embeddings():
+    global _backend_embeddings
+    if _backend_embeddings is None:
+        if config.LLM_BACKEND == backends_llm.BackendFalso.nombre:
+            _backend_embeddings = backends_llm.crear_backend(backends_llm.BackendFalso.nombre).cargar()
+        else:
+            logger.info(f"Cargando modelo de embeddings desde: {config.VECTOR_EMBEBIDO_MODELO_PATH}")
+            _backend_embeddings = backends_llm.crear_backend(
+                backends_llm.BackendLlamaCpp.nombre, ruta_modelo=config.VECTOR_EMBEBIDO_MODELO_PATH,
+                n_ctx=config.VECTOR_EMBEBIDO_N_CTX, embedding=True, pooling=config.VECTOR_EMBEBIDO_POOLING
+            ).cargar(n_threads=config.N_THREADS, n_gpu_layers=0)
+    return _backend_embeddings
+
+
+def calcular_embeddings(textos):
+    """Matriz float32 (len(textos) x dimension) con filas de norma 1."""
+    textos = list(textos)
+    with _embeddings_lock:
+        embeddings = np.asarray(_obtener_backend_embeddings().embed(textos), dtype=np.float32)
+    if embeddings.ndim != 2 or embeddings.shape[0] != len(textos):
+        raise ValueError(f"Embeddings con forma {embeddings.shape}; se esperaba ({len(textos)}, dimension).")
+    normas = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.where(normas > 0, normas, 1.0)
+
+
+def obtener_indice():
+    global _indice
+    with _indice_lock:
+        if _indice is None:
+            _indice = IndiceVectorial(config.VECTOR_EMBEBIDO_DIR)
+            logger.info(f"Índice vectorial embebido abierto en {config.VECTOR_EMBEBIDO_DIR} ({_indice.num_vectores} vectores).")
+        return _indice
+
+
+def consultar_lote(queries, top_k=3, page_start=None, page_end=None):
+    """Resultados de cada consulta, con el mismo formato que el servicio /query/ (embeddings en un solo lote)."""
+    global _aviso_modelo_distinto
+    indice = obtener_indice()
+    if not queries or indice.num_vectores == 0:
+        return [[] for _ in queries]
+    if indice.manifiesto.get("modelo_embeddings") != huella_modelo_embeddings() and not _aviso_modelo_distinto:
+        _aviso_modelo_distinto = True
+        logger.warning(f"El índice vectorial se construyó con '{indice.manifiesto.get('modelo_embeddings')}' y se consulta "
+                       f"con '{huella_modelo_embeddings()}'. Los resultados no serán fiables: reconstruir el índice.")
+    embeddings = calcular_embeddings(queries)
+    return [indice.buscar(embedding, top_k, page_start, page_end) for embedding in embeddings]
+
+
+def consultar(query, top_k=3, page_start=None, page_end=None):
+    return consultar_lote([query], top_k, page_start, page_end)[0]
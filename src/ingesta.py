@@ -0,0 +1,238 @@
+# src/ingesta.py
+# Ingesta masiva de material de referencia (apuntes, bibliografía, temario) en el índice vectorial
+# embebido que consulta _extraer_y_consultar_terminos_esquema (config.VECTOR_DB_MODO = "embebido").
+#
+# Recorre un directorio documento a documento: cada página se parte en fragmentos por oraciones (nunca
+# entre páginas, para que los filtros page_start/page_end sean exactos), los fragmentos se embeben en
+# lotes y se añaden al índice en disco. Cada documento se identifica por su ruta relativa al directorio
+# y su sha256: los que no han cambiado desde la última ingesta se saltan sin leerlos ni embeberlos.
+#
+# Páginas: en .pdf, las del documento (requiere pypdf); en .txt/.md, el carácter de salto de página
+# "\f" (lo que escribe pdftotext) separa páginas, y un archivo sin "\f" es una única página 1.
+#
+# Uso:
+#   python -m src.ingesta data/referencias
+#   python -m src.ingesta data/referencias --reconstruir   # borra el índice (p. ej. al cambiar de modelo)
+import os
+import sys
+import time
+import hashlib
+import logging
+import argparse
+from src import config
+from src import utils
+from src import trazas
+from src import indice_vectorial
+
+logger = logging.getLogger(__name__)
+
+_TAMANO_BLOQUE_HASH = 1 << 20
+
+
+class ErrorLecturaDocumento(Exception):
+    """El documento no se pudo leer o extraer su texto; se omite y la ingesta continúa."""
+
+
+def listar_documentos(directorio):
+    """Rutas de los documentos admitidos bajo `directorio` (recursivo, en orden estable)."""
+    rutas = []
+    for raiz, subdirectorios, archivos in os.walk(directorio):
+        subdirectorios[:] = sorted(d for d in subdirectorios if not d.startswith("."))
+        for archivo in sorted(archivos):
+            if not archivo.startswith(".") and os.path.splitext(archivo)[1].lower() in config.VECTOR_INGESTA_EXTENSIONES:
+                rutas.append(os.path.join(raiz, archivo))
+    return rutas
+
+
+def sha256_archivo(ruta):
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(_TAMANO_BLOQUE_HASH), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def _paginas_pdf(ruta):
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise ErrorLecturaDocumento("Leer PDF requiere el paquete 'pypdf' (pip install pypdf); "
+                                    "alternativamente, convertirlo a texto con pdftotext.")
+    try:
+        lector = PdfReader(ruta)
+        for numero, pagina in enumerate(lector.pages, start=1):
+            yield numero, pagina.extract_text() or ""
+    except ErrorLecturaDocumento:
+        raise
+    except Exception as e:
+        raise ErrorLecturaDocumento(f"No se pudo extraer el texto del PDF: {e}") from e
+
+
+def _paginas_texto(ruta):
+    try:
+        with open(ruta, "rb") as f:
+            contenido = f.read()
+    except OSError as e:
+        raise ErrorLecturaDocumento(str(e)) from e
+    try:
+        texto = contenido.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        texto = contenido.decode("cp1252", errors="replace") # Material exportado desde Windows
+    for numero, pagina in enumerate(texto.split("\f"), start=1):
+        yield numero, pagina
+
+
+def paginas_documento(ruta):
+    """(número de página desde 1, texto) de cada página del documento, de una en una."""
+    if os.path.splitext(ruta)[1].lower() == ".pdf":
+        return _paginas_pdf(ruta)
+    return _paginas_texto(ruta)
+
+
+def _partir_unidad(unidad, max_caracteres):
+    """Parte entre palabras las unidades más largas que un fragmento (texto sin puntuación)."""
+    while len(unidad) > max_caracteres:
+        corte = unidad.rfind(" ", 0, max_caracteres)
+        if corte <= 0:
+            corte = max_caracteres
+        yield unidad[:corte]
+        unidad = unidad[corte:]
+    if unidad:
+        yield unidad
+
+
+def fragmentar_pagina(texto, max_caracteres=None, solapamiento_caracteres=None):
+    """
+    Fragmentos de hasta `max_caracteres` que cortan entre oraciones/párrafos. Cada fragmento
+    empieza repitiendo las últimas oraciones del anterior (hasta `solapamiento_caracteres`), para que
+    una idea partida en el corte siga siendo recuperable entera desde alguno de los dos.
+    """
+    max_caracteres = max_caracteres or config.VECTOR_INGESTA_CARACTERES_FRAGMENTO
+    solapamiento_caracteres = config.VECTOR_INGESTA_SOLAPAMIENTO_CARACTERES if solapamiento_caracteres is None else solapamiento_caracteres
+    unidades, longitud, hay_nuevas = [], 0, False
+    for unidad in utils._iterar_unidades(texto):
+        for trozo in _partir_unidad(unidad, max_caracteres):
+            if hay_nuevas and longitud + len(trozo) > max_caracteres:
+                fragmento = "".join(unidades).strip()
+                if fragmento:
+                    yield fragmento
+                conservadas, longitud = [], 0
+                for anterior in reversed(unidades):
+                    if longitud + len(anterior) > solapamiento_caracteres or longitud + len(anterior) + len(trozo) > max_caracteres:
+                        break
+                    conservadas.insert(0, anterior)
+                    longitud += len(anterior)
+                unidades, hay_nuevas = conservadas, False
+            unidades.append(trozo)
+            longitud += len(trozo)
+            hay_nuevas = True
+    fragmento = "".join(unidades).strip()
+    if hay_nuevas and fragmento:
+        yield fragmento
+
+
+def fragmentos_documento(ruta, fuente, sha256):
+    """Fragmentos del documento listos para el índice ({"text", "citation", "page", "fuente", "sha256"})."""
+    for pagina, texto in paginas_documento(ruta):
+        for texto_fragmento in fragmentar_pagina(texto):
+            yield {
+                "text": texto_fragmento,
+                "citation": f"{fuente}, p. {pagina}",
+                "page": pagina,
+                "fuente": fuente,
+                "sha256": sha256,
+            }
+
+
+def ingestar_directorio(directorio=None, reconstruir=False, reportar_progreso=None):
+    """
+    Indexa los documentos nuevos o modificados de `directorio` y devuelve un resumen de la ingesta.
+    Los fragmentos de varios documentos comparten lote de embeddings; un documento pasa a ser vigente
+    (y sustituye a su versión anterior) cuando todos sus fragmentos están escritos, así que una ingesta
+    interrumpida nunca deja documentos a medias en las búsquedas: la siguiente los retoma.
+    """
+    directorio = directorio or config.VECTOR_INGESTA_DIR
+    if not os.path.isdir(directorio):
+        raise FileNotFoundError(f"No existe el directorio de documentos: {directorio}")
+    inicio = time.perf_counter()
+    indice = indice_vectorial.obtener_indice()
+    huella = indice_vectorial.huella_modelo_embeddings()
+    if reconstruir:
+        logger.info(f"Reconstruyendo el índice vectorial en {indice.directorio}.")
+        indice.vaciar()
+    elif indice.num_vectores and indice.manifiesto.get("modelo_embeddings") != huella:
+        raise ValueError(f"El índice vectorial se construyó con '{indice.manifiesto.get('modelo_embeddings')}' y el modelo "
+                         f"de embeddings actual es '{huella}'. Reconstruirlo (--reconstruir) para cambiar de modelo.")
+
+    rutas = listar_documentos(directorio)
+    resumen = {"directorio": directorio, "documentos": len(rutas), "ingestados": [], "sin_cambios": 0,
+               "omitidos": [], "fragmentos": 0, "segundos": None}
+    lote, completados = [], {}
+
+    def volcar():
+        if lote:
+            with trazas.span("ingesta.embeddings_lote", fragmentos=len(lote)):
+                vectores = indice_vectorial.calcular_embeddings([f["text"] for f in lote])
+            indice.agregar(lote, vectores, huella)
+            resumen["fragmentos"] += len(lote)
+        if completados:
+            indice.registrar_fuentes(completados)
+        lote.clear()
+        completados.clear()
+
+    for num_documento, ruta in enumerate(rutas, start=1):
+        if reportar_progreso:
+            reportar_progreso("Documentos", num_documento, len(rutas))
+        fuente = os.path.relpath(ruta, directorio).replace(os.sep, "/")
+        sha256 = sha256_archivo(ruta)
+        if indice.version_fuente(fuente) == sha256:
+            resumen["sin_cambios"] += 1
+            continue
+        num_fragmentos = 0
+        try:
+            for fragmento in fragmentos_documento(ruta, fuente, sha256):
+                lote.append(fragmento)
+                num_fragmentos += 1
+                if len(lote) >= config.VECTOR_INGESTA_LOTE_EMBEDDINGS:
+                    volcar()
+        except ErrorLecturaDocumento as e:
+            logger.warning(f"Documento '{fuente}' omitido: {e}")
+            resumen["omitidos"].append({"fuente": fuente, "motivo": str(e)})
+            # Lo ya escrito de este documento queda inactivo (su versión no se registra).
+            lote[:] = [f for f in lote if f["fuente"] != fuente]
+            continue
+        completados[fuente] = {"sha256": sha256, "num_fragmentos": num_fragmentos, "ingestado": time.time()}
+        resumen["ingestados"].append({"fuente": fuente, "fragmentos": num_fragmentos})
+        logger.info(f"Documento '{fuente}': {num_fragmentos} fragmentos.")
+    volcar()
+
+    resumen["segundos"] = round(time.perf_counter() - inicio, 2)
+    logger.info(f"Ingesta de {directorio} terminada en {resumen['segundos']} s: {len(resumen['ingestados'])} documentos "
+                f"indexados ({resumen['fragmentos']} fragmentos), {resumen['sin_cambios']} sin cambios, "
+                f"{len(resumen['omitidos'])} omitidos. El índice tiene {indice.num_vectores} vectores.")
+    return resumen
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingesta de material de referencia en el índice vectorial embebido.")
+    parser.add_argument("directorio", nargs="?", default=config.VECTOR_INGESTA_DIR,
+                        help=f"Directorio con documentos {'/'.join(config.VECTOR_INGESTA_EXTENSIONES)} (por defecto, data/referencias).")
+    parser.add_argument("--reconstruir", action="store_true",
+                        help="Borra el índice y reindexa todo (necesario al cambiar de modelo de embeddings).")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)-5s] %(name)s: %(message)s")
+    try:
+        with trazas.traza("ingesta"):
+            resumen = ingestar_directorio(args.directorio, reconstruir=args.reconstruir)
+    except (FileNotFoundError, ValueError) as e:
+        logger.critical(str(e))
+        sys.exit(2)
+    for omitido in resumen["omitidos"]:
+        print(f"OMITIDO  {omitido['fuente']}: {omitido['motivo']}")
+    print(f"{len(resumen['ingestados'])} indexados, {resumen['sin_cambios']} sin cambios, "
+          f"{len(resumen['omitidos'])} omitidos, {resumen['fragmentos']} fragmentos en {resumen['segundos']} s.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,46 @@
 # src/llm_processing.py
-from llama_cpp import Llama
-import os
 import time
 import re
 import logging # <--- Importar logging
+import threading
+from contextlib import ExitStack
 from src import config
 from src import prompts
+from src import indice_lexico
+from src import cache_resultados
+from src import documento_tokenizado
+from src import metricas
+from src import trazas
+from src import gramaticas
+from src import registro_modelos
 
 logger = logging.getLogger(__name__)
-llm_instance = None # Esta será la instancia global del modelo cargado
+registro = None # Registro global de modelos (ver registro_modelos); solo se asigna con el modelo por defecto ya calentado
 
-def cargar_modelo_llm(use_cpu_only=False): # <--- Añadir parámetro use_cpu_only
-    global llm_instance
-    if llm_instance is not None:
-        logger.info("Modelo LLM ya está cargado.")
-        return llm_instance
+# Estado de la carga del modelo (la API la hace en segundo plano y lo expone en /health/ready).
+ESTADO_CARGA_PENDIENTE = "pendiente"
+ESTADO_CARGA_CARGANDO = "cargando"
+ESTADO_CARGA_LISTO = "listo"
+ESTADO_CARGA_ERROR = "error"
+estado_carga = {"estado": ESTADO_CARGA_PENDIENTE, "error": None, "segundos": None}
+_carga_terminada = threading.Event() # Se activa al terminar la carga, con éxito o con error
 
-    logger.info(f"Cargando modelo desde: {config.MODEL_PATH}")
-    if not os.path.exists(config.MODEL_PATH):
-        logger.critical(f"No se encontró el archivo del modelo en {config.MODEL_PATH}")
-        return None
+def _terminar_carga(estado, error=None, segundos=None):
+    estado_carga.update(estado=estado, error=error, segundos=segundos)
+    _carga_terminada.set()
+
+def cargar_modelo_llm(use_cpu_only=False, n_threads=None): # <--- Añadir parámetro use_cpu_only
+    """
+    Crea el registro global de modelos con el backend config.LLM_BACKEND y carga (y calienta) el
+    modelo por defecto; el resto se carga cuando alguna tarea lo necesita. `n_threads` sobrescribe el
+    de todos los modelos (lo usan las réplicas de pool_replicas para repartirse los núcleos).
+    Devuelve el registro, o None si falla la carga.
+    """
+    global registro
+    if registro is not None:
+        logger.info("Modelo LLM ya está cargado.")
+        return registro
+    estado_carga.update(estado=ESTADO_CARGA_CARGANDO, error=None, segundos=None)
 
     n_gpu_layers_to_use = config.N_GPU_LAYERS
     if use_cpu_only:
@@ -30,17 +51,12 @@ def cargar_modelo_llm(use_cpu_only=False): # <--- Añadir parámetro use_cpu_onl
         
     try:
         start_time_carga = time.time()
-        llm_instance = Llama(
-            model_path=config.MODEL_PATH,
-            n_ctx=config.CONTEXT_SIZE,
-            n_threads=config.N_THREADS,
-            n_gpu_layers=n_gpu_layers_to_use, # <--- Usar la variable ajustada
-            n_batch=config.N_BATCH_LLAMA,
-            verbose=config.LLM_VERBOSE,
-            seed=42, 
-        )
+        nuevo_registro = registro_modelos.RegistroModelos(use_cpu_only=use_cpu_only, n_threads=n_threads)
+        nuevo_registro.cargar(nuevo_registro.modelo_por_defecto)
         end_time_carga = time.time()
         logger.info(f"Modelo LLM cargado exitosamente en {end_time_carga - start_time_carga:.2f} segundos.")
+        registro = nuevo_registro
+        _terminar_carga(ESTADO_CARGA_LISTO, segundos=round(time.time() - start_time_carga, 2))
         if use_cpu_only:
             logger.info("Modelo cargado en modo CPU (n_gpu_layers=0).")
         elif n_gpu_layers_to_use > 0 :
@@ -48,36 +64,345 @@ def cargar_modelo_llm(use_cpu_only=False): # <--- Añadir parámetro use_cpu_onl
         else: # n_gpu_layers_to_use es 0 (o negativo si config.N_GPU_LAYERS era negativo y no se forzó CPU)
              logger.info(f"Modelo cargado con {n_gpu_layers_to_use} capas en GPU (podría ser CPU si es 0 o negativo y no hay GPU).")
 
-        return llm_instance
+        return registro
+    except FileNotFoundError as e:
+        logger.critical(str(e))
+        registro = None
+        _terminar_carga(ESTADO_CARGA_ERROR, error=str(e))
+        return None
     except Exception as e:
         logger.critical(f"Al cargar el modelo LLM: {e}", exc_info=True)
-        logger.info("Posibles causas: CONTEXT_SIZE, archivo corrupto, Llama.cpp sin soporte GPU.")
-        llm_instance = None
+        logger.info("Posibles causas: CONTEXT_SIZE, archivo corrupto, Llama.cpp sin soporte GPU, config.MODELOS_LLM.")
+        registro = None
+        _terminar_carga(ESTADO_CARGA_ERROR, error=f"{type(e).__name__}: {e}")
         return None
 
-def _llamar_al_llm(prompt_texto, max_tokens_salida, temperatura, descripcion_tarea, stop_sequences=None):
-    if llm_instance is None:
+def cargar_modelo_en_segundo_plano(use_cpu_only=False):
+    """
+    Lanza cargar_modelo_llm en un hilo y vuelve enseguida (la API acepta conexiones mientras el modelo
+    carga). El progreso se consulta en `estado_carga`; esperar_carga_modelo bloquea hasta que termine.
+    """
+    if registro is not None or estado_carga["estado"] == ESTADO_CARGA_CARGANDO:
+        return None
+    _carga_terminada.clear()
+    estado_carga.update(estado=ESTADO_CARGA_CARGANDO, error=None, segundos=None)
+    hilo = threading.Thread(target=cargar_modelo_llm, kwargs={"use_cpu_only": use_cpu_only}, name="carga-modelo", daemon=True)
+    hilo.start()
+    return hilo
+
+def esperar_carga_modelo(timeout=None):
+    """Espera a que termine una carga en curso (sin carga iniciada, vuelve enseguida). Devuelve el registro."""
+    if estado_carga["estado"] == ESTADO_CARGA_CARGANDO:
+        _carga_terminada.wait(timeout)
+    return registro
+
+def usar_modelo(tipo_tarea, tokens_necesarios=None):
+    """
+    Bloque `with` con el backend del modelo de `tipo_tarea` ("esquema", "esquema_parcial", "fusion",
+    "apuntes_seccion") en el contexto más pequeño donde caben `tokens_necesarios`, cargado si hace
+    falta (ver registro_modelos.RegistroModelos.usar).
+    """
+    return registro.usar(tipo_tarea, tokens_necesarios)
+
+def usar_tokenizador(tipo_tarea):
+    """Bloque `with` con un backend del modelo de `tipo_tarea` para tokenizar (cualquier contexto ya abierto)."""
+    return registro.tokenizador(tipo_tarea)
+
+def n_ctx_tarea(tipo_tarea):
+    """Contexto más grande del modelo de `tipo_tarea` (sin cargarlo)."""
+    return registro.n_ctx(tipo_tarea) if registro is not None else config.CONTEXT_SIZE
+
+def _mismo_tokenizador(tarea_a, tarea_b):
+    """Las dos tareas usan el mismo GGUF: los tokens de una sirven para la otra."""
+    return registro is not None and registro.ruta(tarea_a) == registro.ruta(tarea_b)
+
+def preparar_contexto_apuntes(transcripcion_completa):
+    """
+    Prepara, una sola vez por transcripción, el contexto que compartirán todas las secciones
+    de los apuntes según config.APUNTES_MODO_CONTEXTO:
+      - "prefijo_kv":   transcripción evaluada una vez y reutilizada desde el KV cache.
+                        Si no cabe en el contexto, se recurre a "recuperacion".
+      - "recuperacion": índice BM25 sobre la transcripción; cada sección recibe solo los pasajes relevantes.
+      - "completo":     cada sección recibe la transcripción completa (comportamiento original).
+    Devuelve un dict con la clave "modo" y los datos del modo, o None para el modo "completo".
+    """
+    modo = config.APUNTES_MODO_CONTEXTO
+    if modo == "prefijo_kv":
+        prefijo_kv = preparar_prefijo_apuntes(transcripcion_completa)
+        if prefijo_kv is not None:
+            return {"modo": "prefijo_kv", "prefijo_kv": prefijo_kv}
+        logger.info("No se pudo usar el prefijo KV para los apuntes. Se usará recuperación de pasajes relevantes.")
+        modo = "recuperacion"
+    if modo == "recuperacion":
+        if not transcripcion_completa:
+            logger.error("Transcripción completa no proporcionada. No se puede construir el índice de recuperación.")
+            return None
+        return {"modo": "recuperacion", "indice": indice_lexico.IndiceBM25.desde_texto(transcripcion_completa)}
+    logger.info(f"Modo de contexto de apuntes: '{modo}'. Se enviará la transcripción completa en cada sección.")
+    return None
+
+def _contar_tokens_ventana(indice, i):
+    if indice.tokens_por_ventana[i] is None:
+        try:
+            with usar_tokenizador("apuntes_seccion") as llm:
+                indice.tokens_por_ventana[i] = len(llm.tokenize(indice.ventanas[i].encode('utf-8', 'ignore'), add_bos=False))
+        except Exception as e_tok:
+            logger.debug(f"No se pudo tokenizar la ventana {i} del índice: {e_tok}. Se estimará por palabras.")
+            indice.tokens_por_ventana[i] = int(len(indice.ventanas[i].split()) / 0.75)
+    return indice.tokens_por_ventana[i]
+
+def seleccionar_contexto_relevante(seccion_esquema_actual, indice):
+    """
+    Devuelve los pasajes de la transcripción más relevantes para la sección, limitados a
+    config.APUNTES_RECUPERACION_TOP_K ventanas y config.APUNTES_RECUPERACION_MAX_TOKENS_CONTEXTO tokens.
+    Los pasajes se devuelven en su orden original dentro de la transcripción.
+    """
+    consulta = indice_lexico.consulta_desde_seccion(seccion_esquema_actual)
+    resultados = indice.buscar(consulta, top_k=config.APUNTES_RECUPERACION_TOP_K)
+
+    seleccionadas = []
+    tokens_acumulados = 0
+    for i, _ in resultados:
+        tokens_ventana = _contar_tokens_ventana(indice, i)
+        if tokens_acumulados + tokens_ventana > config.APUNTES_RECUPERACION_MAX_TOKENS_CONTEXTO:
+            continue
+        seleccionadas.append(i)
+        tokens_acumulados += tokens_ventana
+
+    logger.info(f"Recuperación: {len(seleccionadas)}/{len(indice.ventanas)} ventanas seleccionadas (~{tokens_acumulados} tokens).")
+    if not seleccionadas:
+        return ""
+    return "\n[...]\n".join(indice.ventanas[i] for i in sorted(seleccionadas))
+
+def preparar_prefijo_apuntes(transcripcion_completa):
+    """
+    Tokeniza el prefijo compartido de los apuntes (instrucciones + transcripción) y comprueba que
+    quepa en el contexto. Se evalúa una sola vez, en su primer uso (ver _restaurar_prefijo_kv), y su
+    instantánea del estado del modelo se reutiliza en cada sección. Devuelve None si no se puede usar.
+    """
+    if registro is None:
+        logger.critical("Modelo LLM no cargado. No se puede preparar el prefijo KV de apuntes.")
+        return None
+    if not transcripcion_completa:
+        logger.error("Transcripción completa no proporcionada. No se puede preparar el prefijo KV de apuntes.")
+        return None
+
+    prefijo_texto = prompts.PROMPT_APUNTES_PREFIJO_TRANSCRIPCION_TEMPLATE.format(
+        contexto_relevante_de_transcripcion=transcripcion_completa
+    )
+    try:
+        with usar_tokenizador("apuntes_seccion") as llm:
+            tokens_prefijo = llm.tokenize(prefijo_texto.encode('utf-8', 'ignore'))
+    except Exception as e_tok:
+        logger.error(f"No se pudo tokenizar el prefijo de apuntes: {e_tok}", exc_info=True)
+        return None
+
+    margen_seguridad_tokens = 20
+    n_ctx = n_ctx_tarea("apuntes_seccion")
+    if len(tokens_prefijo) + config.MAX_TOKENS_APUNTES_POR_SECCION + margen_seguridad_tokens > n_ctx:
+        logger.warning(f"El prefijo de apuntes ({len(tokens_prefijo)} tokens) + salida ({config.MAX_TOKENS_APUNTES_POR_SECCION}) "
+                       f"no cabe en el contexto del modelo ({n_ctx}). Se usará el prompt completo por sección.")
+        return None
+
+    # La evaluación se difiere hasta la primera sección que no salga de la caché de resultados. Hay una
+    # instantánea por tamaño de contexto: cada sección puede ir al contexto más pequeño en el que quepa.
+    return {"tokens": list(tokens_prefijo), "estados": {}}
+
+def _evaluar_prefijo_kv(llm, prefijo_kv):
+    """Evalúa el prefijo desde un KV cache vacío y guarda la instantánea del estado resultante. Devuelve True."""
+    tokens_prefijo = prefijo_kv["tokens"]
+    logger.info(f"Evaluando prefijo compartido de apuntes ({len(tokens_prefijo)} tokens) una sola vez...")
+    start_time_prefijo = time.time()
+    try:
+        llm.reset()
+        llm.eval(tokens_prefijo)
+        prefijo_kv["estados"][llm.n_ctx()] = llm.save_state()
+    except Exception:
+        llm.reset()
+        raise
+    logger.info(f"Prefijo de apuntes evaluado y guardado en {time.time() - start_time_prefijo:.2f} seg.")
+    return True
+
+def _restaurar_prefijo_kv(llm, prefijo_kv):
+    """
+    Deja el KV cache del modelo con exactamente el prefijo evaluado.
+    Si el cache todavía empieza por el prefijo (caso habitual entre secciones consecutivas)
+    no se copia nada: llama.cpp reutiliza la coincidencia más larga al generar.
+    La instantánea sirve también si el registro descargó y volvió a cargar el contexto.
+    Devuelve True si el prefijo se tuvo que evaluar (primera sección en este tamaño de contexto).
+    """
+    estado = prefijo_kv["estados"].get(llm.n_ctx())
+    if estado is None:
+        return _evaluar_prefijo_kv(llm, prefijo_kv)
+    if llm.prefijo_en_cache(prefijo_kv["tokens"]):
+        return False
+    logger.debug("El KV cache ya no contiene el prefijo de apuntes. Restaurando instantánea.")
+    llm.load_state(estado)
+    return False
+
+def _generar_en_stream(llm, prompt_para_llm, num_tokens_prompt, emitir_token, **parametros_generacion):
+    """
+    Genera con stream=True llamando a `emitir_token(texto)` por cada fragmento producido.
+    Devuelve una salida con la misma forma que la llamada sin stream (choices + usage).
+    """
+    partes_generadas = []
+    finish_reason = None
+    inicio = time.perf_counter()
+    primer_token = None
+    for fragmento in llm.stream(prompt_para_llm, **parametros_generacion):
+        eleccion = fragmento["choices"][0]
+        if primer_token is None:
+            primer_token = time.perf_counter()
+        if eleccion.get("text"):
+            partes_generadas.append(eleccion["text"])
+            try:
+                emitir_token(eleccion["text"])
+            except Exception as e_emitir:
+                logger.warning(f"Error al emitir token en stream: {e_emitir}")
+        if eleccion.get("finish_reason"):
+            finish_reason = eleccion["finish_reason"]
+    fin = time.perf_counter()
+    # El primer fragmento llega tras evaluar el prompt: separa evaluación del prompt y generación en la traza.
+    primer_token = primer_token or fin
+    trazas.registrar_span("llm.evaluacion_prompt", inicio, primer_token, tokens=num_tokens_prompt)
+    trazas.registrar_span("llm.generacion", primer_token, fin, tokens=len(partes_generadas))
+    return {
+        "choices": [{"text": "".join(partes_generadas), "finish_reason": finish_reason}],
+        # En stream llama.cpp emite un fragmento por token generado.
+        "usage": {"prompt_tokens": num_tokens_prompt, "completion_tokens": len(partes_generadas)},
+    }
+
+def _llamar_al_llm(prompt_texto, max_tokens_salida, temperatura, descripcion_tarea, stop_sequences=None, prefijo_kv=None,
+                   emitir_token=None, tokens_prompt=None, tipo_tarea="otra", gramatica=None):
+    """
+    Llama al LLM local (ver _generar_con_llm) y registra sus estadísticas en las métricas del
+    servicio bajo `tipo_tarea` ("esquema", "esquema_parcial", "fusion", "apuntes_seccion").
+    `gramatica` (GBNF, ver gramaticas.py) restringe la salida del modelo.
+    """
+    with trazas.span(f"llm.{tipo_tarea}", descripcion=descripcion_tarea) as span_llm:
+        texto_generado, finish_reason, stats = _generar_con_llm(
+            prompt_texto, max_tokens_salida, temperatura, descripcion_tarea, stop_sequences=stop_sequences,
+            prefijo_kv=prefijo_kv, emitir_token=emitir_token, tokens_prompt=tokens_prompt, gramatica=gramatica,
+            tipo_tarea=tipo_tarea
+        )
+        span_llm.establecer(
+            finish_reason=finish_reason,
+            tokens_prompt=stats.get("tokens_prompt", 0),
+            tokens_prompt_reutilizados=stats.get("tokens_prompt_reutilizados", 0),
+            tokens_generados=stats.get("tokens_generados", 0),
+            n_ctx=stats.get("n_ctx"),
+        )
+    metricas.registrar_llamada_llm(tipo_tarea, finish_reason, stats)
+    if stats.get("processing_time_seconds"):
+        metricas.MODELO_OCUPADO.inc(stats["processing_time_seconds"])
+    return texto_generado, finish_reason, stats
+
+def _estadisticas_borrador(llm, borrador_inicio, tokens_generados):
+    """
+    Tokens de borrador propuestos y aceptados durante una llamada (diferencia de los contadores del
+    backend), o {} sin decodificación especulativa. llama-cpp-python no informa de los aceptados: el
+    primer token sale de la evaluación del prompt y cada pase de verificación aporta los aceptados más
+    uno del propio modelo, así que aceptados = generados - 1 - pases (exacto salvo corte por stop).
+    """
+    borrador_fin = llm.estadisticas_borrador()
+    if borrador_inicio is None or borrador_fin is None:
+        return {}
+    pases = borrador_fin["pases"] - borrador_inicio["pases"]
+    propuestos = borrador_fin["propuestos"] - borrador_inicio["propuestos"]
+    aceptados = min(propuestos, max(0, tokens_generados - 1 - pases))
+    return {
+        "tokens_borrador_propuestos": propuestos,
+        "tokens_borrador_aceptados": aceptados,
+        "tasa_aceptacion_borrador": aceptados / propuestos if propuestos else 0.0,
+    }
+
+def _generar_con_llm(prompt_texto, max_tokens_salida, temperatura, descripcion_tarea, stop_sequences=None, prefijo_kv=None, emitir_token=None, tokens_prompt=None,
+                     gramatica=None, tipo_tarea="otra"):
+    """
+    Llama al modelo de `tipo_tarea` del registro (cargándolo si hace falta). El prompt se tokeniza con
+    cualquier contexto abierto del modelo y se genera en el más pequeño donde caben prompt y salida.
+    Si se pasa `prefijo_kv` (ver preparar_prefijo_apuntes), `prompt_texto` es solo el sufijo y el
+    prefijo ya evaluado se reutiliza desde el KV cache.
+    Si se pasa `tokens_prompt` (ya tokenizado, ver documento_tokenizado), se envía tal cual y
+    `prompt_texto` puede ser None.
+    Si se pasa `emitir_token`, se genera en stream y se invoca con cada fragmento de texto
+    (también se genera en stream, sin emitir, si hay una traza activa, para medir por separado
+    la evaluación del prompt y la generación).
+    """
+    if registro is None:
         logger.critical(f"Modelo LLM no cargado. No se puede procesar '{descripcion_tarea}'.")
         return None, "llm_not_loaded", {}
+    margen_seguridad_tokens = 20
+    # Solo la obtención del modelo (que puede cargarlo) se informa como model_load_failed; los errores
+    # de la generación conservan su causa (ver _generar_con_modelo).
+    with ExitStack() as reserva:
+        try:
+            llm = reserva.enter_context(usar_tokenizador(tipo_tarea))
+        except Exception as e:
+            return _fallo_de_carga(tipo_tarea, descripcion_tarea, e)
+        prompt_tokenizado = _tokenizar_prompt(llm, prompt_texto, descripcion_tarea, prefijo_kv, tokens_prompt)
+    if prompt_tokenizado is None:
+        return None, "prefix_tokenization_failed", {}
+    prompt_para_llm, num_tokens_prompt_reales, num_tokens_prompt_reutilizados = prompt_tokenizado
+    # Sin conteo del prompt se usa el contexto más grande del modelo.
+    tokens_necesarios = num_tokens_prompt_reales + max_tokens_salida + margen_seguridad_tokens if num_tokens_prompt_reales else None
+    with ExitStack() as reserva:
+        try:
+            llm = reserva.enter_context(usar_modelo(tipo_tarea, tokens_necesarios))
+        except Exception as e:
+            return _fallo_de_carga(tipo_tarea, descripcion_tarea, e)
+        return _generar_con_modelo(
+            llm, prompt_texto, prompt_para_llm, num_tokens_prompt_reales, num_tokens_prompt_reutilizados,
+            max_tokens_salida, temperatura, descripcion_tarea, stop_sequences=stop_sequences,
+            prefijo_kv=prefijo_kv, emitir_token=emitir_token, gramatica=gramatica
+        )
 
+def _fallo_de_carga(tipo_tarea, descripcion_tarea, error):
+    logger.error(f"No se pudo cargar el modelo '{registro.nombre_modelo(tipo_tarea)}' para '{descripcion_tarea}': {error}", exc_info=True)
+    return None, f"model_load_failed: {error}", {}
+
+def _tokenizar_prompt(llm, prompt_texto, descripcion_tarea, prefijo_kv=None, tokens_prompt=None):
+    """
+    Devuelve (prompt para el modelo, tokens del prompt, tokens reutilizados del prefijo KV). Si no se
+    puede tokenizar, el prompt es el texto y el conteo 0; None si sin tokens no se puede usar `prefijo_kv`.
+    """
     num_tokens_prompt_reales = 0
+    num_tokens_prompt_reutilizados = 0
+    prompt_para_llm = prompt_texto
     try:
-        if llm_instance:
+        if tokens_prompt is not None:
+            prompt_para_llm = [int(t) for t in tokens_prompt]
+            num_tokens_prompt_reales = len(prompt_para_llm)
+        elif llm:
             # Asegurarse de que prompt_texto sea string antes de encodear
             if not isinstance(prompt_texto, str):
                 logger.error(f"(LLM Call) prompt_texto para '{descripcion_tarea}' no es una cadena (tipo: {type(prompt_texto)}). No se puede tokenizar.")
                 # Considerar devolver un error aquí o un valor por defecto para num_tokens_prompt_reales
                 # Por ahora, se quedará en 0 y la lógica posterior podría manejarlo o fallar.
+            elif prefijo_kv is not None:
+                tokens_sufijo = llm.tokenize(prompt_texto.encode('utf-8', 'ignore'), add_bos=False)
+                prompt_para_llm = prefijo_kv["tokens"] + tokens_sufijo
+                num_tokens_prompt_reales = len(prompt_para_llm)
+                num_tokens_prompt_reutilizados = len(prefijo_kv["tokens"])
             else:
-                tokens_del_prompt = llm_instance.tokenize(prompt_texto.encode('utf-8', 'ignore'))
+                tokens_del_prompt = llm.tokenize(prompt_texto.encode('utf-8', 'ignore'))
                 num_tokens_prompt_reales = len(tokens_del_prompt)
+                prompt_para_llm = tokens_del_prompt # Evita que llama.cpp vuelva a tokenizar el mismo texto
         else:
-            logger.warning(f"llm_instance no disponible para tokenizar prompt para '{descripcion_tarea}' (conteo previo).")
+            logger.warning(f"Modelo no disponible para tokenizar prompt para '{descripcion_tarea}' (conteo previo).")
     except Exception as e_tok:
         logger.warning(f"No se pudo tokenizar el prompt para '{descripcion_tarea}' para conteo previo: {e_tok}")
-
+        if prefijo_kv is not None:
+            logger.error(f"Sin tokens del sufijo no se puede reutilizar el prefijo KV para '{descripcion_tarea}'.")
+            return None
+    return prompt_para_llm, num_tokens_prompt_reales, num_tokens_prompt_reutilizados
+
+def _generar_con_modelo(llm, prompt_texto, prompt_para_llm, num_tokens_prompt_reales, num_tokens_prompt_reutilizados,
+                        max_tokens_salida, temperatura, descripcion_tarea, stop_sequences=None, prefijo_kv=None,
+                        emitir_token=None, gramatica=None):
+    """Genera con el backend `llm` el prompt ya tokenizado por _tokenizar_prompt (ver _generar_con_llm)."""
     # --- Inicio de la lógica de cálculo dinámico de tokens de salida ---
-    espacio_contexto_total_llm = config.CONTEXT_SIZE
+    espacio_contexto_total_llm = llm.n_ctx()
     margen_seguridad_tokens = 20  # Margen para tokens especiales, BOS/EOS, etc.
 
     espacio_disponible_para_salida_bruto = 0
@@ -107,7 +432,7 @@ def _llamar_al_llm(prompt_texto, max_tokens_salida, temperatura, descripcion_tar
     if max_tokens_a_usar_en_llm <= 0 and max_tokens_salida > 0:
         logger.error(f"Cálculo dinámico resultó en 0 o menos tokens para la salida de '{descripcion_tarea}' "
                      f"(Prompt: {num_tokens_prompt_reales}, Disponible Bruto: {espacio_disponible_para_salida_bruto}, Configurado: {max_tokens_salida}). "
-                     f"No se llamará al LLM. Revisar CONTEXT_SIZE y longitud del prompt.")
+                     f"No se llamará al LLM. Revisar n_ctx del modelo (config.MODELOS_LLM) y longitud del prompt.")
         # Asegurar que las variables de estadísticas se inicialicen si no se llama al LLM
         stats = {
             "tokens_prompt": num_tokens_prompt_reales, # O el mejor estimado que tengamos
@@ -118,7 +443,7 @@ def _llamar_al_llm(prompt_texto, max_tokens_salida, temperatura, descripcion_tar
         return None, "zero_tokens_for_output", stats
     # --- Fin de la lógica de cálculo dinámico ---
 
-    logger.info(f"Enviando prompt al LLM para '{descripcion_tarea}' ({num_tokens_prompt_reales} tokens), "
+    logger.info(f"Enviando prompt al LLM para '{descripcion_tarea}' ({num_tokens_prompt_reales} tokens, contexto de {espacio_contexto_total_llm}), "
                 f"max_tokens_out (dinámico): {max_tokens_a_usar_en_llm} (configurado: {max_tokens_salida}), temp: {temperatura}.")
 
     # Advertencia actualizada sobre posible desbordamiento
@@ -127,23 +452,37 @@ def _llamar_al_llm(prompt_texto, max_tokens_salida, temperatura, descripcion_tar
         logger.warning(
             f"ALERTA DE CONTEXTO para '{descripcion_tarea}': Prompt ({num_tokens_prompt_reales}) + Salida Solicitada ({max_tokens_a_usar_en_llm}) "
             f"+ Margen ({margen_seguridad_tokens}) = {num_tokens_prompt_reales + max_tokens_a_usar_en_llm + margen_seguridad_tokens} tokens. "
-            f"Esto está muy cerca o excede el CONTEXT_SIZE ({espacio_contexto_total_llm}). "
+            f"Esto está muy cerca o excede el contexto del modelo ({espacio_contexto_total_llm}). "
             f"Espacio disponible calculado (bruto): {espacio_disponible_para_salida_bruto}."
         )
     
-    if logger.isEnabledFor(logging.DEBUG):
+    if logger.isEnabledFor(logging.DEBUG) and prompt_texto:
         logger.debug(f"Prompt para '{descripcion_tarea}':\n'''\n{prompt_texto[:500]}...\n'''")
     
+    borrador_inicio = llm.estadisticas_borrador()
     start_time_llm = time.time()
     try:
-        output = llm_instance(
-            prompt_texto,
-            max_tokens=max_tokens_a_usar_en_llm, # <--- USAR EL VALOR DINÁMICO
-            stop=stop_sequences,
-            echo=False,
-            temperature=temperatura,
-            seed=42
-        )
+        if prefijo_kv is not None and _restaurar_prefijo_kv(llm, prefijo_kv):
+            num_tokens_prompt_reutilizados = 0 # Recién evaluado: cuenta como evaluado, no como reutilizado
+
+        if emitir_token is not None or trazas.traza_activa():
+            output = _generar_en_stream(
+                llm, prompt_para_llm, num_tokens_prompt_reales, emitir_token or (lambda _texto: None),
+                max_tokens=max_tokens_a_usar_en_llm,
+                stop=stop_sequences,
+                temperature=temperatura,
+                seed=42,
+                gramatica=gramatica
+            )
+        else:
+            output = llm.completar(
+                prompt_para_llm,
+                max_tokens=max_tokens_a_usar_en_llm, # <--- USAR EL VALOR DINÁMICO
+                stop=stop_sequences,
+                temperature=temperatura,
+                seed=42,
+                gramatica=gramatica
+            )
         
         end_time_llm = time.time()
         processing_time = end_time_llm - start_time_llm # Definir processing_time aquí
@@ -162,8 +501,7 @@ def _llamar_al_llm(prompt_texto, max_tokens_salida, temperatura, descripcion_tar
             tokens_generados = usage_stats.get('completion_tokens', 0)
             if tokens_generados == 0 and texto_generado:
                 try:
-                    if llm_instance: # Asegurar que llm_instance exista
-                        tokens_generados = len(llm_instance.tokenize(texto_generado.encode('utf-8', 'ignore')))
+                    tokens_generados = len(llm.tokenize(texto_generado.encode('utf-8', 'ignore')))
                 except Exception as e:
                      logger.debug(f"No se pudo tokenizar el texto generado para fallback: {e}")
 
@@ -184,9 +522,9 @@ def _llamar_al_llm(prompt_texto, max_tokens_salida, temperatura, descripcion_tar
         if final_tokens_prompt_stat == 0:
             if num_tokens_prompt_reales > 0:
                 final_tokens_prompt_stat = num_tokens_prompt_reales
-            elif llm_instance: 
+            elif prompt_texto:
                 try:
-                    final_tokens_prompt_stat = len(llm_instance.tokenize(prompt_texto.encode('utf-8', 'ignore')))
+                    final_tokens_prompt_stat = len(llm.tokenize(prompt_texto.encode('utf-8', 'ignore')))
                 except Exception:
                     pass 
 
@@ -196,13 +534,23 @@ def _llamar_al_llm(prompt_texto, max_tokens_salida, temperatura, descripcion_tar
         
         stats = {
             "tokens_prompt": final_tokens_prompt_stat,
+            "tokens_prompt_reutilizados": num_tokens_prompt_reutilizados,
+            "tokens_prompt_evaluados": max(0, final_tokens_prompt_stat - num_tokens_prompt_reutilizados),
             "tokens_generados": tokens_generados,
             "processing_time_seconds": processing_time,
-            "tokens_por_segundo": tokens_por_segundo
+            "tokens_por_segundo": tokens_por_segundo,
+            "n_ctx": espacio_contexto_total_llm,
+            **_estadisticas_borrador(llm, borrador_inicio, tokens_generados)
         }
 
         logger.info(f"LLM Task '{descripcion_tarea}' completada en {processing_time:.2f} seg.")
-        logger.info(f"  Stats: Prompt Tokens: {stats['tokens_prompt']}, Tokens Generados: {tokens_generados}, Tasa: {tokens_por_segundo:.2f} tokens/seg.")
+        texto_borrador = ""
+        if "tokens_borrador_propuestos" in stats:
+            texto_borrador = (f", Borrador: {stats['tokens_borrador_aceptados']}/{stats['tokens_borrador_propuestos']} "
+                              f"aceptados ({stats['tasa_aceptacion_borrador']:.0%})")
+        logger.info(f"  Stats: Prompt Tokens: {stats['tokens_prompt']} (Reutilizados: {stats['tokens_prompt_reutilizados']}, "
+                    f"Evaluados: {stats['tokens_prompt_evaluados']}), Tokens Generados: {tokens_generados}, "
+                    f"Tasa: {tokens_por_segundo:.2f} tokens/seg{texto_borrador}.")
         logger.info(f"  Finish Reason: {finish_reason}")
 
         if finish_reason == 'length':
@@ -227,75 +575,274 @@ def _llamar_al_llm(prompt_texto, max_tokens_salida, temperatura, descripcion_tar
         return None, f"exception_during_llm_call: {str(e)}", stats
 
 
-def generar_esquema_de_texto(texto_para_esquema, es_parcial=False, chunk_num=None, total_chunks=None):
+def _componentes_generacion(tipo_tarea, max_tokens_salida, temperatura, stop_sequences=None, gramatica=None):
+    """
+    Modelo de `tipo_tarea` y parámetros de generación que, junto con el prompt, determinan el
+    resultado (para la clave de caché).
+    """
+    componentes = {
+        "modelo": cache_resultados.huella_modelo_local(registro.ruta(tipo_tarea) if registro is not None else None),
+        "n_ctx": n_ctx_tarea(tipo_tarea),
+        "max_tokens": max_tokens_salida,
+        "temperatura": temperatura,
+        "stop": stop_sequences or [],
+        "seed": 42,
+    }
+    if gramatica:
+        # Solo si hay gramática: sin ella, las claves (y la caché ya guardada) no cambian.
+        componentes["gramatica"] = gramatica
+    return componentes
+
+def _gramatica_esquema():
+    """GBNF de las llamadas de esquema y fusión si config.LLM_GRAMATICA_ESQUEMA está activo (si no, None)."""
+    if not config.LLM_GRAMATICA_ESQUEMA:
+        return None
+    return gramaticas.gbnf_esquema(config.LLM_GRAMATICA_ESQUEMA_PROFUNDIDAD)
+
+def _stop_sequences_fusion(gramatica):
+    """Con gramática la salida ya termina con el esquema; sin ella, se corta el texto que suele seguirlo."""
+    if gramatica:
+        return None
+    return [
+        "\n\n--- FIN DE LA RESPUESTA ---",
+        "\n---", # Una secuencia más genérica por si acaso
+        "\nEste esquema maestro fusionado representa" # Otra parte del texto no deseado
+    ]
+
+def _con_cache(tarea, componentes, calcular, descripcion_tarea, emitir_token=None):
+    """
+    Devuelve el resultado cacheado para `componentes` o lo calcula con `calcular()` y lo guarda.
+    En un acierto con `emitir_token`, el texto completo se emite de una vez.
+    """
+    resultado = cache_resultados.obtener(tarea, componentes)
+    if resultado is not None:
+        logger.info(f"'{descripcion_tarea}': resultado obtenido de la caché ({len(resultado)} caracteres).")
+        if emitir_token is not None:
+            emitir_token(resultado)
+        return resultado
+    resultado = calcular()
+    cache_resultados.guardar(tarea, componentes, resultado)
+    return resultado
+
+
+def _componentes_cache_esquema_parcial(texto_chunk):
+    # La clave depende solo del contenido del mega-chunk, no de su posición ("chunk N de M"): al
+    # corregir una transcripción, los mega-chunks sin cambios reutilizan su esquema parcial aunque
+    # cambie su numeración o el total de chunks.
+    return {
+        "texto": texto_chunk,
+        "plantilla": prompts.PROMPT_GENERAR_ESQUEMA_PARCIAL_TEMPLATE,
+        **_componentes_generacion("esquema_parcial", config.MAX_TOKENS_ESQUEMA_PARCIAL, config.LLM_TEMPERATURE_ESQUEMA,
+                                  gramatica=_gramatica_esquema()),
+    }
+
+def esquema_parcial_en_cache(mega_chunk):
+    """Indica si el esquema parcial de este mega-chunk (str o DocumentoTokenizado) ya está en la caché de resultados."""
+    texto_chunk = mega_chunk.texto if isinstance(mega_chunk, documento_tokenizado.DocumentoTokenizado) else mega_chunk
+    return cache_resultados.contiene("esquema_parcial", _componentes_cache_esquema_parcial(texto_chunk))
+
+
+def generar_esquema_de_texto(texto_para_esquema, es_parcial=False, chunk_num=None, total_chunks=None, emitir_token=None):
+    """
+    Genera el esquema (completo o parcial de un mega-chunk). `texto_para_esquema` puede ser un str
+    o un DocumentoTokenizado: en ese caso el prompt se arma con sus tokens, sin re-tokenizar el texto
+    (el documento se tokeniza con el modelo de "esquema"; un parcial con otro GGUF re-tokeniza su texto).
+    """
+    documento = texto_para_esquema if isinstance(texto_para_esquema, documento_tokenizado.DocumentoTokenizado) else None
+    texto = documento.texto if documento is not None else texto_para_esquema
+    gramatica = _gramatica_esquema()
+    tipo_tarea = "esquema_parcial" if es_parcial else "esquema"
+    if documento is not None and es_parcial and not _mismo_tokenizador("esquema", "esquema_parcial"):
+        documento = None
 
     if es_parcial:
         num_str = str(chunk_num) if chunk_num is not None else "?"
         total_str = str(total_chunks) if total_chunks is not None else "?"
         descripcion_proceso_base = f"Esquema Parcial (Mega-Chunk {num_str}/{total_str})"
-        prompt_final_esquema = prompts.PROMPT_GENERAR_ESQUEMA_PARCIAL_TEMPLATE.format(
-            texto_fragmento=texto_para_esquema,
-            chunk_numero=chunk_num,
-            total_chunks=total_chunks
-        )
+        plantilla, campo_texto = prompts.PROMPT_GENERAR_ESQUEMA_PARCIAL_TEMPLATE, "texto_fragmento"
+        otros_campos = {"chunk_numero": chunk_num, "total_chunks": total_chunks}
         max_tokens_para_este_esquema = config.MAX_TOKENS_ESQUEMA_PARCIAL
+        componentes_cache = _componentes_cache_esquema_parcial(texto)
     else: 
-        prompt_final_esquema = prompts.PROMPT_GENERAR_ESQUEMA_TEMPLATE.format(
-            texto_completo=texto_para_esquema
-        )
+        plantilla, campo_texto = prompts.PROMPT_GENERAR_ESQUEMA_TEMPLATE, "texto_completo"
+        otros_campos = {}
         max_tokens_para_este_esquema = config.MAX_TOKENS_ESQUEMA_FUSIONADO
         descripcion_proceso_base = "Esquema Completo (Pase Único)"
+        componentes_cache = {
+            "texto": texto,
+            "plantilla": plantilla,
+            **_componentes_generacion("esquema", max_tokens_para_este_esquema, config.LLM_TEMPERATURE_ESQUEMA, gramatica=gramatica),
+        }
     
     logger.info(f"Iniciando Generación de {descripcion_proceso_base}")
-    
-    # Esta línea estaba duplicada y usaba el template incorrecto para el caso parcial.
-    # prompt_final_esquema = prompts.PROMPT_GENERAR_ESQUEMA_TEMPLATE.format(texto_completo=texto_para_esquema)
-    # max_tokens_para_este_esquema = config.MAX_TOKENS_ESQUEMA_PARCIAL if es_parcial else config.MAX_TOKENS_ESQUEMA_FUSIONADO
-    
-    esquema_generado, _, _ = _llamar_al_llm(
-        prompt_texto=prompt_final_esquema,
-        max_tokens_salida=max_tokens_para_este_esquema,
-        temperatura=config.LLM_TEMPERATURE_ESQUEMA,
-        descripcion_tarea=descripcion_proceso_base
-    )
-    return esquema_generado
 
-def fusionar_esquemas(lista_esquemas_parciales):
-    if not lista_esquemas_parciales:
-        logger.error("No hay esquemas parciales para fusionar.")
-        return None
-    if len(lista_esquemas_parciales) == 1:
-        logger.info("Solo hay un esquema parcial, devolviéndolo directamente (no se necesita fusión).")
-        return lista_esquemas_parciales[0]
+    def generar():
+        if documento is not None and registro is not None:
+            prompt_texto = None
+            with usar_tokenizador(tipo_tarea) as llm:
+                tokens_prompt = documento_tokenizado.construir_prompt(plantilla, campo_texto, documento, llm, **otros_campos)
+        else:
+            prompt_texto = plantilla.format(**{campo_texto: texto, **otros_campos})
+            tokens_prompt = None
+        esquema_generado, _, _ = _llamar_al_llm(
+            prompt_texto=prompt_texto,
+            max_tokens_salida=max_tokens_para_este_esquema,
+            temperatura=config.LLM_TEMPERATURE_ESQUEMA,
+            descripcion_tarea=descripcion_proceso_base,
+            emitir_token=emitir_token,
+            tokens_prompt=tokens_prompt,
+            tipo_tarea=tipo_tarea,
+            gramatica=gramatica
+        )
+        return esquema_generado
+
+    return _con_cache(
+        tipo_tarea,
+        componentes_cache,
+        generar,
+        descripcion_proceso_base,
+        emitir_token=emitir_token
+    )
 
-    logger.info("Iniciando Fusión de Esquemas Parciales")
-    
+def construir_prompt_fusion(lista_esquemas_parciales):
+    """Prompt de PROMPT_FUSIONAR_ESQUEMAS_TEMPLATE con los esquemas numerados en orden (también lo usa el camino de Gemini)."""
     texto_esquemas_concatenados = ""
     for i, esquema_p in enumerate(lista_esquemas_parciales):
         texto_esquemas_concatenados += f"--- ESQUEMA PARCIAL {i+1} ---\n{esquema_p}\n\n"
-    
-    prompt_final_fusion = prompts.PROMPT_FUSIONAR_ESQUEMAS_TEMPLATE.format(texto_esquemas_parciales=texto_esquemas_concatenados)
+    return prompts.PROMPT_FUSIONAR_ESQUEMAS_TEMPLATE.format(texto_esquemas_parciales=texto_esquemas_concatenados)
+
+def fusionar_grupo_de_esquemas(lista_esquemas_parciales, descripcion_tarea="Fusión de Esquemas", emitir_token=None):
+    """Fusiona una lista de esquemas con una sola llamada a PROMPT_FUSIONAR_ESQUEMAS_TEMPLATE."""
+    prompt_final_fusion = construir_prompt_fusion(lista_esquemas_parciales)
+    gramatica = _gramatica_esquema()
 
-    stop_sequences_fusion = [
-        "\n\n--- FIN DE LA RESPUESTA ---",
-        "\n---", # Una secuencia más genérica por si acaso
-        "\nEste esquema maestro fusionado representa" # Otra parte del texto no deseado
-    ]
-    
     esquema_fusionado, _, _ = _llamar_al_llm(
         prompt_texto=prompt_final_fusion,
         max_tokens_salida=config.MAX_TOKENS_ESQUEMA_FUSIONADO,
         temperatura=config.LLM_TEMPERATURE_FUSION,
-        descripcion_tarea="Fusión de Esquemas",
-        stop_sequences=stop_sequences_fusion
+        descripcion_tarea=descripcion_tarea,
+        stop_sequences=_stop_sequences_fusion(gramatica),
+        emitir_token=emitir_token,
+        tipo_tarea="fusion",
+        gramatica=gramatica
     )
     return esquema_fusionado
 
-def generar_apuntes_por_seccion(seccion_esquema_actual, transcripcion_completa, num_seccion=None, total_secciones=None):
+def _contar_tokens_texto(texto, tipo_tarea="fusion"):
+    try:
+        with usar_tokenizador(tipo_tarea) as llm:
+            return len(llm.tokenize(texto.encode('utf-8', 'ignore'), add_bos=False))
+    except Exception as e_tok:
+        logger.debug(f"No se pudo tokenizar texto para conteo: {e_tok}. Se estimará por palabras.")
+        return int(len(texto.split()) / 0.75)
+
+def _agrupar_esquemas_por_presupuesto(esquemas, tokens_por_esquema, presupuesto_tokens, fan_in):
+    """
+    Agrupa esquemas consecutivos (se conserva el orden cronológico) en grupos de como máximo
+    `fan_in` esquemas cuya suma de tokens no supere `presupuesto_tokens`.
+    Un esquema que por sí solo excede el presupuesto queda en un grupo propio.
+    """
+    grupos = []
+    grupo_actual, tokens_grupo_actual = [], 0
+    for esquema, tokens_esquema in zip(esquemas, tokens_por_esquema):
+        if grupo_actual and (len(grupo_actual) >= fan_in or tokens_grupo_actual + tokens_esquema > presupuesto_tokens):
+            grupos.append(grupo_actual)
+            grupo_actual, tokens_grupo_actual = [], 0
+        grupo_actual.append(esquema)
+        tokens_grupo_actual += tokens_esquema
+    if grupo_actual:
+        grupos.append(grupo_actual)
+    return grupos
+
+def _fusionar_nivel(grupos, nivel):
+    """Fusiona todos los grupos de un nivel del árbol (en paralelo si hay pool de réplicas)."""
+    from src import pool_replicas # Import diferido: pool_replicas importa este módulo en las réplicas
+
+    resultados = [grupo[0] if len(grupo) == 1 else None for grupo in grupos]
+    indices_a_fusionar = [i for i, grupo in enumerate(grupos) if len(grupo) > 1]
+    descripciones = {i: f"Fusión de Esquemas (nivel {nivel}, grupo {i+1}/{len(grupos)})" for i in indices_a_fusionar}
+
+    pool = pool_replicas.obtener_pool()
+    if pool is not None and len(indices_a_fusionar) > 1:
+        resultados_pool = pool.fusionar_grupos([grupos[i] for i in indices_a_fusionar], [descripciones[i] for i in indices_a_fusionar])
+        for i, resultado in zip(indices_a_fusionar, resultados_pool):
+            resultados[i] = resultado
+
+    for i in indices_a_fusionar:
+        if not resultados[i]:
+            resultados[i] = fusionar_grupo_de_esquemas(grupos[i], descripciones[i])
+        if not resultados[i]:
+            logger.warning(f"La fusión del grupo {i+1} (nivel {nivel}) falló. Se conservan sus esquemas concatenados.")
+            resultados[i] = "\n".join(grupos[i])
+    return resultados
+
+def fusionar_esquemas(lista_esquemas_parciales, emitir_token=None):
+    """
+    Fusiona los esquemas parciales en un esquema maestro. Si todos caben en un solo prompt de fusión
+    se hace una única llamada; si no, se fusionan por grupos acotados en tokens (como máximo
+    config.FUSION_FAN_IN esquemas por grupo) y se repite sobre los resultados hasta que queda uno.
+    `emitir_token` solo se usa en la fusión final (la que produce el esquema maestro).
+    """
+    if not lista_esquemas_parciales:
+        logger.error("No hay esquemas parciales para fusionar.")
+        return None
+    if len(lista_esquemas_parciales) == 1:
+        logger.info("Solo hay un esquema parcial, devolviéndolo directamente (no se necesita fusión).")
+        return lista_esquemas_parciales[0]
+
+    componentes_cache = {
+        "esquemas": list(lista_esquemas_parciales),
+        "plantilla": prompts.PROMPT_FUSIONAR_ESQUEMAS_TEMPLATE,
+        "fan_in": config.FUSION_FAN_IN,
+        **_componentes_generacion("fusion", config.MAX_TOKENS_ESQUEMA_FUSIONADO, config.LLM_TEMPERATURE_FUSION, gramatica=_gramatica_esquema()),
+    }
+    return _con_cache(
+        "fusion",
+        componentes_cache,
+        lambda: _fusionar_esquemas_en_arbol(lista_esquemas_parciales, emitir_token),
+        "Fusión de Esquemas",
+        emitir_token=emitir_token
+    )
+
+def _fusionar_esquemas_en_arbol(lista_esquemas_parciales, emitir_token=None):
+    logger.info("Iniciando Fusión de Esquemas Parciales")
+
+    margen_seguridad_tokens = 20
+    tokens_separador_por_esquema = 12 # "--- ESQUEMA PARCIAL N ---" y saltos de línea
+    tokens_prompt_base = _contar_tokens_texto(prompts.PROMPT_FUSIONAR_ESQUEMAS_TEMPLATE.replace("{texto_esquemas_parciales}", ""))
+    presupuesto_tokens = n_ctx_tarea("fusion") - tokens_prompt_base - config.MAX_TOKENS_ESQUEMA_FUSIONADO - margen_seguridad_tokens
+
+    esquemas_nivel = list(lista_esquemas_parciales)
+    tokens_nivel = [_contar_tokens_texto(e) + tokens_separador_por_esquema for e in esquemas_nivel]
+    if sum(tokens_nivel) <= presupuesto_tokens:
+        return fusionar_grupo_de_esquemas(esquemas_nivel, emitir_token=emitir_token)
+
+    logger.info(f"Los {len(esquemas_nivel)} esquemas parciales ({sum(tokens_nivel)} tokens) exceden el presupuesto de fusión "
+                f"({presupuesto_tokens} tokens). Se usará fusión jerárquica (fan-in: {config.FUSION_FAN_IN}).")
+    nivel = 1
+    while True:
+        grupos = _agrupar_esquemas_por_presupuesto(esquemas_nivel, tokens_nivel, presupuesto_tokens, config.FUSION_FAN_IN)
+        if len(grupos) == 1:
+            return fusionar_grupo_de_esquemas(grupos[0], "Fusión de Esquemas (final)", emitir_token=emitir_token)
+        if len(grupos) == len(esquemas_nivel):
+            logger.warning(f"Fusión jerárquica sin reducción posible en el nivel {nivel} ({len(grupos)} esquemas demasiado grandes). "
+                           "Se intentará una fusión final única; el resultado podría truncarse.")
+            return fusionar_grupo_de_esquemas(esquemas_nivel, "Fusión de Esquemas (final, sin reducción)", emitir_token=emitir_token)
+
+        logger.info(f"Fusión jerárquica nivel {nivel}: {len(esquemas_nivel)} esquemas -> {len(grupos)} grupos.")
+        with trazas.span("fusion.nivel", nivel=nivel, esquemas=len(esquemas_nivel), grupos=len(grupos)):
+            esquemas_nivel = _fusionar_nivel(grupos, nivel)
+        tokens_nivel = [_contar_tokens_texto(e) + tokens_separador_por_esquema for e in esquemas_nivel]
+        nivel += 1
+
+def generar_apuntes_por_seccion(seccion_esquema_actual, transcripcion_completa, num_seccion=None, total_secciones=None, contexto_apuntes=None, emitir_token=None):
     """
-    Genera apuntes para una sección específica del esquema, usando la transcripción completa como contexto.
+    Genera apuntes para una sección específica del esquema, usando la transcripción como contexto.
+    `contexto_apuntes` es el resultado de preparar_contexto_apuntes: con "prefijo_kv" la transcripción
+    ya está evaluada en el KV cache y solo se envía la sección; con "recuperacion" se envían solo
+    los pasajes relevantes. Sin él, se envía la transcripción completa.
     """
-    if llm_instance is None:
+    if registro is None:
         logger.critical("Modelo LLM no cargado. No se pueden generar apuntes para la sección.")
         return "" 
     if not seccion_esquema_actual or not seccion_esquema_actual.strip():
@@ -313,19 +860,36 @@ def generar_apuntes_por_seccion(seccion_esquema_actual, transcripcion_completa,
     descripcion_tarea = f"Apuntes para Sección {num_seccion or '?'}/{total_secciones or '?'} ('{titulo_seccion_log}')"
     logger.info(f"Iniciando generación de {descripcion_tarea}")
 
-    prompt_final_apuntes = prompts.PROMPT_GENERAR_APUNTES_POR_SECCION_TEMPLATE.format(
-        seccion_del_esquema_actual=seccion_esquema_actual,
-        contexto_relevante_de_transcripcion=transcripcion_completa # Pasando la transcripción completa
-    )
+    modo_contexto = contexto_apuntes["modo"] if contexto_apuntes else "completo"
+    prefijo_kv = contexto_apuntes["prefijo_kv"] if modo_contexto == "prefijo_kv" else None
 
-    # Advertencia sobre el tamaño del prompt (transcripción completa + sección del esquema + prompt template)
-    # Esto es solo una estimación muy burda porque tokenizar todo aquí sería costoso.
-    # El conteo real y la advertencia más precisa ocurrirán dentro de _llamar_al_llm.
-    len_prompt_aprox_palabras = len(prompt_final_apuntes.split())
-    if len_prompt_aprox_palabras * 0.7 > config.CONTEXT_SIZE : # Asumiendo ~0.7 tokens/palabra (muy conservador)
-         logger.warning(f"El prompt para '{descripcion_tarea}' (incluyendo transcripción completa) "
-                        f"es potencialmente MUY GRANDE (~{len_prompt_aprox_palabras} palabras). "
-                        "Podría exceder el límite de contexto.")
+    if prefijo_kv is not None:
+        # La transcripción ya está en el KV cache; solo se envía la parte específica de la sección.
+        prompt_final_apuntes = prompts.PROMPT_APUNTES_SUFIJO_SECCION_TEMPLATE.format(
+            seccion_del_esquema_actual=seccion_esquema_actual
+        )
+    elif modo_contexto == "recuperacion":
+        contexto_relevante = seleccionar_contexto_relevante(seccion_esquema_actual, contexto_apuntes["indice"])
+        if not contexto_relevante:
+            logger.warning(f"No se encontraron pasajes relevantes para '{descripcion_tarea}'.")
+        prompt_final_apuntes = prompts.PROMPT_GENERAR_APUNTES_POR_SECCION_TEMPLATE.format(
+            seccion_del_esquema_actual=seccion_esquema_actual,
+            contexto_relevante_de_transcripcion=contexto_relevante
+        )
+    else:
+        prompt_final_apuntes = prompts.PROMPT_GENERAR_APUNTES_POR_SECCION_TEMPLATE.format(
+            seccion_del_esquema_actual=seccion_esquema_actual,
+            contexto_relevante_de_transcripcion=transcripcion_completa # Pasando la transcripción completa
+        )
+
+        # Advertencia sobre el tamaño del prompt (transcripción completa + sección del esquema + prompt template)
+        # Esto es solo una estimación muy burda porque tokenizar todo aquí sería costoso.
+        # El conteo real y la advertencia más precisa ocurrirán dentro de _llamar_al_llm.
+        len_prompt_aprox_palabras = len(prompt_final_apuntes.split())
+        if len_prompt_aprox_palabras * 0.7 > n_ctx_tarea("apuntes_seccion"): # Asumiendo ~0.7 tokens/palabra (muy conservador)
+             logger.warning(f"El prompt para '{descripcion_tarea}' (incluyendo transcripción completa) "
+                            f"es potencialmente MUY GRANDE (~{len_prompt_aprox_palabras} palabras). "
+                            "Podría exceder el límite de contexto.")
 
     # Definir secuencias de parada para evitar texto no deseado al final de los apuntes de sección
     stop_sequences_apuntes = [
@@ -333,12 +897,31 @@ def generar_apuntes_por_seccion(seccion_esquema_actual, transcripcion_completa,
         "\n\n## " # Si empieza a generar la siguiente sección por error
     ]
 
-    apuntes_seccion, _, _ = _llamar_al_llm(
-        prompt_texto=prompt_final_apuntes,
-        max_tokens_salida=config.MAX_TOKENS_APUNTES_POR_SECCION,
-        temperatura=config.LLM_TEMPERATURE_APUNTES,
-        descripcion_tarea=descripcion_tarea,
-        stop_sequences=stop_sequences_apuntes
+    componentes_cache = {
+        "prompt": prompt_final_apuntes,
+        **_componentes_generacion("apuntes_seccion", config.MAX_TOKENS_APUNTES_POR_SECCION, config.LLM_TEMPERATURE_APUNTES,
+                                  stop_sequences_apuntes),
+    }
+    if prefijo_kv is not None:
+        # El prompt real es prefijo (transcripción) + sufijo de la sección.
+        componentes_cache["prefijo"] = prompts.PROMPT_APUNTES_PREFIJO_TRANSCRIPCION_TEMPLATE
+        componentes_cache["transcripcion"] = transcripcion_completa
+
+    apuntes_seccion = _con_cache(
+        "apuntes_seccion",
+        componentes_cache,
+        lambda: _llamar_al_llm(
+            prompt_texto=prompt_final_apuntes,
+            max_tokens_salida=config.MAX_TOKENS_APUNTES_POR_SECCION,
+            temperatura=config.LLM_TEMPERATURE_APUNTES,
+            descripcion_tarea=descripcion_tarea,
+            stop_sequences=stop_sequences_apuntes,
+            prefijo_kv=prefijo_kv,
+            emitir_token=emitir_token,
+            tipo_tarea="apuntes_seccion"
+        )[0],
+        descripcion_tarea,
+        emitir_token=emitir_token
     )
 
     return apuntes_seccion if apuntes_seccion else ""
\ No newline at end of file
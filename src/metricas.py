@@ -0,0 +1,200 @@
+# src/metricas.py
+# Métricas del servicio en formato de exposición de texto de Prometheus (GET /metrics).
+# Implementación mínima (contadores, medidores e histogramas con etiquetas) para no añadir dependencias.
+# Las métricas son del proceso actual: las réplicas del pool no se agregan aquí.
+import math
+import threading
+
+_registro = []
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _formatear_etiquetas(nombres, valores, extra=None):
+    pares = list(zip(nombres, valores)) + (list(extra.items()) if extra else [])
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{nombre}="{_escapar(valor)}"' for nombre, valor in pares) + "}"
+
+
+def _formatear_numero(valor):
+    if math.isinf(valor):
+        return "+Inf" if valor > 0 else "-Inf"
+    return repr(float(valor)) if not float(valor).is_integer() else str(int(valor))
+
+
+class _Metrica:
+    tipo = None
+
+    def __init__(self, nombre, descripcion, etiquetas=()):
+        self.nombre = nombre
+        self.descripcion = descripcion
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}
+        self._lock = threading.Lock()
+        _registro.append(self)
+
+    def _clave(self, etiquetas):
+        if set(etiquetas) != set(self.etiquetas):
+            raise ValueError(f"La métrica '{self.nombre}' requiere las etiquetas {self.etiquetas}, se recibieron {tuple(etiquetas)}.")
+        return tuple(str(etiquetas[nombre]) for nombre in self.etiquetas)
+
+    def _lineas_muestras(self):
+        raise NotImplementedError
+
+    def exponer(self):
+        lineas = [f"# HELP {self.nombre} {self.descripcion}", f"# TYPE {self.nombre} {self.tipo}"]
+        lineas.extend(self._lineas_muestras())
+        return "\n".join(lineas)
+
+
+class Contador(_Metrica):
+    tipo = "counter"
+
+    def inc(self, valor=1, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + valor
+
+    def total(self):
+        """Suma de todas las series (p. ej. para que el benchmark mida lo ocurrido entre dos lecturas)."""
+        with self._lock:
+            return sum(self._valores.values())
+
+    def _lineas_muestras(self):
+        with self._lock:
+            valores = sorted(self._valores.items())
+        return [f"{self.nombre}{_formatear_etiquetas(self.etiquetas, clave)} {_formatear_numero(v)}" for clave, v in valores]
+
+
+class Medidor(_Metrica):
+    """Valor instantáneo. Con `funcion` (sin etiquetas) se lee en el momento de exponer."""
+    tipo = "gauge"
+
+    def __init__(self, nombre, descripcion, etiquetas=(), funcion=None):
+        super().__init__(nombre, descripcion, etiquetas)
+        self.funcion = funcion
+
+    def establecer(self, valor, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._valores[clave] = valor
+
+    def establecer_funcion(self, funcion):
+        self.funcion = funcion
+
+    def _lineas_muestras(self):
+        if self.funcion is not None:
+            try:
+                return [f"{self.nombre} {_formatear_numero(self.funcion())}"]
+            except Exception:
+                return []
+        with self._lock:
+            valores = sorted(self._valores.items())
+        return [f"{self.nombre}{_formatear_etiquetas(self.etiquetas, clave)} {_formatear_numero(v)}" for clave, v in valores]
+
+
+class Histograma(_Metrica):
+    tipo = "histogram"
+
+    def __init__(self, nombre, descripcion, etiquetas=(), limites=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600)):
+        super().__init__(nombre, descripcion, etiquetas)
+        self.limites = tuple(sorted(limites)) + (math.inf,)
+
+    def observar(self, valor, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            cubetas, suma, cuenta = self._valores.get(clave, ([0] * len(self.limites), 0.0, 0))
+            for i, limite in enumerate(self.limites):
+                if valor <= limite:
+                    cubetas[i] += 1
+                    break
+            self._valores[clave] = (cubetas, suma + valor, cuenta + 1)
+
+    def _lineas_muestras(self):
+        with self._lock:
+            valores = sorted((clave, (list(c), s, n)) for clave, (c, s, n) in self._valores.items())
+        lineas = []
+        for clave, (cubetas, suma, cuenta) in valores:
+            acumulado = 0
+            for limite, en_cubeta in zip(self.limites, cubetas):
+                acumulado += en_cubeta
+                etiquetas = _formatear_etiquetas(self.etiquetas, clave, {"le": _formatear_numero(limite)})
+                lineas.append(f"{self.nombre}_bucket{etiquetas} {acumulado}")
+            etiquetas = _formatear_etiquetas(self.etiquetas, clave)
+            lineas.append(f"{self.nombre}_sum{etiquetas} {_formatear_numero(suma)}")
+            lineas.append(f"{self.nombre}_count{etiquetas} {cuenta}")
+        return lineas
+
+
+def exponer():
+    """Todas las métricas registradas en formato de texto de Prometheus (versión 0.0.4)."""
+    return "\n".join(metrica.exponer() for metrica in _registro) + "\n"
+
+
+# --- Métricas del servicio ---
+
+LLM_TAREAS = Contador(
+    "apuntes_llm_tareas_total", "Llamadas de generación por tipo de tarea.", ("tarea",))
+LLM_FINISH_REASON = Contador(
+    "apuntes_llm_finish_reason_total", "Motivo de finalización de la generación (length = truncada por max_tokens).",
+    ("tarea", "razon"))
+LLM_TOKENS_PROMPT = Contador(
+    "apuntes_llm_tokens_prompt_total", "Tokens de prompt enviados al modelo.", ("tarea",))
+LLM_TOKENS_PROMPT_REUTILIZADOS = Contador(
+    "apuntes_llm_tokens_prompt_reutilizados_total", "Tokens de prompt reutilizados desde el KV cache.", ("tarea",))
+LLM_TOKENS_GENERADOS = Contador(
+    "apuntes_llm_tokens_generados_total", "Tokens generados por el modelo.", ("tarea",))
+LLM_DURACION = Histograma(
+    "apuntes_llm_duracion_segundos", "Duración de cada llamada de generación.", ("tarea",))
+LLM_TOKENS_POR_SEGUNDO = Histograma(
+    "apuntes_llm_tokens_por_segundo", "Velocidad de generación de cada llamada.", ("tarea",),
+    limites=(1, 2, 5, 10, 20, 50, 100, 200))
+LLM_TOKENS_BORRADOR_PROPUESTOS = Contador(
+    "apuntes_llm_tokens_borrador_propuestos_total", "Tokens propuestos por el borrador (decodificación especulativa).", ("tarea",))
+LLM_TOKENS_BORRADOR_ACEPTADOS = Contador(
+    "apuntes_llm_tokens_borrador_aceptados_total", "Tokens del borrador aceptados por el modelo (decodificación especulativa).", ("tarea",))
+LLM_MODELOS_CARGAS = Contador(
+    "apuntes_llm_modelos_cargas_total", "Cargas de modelos del registro (bajo demanda).", ("modelo",))
+LLM_MODELOS_DESCARGAS = Contador(
+    "apuntes_llm_modelos_descargas_total", "Modelos descargados para respetar el presupuesto de memoria (LRU).", ("modelo",))
+LLM_MODELOS_MEMORIA = Medidor(
+    "apuntes_llm_modelos_memoria_bytes", "Memoria estimada (pesos + KV cache) de los modelos cargados.")
+GEMINI_REINTENTOS = Contador(
+    "apuntes_gemini_reintentos_total", "Reintentos de llamadas a Gemini por error transitorio (código HTTP o tipo de error).",
+    ("tarea", "motivo"))
+MODELO_OCUPADO = Contador(
+    "apuntes_modelo_ocupado_segundos_total", "Tiempo acumulado con el modelo local generando (este proceso).")
+TRABAJOS_EN_COLA = Medidor(
+    "apuntes_trabajos_en_cola", "Trabajos esperando al hilo trabajador.")
+TRABAJOS_INGESTA_EN_COLA = Medidor(
+    "apuntes_trabajos_ingesta_en_cola", "Ingestas del índice vectorial esperando a su hilo trabajador.")
+TRABAJOS_FINALIZADOS = Contador(
+    "apuntes_trabajos_finalizados_total", "Trabajos finalizados por tipo y estado.", ("tipo", "estado"))
+HTTP_PETICIONES = Contador(
+    "apuntes_http_peticiones_total", "Peticiones HTTP por endpoint, método y código de estado.",
+    ("endpoint", "metodo", "codigo"))
+HTTP_LATENCIA = Histograma(
+    "apuntes_http_latencia_segundos", "Latencia de las peticiones HTTP por endpoint (hasta enviar la cabecera).",
+    ("endpoint", "metodo"))
+
+
+def registrar_llamada_llm(tarea, finish_reason, stats):
+    """Registra las estadísticas que devuelve una llamada de generación (local o Gemini)."""
+    LLM_TAREAS.inc(tarea=tarea)
+    # Sin el detalle de los errores ("exception_during_llm_call: ...") para acotar la cardinalidad.
+    LLM_FINISH_REASON.inc(tarea=tarea, razon=str(finish_reason or "desconocido").split(":")[0])
+    if not stats:
+        return
+    LLM_TOKENS_PROMPT.inc(stats.get("tokens_prompt") or 0, tarea=tarea)
+    LLM_TOKENS_PROMPT_REUTILIZADOS.inc(stats.get("tokens_prompt_reutilizados") or 0, tarea=tarea)
+    LLM_TOKENS_GENERADOS.inc(stats.get("tokens_generados") or 0, tarea=tarea)
+    if stats.get("processing_time_seconds"):
+        LLM_DURACION.observar(stats["processing_time_seconds"], tarea=tarea)
+    if stats.get("tokens_por_segundo"):
+        LLM_TOKENS_POR_SEGUNDO.observar(stats["tokens_por_segundo"], tarea=tarea)
+    if "tokens_borrador_propuestos" in stats:
+        LLM_TOKENS_BORRADOR_PROPUESTOS.inc(stats["tokens_borrador_propuestos"], tarea=tarea)
+        LLM_TOKENS_BORRADOR_ACEPTADOS.inc(stats["tokens_borrador_aceptados"], tarea=tarea)
@@ -0,0 +1,209 @@
+# src/pipeline.py
+# Orquestación de alto nivel (esquema completo y apuntes completos) compartida por la CLI y la API.
+import re
+import logging
+from src import config
+from src import utils
+from src import llm_processing
+from src import prompts
+from src import pool_replicas
+from src import documento_tokenizado
+from src import trazas
+
+logger = logging.getLogger(__name__)
+
+
+class ErrorGeneracion(Exception):
+    """Fallo no recuperable de una fase del pipeline (el mensaje es apto para mostrarse al usuario)."""
+
+
+def _reportar(reportar_progreso, fase, actual=None, total=None):
+    if reportar_progreso is not None:
+        try:
+            reportar_progreso(fase, actual, total)
+        except Exception as e:
+            logger.warning(f"Error al reportar progreso de la fase '{fase}': {e}")
+
+
+def generar_esquema_completo(texto_completo_transcripcion, reportar_progreso=None, emitir_token=None):
+    """
+    Genera el esquema jerárquico de una transcripción: en un solo pase si cabe en el contexto,
+    o con mega-chunking (esquemas parciales + fusión) si no.
+    `reportar_progreso(fase, actual, total)` se invoca al inicio de cada fase/mega-chunk.
+    `emitir_token(texto)` recibe en stream los tokens del esquema final (pase único o fusión final).
+    """
+    if llm_processing.registro is None:
+        raise ErrorGeneracion("Modelo LLM no cargado.")
+
+    _reportar(reportar_progreso, "Análisis de tokens")
+    with utils.timed_phase("Análisis de Tokens para Generación de Esquema") as span_analisis:
+        try:
+            # Única tokenización de la transcripción (con el modelo del esquema): sus tokens se reutilizan en
+            # los mega-chunks y prompts.
+            with llm_processing.usar_tokenizador("esquema") as llm:
+                documento = documento_tokenizado.DocumentoTokenizado.desde_texto(texto_completo_transcripcion, llm)
+                num_tokens_prompt_base = documento_tokenizado.contar_tokens_plantilla(
+                    prompts.PROMPT_GENERAR_ESQUEMA_TEMPLATE, "texto_completo", llm
+                )
+            num_tokens_contenido_transcripcion = documento.num_tokens
+        except Exception as e:
+            logger.critical(f"Error CRÍTICO al tokenizar para el esquema: {e}", exc_info=True)
+            raise ErrorGeneracion(f"Error al tokenizar la transcripción: {e}")
+        logger.info(f"Tokens para esquema: Base={num_tokens_prompt_base}, Contenido={num_tokens_contenido_transcripcion}")
+        span_analisis.establecer(tokens_base=num_tokens_prompt_base, tokens_contenido=num_tokens_contenido_transcripcion)
+
+    # Cada presupuesto con el contexto del modelo que hará esa llamada (ver config.MODELOS_POR_TAREA).
+    tokens_salida_pase_unico = config.MAX_TOKENS_ESQUEMA_FUSIONADO
+    max_tokens_para_contenido_en_pase_unico = int(
+        (llm_processing.n_ctx_tarea("esquema") * config.MEGA_CHUNK_CONTEXT_FACTOR) - num_tokens_prompt_base - tokens_salida_pase_unico
+    )
+    max_tokens_para_contenido_en_mega_chunk_individual = int(
+         (llm_processing.n_ctx_tarea("esquema_parcial") * config.MEGA_CHUNK_CONTEXT_FACTOR) - num_tokens_prompt_base - config.MAX_TOKENS_ESQUEMA_PARCIAL
+    )
+
+    if max_tokens_para_contenido_en_pase_unico <= 0 or max_tokens_para_contenido_en_mega_chunk_individual <= 0:
+        logger.critical(f"Cálculo de tokens para contenido de esquema resultó no positivo. "
+                        f"Pase único: {max_tokens_para_contenido_en_pase_unico}, "
+                        f"Chunk: {max_tokens_para_contenido_en_mega_chunk_individual}.")
+        raise ErrorGeneracion("Cálculo de tokens para contenido de esquema resultó no positivo.")
+
+    if num_tokens_contenido_transcripcion <= max_tokens_para_contenido_en_pase_unico:
+        logger.info(f"La transcripción ({num_tokens_contenido_transcripcion} tokens) cabe en un solo pase para esquema.")
+        _reportar(reportar_progreso, "Esquema en un solo pase", 1, 1)
+        esquema_final_texto = llm_processing.generar_esquema_de_texto(documento, es_parcial=False, emitir_token=emitir_token)
+    else:
+        logger.info(f"La transcripción ({num_tokens_contenido_transcripcion} tokens) excede límite para pase único de esquema. "
+                    f"Se usará mega-chunking (límite por chunk: {max_tokens_para_contenido_en_mega_chunk_individual} tokens).")
+        _reportar(reportar_progreso, "División en mega-chunks")
+        # Solo se calculan los rangos de tokens; los textos de los chunks se materializan de a uno al recorrerlos.
+        with trazas.span("esquema.division_mega_chunks", tokens=num_tokens_contenido_transcripcion) as span_division:
+            rangos_mega_chunks = list(utils.calcular_rangos_mega_chunks(
+                documento,
+                max_tokens_para_contenido_en_mega_chunk_individual,
+                config.MEGA_CHUNK_OVERLAP_TOKENS
+            ))
+            span_division.establecer(mega_chunks=len(rangos_mega_chunks))
+        if not rangos_mega_chunks:
+            raise ErrorGeneracion("No se generaron mega-chunks.")
+        total_chunks = len(rangos_mega_chunks)
+
+        def iterar_mega_chunks():
+            return utils.dividir_en_mega_chunks(
+                documento,
+                max_tokens_para_contenido_en_mega_chunk_individual,
+                config.MEGA_CHUNK_OVERLAP_TOKENS,
+                rangos=rangos_mega_chunks
+            )
+
+        logger.info(f"Transcripción dividida en {total_chunks} mega-chunks para esquemas parciales.")
+
+        resultados_pool = {}
+        pool = pool_replicas.obtener_pool()
+        if pool is not None and total_chunks > 1:
+            # Reprocesamiento incremental: los mega-chunks cuyo texto no cambió (p. ej. al volver a subir
+            # una transcripción corregida) ya tienen su esquema parcial en la caché y no se envían a las réplicas.
+            pendientes = [(i, c) for i, c in enumerate(iterar_mega_chunks()) if not llm_processing.esquema_parcial_en_cache(c)]
+            if len(pendientes) < total_chunks:
+                logger.info(f"{total_chunks - len(pendientes)}/{total_chunks} mega-chunks sin cambios "
+                            f"(esquema parcial en caché). Se generarán {len(pendientes)}.")
+            if len(pendientes) > 1:
+                logger.info(f"Generando {len(pendientes)} esquemas parciales en paralelo con {pool.num_replicas} réplicas.")
+                resultados_pendientes = pool.generar_esquemas_parciales(
+                    [c for _, c in pendientes], reportar_progreso=reportar_progreso,
+                    numeros_chunk=[i + 1 for i, _ in pendientes], total_chunks=total_chunks
+                )
+                for (i, _), resultado in zip(pendientes, resultados_pendientes):
+                    if resultado:
+                        resultados_pool[i] = resultado
+                    else:
+                        logger.warning(f"La réplica no devolvió esquema para el mega-chunk {i+1}. Reintentando con el modelo local.")
+            del pendientes
+
+        esquemas_parciales = []
+        for i, mega_chunk in enumerate(iterar_mega_chunks()):
+            if i in resultados_pool:
+                esquemas_parciales.append(resultados_pool[i])
+                continue
+            _reportar(reportar_progreso, "Esquemas parciales", i + 1, total_chunks)
+            logger.info(f"  Procesando mega-chunk {i+1}/{total_chunks} ({len(mega_chunk.texto.split())} palabras, {mega_chunk.num_tokens} tokens).")
+            with trazas.span("esquema.mega_chunk", chunk=i + 1, total_chunks=total_chunks, tokens=mega_chunk.num_tokens):
+                esquema_parcial = llm_processing.generar_esquema_de_texto(
+                    mega_chunk, es_parcial=True, chunk_num=i + 1, total_chunks=total_chunks
+                )
+            if esquema_parcial:
+                esquemas_parciales.append(esquema_parcial)
+            else:
+                logger.warning(f"El esquema parcial para el mega-chunk {i+1} fue vacío o nulo.")
+
+        if not esquemas_parciales:
+            raise ErrorGeneracion("No se generaron esquemas parciales.")
+
+        logger.info(f"Se generaron {len(esquemas_parciales)} esquemas parciales. Fusionando...")
+        _reportar(reportar_progreso, "Fusión de esquemas", 1, 1)
+        esquema_final_texto = llm_processing.fusionar_esquemas(esquemas_parciales, emitir_token=emitir_token)
+
+    if not esquema_final_texto or not esquema_final_texto.strip():
+        raise ErrorGeneracion("Fallo en la generación del esquema final.")
+    return esquema_final_texto
+
+
+def dividir_esquema_en_secciones(esquema_texto):
+    """Divide el esquema en sus secciones de nivel 1 (líneas que comienzan con 'N. ')."""
+    secciones_del_esquema = re.split(r"\n(?=\d+\.\s)", esquema_texto.strip())
+    return [s.strip() for s in secciones_del_esquema if s.strip()]
+
+
+def generar_apuntes_completos(esquema_texto, texto_completo_transcripcion, titulo_guia, reportar_progreso=None, emitir_token=None):
+    """
+    Genera los apuntes en Markdown de todas las secciones del esquema.
+    Devuelve el documento completo encabezado por `titulo_guia`.
+    `emitir_token(texto)` recibe en stream los tokens de cada sección a medida que se generan.
+    """
+    if llm_processing.registro is None:
+        raise ErrorGeneracion("Modelo LLM no cargado.")
+    if not esquema_texto or not esquema_texto.strip():
+        raise ErrorGeneracion("El esquema no puede estar vacío.")
+
+    logger.info("Dividiendo el esquema maestro en secciones para generar apuntes.")
+    secciones_del_esquema = dividir_esquema_en_secciones(esquema_texto)
+
+    _reportar(reportar_progreso, "Preparación del contexto de apuntes")
+    # Contexto común a todas las secciones (prefijo KV o índice de recuperación), preparado una sola vez.
+    with trazas.span("apuntes.preparar_contexto"):
+        contexto_apuntes = llm_processing.preparar_contexto_apuntes(texto_completo_transcripcion)
+
+    apuntes_completos_md_list = []
+    if emitir_token is not None:
+        emitir_token(f"# {titulo_guia}\n\n")
+    if not secciones_del_esquema:
+        logger.warning("No se pudieron identificar secciones principales numeradas en el esquema para apuntes. "
+                       "Se generarán apuntes para el esquema completo como una sola sección.")
+        _reportar(reportar_progreso, "Apuntes por sección", 1, 1)
+        apuntes_para_seccion_unica = llm_processing.generar_apuntes_por_seccion(
+            esquema_texto, texto_completo_transcripcion, 1, 1, contexto_apuntes=contexto_apuntes,
+            emitir_token=emitir_token
+        )
+        if apuntes_para_seccion_unica:
+            apuntes_completos_md_list.append(apuntes_para_seccion_unica.strip())
+    else:
+        logger.info(f"Esquema dividido en {len(secciones_del_esquema)} secciones para apuntes.")
+        for i, seccion_esq_texto in enumerate(secciones_del_esquema):
+            _reportar(reportar_progreso, "Apuntes por sección", i + 1, len(secciones_del_esquema))
+            logger.info(f"  Procesando apuntes para Sección {i+1}/{len(secciones_del_esquema)} del esquema.")
+            if emitir_token is not None and apuntes_completos_md_list:
+                emitir_token("\n\n")
+            with trazas.span("apuntes.seccion", seccion=i + 1, total_secciones=len(secciones_del_esquema)):
+                apuntes_para_esta_seccion = llm_processing.generar_apuntes_por_seccion(
+                    seccion_esq_texto, texto_completo_transcripcion, i + 1, len(secciones_del_esquema),
+                    contexto_apuntes=contexto_apuntes,
+                    emitir_token=emitir_token
+                )
+            if apuntes_para_esta_seccion:
+                apuntes_completos_md_list.append(apuntes_para_esta_seccion.strip())
+            else:
+                titulo_seccion_err = seccion_esq_texto.splitlines()[0] if seccion_esq_texto.splitlines() else f"Sección vacía {i+1}"
+                logger.warning(f"No se generaron apuntes para la sección del esquema: '{titulo_seccion_err}'")
+
+    if not apuntes_completos_md_list:
+        raise ErrorGeneracion("No se pudo generar contenido para los apuntes.")
+    return f"# {titulo_guia}\n\n" + "\n\n".join(apuntes_completos_md_list)
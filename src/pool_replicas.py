@@ -0,0 +1,156 @@
+# src/pool_replicas.py
+# Pool opcional de procesos réplica del modelo para generar esquemas parciales (y grupos de la
+# fusión jerárquica) en paralelo.
+# Cada réplica carga el mismo GGUF con mmap (las páginas de los pesos se comparten entre procesos)
+# y usa su propio número de hilos, fijada a un bloque de núcleos distinto cuando es posible.
+import os
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from src import config
+
+logger = logging.getLogger(__name__)
+
+_pool = None # Pool global del proceso principal (None si está desactivado)
+
+
+def _inicializar_replica(contador_replicas, n_threads, use_cpu_only, fijar_cpus):
+    """Se ejecuta una vez en cada proceso réplica: fija CPUs y carga el modelo."""
+    from src import llm_processing
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)-5s] %(processName)-18s %(name)-20s: %(message)s"
+    )
+    with contador_replicas.get_lock():
+        indice_replica = contador_replicas.value
+        contador_replicas.value += 1
+
+    if fijar_cpus and hasattr(os, "sched_setaffinity"):
+        cpus_disponibles = sorted(os.sched_getaffinity(0))
+        inicio = (indice_replica * n_threads) % len(cpus_disponibles)
+        cpus_replica = {cpus_disponibles[(inicio + i) % len(cpus_disponibles)] for i in range(n_threads)}
+        try:
+            os.sched_setaffinity(0, cpus_replica)
+            logger.info(f"Réplica {indice_replica} fijada a CPUs {sorted(cpus_replica)}.")
+        except OSError as e:
+            logger.warning(f"No se pudo fijar la afinidad de CPU de la réplica {indice_replica}: {e}")
+
+    if llm_processing.cargar_modelo_llm(use_cpu_only=use_cpu_only, n_threads=n_threads) is None:
+        # Sin modelo la réplica no sirve; se propaga para que el pool quede marcado como roto.
+        raise RuntimeError(f"La réplica {indice_replica} no pudo cargar el modelo LLM.")
+
+
+def _generar_esquema_parcial_en_replica(texto_chunk, chunk_num, total_chunks):
+    from src import llm_processing
+    return llm_processing.generar_esquema_de_texto(
+        texto_chunk, es_parcial=True, chunk_num=chunk_num, total_chunks=total_chunks
+    )
+
+
+def _fusionar_grupo_en_replica(esquemas_grupo, descripcion_tarea):
+    from src import llm_processing
+    return llm_processing.fusionar_grupo_de_esquemas(esquemas_grupo, descripcion_tarea)
+
+
+class PoolReplicas:
+    def __init__(self, num_replicas, n_threads_por_replica, use_cpu_only=False):
+        self.num_replicas = num_replicas
+        self.n_threads_por_replica = n_threads_por_replica
+        # "spawn": el proceso principal ya tiene hilos (uvicorn, trabajador) y su propio modelo cargado.
+        contexto_mp = multiprocessing.get_context("spawn")
+        self._executor = ProcessPoolExecutor(
+            max_workers=num_replicas,
+            mp_context=contexto_mp,
+            initializer=_inicializar_replica,
+            initargs=(contexto_mp.Value("i", 0), n_threads_por_replica, use_cpu_only, config.POOL_REPLICAS_FIJAR_CPUS),
+        )
+
+    def _ejecutar_en_orden(self, funcion, lista_args, descripcion, reportar_progreso=None):
+        """
+        Envía `funcion(*args)` a las réplicas para cada elemento de `lista_args` y devuelve los
+        resultados en el mismo orden (None para las tareas que fallaron).
+        Si el pool se rompe (p. ej. una réplica no pudo cargar el modelo), se descarta y todas las
+        tareas pendientes devuelven None: quien llama las repite con el modelo del proceso principal.
+        """
+        total = len(lista_args)
+        resultados = [None] * total
+        try:
+            futuros = {self._executor.submit(funcion, *args): i for i, args in enumerate(lista_args)}
+        except BrokenProcessPool as e:
+            self._descartar(e)
+            return resultados
+        completados = 0
+        roto = None
+        for futuro in as_completed(futuros):
+            i = futuros[futuro]
+            completados += 1
+            try:
+                resultados[i] = futuro.result()
+            except BrokenProcessPool as e:
+                roto = e
+            except Exception as e:
+                logger.error(f"La réplica falló en '{descripcion}' (tarea {i+1}/{total}): {e}", exc_info=True)
+            logger.info(f"'{descripcion}': tarea {i+1}/{total} recibida ({completados}/{total} completadas).")
+            if reportar_progreso is not None:
+                reportar_progreso(descripcion, completados, total)
+        if roto is not None:
+            self._descartar(roto)
+        return resultados
+
+    def _descartar(self, error):
+        logger.error(f"El pool de réplicas está roto ({error}). Se cierra; las tareas se harán con el modelo local.")
+        if _pool is self:
+            cerrar_pool()
+        else:
+            self.cerrar()
+
+    def generar_esquemas_parciales(self, mega_chunks, reportar_progreso=None, numeros_chunk=None, total_chunks=None):
+        """
+        Genera los esquemas parciales de todos los mega-chunks en paralelo.
+        Devuelve la lista de resultados en el mismo orden que `mega_chunks` (None si un chunk falló).
+        `numeros_chunk`/`total_chunks` indican la posición real de cada chunk cuando solo se envía
+        un subconjunto (p. ej. los que no estaban en la caché).
+        """
+        numeros_chunk = numeros_chunk or list(range(1, len(mega_chunks) + 1))
+        total_chunks = total_chunks or len(mega_chunks)
+        return self._ejecutar_en_orden(
+            _generar_esquema_parcial_en_replica,
+            [(texto_chunk, num, total_chunks) for texto_chunk, num in zip(mega_chunks, numeros_chunk)],
+            "Esquemas parciales",
+            reportar_progreso=reportar_progreso
+        )
+
+    def fusionar_grupos(self, grupos, descripciones):
+        """Fusiona en paralelo los grupos de un mismo nivel de la fusión jerárquica."""
+        return self._ejecutar_en_orden(
+            _fusionar_grupo_en_replica,
+            list(zip(grupos, descripciones)),
+            "Fusión jerárquica"
+        )
+
+    def cerrar(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+def iniciar_pool(use_cpu_only=False):
+    """Crea el pool global si config.POOL_REPLICAS_NUM > 0. Las réplicas cargan el modelo al recibir su primera tarea."""
+    global _pool
+    if _pool is not None or config.POOL_REPLICAS_NUM <= 0:
+        return _pool
+    logger.info(f"Iniciando pool de {config.POOL_REPLICAS_NUM} réplicas del modelo "
+                f"({config.POOL_REPLICAS_N_THREADS} hilos c/u, mmap={config.LLM_USE_MMAP}).")
+    _pool = PoolReplicas(config.POOL_REPLICAS_NUM, config.POOL_REPLICAS_N_THREADS, use_cpu_only=use_cpu_only)
+    return _pool
+
+
+def obtener_pool():
+    return _pool
+
+
+def cerrar_pool():
+    global _pool
+    if _pool is not None:
+        _pool.cerrar()
+        _pool = None
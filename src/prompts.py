@@ -130,6 +130,56 @@ Generar apuntes completos, claros y pedagógicos para la "SECCIÓN DEL ESQUEMA A
 --- INICIO DE APUNTES PARA LA SECCIÓN DEL ESQUEMA ---
 """
 
+# Variante de PROMPT_GENERAR_APUNTES_POR_SECCION_TEMPLATE dividida en prefijo + sufijo.
+# El prefijo (instrucciones + transcripción) es idéntico para todas las secciones, así que
+# se evalúa una sola vez en el LLM y su estado KV se reutiliza; solo el sufijo cambia por sección.
+PROMPT_APUNTES_PREFIJO_TRANSCRIPCION_TEMPLATE = """Eres un asistente experto en redacción académica y creación de material de estudio detallado.
+Tu tarea es generar apuntes EN ESPAÑOL de clase en formato Markdown para UNA SECCIÓN ESPECÍFICA del esquema de una clase, utilizando la transcripción completa como referencia principal.
+La sección a desarrollar se indica DESPUÉS de la transcripción.
+
+--- OBJETIVO ---
+Generar apuntes completos, claros y pedagógicos para la "SECCIÓN DEL ESQUEMA A DESARROLLAR", basados exclusivamente en el contenido del "CONTEXTO DE LA TRANSCRIPCIÓN COMPLETA".
+
+--- INSTRUCCIONES ---
+1.  Seguir la estructura del esquema:
+    - Tomar la "SECCIÓN DEL ESQUEMA A DESARROLLAR" como guía de estructura.
+    - Usar el primer ítem como encabezado Markdown principal (`#`).
+    - Desarrollar subpuntos con encabezados (`##`, `###`, etc) o listas con viñetas, según corresponda.
+
+2.  Elaborar contenido desde la transcripción:
+    - Buscar la información correspondiente para cada punto en el contexto de transcripción.
+    - Sintetizar y desarrollar explicaciones claras. Definir conceptos, explicar procesos, incluir ejemplos.
+    - No copiar ni parafrasear literalmente.
+
+3.  Manejar la falta de información:
+    - Si no hay información clara para un punto, indicarlo así:
+      `(No se encontró información detallada en la transcripción proporcionada para este punto específico del esquema).`
+    - No inventar ni completar con contenido genérico.
+
+4.  Formatear en Markdown:
+    - Usar `#`, `##`, `###`, etc para jerarquía.
+    - Usar `-` o `*` para listas clave.
+    - Resaltar términos importantes con **negrita** dentro de párrafos.
+    - Usar bloques de código para ejemplos técnicos.
+
+5.  Control de la salida:
+    - La salida debe contener únicamente los apuntes de la sección.
+    - No incluir preámbulos, explicaciones adicionales ni conclusiones.
+    - Comenzar directamente con el primer encabezado Markdown (`# ...`)
+
+--- CONTEXTO DE LA TRANSCRIPCIÓN COMPLETA (para referencia) ---
+{contexto_relevante_de_transcripcion}
+--- FIN DEL CONTEXTO DE LA TRANSCRIPCIÓN ---
+"""
+
+PROMPT_APUNTES_SUFIJO_SECCION_TEMPLATE = """
+--- SECCIÓN DEL ESQUEMA A DESARROLLAR ---
+{seccion_del_esquema_actual}
+--- FIN DE LA SECCIÓN ---
+
+--- INICIO DE APUNTES PARA LA SECCIÓN DEL ESQUEMA ---
+"""
+
 PROMPT_GEMINI_APUNTES_DESDE_ESQUEMA_Y_TRANSCRIPCION = """\
 Generar apuntes detallados en formato Markdown basados en el siguiente esquema y transcripción.
 Si se proporciona "Información Adicional de la Base de Datos Vectorial", intégrala de forma natural en los apuntes donde sea relevante, y asegúrate de citar la fuente usando la "Cita" proporcionada para cada fragmento de información adicional. Por ejemplo: "(Fuente: <Cita aquí>)".
@@ -0,0 +1,268 @@
+# src/registro_modelos.py
+# Registro de los modelos locales declarados en config.MODELOS_LLM. Cada tipo de tarea usa el modelo
+# que le asigna config.MODELOS_POR_TAREA (p. ej. una cuantización pequeña y rápida para los esquemas
+# parciales y una mayor para los apuntes), con su propio n_ctx, n_threads y n_batch.
+# Cada modelo se abre con contextos de varios tamaños (config.LLM_CONTEXTOS, hasta su n_ctx) sobre los
+# mismos pesos mapeados con mmap, y cada llamada usa el más pequeño en el que caben prompt + max_tokens:
+# un texto corto no reserva ni recorre un KV cache de n_ctx tokens.
+# Los contextos se abren (y calientan) la primera vez que se necesitan y siguen abiertos mientras quepan
+# en config.MODELOS_PRESUPUESTO_MEMORIA_MB y en los límites por modelo (config.LLM_CONTEXTOS_MAX_TOKENS_POR_MODELO,
+# config.LLM_CONTEXTOS_MAX_POR_MODELO); para abrir uno que
+# no cabe se cierran los usados hace más tiempo (LRU), nunca uno que esté generando en ese momento.
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from src import config
+from src import metricas
+from src import backends_llm
+from src import documento_tokenizado
+
+logger = logging.getLogger(__name__)
+
+
+def calentar_modelo(backend):
+    """
+    Genera config.LLM_CALENTAMIENTO_TOKENS tokens con un prompt corto: la primera evaluación recorre
+    todas las capas, así que los fallos de página del mmap y las reservas del contexto se pagan aquí
+    y no en la primera petición real. El KV cache se vacía después.
+    """
+    if not config.LLM_CALENTAMIENTO_TOKENS:
+        return
+    inicio = time.time()
+    backend.completar(config.LLM_PROMPT_CALENTAMIENTO, max_tokens=config.LLM_CALENTAMIENTO_TOKENS, temperature=0.0, seed=42)
+    backend.reset()
+    logger.info(f"Modelo calentado en {time.time() - inicio:.2f} segundos.")
+
+
+class RegistroModelos:
+    """
+    Contextos de los modelos abiertos bajo demanda, en orden LRU y por clave (modelo, n_ctx).
+    `usar(tarea, tokens_necesarios)` entrega el backend del contexto más pequeño del modelo de la tarea
+    en el que caben `tokens_necesarios` (abriéndolo si hace falta) y lo protege del cierre mientras
+    dure el bloque; `tokenizador(tarea)` entrega cualquier contexto ya abierto del modelo.
+    Un contexto de llama.cpp no admite llamadas concurrentes y su KV cache es estado compartido (p. ej. el
+    prefijo de apuntes restaurado justo antes de generar): cada contexto tiene un lock que `usar` retiene
+    durante todo el bloque, así que los endpoints en stream, el trabajador y cualquier otro hilo generan de
+    a uno por contexto (el mismo hilo puede anidar bloques). Los bloques de `tokenizador` no lo toman: solo deben
+    tokenizar y detokenizar, que usan el vocabulario y no el KV cache.
+    `n_threads` sobrescribe el de todos los modelos (lo usan las réplicas de pool_replicas).
+    """
+
+    def __init__(self, modelos=None, modelos_por_tarea=None, modelo_por_defecto=None, presupuesto_bytes=None,
+                 nombre_backend=None, use_cpu_only=False, n_threads=None, contextos=None, max_contextos_por_modelo=None,
+                 max_tokens_contextos_por_modelo=None):
+        self.modelos = config.MODELOS_LLM if modelos is None else modelos
+        self.modelos_por_tarea = config.MODELOS_POR_TAREA if modelos_por_tarea is None else modelos_por_tarea
+        self.modelo_por_defecto = modelo_por_defecto or config.MODELO_POR_DEFECTO
+        self.presupuesto_bytes = (
+            config.MODELOS_PRESUPUESTO_MEMORIA_MB * 1024 * 1024 if presupuesto_bytes is None else presupuesto_bytes
+        )
+        self.nombre_backend = nombre_backend or config.LLM_BACKEND
+        self.use_cpu_only = use_cpu_only
+        self.n_threads = n_threads
+        self.contextos = config.LLM_CONTEXTOS if contextos is None else contextos
+        self.max_contextos_por_modelo = (
+            config.LLM_CONTEXTOS_MAX_POR_MODELO if max_contextos_por_modelo is None else max_contextos_por_modelo
+        ) # 0 = sin límite
+        self.max_tokens_contextos_por_modelo = (
+            config.LLM_CONTEXTOS_MAX_TOKENS_POR_MODELO if max_tokens_contextos_por_modelo is None else max_tokens_contextos_por_modelo
+        ) # Suma de los n_ctx abiertos de cada modelo; 0 = sin límite
+        for nombre in [self.modelo_por_defecto, *self.modelos_por_tarea.values()]:
+            if nombre not in self.modelos:
+                raise ValueError(f"Modelo '{nombre}' no declarado en config.MODELOS_LLM. Declarados: {sorted(self.modelos)}")
+        self._cargados = OrderedDict() # (nombre, n_ctx) -> backend, del usado hace más tiempo al más reciente
+        self._memoria = {} # (nombre, n_ctx) -> bytes estimados del contexto sin los pesos (KV cache)
+        self._pesos = {} # (nombre, n_ctx) -> bytes de los pesos (compartidos por los contextos del mismo GGUF)
+        self._en_uso = {} # (nombre, n_ctx) -> bloques `usar` abiertos (no se cierra mientras sea > 0)
+        self._locks_generacion = {} # (nombre, n_ctx) -> RLock retenido por el bloque `usar` que genera en ese contexto
+        # Una carga retiene el lock: las demás tareas esperan a que termine (las cargas son raras y cada
+        # contexto genera de uno en uno de todos modos).
+        self._lock = threading.RLock()
+
+    def nombre_modelo(self, tarea):
+        return self.modelos_por_tarea.get(tarea, self.modelo_por_defecto)
+
+    def declaracion(self, nombre):
+        """Parámetros del modelo `nombre` con los valores por defecto de config resueltos."""
+        declaracion = self.modelos[nombre]
+
+        def valor(clave, por_defecto):
+            return declaracion[clave] if declaracion.get(clave) is not None else por_defecto
+
+        n_ctx = valor("n_ctx", config.CONTEXT_SIZE)
+        return {
+            "ruta": valor("ruta", os.path.join(config.BASE_PROJECT_DIR, "models", valor("archivo", config.MODEL_FILENAME))),
+            "n_ctx": n_ctx,
+            # Tamaños de contexto disponibles, de menor a mayor; el último siempre es n_ctx.
+            "contextos": sorted({c for c in valor("contextos", self.contextos) if c < n_ctx} | {n_ctx}),
+            "n_threads": self.n_threads if self.n_threads is not None else valor("n_threads", config.N_THREADS),
+            "n_batch": valor("n_batch", config.N_BATCH_LLAMA),
+            "n_gpu_layers": 0 if self.use_cpu_only else valor("n_gpu_layers", config.N_GPU_LAYERS),
+        }
+
+    def ruta(self, tarea):
+        return self.declaracion(self.nombre_modelo(tarea))["ruta"]
+
+    def n_ctx(self, tarea):
+        """Contexto más grande del modelo de `tarea` (el límite de los prompts que puede procesar)."""
+        return self.declaracion(self.nombre_modelo(tarea))["n_ctx"]
+
+    def contexto_para(self, tarea, tokens_necesarios=None):
+        """Tamaño de contexto más pequeño en el que caben `tokens_necesarios` (sin ellos, o si no cabe en ninguno, n_ctx)."""
+        contextos = self.declaracion(self.nombre_modelo(tarea))["contextos"]
+        if tokens_necesarios is None:
+            return contextos[-1]
+        return next((c for c in contextos if c >= tokens_necesarios), contextos[-1])
+
+    @contextmanager
+    def _reservar(self, clave, exclusivo=False):
+        with self._lock:
+            backend = self._cargados.get(clave) or self._cargar(*clave)
+            self._cargados.move_to_end(clave)
+            self._en_uso[clave] = self._en_uso.get(clave, 0) + 1
+            lock_generacion = self._locks_generacion.setdefault(clave, threading.RLock())
+        try:
+            if exclusivo:
+                # Fuera de self._lock: esperar a otro hilo que genera en este contexto no frena a los demás.
+                with lock_generacion:
+                    yield backend
+            else:
+                yield backend
+        finally:
+            with self._lock:
+                self._en_uso[clave] -= 1
+
+    def usar(self, tarea, tokens_necesarios=None):
+        """
+        Backend del contexto más pequeño del modelo de `tarea` en el que caben `tokens_necesarios`
+        (prompt + salida; sin ellos, el de n_ctx), abierto si hace falta; no se cierra hasta salir del bloque
+        y ningún otro hilo lo usa mientras tanto.
+        """
+        return self._reservar((self.nombre_modelo(tarea), self.contexto_para(tarea, tokens_necesarios)), exclusivo=True)
+
+    def tokenizador(self, tarea):
+        """
+        Backend de cualquier contexto ya abierto del modelo de `tarea` (el usado más recientemente), o
+        del más pequeño si no hay ninguno: basta para tokenizar y contar tokens. Sin exclusividad (otro
+        hilo puede estar generando en él): no se debe generar ni tocar su KV cache.
+        """
+        nombre = self.nombre_modelo(tarea)
+        with self._lock:
+            abiertos = [clave for clave in self._cargados if clave[0] == nombre]
+            clave = abiertos[-1] if abiertos else (nombre, self.declaracion(nombre)["contextos"][0])
+            return self._reservar(clave)
+
+    def cargar(self, nombre, n_ctx=None):
+        """Abre (y calienta) el contexto `n_ctx` del modelo `nombre` (por defecto, el más pequeño). Devuelve su backend."""
+        n_ctx = n_ctx or self.declaracion(nombre)["contextos"][0]
+        with self._lock:
+            if (nombre, n_ctx) in self._cargados:
+                return self._cargados[(nombre, n_ctx)]
+            return self._cargar(nombre, n_ctx)
+
+    def _cargar(self, nombre, n_ctx):
+        clave = (nombre, n_ctx)
+        declaracion = self.declaracion(nombre)
+        opciones = {"n_ctx": n_ctx}
+        pesos = 0
+        if self.nombre_backend == backends_llm.BackendLlamaCpp.nombre:
+            opciones.update(ruta_modelo=declaracion["ruta"], n_batch=declaracion["n_batch"])
+            if os.path.exists(declaracion["ruta"]):
+                pesos = os.path.getsize(declaracion["ruta"])
+            logger.info(f"Cargando modelo '{nombre}' desde: {declaracion['ruta']} (n_ctx={n_ctx}, "
+                        f"n_threads={declaracion['n_threads']}, n_batch={declaracion['n_batch']}).")
+        else:
+            logger.info(f"Cargando modelo '{nombre}' (n_ctx={n_ctx}) con el backend LLM '{self.nombre_backend}'.")
+        self._liberar_contextos(nombre, n_ctx)
+        pesos_compartidos = any(c[0] == nombre for c in self._cargados) # Los pesos ya están mapeados
+        self._liberar_memoria(0 if pesos_compartidos else pesos) # Solo los pesos: el KV cache se suma al cargar
+
+        inicio = time.time()
+        backend = backends_llm.crear_backend(self.nombre_backend, **opciones).cargar(
+            n_threads=declaracion["n_threads"], n_gpu_layers=declaracion["n_gpu_layers"]
+        )
+        try:
+            calentar_modelo(backend)
+        except Exception:
+            backend.liberar()
+            raise
+        self._cargados[clave] = backend
+        self._pesos[clave] = pesos
+        self._memoria[clave] = max(0, backend.memoria_estimada_bytes() - pesos)
+        metricas.LLM_MODELOS_CARGAS.inc(modelo=nombre)
+        logger.info(f"Modelo '{nombre}' (n_ctx={n_ctx}) cargado en {time.time() - inicio:.2f} segundos "
+                    f"(~{(pesos + self._memoria[clave]) / 2**20:.0f} MB; {len(self._cargados)} contexto(s) abierto(s)).")
+        # La estimación real (con el KV cache) puede superar la prevista: se ajusta cerrando otros.
+        self._liberar_memoria(0, conservar=clave)
+        metricas.LLM_MODELOS_MEMORIA.establecer(self.memoria_bytes())
+        return backend
+
+    def _liberar_contextos(self, nombre, n_ctx):
+        """Cierra contextos de `nombre` en orden LRU hasta que abrir uno de `n_ctx` respete los límites por modelo."""
+        for clave in [c for c in self._cargados if c[0] == nombre]:
+            abiertos = [c for c in self._cargados if c[0] == nombre]
+            excede_numero = self.max_contextos_por_modelo and len(abiertos) + 1 > self.max_contextos_por_modelo
+            excede_tokens = (self.max_tokens_contextos_por_modelo
+                             and sum(c[1] for c in abiertos) + n_ctx > self.max_tokens_contextos_por_modelo)
+            if not (excede_numero or excede_tokens):
+                return
+            self.descargar(*clave) # No cierra un contexto en uso
+
+    def memoria_bytes(self):
+        """Memoria estimada de los contextos abiertos: KV cache de cada uno y pesos de cada modelo una sola vez."""
+        with self._lock:
+            pesos = {clave[0]: self._pesos[clave] for clave in self._cargados}
+            return sum(self._memoria.values()) + sum(pesos.values())
+
+    def _liberar_memoria(self, bytes_necesarios, conservar=None):
+        """Cierra contextos en orden LRU hasta que los abiertos más `bytes_necesarios` quepan en el presupuesto."""
+        if not self.presupuesto_bytes:
+            return
+        for clave in list(self._cargados):
+            if self.memoria_bytes() + bytes_necesarios <= self.presupuesto_bytes:
+                return
+            if clave != conservar and not self._en_uso.get(clave):
+                self.descargar(*clave)
+        total = self.memoria_bytes() + bytes_necesarios
+        if total > self.presupuesto_bytes:
+            logger.warning(f"Los modelos en uso necesitan ~{total / 2**20:.0f} MB y el presupuesto es de "
+                           f"{self.presupuesto_bytes / 2**20:.0f} MB (config.MODELOS_PRESUPUESTO_MEMORIA_MB). Se continúa.")
+
+    def descargar(self, nombre, n_ctx=None):
+        """
+        Cierra el contexto `n_ctx` del modelo `nombre` (sin `n_ctx`, todos los suyos) salvo los que se
+        estén usando. Devuelve si se cerró alguno.
+        """
+        with self._lock:
+            claves = [c for c in self._cargados if c[0] == nombre and n_ctx in (None, c[1]) and not self._en_uso.get(c)]
+            for clave in claves:
+                backend = self._cargados.pop(clave)
+                self._pesos.pop(clave, None)
+                self._locks_generacion.pop(clave, None) # Nadie lo retiene ni lo espera: el contexto no está en uso
+                memoria = self._memoria.pop(clave, 0)
+                backend.liberar()
+                metricas.LLM_MODELOS_DESCARGAS.inc(modelo=nombre)
+                logger.info(f"Modelo '{nombre}' (n_ctx={clave[1]}) descargado (~{memoria / 2**20:.0f} MB de KV cache liberados"
+                            f"{'' if any(c[0] == nombre for c in self._cargados) else ', y sus pesos'}).")
+            if claves:
+                # Los tokens de las plantillas se cachean por tokenizador: se olvidan para no retener el modelo.
+                documento_tokenizado.limpiar_cache_plantillas()
+                metricas.LLM_MODELOS_MEMORIA.establecer(self.memoria_bytes())
+            return bool(claves)
+
+    def cargados(self):
+        """Contextos abiertos, del usado hace más tiempo al más reciente (para /health/ready)."""
+        with self._lock:
+            return [
+                {"nombre": nombre, "n_ctx": n_ctx, "memoria_mb": round((self._pesos[(nombre, n_ctx)] + self._memoria[(nombre, n_ctx)]) / 2**20),
+                 "en_uso": self._en_uso.get((nombre, n_ctx), 0)}
+                for nombre, n_ctx in self._cargados
+            ]
+
+    def cerrar(self):
+        with self._lock:
+            for nombre in {clave[0] for clave in self._cargados}:
+                self.descargar(nombre)
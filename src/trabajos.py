@@ -0,0 +1,228 @@
+# src/trabajos.py
+# Subsistema de trabajos en segundo plano: la API encola la generación y responde de inmediato,
+# un único hilo trabajador (dueño del modelo LLM) ejecuta los pipelines uno por uno. Los trabajos que no
+# usan el modelo (la ingesta del índice vectorial) tienen su propio gestor, con su cola y su hilo.
+import os
+import json
+import time
+import uuid
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from src import config
+from src import metricas
+from src import trazas
+
+logger = logging.getLogger(__name__)
+
+ESTADO_EN_COLA = "en_cola"
+ESTADO_EN_PROCESO = "en_proceso"
+ESTADO_COMPLETADO = "completado"
+ESTADO_FALLIDO = "fallido"
+ESTADOS_FINALES = (ESTADO_COMPLETADO, ESTADO_FALLIDO)
+
+
+class AlmacenTrabajos:
+    """
+    Almacén en disco de trabajos: un directorio por trabajo con `trabajo.json` (metadatos,
+    estado y progreso) y un archivo por cada entrada de texto, para poder reanudarlos tras un reinicio.
+    """
+
+    def __init__(self, directorio):
+        self.directorio = directorio
+        self._lock = threading.Lock()
+        os.makedirs(self.directorio, exist_ok=True)
+
+    def _ruta_trabajo(self, id_trabajo):
+        return os.path.join(self.directorio, id_trabajo, "trabajo.json")
+
+    def _ruta_entrada(self, id_trabajo, nombre_entrada):
+        return os.path.join(self.directorio, id_trabajo, f"entrada_{nombre_entrada}.txt")
+
+    def _escribir(self, trabajo):
+        ruta = self._ruta_trabajo(trabajo["id"])
+        ruta_temporal = ruta + ".tmp"
+        with open(ruta_temporal, "w", encoding="utf-8") as f:
+            json.dump(trabajo, f, ensure_ascii=False, indent=2)
+        os.replace(ruta_temporal, ruta) # Escritura atómica: nunca queda un trabajo.json a medias
+
+    def crear(self, tipo, entradas, nombre_base, id_correlacion=None):
+        id_trabajo = uuid.uuid4().hex
+        os.makedirs(os.path.join(self.directorio, id_trabajo), exist_ok=True)
+        for nombre_entrada, contenido in entradas.items():
+            with open(self._ruta_entrada(id_trabajo, nombre_entrada), "w", encoding="utf-8") as f:
+                f.write(contenido)
+        trabajo = {
+            "id": id_trabajo,
+            "tipo": tipo,
+            "nombre_base": nombre_base,
+            "id_correlacion": id_correlacion,
+            "entradas": sorted(entradas.keys()),
+            "estado": ESTADO_EN_COLA,
+            "progreso": None,
+            "archivo_resultado": None,
+            "error": None,
+            "creado": time.time(),
+            "iniciado": None,
+            "finalizado": None,
+        }
+        with self._lock:
+            self._escribir(trabajo)
+        return trabajo
+
+    def obtener(self, id_trabajo):
+        try:
+            with open(self._ruta_trabajo(id_trabajo), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"No se pudo leer el trabajo '{id_trabajo}': {e}", exc_info=True)
+            return None
+
+    def leer_entradas(self, trabajo):
+        entradas = {}
+        for nombre_entrada in trabajo["entradas"]:
+            with open(self._ruta_entrada(trabajo["id"], nombre_entrada), "r", encoding="utf-8") as f:
+                entradas[nombre_entrada] = f.read()
+        return entradas
+
+    def actualizar(self, id_trabajo, **campos):
+        with self._lock:
+            trabajo = self.obtener(id_trabajo)
+            if trabajo is None:
+                logger.warning(f"Se intentó actualizar un trabajo inexistente: {id_trabajo}")
+                return None
+            trabajo.update(campos)
+            self._escribir(trabajo)
+            return trabajo
+
+    def listar_no_finalizados(self):
+        """Trabajos en cola o interrumpidos a mitad de proceso, ordenados por fecha de creación."""
+        trabajos = []
+        for id_trabajo in os.listdir(self.directorio):
+            trabajo = self.obtener(id_trabajo)
+            if trabajo and trabajo["estado"] not in ESTADOS_FINALES:
+                trabajos.append(trabajo)
+        return sorted(trabajos, key=lambda t: t["creado"])
+
+
+class GestorTrabajos:
+    """
+    Cola de trabajos atendida por un único hilo trabajador. `ejecutores` mapea cada tipo de trabajo
+    a una función `ejecutor(trabajo, entradas, reportar_progreso, emitir_token) -> nombre_archivo_resultado`
+    (`emitir_token` es None salvo que alguien esté escuchando el trabajo en stream).
+    Varios gestores pueden compartir un almacén: cada uno reanuda y ejecuta solo los tipos de sus `ejecutores`.
+    """
+
+    def __init__(self, almacen, ejecutores, nombre_hilo="trabajador-llm"):
+        self.almacen = almacen
+        self.ejecutores = ejecutores
+        self.nombre_hilo = nombre_hilo
+        self._cola = queue.Queue()
+        self._futuros = {}
+        self._oyentes = {}
+        self._futuros_lock = threading.Lock()
+        self._hilo = None
+
+    def iniciar(self):
+        if self._hilo is not None:
+            return
+        # Reanudar los trabajos que quedaron pendientes o interrumpidos en una ejecución anterior.
+        for trabajo in self.almacen.listar_no_finalizados():
+            if trabajo["tipo"] not in self.ejecutores:
+                continue # De otro gestor
+            logger.info(f"Reanudando trabajo pendiente '{trabajo['id']}' ({trabajo['tipo']}, estado previo: {trabajo['estado']}).")
+            self.almacen.actualizar(trabajo["id"], estado=ESTADO_EN_COLA, progreso=None)
+            self._cola.put(trabajo["id"])
+        self._hilo = threading.Thread(target=self._bucle_trabajador, name=self.nombre_hilo, daemon=True)
+        self._hilo.start()
+        logger.info(f"Hilo trabajador '{self.nombre_hilo}' iniciado.")
+
+    def encolar(self, tipo, entradas, nombre_base, oyente=None, id_correlacion=None):
+        """
+        Crea y encola un trabajo. Devuelve (trabajo, futuro): el futuro se resuelve con el
+        trabajo final, para quien quiera esperar el resultado.
+        `oyente(evento)`, si se pasa, recibe desde el hilo trabajador los eventos de progreso
+        ({"tipo": "progreso", ...}) y los tokens generados ({"tipo": "token", "texto": ...}).
+        `id_correlacion` (por defecto, el de la petición en curso) enlaza la traza del trabajo con la de la petición.
+        """
+        if tipo not in self.ejecutores:
+            raise ValueError(f"Tipo de trabajo desconocido: {tipo}")
+        trabajo = self.almacen.crear(tipo, entradas, nombre_base, id_correlacion or trazas.id_correlacion_actual())
+        futuro = Future()
+        with self._futuros_lock:
+            self._futuros[trabajo["id"]] = futuro
+            if oyente is not None:
+                self._oyentes[trabajo["id"]] = oyente
+        self._cola.put(trabajo["id"])
+        logger.info(f"Trabajo '{trabajo['id']}' ({tipo}) encolado. Trabajos en cola: {self.tamano_cola()}.")
+        return trabajo, futuro
+
+    def tamano_cola(self):
+        return self._cola.qsize()
+
+    def _bucle_trabajador(self):
+        while True:
+            id_trabajo = self._cola.get()
+            try:
+                self._ejecutar(id_trabajo)
+            except Exception as e:
+                logger.error(f"Error inesperado en el hilo trabajador con el trabajo '{id_trabajo}': {e}", exc_info=True)
+            finally:
+                self._cola.task_done()
+
+    def _ejecutar(self, id_trabajo):
+        trabajo = self.almacen.obtener(id_trabajo)
+        if trabajo is None:
+            logger.error(f"Trabajo '{id_trabajo}' no encontrado en el almacén. Se descarta.")
+            return
+
+        with self._futuros_lock:
+            oyente = self._oyentes.pop(id_trabajo, None)
+
+        def reportar_progreso(fase, actual=None, total=None):
+            descripcion = f"{fase} {actual}/{total}" if actual is not None and total is not None else fase
+            progreso = {"fase": fase, "actual": actual, "total": total, "descripcion": descripcion}
+            self.almacen.actualizar(id_trabajo, progreso=progreso)
+            if oyente is not None:
+                oyente({"tipo": "progreso", **progreso})
+
+        emitir_token = None
+        if oyente is not None:
+            def emitir_token(texto):
+                oyente({"tipo": "token", "texto": texto})
+
+        logger.info(f"Iniciando trabajo '{id_trabajo}' ({trabajo['tipo']}).")
+        self.almacen.actualizar(id_trabajo, estado=ESTADO_EN_PROCESO, iniciado=time.time())
+        try:
+            entradas = self.almacen.leer_entradas(trabajo)
+            # El trabajo se traza aparte de la petición que lo encoló (que ya respondió), con su mismo id de correlación.
+            with trazas.traza(f"trabajo_{trabajo['tipo']}", id_correlacion=trabajo.get("id_correlacion") or id_trabajo):
+                archivo_resultado = self.ejecutores[trabajo["tipo"]](trabajo, entradas, reportar_progreso, emitir_token)
+            resultado = {"estado": ESTADO_COMPLETADO, "archivo_resultado": archivo_resultado}
+            logger.info(f"Trabajo '{id_trabajo}' completado: {archivo_resultado}")
+        except Exception as e:
+            logger.error(f"Trabajo '{id_trabajo}' fallido: {e}", exc_info=True)
+            resultado = {"estado": ESTADO_FALLIDO, "error": str(e)}
+
+        try:
+            trabajo_final = self.almacen.actualizar(id_trabajo, finalizado=time.time(), **resultado)
+        except Exception as e:
+            logger.error(f"No se pudo escribir el estado final del trabajo '{id_trabajo}': {e}", exc_info=True)
+            trabajo_final = None
+        if trabajo_final is None:
+            # trabajo.json ilegible o borrado: quien espera el futuro recibe un trabajo fallido, nunca None.
+            trabajo_final = {**trabajo, "estado": ESTADO_FALLIDO,
+                             "error": resultado.get("error") or "No se pudo guardar el estado final del trabajo."}
+
+        metricas.TRABAJOS_FINALIZADOS.inc(tipo=trabajo_final["tipo"], estado=trabajo_final["estado"])
+        with self._futuros_lock:
+            futuro = self._futuros.pop(id_trabajo, None)
+        if futuro is not None:
+            futuro.set_result(trabajo_final)
+
+
+def crear_gestor(ejecutores, nombre_hilo="trabajador-llm", almacen=None):
+    return GestorTrabajos(AlmacenTrabajos(config.TRABAJOS_DIR) if almacen is None else almacen, ejecutores, nombre_hilo)
@@ -0,0 +1,177 @@
+# src/trazas.py
+# Trazas por petición/ejecución: spans anidados con atributos (tokens, chunk, etc.) e id de correlación.
+# Cada traza finalizada se escribe como JSON de "trace events" de Chrome (abrir con chrome://tracing
+# o https://ui.perfetto.dev) en config.TRAZAS_DIR.
+import os
+import re
+import json
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from src import config
+
+logger = logging.getLogger(__name__)
+
+_traza_actual = contextvars.ContextVar("traza_actual", default=None)
+# Id de correlación de la petición en curso (existe aunque las trazas estén desactivadas).
+_id_correlacion = contextvars.ContextVar("id_correlacion", default=None)
+_CARACTERES_NO_VALIDOS_ID = re.compile(r"[^A-Za-z0-9_-]")
+LONGITUD_MAX_ID_CORRELACION = 64
+
+
+def normalizar_id_correlacion(valor):
+    """
+    Id de correlación apto como componente de un nombre de archivo (viene del cliente en X-Request-ID):
+    solo [A-Za-z0-9_-] (el resto se cambia por "_") y como mucho LONGITUD_MAX_ID_CORRELACION caracteres.
+    None si no se pasa ninguno.
+    """
+    if not valor:
+        return None
+    return _CARACTERES_NO_VALIDOS_ID.sub("_", str(valor)[:LONGITUD_MAX_ID_CORRELACION])
+
+
+def _ahora_us():
+    return time.perf_counter_ns() // 1000
+
+
+class Span:
+    def __init__(self, nombre, atributos=None, inicio_us=None):
+        self.nombre = nombre
+        self.atributos = dict(atributos or {})
+        self.inicio_us = inicio_us if inicio_us is not None else _ahora_us()
+        self.fin_us = None
+        self.hilo = threading.get_ident()
+
+    def establecer(self, **atributos):
+        """Añade o actualiza atributos del span (p. ej. conteos de tokens conocidos al final)."""
+        self.atributos.update(atributos)
+
+
+class Traza:
+    def __init__(self, nombre, id_correlacion=None):
+        self.nombre = nombre
+        self.id_correlacion = normalizar_id_correlacion(id_correlacion) or uuid.uuid4().hex
+        self.inicio_epoch = time.time()
+        self._spans = []
+        self._lock = threading.Lock()
+
+    def agregar(self, span):
+        with self._lock:
+            self._spans.append(span)
+
+    def registrar_span(self, nombre, inicio_perf_s, fin_perf_s, **atributos):
+        """Añade un span ya terminado a partir de marcas de time.perf_counter()."""
+        span_nuevo = Span(nombre, atributos=atributos, inicio_us=int(inicio_perf_s * 1_000_000))
+        span_nuevo.fin_us = int(fin_perf_s * 1_000_000)
+        self.agregar(span_nuevo)
+
+    def a_chrome_trace(self):
+        """Eventos completos ("ph": "X") con tiempos en microsegundos."""
+        with self._lock:
+            spans = list(self._spans)
+        pid = os.getpid()
+        eventos = [{
+            "name": span.nombre,
+            "cat": span.nombre.split(".")[0],
+            "ph": "X",
+            "ts": span.inicio_us,
+            "dur": max(0, (span.fin_us or span.inicio_us) - span.inicio_us),
+            "pid": pid,
+            "tid": span.hilo,
+            "args": {**span.atributos, "id_correlacion": self.id_correlacion},
+        } for span in spans]
+        return {
+            "traceEvents": eventos,
+            "displayTimeUnit": "ms",
+            "otherData": {"traza": self.nombre, "id_correlacion": self.id_correlacion, "inicio": self.inicio_epoch},
+        }
+
+    def guardar(self, directorio):
+        os.makedirs(directorio, exist_ok=True)
+        marca_tiempo = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.inicio_epoch))
+        ruta = os.path.join(directorio, f"{marca_tiempo}_{self.nombre}_{self.id_correlacion}.json")
+        with open(ruta, "w", encoding="utf-8") as f:
+            json.dump(self.a_chrome_trace(), f, ensure_ascii=False)
+        return ruta
+
+
+def iniciar_traza(nombre, id_correlacion=None):
+    """
+    Abre una traza en el contexto actual (lo heredan las tareas asyncio creadas después) y devuelve
+    (traza, token), o (None, None) si las trazas están desactivadas. Cerrar con finalizar_traza.
+    """
+    if not config.TRAZAS_ACTIVADAS:
+        return None, None
+    traza_nueva = Traza(nombre, id_correlacion or id_correlacion_actual())
+    return traza_nueva, _traza_actual.set(traza_nueva)
+
+
+def finalizar_traza(traza_a_guardar, token=None):
+    """Desvincula la traza del contexto (si se pasa su token) y la escribe en config.TRAZAS_DIR."""
+    if token is not None:
+        _traza_actual.reset(token)
+    if traza_a_guardar is None:
+        return
+    try:
+        ruta = traza_a_guardar.guardar(config.TRAZAS_DIR)
+        logger.info(f"Traza '{traza_a_guardar.nombre}' ({traza_a_guardar.id_correlacion}) guardada en: {ruta}")
+    except Exception as e:
+        logger.warning(f"No se pudo guardar la traza '{traza_a_guardar.nombre}': {e}")
+
+
+@contextmanager
+def traza(nombre, id_correlacion=None):
+    """Traza para lo que se ejecute dentro del bloque (con un span raíz `nombre`), escrita al salir."""
+    traza_nueva, token = iniciar_traza(nombre, id_correlacion)
+    try:
+        with span(nombre):
+            yield traza_nueva
+    finally:
+        finalizar_traza(traza_nueva, token)
+
+
+@contextmanager
+def span(nombre, **atributos):
+    """
+    Span de la traza actual; el anidamiento se deduce de los tiempos de cada hilo, como en el visor.
+    Devuelve el Span para añadir atributos con .establecer() (también sin traza activa).
+    """
+    traza_en_curso = _traza_actual.get()
+    span_nuevo = Span(nombre, atributos=atributos)
+    if traza_en_curso is None:
+        yield span_nuevo
+        return
+    try:
+        yield span_nuevo
+    except BaseException as e:
+        span_nuevo.establecer(error=f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        span_nuevo.fin_us = _ahora_us()
+        traza_en_curso.agregar(span_nuevo)
+
+
+def registrar_span(nombre, inicio_perf_s, fin_perf_s, **atributos):
+    """Registra un span ya terminado a partir de marcas de time.perf_counter() (p. ej. subfases medidas a posteriori)."""
+    traza_en_curso = _traza_actual.get()
+    if traza_en_curso is not None:
+        traza_en_curso.registrar_span(nombre, inicio_perf_s, fin_perf_s, **atributos)
+
+
+def traza_activa():
+    return _traza_actual.get() is not None
+
+
+def establecer_id_correlacion(id_correlacion):
+    """Fija el id de correlación del contexto actual (p. ej. el X-Request-ID de una petición)."""
+    return _id_correlacion.set(id_correlacion)
+
+
+def id_correlacion_actual():
+    traza_en_curso = _traza_actual.get()
+    if traza_en_curso is not None:
+        return traza_en_curso.id_correlacion
+    return _id_correlacion.get()
@@ -1,10 +1,16 @@
 # src/utils.py
 import os
 import time
+import hashlib
+import numpy as np
 from contextlib import contextmanager
 import logging
 from src import config
-import requests
+from src import trazas
+from src import cache_resultados
+from src import indice_vectorial
+import asyncio
+import httpx
 import re
 from typing import Optional
 
@@ -18,10 +24,15 @@ def format_duration(seconds):
     return f"{minutes} min {remaining_seconds:.2f} seg"
 
 @contextmanager
-def timed_phase(phase_name):
+def timed_phase(phase_name, **atributos):
+    """
+    Registra inicio/fin de una fase en el log y la añade como span a la traza activa (ver trazas.py).
+    Devuelve el span, para añadir atributos conocidos durante la fase: `fase.establecer(tokens=...)`.
+    """
     logger.info(f"--- Iniciando Fase: {phase_name} ---")
     start_time = time.time()
-    yield
+    with trazas.span(phase_name, **atributos) as span_fase:
+        yield span_fase
     duration = time.time() - start_time
     logger.info(f"--- Fin Fase: {phase_name} (Duración: {format_duration(duration)}) ---")
 
@@ -92,96 +103,160 @@ def crear_directorios_necesarios():
         logger.error(f"No se pudieron crear los directorios necesarios: {e}", exc_info=True)
 
 
-def dividir_en_mega_chunks(texto_completo, max_tokens_contenido_chunk, overlap_tokens, llm_tokenizer_instance):
+# Fin de oración (seguido de espacio) o salto de párrafo: únicos puntos donde se puede cortar un mega-chunk.
+_PATRON_LIMITE_UNIDAD = re.compile(r"(?<=[.!?…])\s+|\n\s*\n")
+# Tamaño típico de una oración transcrita; fija la probabilidad de corte por contenido sin depender
+# del documento (si dependiera, cualquier edición podría mover todos los cortes).
+_TOKENS_TIPICOS_POR_ORACION = 30
+
+
+def _iterar_unidades(texto):
+    """Recorre el texto por oraciones/párrafos conservando el espaciado (''.join(unidades) == texto)."""
+    inicio = 0
+    for m in _PATRON_LIMITE_UNIDAD.finditer(texto):
+        if m.end() > inicio:
+            yield texto[inicio:m.end()]
+            inicio = m.end()
+    if inicio < len(texto):
+        yield texto[inicio:]
+
+
+def _es_corte_por_contenido(unidad, probabilidad_corte):
     """
-    Divide el texto en mega-chunks, respetando un límite de tokens para el contenido de cada chunk.
-    Intenta hacer los chunks lo más grandes posible (cercanos a max_tokens_contenido_chunk)
-    y aplica el overlap en tokens.
+    Decide si se corta después de `unidad` mirando solo su contenido (hash del texto normalizado),
+    de modo que los cortes no dependen de lo que haya antes en la transcripción.
+    """
+    normalizada = " ".join(unidad.split()).encode("utf-8")
+    valor_hash = int.from_bytes(hashlib.blake2b(normalizada, digest_size=8).digest(), "big")
+    return (valor_hash % 10000) < probabilidad_corte * 10000
+
+
+def _iterar_unidades_en_tokens(documento, max_tokens_unidad, tolerancia_tokens):
+    """
+    Recorre las oraciones/párrafos del documento como (token_inicio, token_fin, texto, fin_de_parrafo),
+    usando el mapa de desplazamientos del documento (calculado una sola vez).
+    Las que superan max_tokens_unidad (p. ej. transcripciones sin puntuación) se parten entre
+    palabras, buscando un inicio de palabra dentro de `tolerancia_tokens`.
+    """
+    desplazamientos = documento.desplazamientos
+    inicios_tokens = desplazamientos[:-1]
+    texto_bytes = documento.texto_bytes
+    num_tokens = documento.num_tokens
+    byte_fin = 0
+    token_inicio = 0
+    for unidad in _iterar_unidades(documento.texto):
+        byte_fin += len(unidad.encode('utf-8', 'ignore'))
+        # Cada token pertenece a la unidad donde empieza; la última unidad se queda con el resto.
+        token_fin = int(np.searchsorted(inicios_tokens, byte_fin, side='left')) if byte_fin < len(texto_bytes) else num_tokens
+        if token_inicio < token_fin < num_tokens and desplazamientos[token_fin] > byte_fin:
+            token_fin -= 1 # Empieza en el espacio final pero sigue en la unidad siguiente ("▁En"): es de la siguiente
+        while token_fin - token_inicio > max_tokens_unidad:
+            corte = token_inicio + max_tokens_unidad
+            for candidato in range(corte, max(token_inicio, corte - tolerancia_tokens), -1):
+                if texto_bytes[inicios_tokens[candidato]:inicios_tokens[candidato] + 1].isspace():
+                    corte = candidato
+                    break
+            yield token_inicio, corte, unidad, False
+            token_inicio = corte
+        if token_fin > token_inicio:
+            fin_de_parrafo = unidad[len(unidad.rstrip()):].count("\n") >= 2
+            yield token_inicio, token_fin, unidad, fin_de_parrafo
+            token_inicio = token_fin
+
+
+def _unidades_hasta_corte_por_parrafo(grupo, tolerancia_tokens):
+    """
+    Número de unidades del grupo a conservar si se corta en el último fin de párrafo que
+    quede dentro de `tolerancia_tokens` del final; si no hay ninguno, todas (corte en fin de oración).
+    """
+    fin_grupo = grupo[-1][1]
+    for i in range(len(grupo) - 1, 0, -1):
+        if fin_grupo - grupo[i - 1][1] > tolerancia_tokens:
+            break
+        if grupo[i - 1][3]:
+            return i
+    return len(grupo)
+
+
+def calcular_rangos_mega_chunks(documento, max_tokens_contenido_chunk, overlap_tokens):
+    """
+    Genera los rangos de tokens (inicio, fin) de los mega-chunks de un DocumentoTokenizado, de como
+    máximo max_tokens_contenido_chunk tokens, en un solo recorrido y sin materializar ningún texto.
+
+    Los cortes se eligen por contenido (content-defined chunking): superado un tamaño mínimo
+    (config.MEGA_CHUNK_TAMANO_MIN_FRACCION del máximo), se corta tras las oraciones cuyo hash cumple
+    una condición fija. Así una corrección local solo cambia el mega-chunk que la contiene (y como
+    mucho el siguiente). Si se llega al máximo sin corte, se corta en el último fin de párrafo dentro
+    de la tolerancia (config.MEGA_CHUNK_TOLERANCIA_CORTE) o, si no hay, en el último fin de oración.
+    Cada chunk (salvo el primero) empieza con las últimas oraciones del anterior hasta overlap_tokens.
     """
-    if not llm_tokenizer_instance:
-        logger.error("(mega-chunks): Se requiere una instancia de tokenizador LLM.")
-        return []
-    if max_tokens_contenido_chunk <= 0:
-        logger.error(f"(mega-chunks): max_tokens_contenido_chunk ({max_tokens_contenido_chunk}) debe ser positivo.")
-        return []
     if overlap_tokens < 0:
         logger.warning("(mega-chunks): overlap_tokens es negativo, se usará 0.")
         overlap_tokens = 0
+    max_tokens_propios = max_tokens_contenido_chunk - overlap_tokens
+    if max_tokens_propios <= 0:
+        logger.error(f"(mega-chunks): max_tokens_contenido_chunk ({max_tokens_contenido_chunk}) debe ser positivo "
+                     f"y mayor que overlap_tokens ({overlap_tokens}).")
+        return
+    if documento.num_tokens == 0:
+        logger.warning("(mega-chunks): Texto a dividir resultó en cero tokens.")
+        return
 
-    # Tokenizar todo el texto de una vez para trabajar con tokens directamente
-    try:
-        # Asegurarse de que el texto sea string antes de encodear
-        if not isinstance(texto_completo, str):
-            logger.error(f"(mega-chunks): El texto_completo no es una cadena (tipo: {type(texto_completo)}). No se puede tokenizar.")
-            return []
-        tokens_originales = llm_tokenizer_instance.tokenize(texto_completo.encode('utf-8', 'ignore'))
-        if not tokens_originales:
-            logger.warning("(mega-chunks): Texto a dividir resultó en cero tokens.")
-            return []
-    except Exception as e_tok_full:
-        logger.error(f"(mega-chunks): Error al tokenizar el texto completo. Error: {e_tok_full}", exc_info=True)
-        return []
-    
-    num_tokens_total = len(tokens_originales)
-    logger.info(f"(mega-chunks): Texto original tokenizado: {num_tokens_total} tokens.")
-
-    mega_chunks_finales = []
-    indice_token_actual = 0
-    iteracion_chunk_num = 0
-
-    logger.info(f"(mega-chunks): Dividiendo texto. Objetivo por chunk: <= {max_tokens_contenido_chunk} tokens. "
-                f"Overlap tokens: {overlap_tokens}.")
+    tokens_minimos = int(max_tokens_propios * config.MEGA_CHUNK_TAMANO_MIN_FRACCION)
+    tolerancia_tokens = max(1, int(max_tokens_propios * config.MEGA_CHUNK_TOLERANCIA_CORTE))
+    # Probabilidad de corte por unidad para que, en promedio, el corte llegue a mitad del margen [mínimo, máximo].
+    probabilidad_corte = min(1.0, _TOKENS_TIPICOS_POR_ORACION / max(1.0, (max_tokens_propios - tokens_minimos) / 2))
+    logger.info(f"(mega-chunks): {documento.num_tokens} tokens. Chunk: {tokens_minimos}-{max_tokens_propios} tokens propios "
+                f"+ {overlap_tokens} de overlap (tolerancia de corte: {tolerancia_tokens} tokens).")
 
-    while indice_token_actual < num_tokens_total:
-        iteracion_chunk_num += 1
-        logger.debug(f"[Chunk Iter {iteracion_chunk_num}] Iniciando en token índice: {indice_token_actual}")
+    inicios_tokens = documento.desplazamientos[:-1]
+    texto_bytes = documento.texto_bytes
 
-        # Determinar el final del chunk actual
-        # El chunk no puede exceder max_tokens_contenido_chunk
-        # ni ir más allá del final del texto
-        fin_chunk_candidato = min(indice_token_actual + max_tokens_contenido_chunk, num_tokens_total)
-        
-        tokens_candidatos = tokens_originales[indice_token_actual:fin_chunk_candidato]
-        
-        if not tokens_candidatos:
-            logger.debug(f"[Chunk Iter {iteracion_chunk_num}] No quedan suficientes tokens para formar un chunk. Finalizando.")
-            break
+    def rango(grupo, grupo_anterior):
+        token_inicio = grupo[0][0]
+        for unidad_anterior in reversed(grupo_anterior):
+            if grupo[0][0] - unidad_anterior[0] > overlap_tokens:
+                break
+            token_inicio = unidad_anterior[0]
+        if overlap_tokens and grupo_anterior and token_inicio == grupo[0][0]:
+            # Ni una oración entera del chunk anterior cabe en el overlap: se solapa desde un inicio de palabra.
+            for candidato in range(max(grupo_anterior[0][0], grupo[0][0] - overlap_tokens), grupo[0][0]):
+                if texto_bytes[inicios_tokens[candidato]:inicios_tokens[candidato] + 1].isspace():
+                    token_inicio = candidato
+                    break
+        return token_inicio, grupo[-1][1]
 
-        try:
-            texto_chunk_final_bytes = llm_tokenizer_instance.detokenize(tokens_candidatos)
-            texto_chunk_final = texto_chunk_final_bytes.decode('utf-8', 'ignore')
-        except Exception as e_detok:
-            logger.error(f"(mega-chunks) Error al decodificar tokens del chunk {iteracion_chunk_num} (índices {indice_token_actual}-{fin_chunk_candidato-1}). Error: {e_detok}. Saltando este intento de chunk.", exc_info=True)
-            indice_token_actual += 1 
-            continue
-            
-        if texto_chunk_final.strip():
-            mega_chunks_finales.append(texto_chunk_final)
-            num_tokens_en_chunk_final = len(tokens_candidatos)
-            logger.debug(f"  Mega-chunk Creado ({iteracion_chunk_num}): {num_tokens_en_chunk_final} tokens. "
-                         f"Inició en token {indice_token_actual}. Texto: '{texto_chunk_final[:50].replace('\n', ' ')}...'")
-            
-            avance_tokens = max(1, num_tokens_en_chunk_final - overlap_tokens)
-            
-            if indice_token_actual + avance_tokens > num_tokens_total:
-                avance_tokens = num_tokens_total - indice_token_actual
-            
-            indice_token_actual += avance_tokens
-            logger.debug(f"  Nuevo índice_token_actual: {indice_token_actual} (avance: {avance_tokens} tokens)")
-
-        elif indice_token_actual < num_tokens_total: 
-            logger.warning(f"(mega-chunks): Chunk decodificado vacío o solo espacios en iteración {iteracion_chunk_num} "
-                           f"(índice token: {indice_token_actual}). Avanzando 1 token para evitar bucle.")
-            indice_token_actual += 1 
-        else: 
-            break
+    grupo_anterior, grupo = [], []
+    for unidad in _iterar_unidades_en_tokens(documento, max_tokens_propios, tolerancia_tokens):
+        tokens_unidad = unidad[1] - unidad[0]
+        if grupo and grupo[-1][1] - grupo[0][0] + tokens_unidad > max_tokens_propios:
+            conservar = _unidades_hasta_corte_por_parrafo(grupo, tolerancia_tokens)
+            if grupo[-1][1] - grupo[conservar - 1][1] + tokens_unidad > max_tokens_propios:
+                conservar = len(grupo) # Lo que sigue al párrafo no cabría con la nueva unidad
+            yield rango(grupo[:conservar], grupo_anterior)
+            grupo_anterior, grupo = grupo[:conservar], grupo[conservar:]
+        grupo.append(unidad)
+        if grupo[-1][1] - grupo[0][0] >= tokens_minimos and _es_corte_por_contenido(unidad[2], probabilidad_corte):
+            yield rango(grupo, grupo_anterior)
+            grupo_anterior, grupo = grupo, []
+    if grupo:
+        yield rango(grupo, grupo_anterior)
 
-    if not mega_chunks_finales and texto_completo and texto_completo.strip():
-        logger.warning("(mega-chunks): No se generó ningún mega-chunk, pero el texto original no estaba vacío. "
-                       "Esto podría indicar que max_tokens_contenido_chunk es demasiado pequeño o hay problemas con la tokenización/decodificación.")
 
-    logger.info(f"(mega-chunks): Texto dividido en {len(mega_chunks_finales)} mega-chunks.")
-    return mega_chunks_finales
+def dividir_en_mega_chunks(documento, max_tokens_contenido_chunk, overlap_tokens, rangos=None):
+    """
+    Generador de mega-chunks (DocumentoTokenizado, vistas sobre los tokens del documento) según
+    calcular_rangos_mega_chunks. Cada texto se materializa solo al producirse el chunk, así que
+    nunca están todos en memoria a la vez. `rangos` permite reutilizar rangos ya calculados
+    (p. ej. para conocer el total de chunks antes de recorrerlos).
+    """
+    if rangos is None:
+        rangos = calcular_rangos_mega_chunks(documento, max_tokens_contenido_chunk, overlap_tokens)
+    for num_chunk, (token_inicio, token_fin) in enumerate(rangos, start=1):
+        mega_chunk = documento.fragmento(token_inicio, token_fin)
+        logger.debug(f"  Mega-chunk {num_chunk}: {mega_chunk.num_tokens} tokens ({token_inicio}-{token_fin}).")
+        if mega_chunk.texto.strip():
+            yield mega_chunk
 
 
 def contar_tokens_llama_cpp(texto, llm_instance):
@@ -189,6 +264,7 @@ def contar_tokens_llama_cpp(texto, llm_instance):
     Cuenta el número de tokens en un texto dado utilizando una instancia de LLM.
     Esta función es un envoltorio para la tokenización específica de LLM.
     """
+    return len(llm_instance.tokenize(texto.encode('utf-8', 'ignore'), add_bos=False))
 
 # --- Funciones Helper movidas de api_main.py ---
 
@@ -211,24 +287,153 @@ def _cleanup_temp_file(path: str):
     except Exception as e:
         logger.warning(f"Error limpiando archivo temporal {path}: {e}")
 
-async def _query_vector_db(query: str, top_k: int = 3, page_start: Optional[int] = None, page_end: Optional[int] = None) -> list[dict]:
-    """
-    Consulta la base de datos vectorial para obtener información relevante.
-    """
+# Cliente HTTP compartido (pool de conexiones keep-alive) para la BD vectorial. Se crea al arrancar
+# la API (iniciar_cliente_vector_db) o, si no, en la primera consulta; se cierra al apagarla.
+_cliente_vector_db = None
+_semaforo_vector_db = None
+
+async def iniciar_cliente_vector_db():
+    global _cliente_vector_db, _semaforo_vector_db
+    if _cliente_vector_db is not None:
+        return _cliente_vector_db
+    _cliente_vector_db = httpx.AsyncClient(
+        base_url=config.VECTOR_DB_BASE_URL,
+        timeout=httpx.Timeout(config.VECTOR_DB_TIMEOUT_SEGUNDOS, connect=config.VECTOR_DB_TIMEOUT_CONEXION_SEGUNDOS),
+        limits=httpx.Limits(max_connections=config.VECTOR_DB_MAX_CONEXIONES, max_keepalive_connections=config.VECTOR_DB_MAX_CONEXIONES),
+    )
+    _semaforo_vector_db = asyncio.Semaphore(config.VECTOR_DB_MAX_CONCURRENCIA)
+    logger.info(f"Cliente de la BD vectorial iniciado ({config.VECTOR_DB_BASE_URL}, "
+                f"hasta {config.VECTOR_DB_MAX_CONCURRENCIA} consultas simultáneas).")
+    return _cliente_vector_db
+
+async def cerrar_cliente_vector_db():
+    global _cliente_vector_db, _semaforo_vector_db
+    if _cliente_vector_db is not None:
+        await _cliente_vector_db.aclose()
+    _cliente_vector_db = None
+    _semaforo_vector_db = None
+
+# None = aún no se sabe si el servicio admite consultas en lote; False tras recibir 404/405/501.
+_lote_vector_db_soportado = None
+
+def _parametros_consulta_vector_db(query, top_k, page_start, page_end):
     params = {"q": query, "top_k": top_k}
     if page_start is not None:
         params["page_start"] = page_start
     if page_end is not None:
         params["page_end"] = page_end
+    return params
 
+def _componentes_cache_vector_db(query, top_k, page_start, page_end):
+    return {"url": config.VECTOR_DB_BASE_URL, **_parametros_consulta_vector_db(query, top_k, page_start, page_end)}
+
+def _leer_cache_vector_db(query, top_k, page_start, page_end):
+    if not config.VECTOR_DB_CACHE_TTL_SEGUNDOS:
+        return None
+    return cache_resultados.obtener("vector_db", _componentes_cache_vector_db(query, top_k, page_start, page_end))
+
+def _guardar_cache_vector_db(query, top_k, page_start, page_end, resultados):
+    # Las respuestas vacías (o fallidas) no se guardan: se vuelven a consultar la próxima vez.
+    if config.VECTOR_DB_CACHE_TTL_SEGUNDOS:
+        cache_resultados.guardar(
+            "vector_db", _componentes_cache_vector_db(query, top_k, page_start, page_end), resultados,
+            expira_segundos=config.VECTOR_DB_CACHE_TTL_SEGUNDOS
+        )
+
+async def _consultar_vector_db_http(query, top_k, page_start, page_end):
+    cliente = await iniciar_cliente_vector_db()
     try:
-        response = requests.get(f"{config.VECTOR_DB_BASE_URL}/query/", params=params)
+        async with _semaforo_vector_db:
+            response = await cliente.get("/query/", params=_parametros_consulta_vector_db(query, top_k, page_start, page_end))
         response.raise_for_status()
         return response.json().get("results", [])
-    except requests.exceptions.RequestException as e:
+    except httpx.TimeoutException as e:
+        logger.error(f"Tiempo de espera agotado al consultar la base de datos vectorial ('{query}'): {e!r}")
+        return []
+    except (httpx.HTTPError, ValueError) as e:
         logger.error(f"Error al consultar la base de datos vectorial: {e}", exc_info=True)
         return []
 
+async def _query_vector_db(query: str, top_k: int = 3, page_start: Optional[int] = None, page_end: Optional[int] = None) -> list[dict]:
+    """
+    Consulta la base de datos vectorial para obtener información relevante.
+    Las respuestas se cachean (con caducidad) por texto de consulta, top_k y rango de páginas.
+    No bloquea el event loop; como mucho config.VECTOR_DB_MAX_CONCURRENCIA consultas a la vez.
+    """
+    if config.VECTOR_DB_MODO == "embebido":
+        # Índice local (sin red): no necesita caché; los embeddings se calculan fuera del event loop.
+        return await asyncio.to_thread(indice_vectorial.consultar, query, top_k, page_start, page_end)
+    resultados = _leer_cache_vector_db(query, top_k, page_start, page_end)
+    if resultados is not None:
+        return resultados
+    resultados = await _consultar_vector_db_http(query, top_k, page_start, page_end)
+    _guardar_cache_vector_db(query, top_k, page_start, page_end, resultados)
+    return resultados
+
+async def _query_vector_db_lote(queries: list[str], top_k: int = 3, page_start: Optional[int] = None, page_end: Optional[int] = None) -> Optional[list[list[dict]]]:
+    """
+    Envía varias consultas en una sola petición: POST /query/batch/ con {"queries": [params, ...]}
+    y respuesta {"results": [resultados de cada consulta, en el mismo orden]}.
+    Devuelve None si el servicio no lo admite o falla (quien llama consulta entonces término a término).
+    """
+    global _lote_vector_db_soportado
+    if not config.VECTOR_DB_CONSULTA_EN_LOTE or _lote_vector_db_soportado is False:
+        return None
+    cliente = await iniciar_cliente_vector_db()
+    cuerpo = {"queries": [_parametros_consulta_vector_db(q, top_k, page_start, page_end) for q in queries]}
+    try:
+        async with _semaforo_vector_db:
+            response = await cliente.post("/query/batch/", json=cuerpo)
+        if response.status_code in (404, 405, 501):
+            logger.info("La BD vectorial no admite consultas en lote. Se consultará término a término.")
+            _lote_vector_db_soportado = False
+            return None
+        response.raise_for_status()
+        resultados = response.json().get("results")
+        if not isinstance(resultados, list) or len(resultados) != len(queries):
+            logger.warning("Respuesta en lote de la BD vectorial con formato inesperado. Se consultará término a término.")
+            return None
+        _lote_vector_db_soportado = True
+        return [r or [] for r in resultados]
+    except (httpx.HTTPError, ValueError) as e:
+        logger.warning(f"Falló la consulta en lote a la BD vectorial ({e!r}). Se consultará término a término.")
+        return None
+
+async def consultar_terminos_vector_db(queries: list[str], top_k: int = 3, page_start: Optional[int] = None, page_end: Optional[int] = None) -> list[list[dict]]:
+    """
+    Resultados de cada consulta, en el mismo orden: primero la caché local, después las restantes
+    en una sola petición en lote y, si el servicio no lo admite, en paralelo una por una.
+    Con config.VECTOR_DB_MODO = "embebido" se consulta el índice local, todo en un solo lote.
+    """
+    if config.VECTOR_DB_MODO == "embebido":
+        with trazas.span("vector_db.embebido", consultas=len(queries), top_k=top_k):
+            return await asyncio.to_thread(indice_vectorial.consultar_lote, queries, top_k, page_start, page_end)
+    resultados = [_leer_cache_vector_db(q, top_k, page_start, page_end) for q in queries]
+    pendientes = [i for i, r in enumerate(resultados) if r is None]
+    if len(pendientes) < len(queries):
+        logger.info(f"BD vectorial: {len(queries) - len(pendientes)}/{len(queries)} consultas servidas desde la caché.")
+    if not pendientes:
+        return resultados
+
+    resultados_pendientes = None
+    if len(pendientes) > 1:
+        with trazas.span("vector_db.lote", consultas=len(pendientes), top_k=top_k):
+            resultados_pendientes = await _query_vector_db_lote([queries[i] for i in pendientes], top_k, page_start, page_end)
+    if resultados_pendientes is None:
+        async def consultar(query):
+            logger.info(f"Consultando base de datos vectorial para: '{query}'")
+            with trazas.span("vector_db.consulta", termino=query, top_k=top_k) as span_consulta:
+                resultados_query = await _consultar_vector_db_http(query, top_k, page_start, page_end)
+                span_consulta.establecer(resultados=len(resultados_query))
+            return resultados_query
+        # Todas las consultas en paralelo: la latencia total es la de la consulta más lenta.
+        resultados_pendientes = await asyncio.gather(*(consultar(queries[i]) for i in pendientes))
+
+    for i, resultados_query in zip(pendientes, resultados_pendientes):
+        _guardar_cache_vector_db(queries[i], top_k, page_start, page_end, resultados_query)
+        resultados[i] = resultados_query
+    return resultados
+
 async def _extraer_y_consultar_terminos_esquema(
     esquema_contenido: str,
     max_terminos_consulta: int = config.MAX_SCHEMA_TERMS_TO_QUERY if hasattr(config, 'MAX_SCHEMA_TERMS_TO_QUERY') else 3,
@@ -260,11 +465,10 @@ async def _extraer_y_consultar_terminos_esquema(
 
     logger.info(f"Términos extraídos para consulta: {terminos_extraidos}")
     
+    resultados_por_termino = await consultar_terminos_vector_db(terminos_extraidos, top_k=top_k_por_termino)
+
     informacion_contextual_acumulada = []
-    for termino in terminos_extraidos:
-        logger.info(f"Consultando base de datos vectorial para el término del esquema: '{termino}'")
-        resultados_vector_db = await _query_vector_db(query=termino, top_k=top_k_por_termino)
-        
+    for termino, resultados_vector_db in zip(terminos_extraidos, resultados_por_termino):
         if resultados_vector_db:
             # Correctly escape quotes within f-string for the term
             items_termino_actual = [f'Resultados para el término del esquema "{termino}":'] 
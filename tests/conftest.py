@@ -0,0 +1,58 @@
+# tests/conftest.py
+# Las pruebas usan el backend LLM falso (determinista, sin GGUF) y el cliente Gemini falso: corren en
+# cualquier máquina de CI sin modelos ni red. Las variables se fijan antes de importar src.config.
+import os
+
+os.environ["LLM_BACKEND"] = "falso"
+os.environ["GEMINI_BACKEND"] = "falso"
+os.environ["LLM_FALSO_TOKENS_POR_SEGUNDO"] = "0"
+os.environ["LLM_FALSO_TOKENS_PROMPT_POR_SEGUNDO"] = "0"
+os.environ["GEMINI_FALSO_LATENCIA_SEGUNDOS"] = "0"
+os.environ["TRAZAS_ACTIVADAS"] = "0"
+
+import pytest
+from src import config
+from src import llm_processing
+from src import cache_resultados
+from src import backends_llm
+
+
+@pytest.fixture(autouse=True)
+def directorios_temporales(tmp_path, monkeypatch):
+    """Caché, trabajos, trazas e índices en un directorio temporal por prueba (nunca en data/)."""
+    for nombre in ("CACHE_RESULTADOS_DIR", "TRABAJOS_DIR", "TRAZAS_DIR", "VECTOR_EMBEBIDO_DIR", "BENCHMARK_DIR"):
+        monkeypatch.setattr(config, nombre, str(tmp_path / nombre.lower()))
+    cache_resultados.cerrar()
+    yield tmp_path
+    cache_resultados.cerrar()
+
+
+@pytest.fixture
+def registro_falso():
+    """Registro global de modelos con el backend falso, cargado como en el arranque de la API."""
+    registro = llm_processing.cargar_modelo_llm()
+    assert registro is not None
+    yield registro
+    registro.cerrar()
+    llm_processing.registro = None
+
+
+@pytest.fixture
+def tokenizador():
+    return backends_llm.BackendFalso()
+
+
+
+@pytest.fixture
+def cliente_api(tmp_path, monkeypatch):
+    """TestClient de la API (arranque incluido) con output/ y data/ en el directorio temporal; al salir descarga el modelo."""
+    from fastapi.testclient import TestClient
+    from src import api_main
+    monkeypatch.setattr(config, "BASE_PROJECT_DIR", str(tmp_path))
+    with TestClient(api_main.app) as cliente:
+        yield cliente
+    llm_processing.esperar_carga_modelo()
+    if llm_processing.registro is not None:
+        llm_processing.registro.cerrar()
+        llm_processing.registro = None
+    llm_processing.estado_carga.update(estado=llm_processing.ESTADO_CARGA_PENDIENTE, error=None, segundos=None)
@@ -0,0 +1,74 @@
+# tests/test_api_gemini.py
+# Esquema con Gemini desde la API (pase único y por partes) contra ModeloGeminiFalso.
+import asyncio
+import pytest
+from fastapi import HTTPException
+from src import config
+from src import prompts
+from src import api_main
+from src import cliente_gemini
+from tests.textos import texto_de_clase
+
+
+@pytest.fixture
+def modelo_gemini():
+    modelo = cliente_gemini.ModeloGeminiFalso(latencia_segundos=0)
+    cliente_gemini.iniciar_cliente(modelo)
+    yield modelo
+    cliente_gemini.cerrar_cliente()
+
+
+def _esquema(texto):
+    return asyncio.run(api_main._call_gemini_api_for_schema(texto, prompts.PROMPT_GEMINI_GENERAR_ESQUEMA_TEMPLATE))
+
+
+def test_pase_unico_cuenta_los_tokens_una_sola_vez(modelo_gemini):
+    assert _esquema(texto_de_clase(5)).strip()
+    assert modelo_gemini.llamadas == 1
+    assert modelo_gemini.conteos == 1
+
+
+@pytest.fixture
+def esquema_por_partes(monkeypatch):
+    monkeypatch.setattr(config, "GEMINI_ESQUEMA_MAX_TOKENS_PASE_UNICO", 1000)
+    monkeypatch.setattr(config, "GEMINI_ESQUEMA_TOKENS_POR_PARTE", 400)
+    monkeypatch.setattr(config, "GEMINI_ESQUEMA_MAX_PARTES_EN_PARALELO", 2)
+
+
+def _partes(texto):
+    partes, _ = asyncio.run(api_main._dividir_transcripcion_para_gemini(texto))
+    return partes
+
+
+def test_esquema_por_partes_en_paralelo_y_fusionado(esquema_por_partes):
+    modelo = cliente_gemini.ModeloGeminiFalso(latencia_segundos=0.01)
+    cliente_gemini.iniciar_cliente(modelo)
+    try:
+        texto = texto_de_clase(12)
+        num_partes = len(_partes(texto))
+        assert num_partes > 2
+
+        assert _esquema(texto).strip()
+        assert modelo.llamadas == num_partes + 1 # Un esquema parcial por parte y la fusión
+        assert modelo.max_simultaneas == 2
+
+        # Al añadir texto al final solo cambia la última parte: el resto de esquemas parciales sale de la caché.
+        llamadas = modelo.llamadas
+        assert _esquema(texto + " Una última pregunta sobre la entropía.").strip()
+        assert modelo.llamadas - llamadas == 2
+    finally:
+        cliente_gemini.cerrar_cliente()
+
+
+def test_si_falla_una_parte_no_se_piden_las_demas(esquema_por_partes, monkeypatch):
+    monkeypatch.setattr(config, "GEMINI_ESQUEMA_MAX_PARTES_EN_PARALELO", 1)
+    modelo = cliente_gemini.ModeloGeminiFalso(latencia_segundos=0.01, errores=[ValueError("respuesta bloqueada")])
+    cliente_gemini.iniciar_cliente(modelo)
+    try:
+        with pytest.raises(HTTPException) as error:
+            _esquema(texto_de_clase(12))
+    finally:
+        cliente_gemini.cerrar_cliente()
+
+    assert error.value.status_code == 502
+    assert modelo.llamadas == 1
@@ -0,0 +1,82 @@
+# tests/test_api_main.py
+import os
+import json
+import asyncio
+import importlib
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from src import config
+from src import api_main
+from src import llm_processing
+from tests.textos import texto_de_clase
+
+
+def test_importar_la_api_no_crea_el_almacen_de_trabajos():
+    from src import api_main
+    api_main = importlib.reload(api_main)
+    assert api_main.gestor_trabajos is None
+    assert not os.path.exists(config.TRABAJOS_DIR)
+
+    api_main._crear_gestores_trabajos()
+    assert os.path.isdir(config.TRABAJOS_DIR)
+    assert api_main.gestor_ingesta.almacen is api_main.gestor_trabajos.almacen
+
+
+def _eventos_ndjson(respuesta):
+    assert respuesta.status_code == 200
+    assert respuesta.headers["content-type"].startswith("application/x-ndjson")
+    return [json.loads(linea) for linea in respuesta.iter_lines() if linea]
+
+
+def test_esquema_y_apuntes_en_stream(cliente_api):
+    transcripcion = texto_de_clase(3)
+    with cliente_api.stream("POST", "/generar_esquema/stream/", files={"file": ("clase.txt", transcripcion.encode("utf-8"))}) as respuesta:
+        eventos = _eventos_ndjson(respuesta)
+    assert eventos[0]["tipo"] == "trabajo"
+    assert eventos[-1]["tipo"] == "fin"
+    assert any(e["tipo"] == "token" for e in eventos)
+    esquema = cliente_api.get(eventos[-1]["url_archivo"]).text
+    assert esquema.strip()
+
+    archivos = {"transcripcion_file": ("clase.txt", transcripcion.encode("utf-8")), "esquema_file": ("esquema.txt", esquema.encode("utf-8"))}
+    with cliente_api.stream("POST", "/generar_apuntes/stream/", files=archivos) as respuesta:
+        eventos = _eventos_ndjson(respuesta)
+    assert [eventos[0]["tipo"], eventos[-1]["tipo"]] == ["trabajo", "fin"]
+    assert eventos[-1]["archivo"].endswith(".md")
+
+
+def test_stream_emite_el_error_como_ultimo_evento():
+    async def fallar():
+        raise HTTPException(status_code=500, detail="fallo de prueba")
+
+    async def leer():
+        cola = asyncio.Queue()
+        cola.put_nowait({"tipo": "trabajo", "id_trabajo": "x"})
+        respuesta = api_main._respuesta_ndjson(cola, fallar())
+        return [json.loads(linea) async for linea in respuesta.body_iterator]
+
+    assert asyncio.run(leer()) == [{"tipo": "trabajo", "id_trabajo": "x"}, {"tipo": "error", "detalle": "fallo de prueba"}]
+
+
+def test_health_ready_cuando_el_modelo_esta_cargado(cliente_api):
+    assert cliente_api.get("/health/live").json() == {"estado": "vivo"}
+
+    llm_processing.esperar_carga_modelo()
+    respuesta = cliente_api.get("/health/ready")
+    assert respuesta.status_code == 200
+    cuerpo = respuesta.json()
+    assert cuerpo["listo"] is True
+    assert cuerpo["modelo"]["estado"] == llm_processing.ESTADO_CARGA_LISTO
+    assert cuerpo["modelos_cargados"] and cuerpo["backend"] == "falso"
+
+
+@pytest.mark.parametrize("estado, error", [("cargando", None), ("error", "No se encontró el modelo")])
+def test_health_ready_mientras_carga_o_si_fallo(monkeypatch, estado, error):
+    monkeypatch.setattr(llm_processing, "registro", None)
+    monkeypatch.setattr(llm_processing, "estado_carga", {"estado": estado, "error": error, "segundos": None})
+
+    respuesta = TestClient(api_main.app).get("/health/ready") # Sin arranque: no se lanza la carga
+    assert respuesta.status_code == 503
+    assert respuesta.json()["listo"] is False
+    assert respuesta.json()["modelo"] == {"estado": estado, "error": error, "segundos": None}
@@ -0,0 +1,63 @@
+# tests/test_cache_resultados.py
+from src import config
+from src import cache_resultados
+from src import llm_processing
+
+COMPONENTES = {
+    "texto": "Transcripción de la clase.",
+    "plantilla": "Esquema de: {texto_completo}",
+    "modelo": "modelo.gguf:123:456",
+    "n_ctx": 4096,
+    "max_tokens": 1024,
+    "temperatura": 0.3,
+    "stop": ["\n---"],
+    "seed": 42,
+}
+
+
+def test_clave_no_depende_del_orden_de_los_componentes():
+    invertidos = dict(reversed(list(COMPONENTES.items())))
+    assert cache_resultados.calcular_clave("esquema", COMPONENTES) == cache_resultados.calcular_clave("esquema", invertidos)
+
+
+def test_clave_estable_entre_versiones():
+    # La caché vive en disco entre ejecuciones: si cambia la serialización, se pierden todos los resultados guardados.
+    assert cache_resultados.calcular_clave("esquema", COMPONENTES) == (
+        "esquema:dacbdf43db3ba100e61c479dcf3a588de6585361bd5d09f74950ce22a2f82e8a"
+    )
+
+
+def test_clave_cambia_con_cualquier_componente_y_con_la_tarea():
+    base = cache_resultados.calcular_clave("esquema", COMPONENTES)
+    for nombre, valor in (("texto", "Otra transcripción."), ("temperatura", 0.4), ("stop", []), ("n_ctx", 8192)):
+        assert cache_resultados.calcular_clave("esquema", {**COMPONENTES, nombre: valor}) != base
+    assert cache_resultados.calcular_clave("esquema_parcial", COMPONENTES) != base
+    assert cache_resultados.calcular_clave("esquema", COMPONENTES).startswith("esquema:")
+
+
+def test_clave_admite_valores_no_serializables():
+    clave = cache_resultados.calcular_clave("gemini", {"ruta": config, "valores": (1, 2)})
+    assert clave == cache_resultados.calcular_clave("gemini", {"ruta": config, "valores": [1, 2]})
+
+
+def test_clave_del_esquema_parcial_no_depende_de_la_posicion_del_chunk(registro_falso):
+    # Se llama dos veces con el mismo texto: la clave no incluye "chunk N de M".
+    primera = llm_processing._componentes_cache_esquema_parcial("Texto del mega-chunk.")
+    segunda = llm_processing._componentes_cache_esquema_parcial("Texto del mega-chunk.")
+    assert cache_resultados.calcular_clave("esquema_parcial", primera) == cache_resultados.calcular_clave("esquema_parcial", segunda)
+    assert "chunk_numero" not in primera and "total_chunks" not in primera
+
+
+def test_guardar_y_obtener(directorios_temporales):
+    assert cache_resultados.obtener("esquema", COMPONENTES) is None
+    cache_resultados.guardar("esquema", COMPONENTES, "1. Tema")
+
+    assert cache_resultados.contiene("esquema", COMPONENTES)
+    assert cache_resultados.obtener("esquema", dict(reversed(list(COMPONENTES.items())))) == "1. Tema"
+    cache_resultados.cerrar() # Persiste al reabrir
+    assert cache_resultados.obtener("esquema", COMPONENTES) == "1. Tema"
+
+
+def test_resultado_vacio_no_se_guarda():
+    cache_resultados.guardar("esquema", COMPONENTES, "")
+    assert not cache_resultados.contiene("esquema", COMPONENTES)
@@ -0,0 +1,164 @@
+# tests/test_cliente_gemini.py
+# Política de llamadas de ClienteGemini (reintentos, plazos, códigos HTTP, concurrencia) contra ModeloGeminiFalso.
+import asyncio
+import pytest
+from src import metricas
+from src import cliente_gemini
+
+PROMPT = "Genera el esquema de esta clase sobre termodinámica y entropía."
+
+
+class ErrorApi(Exception):
+    """Como los errores de google.api_core: el código HTTP en `.code`."""
+
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+def _cliente(modelo, **opciones):
+    opciones = {"max_reintentos": 3, "backoff_inicial_segundos": 0.001, "backoff_max_segundos": 0.002, "plazo_segundos": 5, **opciones}
+    return cliente_gemini.ClienteGemini(modelo, "gemini-falso", **opciones)
+
+
+def _generar(modelo, emitir_fragmento=None, **opciones):
+    async def generar():
+        return await _cliente(modelo, **opciones).generar(PROMPT, emitir_fragmento=emitir_fragmento, tarea="prueba")
+    return asyncio.run(generar())
+
+
+@pytest.mark.parametrize("codigo", [429, 503])
+def test_reintenta_errores_transitorios(codigo):
+    modelo = cliente_gemini.ModeloGeminiFalso(latencia_segundos=0, errores=[ErrorApi(codigo), ErrorApi(codigo)])
+    reintentos_antes = dict(metricas.GEMINI_REINTENTOS._valores).get(("prueba", str(codigo)), 0)
+
+    texto, respuesta = _generar(modelo)
+
+    assert modelo.llamadas == 3
+    assert texto and texto == respuesta.text
+    assert metricas.GEMINI_REINTENTOS._valores[("prueba", str(codigo))] == reintentos_antes + 2
+
+
+def test_reintenta_en_stream_si_no_se_emitio_nada():
+    modelo = cliente_gemini.ModeloGeminiFalso(latencia_segundos=0, errores=[ErrorApi(429)])
+    fragmentos = []
+
+    texto, _ = _generar(modelo, emitir_fragmento=fragmentos.append)
+
+    assert modelo.llamadas == 2
+    assert "".join(fragmentos) == texto
+
+
+def test_no_reintenta_tras_emitir_un_fragmento():
+    modelo = cliente_gemini.ModeloGeminiFalso(latencia_segundos=0, errores_en_stream=[ErrorApi(503)])
+    fragmentos = []
+
+    with pytest.raises(cliente_gemini.ErrorGemini) as error:
+        _generar(modelo, emitir_fragmento=fragmentos.append)
+
+    assert modelo.llamadas == 1
+    assert len(fragmentos) == 1 # El cliente no recibe la salida duplicada
+    assert error.value.codigo_http == 502
+
+
+def test_error_no_reintentable():
+    modelo = cliente_gemini.ModeloGeminiFalso(latencia_segundos=0, errores=[ErrorApi(400)])
+
+    with pytest.raises(cliente_gemini.ErrorGemini) as error:
+        _generar(modelo)
+
+    assert modelo.llamadas == 1
+    assert error.value.codigo_http == 502
+
+
+def test_reintentos_agotados():
+    modelo = cliente_gemini.ModeloGeminiFalso(latencia_segundos=0, errores=[ErrorApi(503)] * 5)
+
+    with pytest.raises(cliente_gemini.ErrorGemini) as error:
+        _generar(modelo, max_reintentos=2)
+
+    assert modelo.llamadas == 3
+    assert error.value.codigo_http == 503
+
+
+def test_prompt_demasiado_grande():
+    modelo = cliente_gemini.ModeloGeminiFalso(latencia_segundos=0)
+
+    with pytest.raises(cliente_gemini.PromptDemasiadoGrande) as error:
+        _generar(modelo, max_tokens_prompt=5)
+
+    assert error.value.codigo_http == 413
+    assert error.value.tokens_prompt > 5
+    assert modelo.llamadas == 0 # Rechazado sin gastar una generación
+
+
+def test_plazo_agotado():
+    modelo = cliente_gemini.ModeloGeminiFalso(latencia_segundos=1.0)
+
+    with pytest.raises(cliente_gemini.ErrorGemini) as error:
+        _generar(modelo, plazo_segundos=0.05)
+
+    assert error.value.codigo_http == 504
+
+
+def test_plazo_agotado_entre_reintentos():
+    modelo = cliente_gemini.ModeloGeminiFalso(latencia_segundos=0.02, errores=[ErrorApi(503)] * 50)
+
+    with pytest.raises(cliente_gemini.ErrorGemini) as error:
+        _generar(modelo, max_reintentos=50, backoff_inicial_segundos=0.05, backoff_max_segundos=0.05, plazo_segundos=0.2)
+
+    assert error.value.codigo_http == 504
+    assert 1 < modelo.llamadas < 50
+
+
+def test_el_semaforo_limita_la_concurrencia():
+    modelo = cliente_gemini.ModeloGeminiFalso(latencia_segundos=0.02)
+
+    async def generar_varias():
+        cliente = _cliente(modelo, max_concurrencia=2)
+        return await asyncio.gather(*(cliente.generar(f"{PROMPT} {i}", tarea="prueba") for i in range(8)))
+
+    resultados = asyncio.run(generar_varias())
+
+    assert len(resultados) == 8 and all(texto for texto, _ in resultados)
+    assert modelo.llamadas == 8
+    assert modelo.max_simultaneas == 2
+
+
+def test_la_espera_por_el_semaforo_cuenta_para_el_plazo():
+    modelo = cliente_gemini.ModeloGeminiFalso(latencia_segundos=0.3)
+
+    async def generar_dos():
+        cliente = _cliente(modelo, max_concurrencia=1, plazo_segundos=0.1)
+        primera = asyncio.ensure_future(cliente.generar(PROMPT, tarea="prueba", plazo_segundos=5))
+        await asyncio.sleep(0.01)
+        with pytest.raises(cliente_gemini.ErrorGemini) as error:
+            await cliente.generar(PROMPT, tarea="prueba")
+        await primera
+        return error.value
+
+    assert asyncio.run(generar_dos()).codigo_http == 504
+    assert modelo.llamadas == 1
+
+
+def test_el_sdk_se_configura_en_la_primera_llamada_y_no_al_arrancar(monkeypatch):
+    creados = []
+
+    def crear_modelo_genai(api_key, nombre_modelo):
+        creados.append((api_key, nombre_modelo))
+        return cliente_gemini.ModeloGeminiFalso(latencia_segundos=0.01)
+
+    monkeypatch.setattr(cliente_gemini.config, "GEMINI_BACKEND", "api")
+    monkeypatch.setenv("GEMINI_API_KEY", "clave-de-prueba")
+    monkeypatch.setattr(cliente_gemini, "_crear_modelo_genai", crear_modelo_genai)
+    cliente = cliente_gemini.iniciar_cliente()
+    try:
+        assert creados == []
+
+        async def generar_dos():
+            return await asyncio.gather(*(cliente.generar(PROMPT, tarea="prueba") for _ in range(2)))
+
+        assert all(texto for texto, _ in asyncio.run(generar_dos()))
+        assert creados == [("clave-de-prueba", cliente_gemini.config.GEMINI_MODEL_NAME)] # Una sola vez
+    finally:
+        cliente_gemini.cerrar_cliente()
@@ -0,0 +1,119 @@
+# tests/test_fusion.py
+import pytest
+from src import config
+from src import llm_processing
+
+
+def test_agrupar_respeta_fan_in_y_orden():
+    esquemas = [f"e{i}" for i in range(10)]
+    grupos = llm_processing._agrupar_esquemas_por_presupuesto(esquemas, [1] * 10, presupuesto_tokens=100, fan_in=4)
+
+    assert grupos == [["e0", "e1", "e2", "e3"], ["e4", "e5", "e6", "e7"], ["e8", "e9"]]
+
+
+def test_agrupar_respeta_presupuesto():
+    esquemas = ["a", "b", "c", "d", "e"]
+    grupos = llm_processing._agrupar_esquemas_por_presupuesto(esquemas, [40, 40, 30, 50, 10], presupuesto_tokens=100, fan_in=10)
+
+    assert grupos == [["a", "b"], ["c", "d", "e"]]
+
+
+def test_agrupar_presupuesto_exacto_cabe():
+    grupos = llm_processing._agrupar_esquemas_por_presupuesto(["a", "b"], [50, 50], presupuesto_tokens=100, fan_in=4)
+    assert grupos == [["a", "b"]]
+
+
+def test_agrupar_esquema_mayor_que_el_presupuesto_queda_solo():
+    grupos = llm_processing._agrupar_esquemas_por_presupuesto(["a", "grande", "b"], [10, 500, 10], presupuesto_tokens=100, fan_in=4)
+    assert grupos == [["a"], ["grande"], ["b"]]
+
+
+def test_agrupar_lista_vacia():
+    assert llm_processing._agrupar_esquemas_por_presupuesto([], [], presupuesto_tokens=100, fan_in=4) == []
+
+
+@pytest.fixture
+def fusion_simulada(monkeypatch):
+    """
+    Fusión sin modelo: cada esquema cuenta un token por palabra, el contexto de fusión es pequeño y
+    cada fusión de grupo devuelve un esquema de una sola línea. Devuelve la lista de llamadas.
+    """
+    llamadas = []
+
+    def fusionar_grupo(lista, descripcion_tarea="Fusión de Esquemas", emitir_token=None):
+        llamadas.append({"esquemas": list(lista), "descripcion": descripcion_tarea, "emitir_token": emitir_token})
+        return f"fusion{len(llamadas)} " + " ".join(e.split()[0] for e in lista)
+
+    monkeypatch.setattr(llm_processing, "fusionar_grupo_de_esquemas", fusionar_grupo)
+    monkeypatch.setattr(llm_processing, "_contar_tokens_texto", lambda texto, tipo_tarea="fusion": len(texto.split()))
+    monkeypatch.setattr(llm_processing, "n_ctx_tarea", lambda tipo_tarea: 600)
+    monkeypatch.setattr(config, "MAX_TOKENS_ESQUEMA_FUSIONADO", 100)
+    monkeypatch.setattr(config, "FUSION_FAN_IN", 3)
+    return llamadas
+
+
+def _presupuesto():
+    tokens_base = len(llm_processing.prompts.PROMPT_FUSIONAR_ESQUEMAS_TEMPLATE.replace("{texto_esquemas_parciales}", "").split())
+    return 600 - tokens_base - 100 - 20
+
+
+def test_fusion_en_un_solo_prompt_si_caben(fusion_simulada):
+    emitir = object()
+    esquemas = ["uno dos", "tres cuatro", "cinco seis"]
+    resultado = llm_processing._fusionar_esquemas_en_arbol(esquemas, emitir_token=emitir)
+
+    assert len(fusion_simulada) == 1
+    assert fusion_simulada[0]["esquemas"] == esquemas
+    assert fusion_simulada[0]["emitir_token"] is emitir
+    assert resultado.startswith("fusion1")
+
+
+def test_fusion_jerarquica_si_exceden_el_presupuesto(fusion_simulada):
+    presupuesto = _presupuesto()
+    # Cada esquema ocupa algo menos de un tercio del presupuesto (con el separador de 12 tokens).
+    palabras_por_esquema = presupuesto // 3 - 12
+    esquemas = [" ".join([f"esquema{i}"] + ["palabra"] * (palabras_por_esquema - 1)) for i in range(7)]
+    emitir = object()
+    resultado = llm_processing._fusionar_esquemas_en_arbol(esquemas, emitir_token=emitir)
+
+    intermedias, final = fusion_simulada[:-1], fusion_simulada[-1]
+    assert len(intermedias) >= 2
+    for llamada in intermedias:
+        assert 2 <= len(llamada["esquemas"]) <= config.FUSION_FAN_IN
+        assert sum(len(e.split()) + 12 for e in llamada["esquemas"]) <= presupuesto
+        assert llamada["emitir_token"] is None # Solo la fusión final emite tokens
+    assert final["emitir_token"] is emitir
+    assert "final" in final["descripcion"]
+    # Se conserva el orden cronológico: el primer nivel agrupa esquemas consecutivos.
+    assert [e.split()[0] for e in intermedias[0]["esquemas"]] == ["esquema0", "esquema1", "esquema2"]
+    assert resultado.startswith(f"fusion{len(fusion_simulada)}")
+
+
+def test_fusion_sin_reduccion_posible_hace_una_fusion_final(fusion_simulada):
+    demasiado_grande = " ".join(["palabra"] * (_presupuesto() + 10))
+    esquemas = [demasiado_grande, demasiado_grande]
+    llm_processing._fusionar_esquemas_en_arbol(esquemas)
+
+    assert len(fusion_simulada) == 1
+    assert fusion_simulada[0]["esquemas"] == esquemas
+    assert "sin reducción" in fusion_simulada[0]["descripcion"]
+
+
+def test_fusion_jerarquica_con_el_backend_falso(registro_falso, monkeypatch):
+    llamadas = []
+    fusionar_grupo = llm_processing.fusionar_grupo_de_esquemas
+
+    def espiar(lista, *args, **kwargs):
+        llamadas.append(len(lista))
+        return fusionar_grupo(lista, *args, **kwargs)
+
+    monkeypatch.setattr(llm_processing, "fusionar_grupo_de_esquemas", espiar)
+    monkeypatch.setattr(llm_processing, "n_ctx_tarea", lambda tipo_tarea: 3200) # Presupuesto para ~4 de estos esquemas
+    monkeypatch.setattr(config, "FUSION_FAN_IN", 2)
+    esquemas = [f"{i}. Tema {i}\n    {i}.1. Detalle del tema {i} con varias palabras" for i in range(1, 6)]
+
+    resultado = llm_processing._fusionar_esquemas_en_arbol(esquemas)
+
+    assert len(llamadas) > 1
+    assert llamadas[0] == 2
+    assert resultado and resultado.lstrip().startswith("1.")
@@ -0,0 +1,72 @@
+# tests/test_gramaticas.py
+import re
+import pytest
+from src import config
+from src import gramaticas
+from src import llm_processing
+from tests.textos import texto_de_clase
+
+
+def _admite(esquema, profundidad_max):
+    """Lo que admite gbnf_esquema(profundidad_max), como expresión regular línea a línea."""
+    lineas = esquema[:-1].split("\n") if esquema.endswith("\n") else esquema.split("\n")
+    nivel_anterior = 0
+    for linea in lineas:
+        coincidencia = re.fullmatch(r"([ \t]*)((?:[1-9][0-9]?\.)+) [^\n\t ][^\n]*", linea)
+        if coincidencia is None:
+            return False
+        nivel = coincidencia.group(2).count(".")
+        if nivel > profundidad_max or nivel > nivel_anterior + 1 or (nivel == 1 and coincidencia.group(1)):
+            return False
+        nivel_anterior = nivel
+    return bool(lineas)
+
+
+def test_gbnf_esquema_de_dos_niveles():
+    assert gramaticas.gbnf_esquema(2) == (
+        'root ::= nivel1+ "\\n"?\n'
+        'nivel1 ::= [1-9] [0-9]? "." " " texto "\\n" nivel2*\n'
+        'nivel2 ::= [ \\t]* [1-9] [0-9]? "." [1-9] [0-9]? "." " " texto "\\n"\n'
+        'texto ::= [^\\n\\t ] [^\\n]*\n'
+    )
+
+
+def test_gbnf_esquema_profundidad_invalida():
+    with pytest.raises(ValueError, match="al menos 1"):
+        gramaticas.gbnf_esquema(0)
+
+
+@pytest.mark.parametrize("esquema, admitido", [
+    ("1. Termodinámica\n    1.1. Entropía\n        1.1.1. Segundo principio\n2. Máquinas térmicas\n", True),
+    ("Aquí tienes el esquema:\n1. Termodinámica\n", False), # Preámbulo
+    ("1. Termodinámica\n1.1.1. Entropía\n", False), # Nivel 3 sin nivel 2
+    ("   1. Termodinámica\n", False), # El nivel 1 empieza en la columna 0
+    ("1. Termodinámica\n    1.1. Entropía\n        1.1.1. Segundo\n            1.1.1.1. Clausius\n", False), # Más de 3 niveles
+])
+def test_lineas_que_admite_un_esquema_de_tres_niveles(esquema, admitido):
+    assert _admite(esquema, 3) is admitido
+
+
+def test_la_salida_del_backend_falso_cumple_la_gramatica(tokenizador):
+    resultado = tokenizador.completar(texto_de_clase(2), max_tokens=512)
+    assert _admite(resultado["choices"][0]["text"], config.LLM_GRAMATICA_ESQUEMA_PROFUNDIDAD)
+
+
+def test_la_gramatica_llega_a_la_generacion_y_a_la_clave_de_cache(registro_falso, monkeypatch):
+    gramaticas_recibidas = []
+    generar_con_llm = llm_processing._generar_con_llm
+
+    def registrar(*args, **kwargs):
+        gramaticas_recibidas.append(kwargs.get("gramatica"))
+        return generar_con_llm(*args, **kwargs)
+    monkeypatch.setattr(llm_processing, "_generar_con_llm", registrar)
+
+    texto = texto_de_clase(2)
+    clave_sin_gramatica = llm_processing._componentes_cache_esquema_parcial(texto)
+    llm_processing.generar_esquema_de_texto(texto)
+    assert gramaticas_recibidas == [None]
+
+    monkeypatch.setattr(config, "LLM_GRAMATICA_ESQUEMA", True)
+    assert llm_processing._componentes_cache_esquema_parcial(texto) != clave_sin_gramatica
+    llm_processing.generar_esquema_de_texto(texto) # Otra clave de caché: se vuelve a generar
+    assert gramaticas_recibidas == [None, gramaticas.gbnf_esquema(config.LLM_GRAMATICA_ESQUEMA_PROFUNDIDAD)]
@@ -0,0 +1,37 @@
+# tests/test_indice_lexico.py
+from src import indice_lexico
+
+
+def test_normalizar_texto_es_quita_tildes_palabras_vacias_y_sufijos():
+    assert indice_lexico.normalizar_texto_es("La Termodinámica y las máquinas térmicas") == ["termodinamica", "maquin", "termic"]
+    # Variantes de la misma palabra comparten raíz.
+    assert indice_lexico.normalizar_texto_es("explicación") == indice_lexico.normalizar_texto_es("explicaciones")
+
+
+def test_dividir_en_ventanas_agrupa_parrafos_cortos_y_corta_los_largos_en_oraciones():
+    texto = "Uno dos tres.\n\nCuatro cinco.\n\nSeis siete ocho nueve diez. Once doce trece catorce."
+    assert indice_lexico.dividir_en_ventanas(texto, 5) == [
+        "Uno dos tres. Cuatro cinco.",
+        "Seis siete ocho nueve diez.",
+        "Once doce trece catorce.",
+    ]
+
+
+def test_consulta_desde_seccion_quita_numeracion_y_vinetas():
+    seccion = "1.2. Entropía\n  - Segundo principio\n* Ciclo de Carnot"
+    assert indice_lexico.consulta_desde_seccion(seccion) == "Entropía Segundo principio Ciclo de Carnot"
+
+
+def test_buscar_ordena_por_relevancia():
+    indice = indice_lexico.IndiceBM25([
+        "Hoy repasamos la fotosíntesis en las plantas.",
+        "La entropía mide el desorden; la entropía de un sistema aislado nunca disminuye.",
+        "El ciclo de Carnot y la entropía de las máquinas térmicas.",
+    ])
+
+    resultados = indice.buscar("Entropía de un sistema")
+    assert [i for i, _ in resultados] == [1, 2]
+    assert resultados[0][1] > resultados[1][1] > 0
+    assert indice.buscar("entropía", top_k=1)[0][0] == 1
+    assert indice.buscar("mecánica cuántica") == []
+    assert indice.tokens_por_ventana == [None, None, None]
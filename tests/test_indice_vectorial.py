@@ -0,0 +1,95 @@
+# tests/test_indice_vectorial.py
+import numpy as np
+import pytest
+from src import config
+from src import backends_llm
+from src import indice_vectorial
+
+
+class _LlamaSinPooling:
+    """Lo que devuelve llama.cpp con un decodificador sin pooling: una lista de vectores por token para cada texto."""
+
+    def embed(self, textos, normalize=True):
+        return [[[0.1, 0.2, 0.3] for _ in texto.split()] for texto in textos]
+
+
+class _LlamaConPooling:
+    def embed(self, textos, normalize=True):
+        return [[1.0, 0.0, 0.0] for _ in textos]
+
+
+@pytest.fixture(autouse=True)
+def sin_backend_de_embeddings(monkeypatch):
+    monkeypatch.setattr(indice_vectorial, "_backend_embeddings", None)
+
+
+def test_calcular_embeddings_devuelve_un_vector_por_texto():
+    textos = ["La entropía de un sistema aislado", "El calor fluye del cuerpo caliente al frío", "Tercer texto"]
+    embeddings = indice_vectorial.calcular_embeddings(textos)
+
+    assert embeddings.shape == (len(textos), backends_llm.BackendFalso.DIMENSION_EMBEDDINGS)
+    assert embeddings.dtype == np.float32
+    assert np.allclose(np.linalg.norm(embeddings, axis=1), 1.0)
+
+
+def test_calcular_embeddings_rechaza_vectores_por_token(monkeypatch):
+    backend = backends_llm.BackendLlamaCpp(embedding=True)
+    backend.llama = _LlamaSinPooling()
+    monkeypatch.setattr(indice_vectorial, "_backend_embeddings", backend)
+
+    with pytest.raises(ValueError, match="un vector por texto"):
+        indice_vectorial.calcular_embeddings(["dos palabras", "y tres palabras"])
+
+
+def test_embed_de_llama_cpp_con_pooling():
+    backend = backends_llm.BackendLlamaCpp(embedding=True)
+    backend.llama = _LlamaConPooling()
+    assert np.asarray(backend.embed(iter(["a", "b"]))).shape == (2, 3)
+
+
+def test_calcular_embeddings_rechaza_forma_incorrecta(monkeypatch):
+    class BackendIncompleto:
+        def embed(self, textos):
+            return [[1.0, 0.0]] # Un solo vector para dos textos
+
+    monkeypatch.setattr(indice_vectorial, "_backend_embeddings", BackendIncompleto())
+    with pytest.raises(ValueError, match="forma"):
+        indice_vectorial.calcular_embeddings(["uno", "dos"])
+
+
+@pytest.mark.parametrize("pooling, constante", [("mean", "LLAMA_POOLING_TYPE_MEAN"), ("last", "LLAMA_POOLING_TYPE_LAST")])
+def test_modo_embeddings_de_llama_cpp_fija_el_pooling(tmp_path, monkeypatch, pooling, constante):
+    llama_cpp = pytest.importorskip("llama_cpp")
+    argumentos = {}
+
+    class LlamaRegistrado:
+        def __init__(self, **kwargs):
+            argumentos.update(kwargs)
+
+    monkeypatch.setattr(llama_cpp, "Llama", LlamaRegistrado)
+    ruta = tmp_path / "modelo.gguf"
+    ruta.write_bytes(b"GGUF")
+
+    backends_llm.BackendLlamaCpp(ruta_modelo=str(ruta), embedding=True, pooling=pooling).cargar()
+    assert argumentos["embedding"] is True
+    assert argumentos["pooling_type"] == getattr(llama_cpp, constante)
+
+    argumentos.clear()
+    backends_llm.BackendLlamaCpp(ruta_modelo=str(ruta), decodificacion_especulativa="").cargar()
+    assert "pooling_type" not in argumentos and not argumentos.get("embedding")
+
+
+def test_pooling_desconocido(tmp_path):
+    pytest.importorskip("llama_cpp")
+    ruta = tmp_path / "modelo.gguf"
+    ruta.write_bytes(b"GGUF")
+    with pytest.raises(ValueError, match="Pooling"):
+        backends_llm.BackendLlamaCpp(ruta_modelo=str(ruta), embedding=True, pooling="max").cargar()
+
+
+def test_la_huella_del_modelo_incluye_el_pooling(monkeypatch):
+    monkeypatch.setattr(config, "LLM_BACKEND", backends_llm.BackendLlamaCpp.nombre)
+    monkeypatch.setattr(config, "VECTOR_EMBEBIDO_POOLING", "mean")
+    media = indice_vectorial.huella_modelo_embeddings()
+    monkeypatch.setattr(config, "VECTOR_EMBEBIDO_POOLING", "last")
+    assert indice_vectorial.huella_modelo_embeddings() != media
@@ -0,0 +1,68 @@
+# tests/test_ingesta.py
+import pytest
+from src import ingesta
+from src import indice_vectorial
+
+
+@pytest.fixture(autouse=True)
+def indice_nuevo(monkeypatch):
+    """Cada prueba abre su propio índice (en el VECTOR_EMBEBIDO_DIR temporal) con el backend falso."""
+    monkeypatch.setattr(indice_vectorial, "_indice", None)
+    monkeypatch.setattr(indice_vectorial, "_backend_embeddings", None)
+
+
+@pytest.fixture
+def documentos(tmp_path):
+    directorio = tmp_path / "referencias"
+    (directorio / "sub").mkdir(parents=True)
+    (directorio / "a.txt").write_text("La entropía de un sistema aislado nunca disminuye.", encoding="utf-8")
+    (directorio / "sub" / "b.md").write_text("El ciclo de Carnot es reversible.\fSegunda página sobre exergía.", encoding="utf-8")
+    (directorio / ".oculto.txt").write_text("No se indexa.", encoding="utf-8")
+    return directorio
+
+
+@pytest.fixture
+def lotes_embeddings(monkeypatch):
+    """Textos de cada llamada a calcular_embeddings durante la prueba."""
+    lotes = []
+    calcular_embeddings = indice_vectorial.calcular_embeddings
+
+    def registrar(textos):
+        lotes.append(list(textos))
+        return calcular_embeddings(textos)
+    monkeypatch.setattr(indice_vectorial, "calcular_embeddings", registrar)
+    return lotes
+
+
+def test_solo_se_reindexan_los_documentos_modificados(documentos, lotes_embeddings):
+    resumen = ingesta.ingestar_directorio(str(documentos))
+    assert resumen["ingestados"] == [{"fuente": "a.txt", "fragmentos": 1}, {"fuente": "sub/b.md", "fragmentos": 2}]
+    assert resumen["fragmentos"] == 3 and len(lotes_embeddings) == 1
+
+    # Sin cambios: se comparan los sha256 y no se embebe nada.
+    resumen = ingesta.ingestar_directorio(str(documentos))
+    assert resumen["ingestados"] == [] and resumen["sin_cambios"] == 2
+    assert len(lotes_embeddings) == 1
+
+    (documentos / "a.txt").write_text("La entalpía es una función de estado.", encoding="utf-8")
+    resumen = ingesta.ingestar_directorio(str(documentos))
+    assert resumen["ingestados"] == [{"fuente": "a.txt", "fragmentos": 1}] and resumen["sin_cambios"] == 1
+    assert lotes_embeddings[-1] == ["La entalpía es una función de estado."]
+
+    # La versión anterior del documento deja de aparecer en las búsquedas.
+    textos = [r["text"] for r in indice_vectorial.consultar("entropía entalpía", top_k=5)]
+    assert "La entalpía es una función de estado." in textos
+    assert "La entropía de un sistema aislado nunca disminuye." not in textos
+    assert len(textos) == 3
+
+
+def test_reconstruir_reindexa_todo(documentos, lotes_embeddings):
+    ingesta.ingestar_directorio(str(documentos))
+    resumen = ingesta.ingestar_directorio(str(documentos), reconstruir=True)
+    assert len(resumen["ingestados"]) == 2 and resumen["sin_cambios"] == 0
+    assert len(indice_vectorial.consultar("Carnot", top_k=10)) == 3
+
+
+def test_directorio_inexistente(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        ingesta.ingestar_directorio(str(tmp_path / "no_existe"))
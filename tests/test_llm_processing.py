@@ -0,0 +1,123 @@
+# tests/test_llm_processing.py
+import pytest
+from src import backends_llm
+from src import llm_processing
+
+PROMPT = "Genera el esquema de esta clase sobre termodinámica y entropía."
+
+
+def _generar(**kwargs):
+    return llm_processing._generar_con_llm(PROMPT, 64, 0.3, "Prueba", tipo_tarea="esquema", **kwargs)
+
+
+def test_generacion_con_el_backend_falso(registro_falso):
+    texto, finish_reason, stats = _generar()
+
+    assert texto
+    assert finish_reason in ("stop", "length")
+    assert stats["n_ctx"] == registro_falso.contexto_para("esquema", stats["tokens_prompt"] + 64 + 20)
+
+
+def test_fallo_al_cargar_el_modelo(registro_falso, monkeypatch):
+    def usar(tarea, tokens_necesarios=None):
+        raise MemoryError("sin memoria para el contexto")
+
+    monkeypatch.setattr(registro_falso, "usar", usar)
+    texto, finish_reason, _ = _generar()
+
+    assert texto is None
+    assert finish_reason == "model_load_failed: sin memoria para el contexto"
+
+
+def test_fallo_al_obtener_el_tokenizador(registro_falso, monkeypatch):
+    def tokenizador(tarea):
+        raise FileNotFoundError("modelo.gguf")
+
+    monkeypatch.setattr(registro_falso, "tokenizador", tokenizador)
+    assert _generar()[1].startswith("model_load_failed")
+
+
+def test_un_error_de_generacion_no_es_un_fallo_de_carga(registro_falso, monkeypatch):
+    def stream(self, *args, **kwargs):
+        raise RuntimeError("llama_decode devolvió 1")
+
+    monkeypatch.setattr(backends_llm.BackendFalso, "stream", stream)
+    texto, finish_reason, _ = _generar(emitir_token=lambda texto: None)
+
+    assert texto is None
+    assert finish_reason == "exception_during_llm_call: llama_decode devolvió 1"
+
+
+def test_un_error_inesperado_se_propaga_con_su_causa(registro_falso, monkeypatch):
+    def generar_con_modelo(*args, **kwargs):
+        raise KeyError("choices")
+
+    monkeypatch.setattr(llm_processing, "_generar_con_modelo", generar_con_modelo)
+    with pytest.raises(KeyError):
+        _generar()
+    assert all(c["en_uso"] == 0 for c in registro_falso.cargados()) # La reserva del contexto se libera igual
+
+
+def test_el_prefijo_de_apuntes_cuenta_como_evaluado_la_primera_vez(registro_falso, monkeypatch):
+    from tests.textos import texto_de_clase
+    from src import metricas
+    monkeypatch.setattr(llm_processing.config, "APUNTES_MODO_CONTEXTO", "prefijo_kv")
+    llamadas = []
+    monkeypatch.setattr(metricas, "registrar_llamada_llm", lambda tarea, finish_reason, stats: llamadas.append(stats))
+    transcripcion = texto_de_clase(3)
+    contexto_apuntes = llm_processing.preparar_contexto_apuntes(transcripcion)
+    tokens_prefijo = len(contexto_apuntes["prefijo_kv"]["tokens"])
+
+    for i, seccion in enumerate(("1. Primera ley", "2. Entropía")):
+        assert llm_processing.generar_apuntes_por_seccion(seccion, transcripcion, i + 1, 2, contexto_apuntes=contexto_apuntes)
+
+    primera, segunda = llamadas
+    assert primera["tokens_prompt_reutilizados"] == 0
+    assert primera["tokens_prompt_evaluados"] == primera["tokens_prompt"]
+    assert segunda["tokens_prompt_reutilizados"] == tokens_prefijo
+    assert segunda["tokens_prompt_evaluados"] == segunda["tokens_prompt"] - tokens_prefijo
+
+
+class _LlmConBorrador:
+    def __init__(self, *contadores):
+        self._contadores = list(contadores)
+
+    def estadisticas_borrador(self):
+        return self._contadores.pop(0)
+
+
+def test_estadisticas_borrador():
+    llm = _LlmConBorrador({"pases": 10, "propuestos": 40}, {"pases": 14, "propuestos": 56})
+    # 20 generados: 1 de la evaluación del prompt + 4 de los pases de verificación + 15 aceptados.
+    stats = llm_processing._estadisticas_borrador(llm, llm.estadisticas_borrador(), 20)
+    assert stats == {"tokens_borrador_propuestos": 16, "tokens_borrador_aceptados": 15, "tasa_aceptacion_borrador": 15 / 16}
+
+    assert llm_processing._estadisticas_borrador(_LlmConBorrador(None), None, 20) == {}
+
+
+class _LlamaBorradorFalso:
+    def __init__(self, n_ctx):
+        self._n_ctx = n_ctx
+        self.generaciones = 0
+
+    def n_ctx(self):
+        return self._n_ctx
+
+    def token_eos(self):
+        return -1
+
+    def generate(self, tokens, **kwargs):
+        self.generaciones += 1
+        while True:
+            yield 7
+
+
+@pytest.mark.parametrize("longitud_prompt, propone", [(91, True), (92, False), (99, False)])
+def test_el_borrador_gguf_solo_propone_si_el_borrador_cabe_en_el_contexto(longitud_prompt, propone):
+    import numpy as np
+    borrador = object.__new__(backends_llm.BorradorGGUF)
+    borrador.llama = _LlamaBorradorFalso(n_ctx=100)
+    borrador.num_pred_tokens = 8
+
+    propuesta = borrador(np.arange(longitud_prompt, dtype=np.intc))
+    assert propuesta.tolist() == ([7] * 8 if propone else [])
@@ -0,0 +1,20 @@
+# tests/test_main.py
+import argparse
+from src import main
+from src import config
+from src import llm_processing
+
+
+def test_una_salida_anticipada_cierra_pool_y_cache(tmp_path, monkeypatch):
+    transcripcion_vacia = tmp_path / "vacia.txt"
+    transcripcion_vacia.write_text("", encoding="utf-8")
+    monkeypatch.setattr(config, "INPUT_FILE_PATH", str(transcripcion_vacia))
+    cerrados = []
+    monkeypatch.setattr(main.pool_replicas, "cerrar_pool", lambda: cerrados.append("pool"))
+    monkeypatch.setattr(main.cache_resultados, "cerrar", lambda: cerrados.append("cache"))
+    try:
+        main._procesar(argparse.Namespace(cpu=False, generar_apuntes=False))
+    finally:
+        llm_processing.registro.cerrar()
+        llm_processing.registro = None
+    assert cerrados == ["pool", "cache"]
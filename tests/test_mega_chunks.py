@@ -0,0 +1,110 @@
+# tests/test_mega_chunks.py
+import pytest
+from src import config
+from src import utils
+from src.documento_tokenizado import DocumentoTokenizado
+from tests.textos import texto_de_clase
+
+
+def _documento(texto, tokenizador):
+    return DocumentoTokenizado.desde_texto(texto, tokenizador)
+
+
+@pytest.mark.parametrize("max_tokens, overlap", [(200, 0), (200, 40), (500, 100), (64, 0)])
+def test_rangos_cubren_el_documento_sin_superar_el_maximo(tokenizador, max_tokens, overlap):
+    documento = _documento(texto_de_clase(30), tokenizador)
+    rangos = list(utils.calcular_rangos_mega_chunks(documento, max_tokens, overlap))
+
+    assert len(rangos) > 1
+    assert rangos[0][0] == 0
+    assert rangos[-1][1] == documento.num_tokens
+    for inicio, fin in rangos:
+        assert 0 < fin - inicio <= max_tokens
+    for (inicio_anterior, fin_anterior), (inicio, fin) in zip(rangos, rangos[1:]):
+        # Sin huecos entre chunks y con un solapamiento de como máximo `overlap` tokens.
+        assert fin_anterior - overlap <= inicio <= fin_anterior
+        assert fin > fin_anterior
+        assert inicio > inicio_anterior
+
+
+def test_sin_overlap_los_chunks_reconstruyen_el_texto(tokenizador):
+    texto = texto_de_clase(20)
+    documento = _documento(texto, tokenizador)
+    chunks = list(utils.dividir_en_mega_chunks(documento, 150, 0))
+
+    assert "".join(c.texto for c in chunks) == texto
+    assert sum(c.num_tokens for c in chunks) == documento.num_tokens
+
+
+def test_los_chunks_son_vistas_de_los_tokens_del_documento(tokenizador):
+    documento = _documento(texto_de_clase(10), tokenizador)
+    rangos = list(utils.calcular_rangos_mega_chunks(documento, 120, 20))
+    chunks = list(utils.dividir_en_mega_chunks(documento, 120, 20, rangos=rangos))
+
+    assert len(chunks) == len(rangos)
+    for chunk, (inicio, fin) in zip(chunks, rangos):
+        assert chunk.tokens.tolist() == documento.tokens[inicio:fin].tolist()
+        assert tokenizador.detokenize(chunk.tokens).decode("utf-8") == chunk.texto
+
+
+def test_los_cortes_caen_en_fin_de_oracion(tokenizador):
+    documento = _documento(texto_de_clase(20), tokenizador)
+    chunks = list(utils.dividir_en_mega_chunks(documento, 200, 0))
+
+    for chunk in chunks[:-1]:
+        assert chunk.texto.rstrip().endswith("clase.")
+
+
+def test_texto_sin_puntuacion_se_corta_entre_palabras(tokenizador):
+    texto = " ".join(f"palabra{i}" for i in range(600))
+    documento = _documento(texto, tokenizador)
+    rangos = list(utils.calcular_rangos_mega_chunks(documento, 100, 0))
+
+    assert len(rangos) > 1
+    for inicio, fin in rangos:
+        assert fin - inicio <= 100
+    for chunk in utils.dividir_en_mega_chunks(documento, 100, 0, rangos=rangos):
+        assert all(palabra.startswith("palabra") and palabra[7:].isdigit() for palabra in chunk.texto.split())
+
+
+def test_una_correccion_local_solo_cambia_los_chunks_cercanos(tokenizador):
+    texto = texto_de_clase(40)
+    corregido = texto.replace("En el punto 35.2 hablamos", "En el punto 35.2 ya hablamos")
+    assert corregido != texto
+    originales = [c.texto for c in utils.dividir_en_mega_chunks(_documento(texto, tokenizador), 200, 0)]
+    nuevos = [c.texto for c in utils.dividir_en_mega_chunks(_documento(corregido, tokenizador), 200, 0)]
+
+    iguales_al_inicio = next(i for i, (a, b) in enumerate(zip(originales, nuevos)) if a != b)
+    assert iguales_al_inicio >= len(originales) // 2
+    assert originales[:iguales_al_inicio] == nuevos[:iguales_al_inicio]
+
+
+def test_un_solo_chunk_si_el_texto_cabe(tokenizador):
+    documento = _documento("Una oración corta. Y otra más.", tokenizador)
+    assert list(utils.calcular_rangos_mega_chunks(documento, 1000, 100)) == [(0, documento.num_tokens)]
+
+
+@pytest.mark.parametrize("max_tokens, overlap", [(100, 100), (50, 80), (0, 0)])
+def test_parametros_invalidos_no_generan_chunks(tokenizador, max_tokens, overlap):
+    documento = _documento(texto_de_clase(3), tokenizador)
+    assert list(utils.calcular_rangos_mega_chunks(documento, max_tokens, overlap)) == []
+
+
+def test_documento_vacio_no_genera_chunks(tokenizador):
+    assert list(utils.dividir_en_mega_chunks(_documento("", tokenizador), 100, 10)) == []
+
+
+def test_overlap_negativo_se_trata_como_cero(tokenizador):
+    documento = _documento(texto_de_clase(10), tokenizador)
+    assert (list(utils.calcular_rangos_mega_chunks(documento, 150, -5))
+            == list(utils.calcular_rangos_mega_chunks(documento, 150, 0)))
+
+
+def test_tamano_minimo_de_los_chunks(tokenizador):
+    documento = _documento(texto_de_clase(40), tokenizador)
+    max_tokens = 300
+    rangos = list(utils.calcular_rangos_mega_chunks(documento, max_tokens, 0))
+
+    minimo = int(max_tokens * config.MEGA_CHUNK_TAMANO_MIN_FRACCION)
+    for inicio, fin in rangos[:-1]:
+        assert fin - inicio >= minimo
@@ -0,0 +1,98 @@
+# tests/test_metricas.py
+import re
+import pytest
+from src import metricas
+
+# Línea de muestra del formato de texto de Prometheus 0.0.4: nombre{etiquetas} valor
+_MUESTRA = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*"(,[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*")*\})? (-?[0-9.e+-]+|\+Inf|-Inf|NaN)$')
+
+
+@pytest.fixture
+def metricas_temporales():
+    """Métricas creadas en la prueba, retiradas del registro global al terminar."""
+    creadas = []
+
+    def crear(clase, *args, **kwargs):
+        metrica = clase(*args, **kwargs)
+        creadas.append(metrica)
+        return metrica
+
+    yield crear
+    for metrica in creadas:
+        metricas._registro.remove(metrica)
+
+
+def test_contador(metricas_temporales):
+    contador = metricas_temporales(metricas.Contador, "prueba_peticiones_total", "Peticiones de prueba.", ("endpoint", "codigo"))
+    contador.inc(endpoint="/esquema", codigo=200)
+    contador.inc(2, endpoint="/esquema", codigo=200)
+    contador.inc(0.5, endpoint="/apuntes", codigo=500)
+
+    assert contador.exponer().splitlines() == [
+        "# HELP prueba_peticiones_total Peticiones de prueba.",
+        "# TYPE prueba_peticiones_total counter",
+        'prueba_peticiones_total{endpoint="/apuntes",codigo="500"} 0.5',
+        'prueba_peticiones_total{endpoint="/esquema",codigo="200"} 3',
+    ]
+    assert contador.total() == 3.5
+
+
+def test_etiquetas_incorrectas(metricas_temporales):
+    contador = metricas_temporales(metricas.Contador, "prueba_etiquetas_total", "Prueba.", ("tarea",))
+    with pytest.raises(ValueError):
+        contador.inc(modelo="principal")
+
+
+def test_escapado_de_etiquetas(metricas_temporales):
+    contador = metricas_temporales(metricas.Contador, "prueba_escapado_total", "Prueba.", ("razon",))
+    contador.inc(razon='error "grave"\nen C:\\ruta')
+
+    assert contador.exponer().splitlines()[-1] == r'prueba_escapado_total{razon="error \"grave\"\nen C:\\ruta"} 1'
+
+
+def test_medidor_con_valor_y_con_funcion(metricas_temporales):
+    medidor = metricas_temporales(metricas.Medidor, "prueba_en_cola", "Trabajos en cola.")
+    medidor.establecer(3)
+    assert medidor.exponer().splitlines()[-1] == "prueba_en_cola 3"
+
+    medidor.establecer_funcion(lambda: 7.25)
+    assert medidor.exponer().splitlines()[-1] == "prueba_en_cola 7.25"
+
+    medidor.establecer_funcion(lambda: 1 / 0) # Un error al leer no rompe la exposición
+    assert medidor.exponer().splitlines() == ["# HELP prueba_en_cola Trabajos en cola.", "# TYPE prueba_en_cola gauge"]
+
+
+def test_histograma_acumulado(metricas_temporales):
+    histograma = metricas_temporales(metricas.Histograma, "prueba_duracion_segundos", "Duración.", ("tarea",), limites=(1, 5))
+    for valor in (0.5, 1, 3, 10):
+        histograma.observar(valor, tarea="fusion")
+
+    assert histograma.exponer().splitlines()[2:] == [
+        'prueba_duracion_segundos_bucket{tarea="fusion",le="1"} 2',
+        'prueba_duracion_segundos_bucket{tarea="fusion",le="5"} 3',
+        'prueba_duracion_segundos_bucket{tarea="fusion",le="+Inf"} 4',
+        'prueba_duracion_segundos_sum{tarea="fusion"} 14.5',
+        'prueba_duracion_segundos_count{tarea="fusion"} 4',
+    ]
+
+
+def test_exposicion_completa_es_formato_prometheus():
+    metricas.LLM_TAREAS.inc(tarea="esquema")
+    metricas.LLM_DURACION.observar(2.5, tarea="esquema")
+    texto = metricas.exponer()
+
+    assert texto.endswith("\n")
+    nombres_declarados = set()
+    for linea in texto.splitlines():
+        if linea.startswith("# HELP "):
+            nombres_declarados.add(linea.split()[2])
+        elif linea.startswith("# TYPE "):
+            _, _, nombre, tipo = linea.split()
+            assert tipo in ("counter", "gauge", "histogram")
+            assert nombre in nombres_declarados
+        else:
+            assert _MUESTRA.match(linea), linea
+            nombre = linea.split("{")[0].split(" ")[0]
+            assert re.sub(r"_(bucket|sum|count)$", "", nombre) in nombres_declarados
+    assert len(nombres_declarados) == len(metricas._registro) # Ningún nombre repetido
+    assert 'apuntes_llm_tareas_total{tarea="esquema"}' in texto
@@ -0,0 +1,72 @@
+# tests/test_pipeline.py
+import re
+import pytest
+from src import config
+from src import pipeline
+from src import cache_resultados
+from tests.textos import texto_de_clase
+
+_LINEA_ESQUEMA = re.compile(r"^\s*\d+(\.\d+)*\.\s+\S")
+
+
+def _ejecutar(texto, **kwargs):
+    fases = []
+    esquema = pipeline.generar_esquema_completo(texto, reportar_progreso=lambda fase, a, t: fases.append((fase, a, t)), **kwargs)
+    return esquema, fases
+
+
+def test_esquema_en_un_solo_pase(registro_falso):
+    tokens = []
+    esquema, fases = _ejecutar(texto_de_clase(5), emitir_token=tokens.append)
+
+    assert [f[0] for f in fases] == ["Análisis de tokens", "Esquema en un solo pase"]
+    assert all(_LINEA_ESQUEMA.match(linea) for linea in esquema.strip().splitlines())
+    assert "".join(tokens).strip() == esquema.strip()
+
+
+def test_esquema_con_mega_chunks_y_fusion(registro_falso):
+    tokens = []
+    esquema, fases = _ejecutar(texto_de_clase(160), emitir_token=tokens.append)
+
+    nombres = [f[0] for f in fases]
+    assert "División en mega-chunks" in nombres
+    parciales = [f for f in fases if f[0] == "Esquemas parciales"]
+    assert len(parciales) > 1
+    assert [f[1] for f in parciales] == list(range(1, len(parciales) + 1))
+    assert nombres[-1] == "Fusión de esquemas"
+    assert all(_LINEA_ESQUEMA.match(linea) for linea in esquema.strip().splitlines())
+    assert "".join(tokens).strip() == esquema.strip() # Solo la fusión final se emite en stream
+    # Cada llamada usó el contexto más pequeño donde cabía (ninguno mayor que el del modelo).
+    assert {c["n_ctx"] for c in registro_falso.cargados()} <= set(registro_falso.declaracion("principal")["contextos"])
+
+
+def test_segunda_ejecucion_sale_de_la_cache(registro_falso):
+    texto = texto_de_clase(160)
+    primero, _ = _ejecutar(texto)
+    aciertos_antes = cache_resultados.estadisticas()["por_tarea"].get("fusion", {}).get("aciertos", 0)
+    segundo, fases = _ejecutar(texto)
+
+    assert segundo == primero
+    assert cache_resultados.estadisticas()["por_tarea"]["fusion"]["aciertos"] == aciertos_antes + 1
+
+
+def test_esquema_sin_cache_es_determinista(registro_falso, monkeypatch):
+    monkeypatch.setattr(config, "CACHE_RESULTADOS_ACTIVADA", False)
+    texto = texto_de_clase(160)
+    assert _ejecutar(texto)[0] == _ejecutar(texto)[0]
+
+
+def test_sin_modelo_cargado():
+    with pytest.raises(pipeline.ErrorGeneracion, match="no cargado"):
+        pipeline.generar_esquema_completo("Texto.")
+
+
+def test_apuntes_de_cada_seccion(registro_falso):
+    texto = texto_de_clase(8)
+    esquema, _ = _ejecutar(texto)
+    secciones = pipeline.dividir_esquema_en_secciones(esquema)
+
+    apuntes = pipeline.generar_apuntes_completos(esquema, texto, "Guía de prueba")
+
+    assert secciones
+    assert apuntes and apuntes.strip()
@@ -0,0 +1,35 @@
+# tests/test_pool_replicas.py
+import os
+import multiprocessing
+import pytest
+from concurrent.futures import ProcessPoolExecutor
+from src import pipeline
+from src import pool_replicas
+from tests.textos import texto_de_clase
+
+
+def _pool_roto(monkeypatch):
+    """Pool global cuyas réplicas mueren al arrancar, como si el modelo no cupiera en memoria."""
+    pool = pool_replicas.PoolReplicas.__new__(pool_replicas.PoolReplicas)
+    pool.num_replicas = 1
+    pool.n_threads_por_replica = 1
+    pool._executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"),
+                                         initializer=os._exit, initargs=(1,))
+    monkeypatch.setattr(pool_replicas, "_pool", pool)
+    return pool
+
+
+@pytest.mark.parametrize("roto_antes_de_enviar", [False, True])
+def test_un_pool_roto_se_descarta_y_devuelve_none(monkeypatch, roto_antes_de_enviar):
+    pool = _pool_roto(monkeypatch)
+    if roto_antes_de_enviar: # `submit` lanza BrokenProcessPool en lugar de cada resultado
+        pool._executor.submit(len, "x").exception(timeout=30)
+    assert pool_replicas.obtener_pool().generar_esquemas_parciales(["a", "b"]) == [None, None]
+    assert pool_replicas.obtener_pool() is None
+
+
+def test_con_el_pool_roto_el_esquema_se_genera_con_el_modelo_local(registro_falso, monkeypatch):
+    _pool_roto(monkeypatch)
+    esquema = pipeline.generar_esquema_completo(texto_de_clase(160))
+    assert esquema.strip()
+    assert pool_replicas.obtener_pool() is None
@@ -0,0 +1,114 @@
+# tests/test_registro_modelos.py
+import time
+import threading
+from src import registro_modelos
+
+MODELOS = {"principal": {"archivo": "principal.gguf", "n_ctx": 8192}, "rapido": {"archivo": "rapido.gguf", "n_ctx": 4096}}
+POR_TAREA = {"esquema": "principal", "esquema_parcial": "rapido"}
+
+
+def _registro(**opciones):
+    return registro_modelos.RegistroModelos(
+        modelos=MODELOS, modelos_por_tarea=POR_TAREA, modelo_por_defecto="principal", nombre_backend="falso",
+        contextos=(2048, 4096), **opciones
+    )
+
+
+def _maximo_simultaneo(bloque, num_hilos=4):
+    """Ejecuta `bloque()` (un context manager) en varios hilos y devuelve cuántos estuvieron dentro a la vez."""
+    dentro, maximo = [0], [0]
+    contador = threading.Lock()
+
+    def trabajar():
+        with bloque():
+            with contador:
+                dentro[0] += 1
+                maximo[0] = max(maximo[0], dentro[0])
+            time.sleep(0.02)
+            with contador:
+                dentro[0] -= 1
+
+    hilos = [threading.Thread(target=trabajar) for _ in range(num_hilos)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join(timeout=5)
+    return maximo[0]
+
+
+def test_elige_el_contexto_mas_pequeno_que_alcanza():
+    registro = _registro()
+    assert registro.declaracion("principal")["contextos"] == [2048, 4096, 8192]
+    assert registro.contexto_para("esquema", 1500) == 2048
+    assert registro.contexto_para("esquema", 2049) == 4096
+    assert registro.contexto_para("esquema", 50_000) == 8192
+    assert registro.contexto_para("esquema") == 8192
+    assert registro.contexto_para("esquema_parcial", 5000) == 4096
+    with registro.usar("esquema", 3000) as backend:
+        assert backend.n_ctx() == 4096
+
+
+def test_por_defecto_los_contextos_abiertos_suman_a_lo_sumo_context_size(monkeypatch):
+    monkeypatch.setattr(registro_modelos.config, "LLM_CONTEXTOS_MAX_TOKENS_POR_MODELO", 12_000)
+    registro = _registro()
+    for tokens in (1000, 3000, 6000, 1000):
+        with registro.usar("esquema", tokens):
+            pass
+    # Al abrir 8192 se cierran 2048 y 4096; el 2048 vuelve a caber junto a él.
+    assert [c["n_ctx"] for c in registro.cargados()] == [8192, 2048]
+
+
+def test_sin_limites_todos_los_contextos_siguen_abiertos():
+    registro = _registro(max_contextos_por_modelo=0, max_tokens_contextos_por_modelo=0)
+    for tokens in (1000, 3000, 6000, 1000):
+        with registro.usar("esquema", tokens):
+            pass
+    assert sorted(c["n_ctx"] for c in registro.cargados()) == [2048, 4096, 8192]
+
+
+def test_max_contextos_cierra_el_usado_hace_mas_tiempo():
+    registro = _registro(max_contextos_por_modelo=2, max_tokens_contextos_por_modelo=0)
+    for tokens in (1000, 3000, 6000):
+        with registro.usar("esquema", tokens):
+            pass
+    assert sorted(c["n_ctx"] for c in registro.cargados()) == [4096, 8192]
+
+
+def test_usar_serializa_la_generacion_en_cada_contexto():
+    registro = _registro()
+    assert _maximo_simultaneo(lambda: registro.usar("esquema", 3000)) == 1
+
+
+def test_contextos_distintos_generan_en_paralelo():
+    registro = _registro()
+    tokens = iter([1000, 3000, 1000, 3000])
+    assert _maximo_simultaneo(lambda: registro.usar("esquema", next(tokens))) == 2
+
+
+def test_el_tokenizador_no_espera_a_la_generacion():
+    registro = _registro()
+    with registro.usar("esquema", 1000):
+        listo = threading.Event()
+
+        def tokenizar():
+            with registro.tokenizador("esquema") as backend:
+                backend.tokenize(b"hola")
+            listo.set()
+
+        threading.Thread(target=tokenizar).start()
+        assert listo.wait(timeout=2)
+
+
+def test_el_mismo_hilo_puede_anidar_bloques():
+    registro = _registro()
+    with registro.usar("esquema", 1000) as externo:
+        with registro.usar("esquema", 1000) as interno:
+            assert interno is externo
+
+
+def test_no_se_descarga_un_contexto_en_uso():
+    registro = _registro()
+    with registro.usar("esquema", 1000):
+        assert not registro.descargar("principal", 2048)
+    assert registro.descargar("principal", 2048)
+    assert registro.cargados() == []
@@ -0,0 +1,159 @@
+# tests/test_trabajos.py
+import time
+import threading
+import pytest
+from src import trabajos
+
+
+def _esperar_estado(almacen, id_trabajo, estados, timeout=5.0):
+    limite = time.time() + timeout
+    while time.time() < limite:
+        trabajo = almacen.obtener(id_trabajo)
+        if trabajo and trabajo["estado"] in estados:
+            return trabajo
+        time.sleep(0.01)
+    raise AssertionError(f"El trabajo {id_trabajo} no llegó a {estados}: {almacen.obtener(id_trabajo)}")
+
+
+def _ejecutor_que_escribe(llamadas):
+    def ejecutor(trabajo, entradas, reportar_progreso, emitir_token):
+        llamadas.append((trabajo["id"], entradas))
+        reportar_progreso("Procesando", 1, 1)
+        return f"{trabajo['nombre_base']}.md"
+    return ejecutor
+
+
+def test_crear_guarda_metadatos_y_entradas(tmp_path):
+    almacen = trabajos.AlmacenTrabajos(str(tmp_path / "trabajos"))
+    trabajo = almacen.crear("esquema", {"transcripcion": "Texto de la clase."}, "clase")
+
+    guardado = almacen.obtener(trabajo["id"])
+    assert guardado["estado"] == trabajos.ESTADO_EN_COLA
+    assert guardado["entradas"] == ["transcripcion"]
+    assert almacen.leer_entradas(guardado) == {"transcripcion": "Texto de la clase."}
+    assert almacen.obtener("inexistente") is None
+
+
+def test_reanuda_trabajos_interrumpidos_tras_un_reinicio(tmp_path):
+    directorio = str(tmp_path / "trabajos")
+    almacen = trabajos.AlmacenTrabajos(directorio)
+    en_cola = almacen.crear("esquema", {"transcripcion": "Primera clase."}, "primera")
+    interrumpido = almacen.crear("esquema", {"transcripcion": "Segunda clase."}, "segunda")
+    completado = almacen.crear("esquema", {"transcripcion": "Tercera clase."}, "tercera")
+    # Estado en disco de un proceso que murió a mitad del segundo trabajo.
+    almacen.actualizar(interrumpido["id"], estado=trabajos.ESTADO_EN_PROCESO, progreso={"fase": "Esquemas parciales"})
+    almacen.actualizar(completado["id"], estado=trabajos.ESTADO_COMPLETADO, archivo_resultado="tercera.md")
+
+    # Nuevo proceso: almacén y gestor nuevos sobre el mismo directorio.
+    llamadas = []
+    gestor = trabajos.GestorTrabajos(trabajos.AlmacenTrabajos(directorio), {"esquema": _ejecutor_que_escribe(llamadas)})
+    gestor.iniciar()
+
+    for trabajo, nombre in ((en_cola, "primera"), (interrumpido, "segunda")):
+        final = _esperar_estado(gestor.almacen, trabajo["id"], trabajos.ESTADOS_FINALES)
+        assert final["estado"] == trabajos.ESTADO_COMPLETADO
+        assert final["archivo_resultado"] == f"{nombre}.md"
+        assert final["progreso"]["fase"] == "Procesando"
+    # En orden de creación, y el ya completado no se repite.
+    assert [id_trabajo for id_trabajo, _ in llamadas] == [en_cola["id"], interrumpido["id"]]
+    assert llamadas[1][1] == {"transcripcion": "Segunda clase."}
+    assert gestor.almacen.obtener(completado["id"])["archivo_resultado"] == "tercera.md"
+
+
+def test_encolar_resuelve_el_futuro_y_notifica_al_oyente(tmp_path):
+    def ejecutor(trabajo, entradas, reportar_progreso, emitir_token):
+        reportar_progreso("Generando")
+        emitir_token("1. Tema")
+        return "resultado.md"
+
+    gestor = trabajos.GestorTrabajos(trabajos.AlmacenTrabajos(str(tmp_path)), {"esquema": ejecutor})
+    gestor.iniciar()
+    eventos = []
+    trabajo, futuro = gestor.encolar("esquema", {"transcripcion": "Texto."}, "clase", oyente=eventos.append)
+
+    final = futuro.result(timeout=5)
+    assert final["id"] == trabajo["id"]
+    assert final["estado"] == trabajos.ESTADO_COMPLETADO
+    assert [e["tipo"] for e in eventos] == ["progreso", "token"]
+    assert eventos[1]["texto"] == "1. Tema"
+
+
+def test_un_ejecutor_que_falla_deja_el_trabajo_fallido(tmp_path):
+    def ejecutor(trabajo, entradas, reportar_progreso, emitir_token):
+        raise RuntimeError("sin memoria")
+
+    gestor = trabajos.GestorTrabajos(trabajos.AlmacenTrabajos(str(tmp_path)), {"esquema": ejecutor})
+    gestor.iniciar()
+    _, futuro = gestor.encolar("esquema", {"transcripcion": "Texto."}, "clase")
+
+    final = futuro.result(timeout=5)
+    assert final["estado"] == trabajos.ESTADO_FALLIDO
+    assert "sin memoria" in final["error"]
+    assert gestor.almacen.listar_no_finalizados() == []
+
+
+def test_tipo_desconocido(tmp_path):
+    gestor = trabajos.GestorTrabajos(trabajos.AlmacenTrabajos(str(tmp_path)), {})
+    with pytest.raises(ValueError, match="apuntes"):
+        gestor.encolar("apuntes", {}, "clase")
+
+
+def test_los_trabajos_se_ejecutan_de_uno_en_uno(tmp_path):
+    activos, maximo = [0], [0]
+    lock = threading.Lock()
+
+    def ejecutor(trabajo, entradas, reportar_progreso, emitir_token):
+        with lock:
+            activos[0] += 1
+            maximo[0] = max(maximo[0], activos[0])
+        time.sleep(0.02)
+        with lock:
+            activos[0] -= 1
+        return "r.md"
+
+    gestor = trabajos.GestorTrabajos(trabajos.AlmacenTrabajos(str(tmp_path)), {"esquema": ejecutor})
+    gestor.iniciar()
+    futuros = [gestor.encolar("esquema", {"transcripcion": str(i)}, f"c{i}")[1] for i in range(4)]
+    for futuro in futuros:
+        assert futuro.result(timeout=5)["estado"] == trabajos.ESTADO_COMPLETADO
+    assert maximo[0] == 1
+
+
+def test_gestores_con_almacen_compartido_no_se_esperan(tmp_path):
+    almacen = trabajos.AlmacenTrabajos(str(tmp_path))
+    pendiente = almacen.crear("ingesta", {"directorio": "referencias"}, "ingesta")
+    liberar = threading.Event()
+
+    def ejecutor_lento(trabajo, entradas, reportar_progreso, emitir_token):
+        assert liberar.wait(timeout=5)
+        return "esquema.md"
+
+    llamadas = []
+    gestor_llm = trabajos.GestorTrabajos(almacen, {"esquema": ejecutor_lento})
+    gestor_ingesta = trabajos.GestorTrabajos(almacen, {"ingesta": _ejecutor_que_escribe(llamadas)}, nombre_hilo="trabajador-ingesta")
+    gestor_llm.iniciar()
+    gestor_ingesta.iniciar()
+    _, futuro_llm = gestor_llm.encolar("esquema", {"transcripcion": "Texto."}, "clase")
+    _, futuro_ingesta = gestor_ingesta.encolar("ingesta", {"directorio": "referencias"}, "ingesta")
+
+    # La ingesta termina mientras el trabajo del modelo sigue en proceso.
+    assert futuro_ingesta.result(timeout=5)["estado"] == trabajos.ESTADO_COMPLETADO
+    assert not futuro_llm.done()
+    # Cada gestor reanuda solo sus tipos: la ingesta pendiente no pasó por el gestor del modelo.
+    assert llamadas[0][0] == pendiente["id"]
+    liberar.set()
+    assert futuro_llm.result(timeout=5)["estado"] == trabajos.ESTADO_COMPLETADO
+
+
+def test_si_no_se_puede_guardar_el_estado_final_el_futuro_recibe_un_fallo(tmp_path):
+    def ejecutor(trabajo, entradas, reportar_progreso, emitir_token):
+        gestor.almacen.actualizar = lambda id_trabajo, **campos: None # trabajo.json borrado a mitad del trabajo
+        return "clase.md"
+
+    gestor = trabajos.GestorTrabajos(trabajos.AlmacenTrabajos(str(tmp_path)), {"esquema": ejecutor})
+    gestor.iniciar()
+    _, futuro = gestor.encolar("esquema", {"transcripcion": "Texto."}, "clase")
+
+    final = futuro.result(timeout=5)
+    assert final["estado"] == trabajos.ESTADO_FALLIDO
+    assert "estado final" in final["error"]
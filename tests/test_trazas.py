@@ -0,0 +1,40 @@
+# tests/test_trazas.py
+import os
+import json
+from src import config, trazas
+
+
+def test_normalizar_id_correlacion():
+    assert trazas.normalizar_id_correlacion(None) is None
+    assert trazas.normalizar_id_correlacion("") is None
+    assert trazas.normalizar_id_correlacion("abc-123_X") == "abc-123_X"
+    assert trazas.normalizar_id_correlacion("../../etc/passwd") == "______etc_passwd"
+    assert len(trazas.normalizar_id_correlacion("a" * 500)) == trazas.LONGITUD_MAX_ID_CORRELACION
+
+
+def test_la_traza_se_guarda_con_un_id_de_correlacion_hostil(monkeypatch):
+    monkeypatch.setattr(config, "TRAZAS_ACTIVADAS", True)
+    with trazas.traza("peticion", "../x/y") as traza_guardada:
+        with trazas.span("fase", tokens=3):
+            assert trazas.id_correlacion_actual() == "___x_y"
+
+    archivos = os.listdir(config.TRAZAS_DIR)
+    assert len(archivos) == 1 and archivos[0].endswith("_peticion____x_y.json")
+    with open(os.path.join(config.TRAZAS_DIR, archivos[0]), encoding="utf-8") as f:
+        contenido = json.load(f)
+    assert contenido["otherData"]["id_correlacion"] == traza_guardada.id_correlacion
+    assert {e["name"] for e in contenido["traceEvents"]} == {"peticion", "fase"}
+
+
+def test_sin_trazas_activadas_no_se_escribe_nada(monkeypatch):
+    monkeypatch.setattr(config, "TRAZAS_ACTIVADAS", False)
+    with trazas.traza("peticion", "abc") as traza_guardada:
+        with trazas.span("fase"):
+            pass
+    assert traza_guardada is None
+    assert not os.path.exists(config.TRAZAS_DIR)
+
+
+def test_la_api_devuelve_el_x_request_id_saneado(cliente_api):
+    respuesta = cliente_api.get("/metrics", headers={"X-Request-ID": "../a b"})
+    assert respuesta.headers["X-Request-ID"] == "___a_b"
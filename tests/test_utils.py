@@ -0,0 +1,103 @@
+# tests/test_utils.py
+# Consultas a la BD vectorial remota contra un servicio simulado con httpx.MockTransport.
+import json
+import time
+import asyncio
+import httpx
+import pytest
+from src import config
+from src import utils
+from src import cache_resultados
+
+
+class ServicioVectorial:
+    """Responde a GET /query/ y POST /query/batch/ con un resultado por término; anota cada petición."""
+
+    def __init__(self, lote_status=200):
+        self.lote_status = lote_status
+        self.peticiones = []
+
+    @staticmethod
+    def _resultados(query):
+        return [{"texto": f"Definición de {query}", "pagina": 1}]
+
+    def __call__(self, request):
+        self.peticiones.append((request.method, request.url.path))
+        if request.url.path == "/query/batch/":
+            if self.lote_status != 200:
+                return httpx.Response(self.lote_status)
+            consultas = json.loads(request.content)["queries"]
+            return httpx.Response(200, json={"results": [self._resultados(c["q"]) for c in consultas]})
+        return httpx.Response(200, json={"results": self._resultados(request.url.params["q"])})
+
+
+@pytest.fixture
+def servicio_vectorial(monkeypatch):
+    """Devuelve una función que instala un ServicioVectorial como destino del cliente compartido."""
+    monkeypatch.setattr(config, "VECTOR_DB_MODO", "remoto")
+    monkeypatch.setattr(utils, "_lote_vector_db_soportado", None)
+
+    def instalar(**kwargs):
+        servicio = ServicioVectorial(**kwargs)
+        monkeypatch.setattr(utils, "_cliente_vector_db", httpx.AsyncClient(transport=httpx.MockTransport(servicio), base_url="http://vector-db"))
+        monkeypatch.setattr(utils, "_semaforo_vector_db", asyncio.Semaphore(config.VECTOR_DB_MAX_CONCURRENCIA))
+        return servicio
+    return instalar
+
+
+def _consultar(terminos):
+    return asyncio.run(utils.consultar_terminos_vector_db(terminos, top_k=1))
+
+
+def test_consulta_en_lote_y_despues_desde_la_cache(servicio_vectorial):
+    servicio = servicio_vectorial()
+    terminos = ["Entropía", "Ciclo de Carnot", "Calor específico"]
+
+    resultados = _consultar(terminos)
+    assert [r[0]["texto"] for r in resultados] == [f"Definición de {t}" for t in terminos]
+    assert servicio.peticiones == [("POST", "/query/batch/")]
+
+    # Solo el término nuevo va a la red (uno solo: sin lote).
+    assert _consultar(terminos + ["Exergía"])[-1][0]["texto"] == "Definición de Exergía"
+    assert servicio.peticiones == [("POST", "/query/batch/"), ("GET", "/query/")]
+
+
+@pytest.mark.parametrize("lote_status", [404, 405, 501])
+def test_sin_lote_consulta_termino_a_termino_y_lo_recuerda(servicio_vectorial, lote_status):
+    servicio = servicio_vectorial(lote_status=lote_status)
+
+    resultados = _consultar(["Entropía", "Ciclo de Carnot"])
+    assert [r[0]["texto"] for r in resultados] == ["Definición de Entropía", "Definición de Ciclo de Carnot"]
+    assert servicio.peticiones == [("POST", "/query/batch/"), ("GET", "/query/"), ("GET", "/query/")]
+    assert utils._lote_vector_db_soportado is False
+
+    servicio.peticiones.clear()
+    _consultar(["Exergía", "Entalpía"])
+    assert servicio.peticiones == [("GET", "/query/"), ("GET", "/query/")]
+
+
+def test_un_fallo_del_lote_no_se_recuerda(servicio_vectorial):
+    servicio = servicio_vectorial(lote_status=500)
+
+    _consultar(["Entropía", "Ciclo de Carnot"])
+    assert servicio.peticiones == [("POST", "/query/batch/"), ("GET", "/query/"), ("GET", "/query/")]
+    assert utils._lote_vector_db_soportado is None
+
+
+def test_las_consultas_cacheadas_caducan(servicio_vectorial, monkeypatch):
+    monkeypatch.setattr(config, "VECTOR_DB_CACHE_TTL_SEGUNDOS", 3600)
+    servicio_vectorial()
+    _consultar(["Entropía"])
+
+    clave = cache_resultados.calcular_clave("vector_db", utils._componentes_cache_vector_db("Entropía", 1, None, None))
+    _, expira = cache_resultados._obtener_cache().get(clave, expire_time=True)
+    assert expira == pytest.approx(time.time() + 3600, abs=60)
+
+
+def test_sin_ttl_no_se_cachea(servicio_vectorial, monkeypatch):
+    monkeypatch.setattr(config, "VECTOR_DB_CACHE_TTL_SEGUNDOS", 0)
+    servicio = servicio_vectorial()
+
+    _consultar(["Entropía"])
+    _consultar(["Entropía"])
+    assert servicio.peticiones == [("GET", "/query/"), ("GET", "/query/")]
@@ -0,0 +1,14 @@
+# tests/textos.py
+# Textos sintéticos compartidos por las pruebas.
+
+def texto_de_clase(num_parrafos, oraciones_por_parrafo=6):
+    """Transcripción sintética con oraciones y párrafos distintos entre sí (determinista)."""
+    temas = ("termodinámica", "entropía", "energía", "sistemas", "equilibrio", "calor", "trabajo", "procesos")
+    parrafos = []
+    for p in range(num_parrafos):
+        oraciones = [
+            f"En el punto {p}.{o} hablamos de {temas[(p + o) % len(temas)]} y de su relación con {temas[(p * o + 3) % len(temas)]} en clase."
+            for o in range(oraciones_por_parrafo)
+        ]
+        parrafos.append(" ".join(oraciones))
+    return "\n\n".join(parrafos)